@@ -9,6 +9,41 @@ class ConsumptionService {
   static const String _baseUrl = globalBaseUrl; // "http://10.0.2.2:5000";
   // 'https://spidertric.pythonanywhere.com'; // Remplacez par votre URL
 
+  // Dernière réponse de chaque URL et son ETag : le serveur répond 304 (sans corps)
+  // tant que rien n'a changé, et on réutilise alors la réponse gardée ici
+  // (l'ETag porte l'id de l'utilisateur : un autre compte n'obtient jamais de 304 pour elle)
+  static final Map<String, String> _etags = {};
+  static final Map<String, dynamic> _bodies = {};
+
+  // GET conditionnel (If-None-Match) ; retourne le JSON décodé, ou null en cas d'erreur
+  Future<dynamic> _getJson(String url, String token) async {
+    final headers = {
+      'Authorization': 'Bearer $token',
+      'Content-Type': 'application/json',
+    };
+    final etag = _etags[url];
+    if (etag != null) {
+      headers['If-None-Match'] = etag;
+    }
+
+    final response = await http.get(Uri.parse(url), headers: headers);
+
+    if (response.statusCode == 304 && _bodies.containsKey(url)) {
+      return _bodies[url];
+    }
+    if (response.statusCode != 200) {
+      return null;
+    }
+
+    final data = json.decode(response.body);
+    final newEtag = response.headers['etag'];
+    if (newEtag != null) {
+      _etags[url] = newEtag;
+      _bodies[url] = data;
+    }
+    return data;
+  }
+
   // Récupérer la consommation cumulative pour un compteur spécifique
   Future<Map<String, dynamic>> getCumulativeConsumption(
     String meterNumber,
@@ -20,21 +55,17 @@ class ConsumptionService {
         return {'success': false, 'message': 'Not authenticated'};
       }
 
-      final response = await http.get(
-        Uri.parse('$_baseUrl/api/meters/$meterNumber/cumulative_consumption'),
-        headers: {
-          'Authorization': 'Bearer $token',
-          'Content-Type': 'application/json',
-        },
+      final data = await _getJson(
+        '$_baseUrl/api/meters/$meterNumber/cumulative_consumption',
+        token,
       );
 
-      if (response.statusCode == 200) {
-        final data = json.decode(response.body);
+      if (data != null) {
         return {'success': true, 'data': data};
       } else {
         return {
           'success': false,
-          'message': 'Failed to load consumption data: ${response.statusCode}',
+          'message': 'Failed to load consumption data',
         };
       }
     } catch (e) {
@@ -43,6 +74,7 @@ class ConsumptionService {
   }
 
   // Récupérer la consommation pour tous les compteurs de l'utilisateur
+  // Un seul appel à /api/consumption/summary (cumul, seuil, reste et relais de chaque compteur)
   Future<Map<String, dynamic>> getAllCumulativeConsumptions() async {
     try {
       final token = await _authService.getToken();
@@ -51,43 +83,21 @@ class ConsumptionService {
         return {'success': false, 'message': 'Not authenticated'};
       }
 
-      // D'abord récupérer tous les compteurs
-      final metersResponse = await http.get(
-        Uri.parse('$_baseUrl/meters'),
-        headers: {
-          'Authorization': 'Bearer $token',
-          'Content-Type': 'application/json',
-        },
-      );
+      final summary = await _getJson('$_baseUrl/api/consumption/summary', token);
 
-      if (metersResponse.statusCode != 200) {
-        return {'success': false, 'message': 'Failed to load meters'};
+      if (summary == null) {
+        return {'success': false, 'message': 'Failed to load consumption summary'};
       }
 
-      final metersData = json.decode(metersResponse.body);
-      final List<dynamic> meters = metersData['meters'] ?? [];
-
-      // Pour chaque compteur, récupérer la consommation cumulative
-      final List<Map<String, dynamic>> consumptions = [];
-
-      for (var meter in meters) {
-        final meterNumber = meter['meter_number'];
-        final consumptionResponse = await getCumulativeConsumption(meterNumber);
-
-        if (consumptionResponse['success'] == true) {
-          consumptions.add({
-            'meter_number': meterNumber,
-            'meter_name': meter['meter_name'],
-            'cumulative_consumption':
-                consumptionResponse['data']['cumulative_consumption'],
-          });
-        }
-      }
+      final List<Map<String, dynamic>> consumptions =
+          List<Map<String, dynamic>>.from(summary['meters'] ?? []);
 
       return {
         'success': true,
         'data': consumptions,
-        'total_consumption': _calculateTotalConsumption(consumptions),
+        'total_consumption':
+            (summary['total_consumption'] as num?)?.toDouble() ??
+            _calculateTotalConsumption(consumptions),
       };
     } catch (e) {
       return {'success': false, 'message': 'Error: $e'};
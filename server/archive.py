@@ -0,0 +1,243 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import accumulate
+
+from timeseries import bucket_start
+
+
+# -----------------------------------------------------------------------------------------------
+# Archive des lectures brutes : un ou plusieurs segments par mois, en colonnes compressées
+#   [MAGIC][bloc compteur 1][bloc compteur 2]...[index JSON][longueur de l'index u32]
+#   bloc = zlib(écarts de ts u32 (le premier depuis le début du mois) + wh u32), little-endian
+# Un segment n'est jamais modifié : il est lisible dès qu'il est enregistré en base.
+# -----------------------------------------------------------------------------------------------
+MAGIC = b'GPA1'
+SUFFIX = '.gpa'
+_FOOTER = struct.Struct('<I')
+_U32 = 'I' if array('I').itemsize == 4 else 'L'
+_SWAP = sys.byteorder == 'big'
+
+
+def _to_bytes(values):
+    column = array(_U32, values)
+    if _SWAP:
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_bytes(data):
+    column = array(_U32)
+    column.frombytes(data)
+    if _SWAP:
+        column.byteswap()
+    return column
+
+
+def segment_name(month, index):
+    """readings-AAAA-MM.<n>.gpa"""
+    return f"readings-{time.strftime('%Y-%m', time.gmtime(month))}.{index}{SUFFIX}"
+
+
+class SegmentReader:
+    """Segment ouvert : index en mémoire, blocs décompressés à la demande"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Segment d'archive invalide: {path}")
+            f.seek(-_FOOTER.size, os.SEEK_END)
+            end = f.tell()
+            (length,) = _FOOTER.unpack(f.read(_FOOTER.size))
+            f.seek(end - length)
+            footer = json.loads(f.read(length))
+        self.month = footer['month']
+        # meter_id -> [offset, longueur, lectures, wh, premier ts, dernier ts]
+        self.index = {int(meter_id): entry for meter_id, entry in footer['meters'].items()}
+
+    def read(self, meter_id):
+        """(ts, wh) du compteur dans ce segment, colonnes triées par ts"""
+        entry = self.index.get(meter_id)
+        if entry is None:
+            return [], []
+        offset, length, count = entry[0], entry[1], entry[2]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = zlib.decompress(f.read(length))
+        deltas = _from_bytes(data[:count * 4])
+        wh = _from_bytes(data[count * 4:])
+        ts = list(accumulate(deltas, initial=self.month))[1:]
+        return ts, wh
+
+    def covers(self, meter_id, start, end):
+        entry = self.index.get(meter_id)
+        return entry is not None and entry[4] < end and entry[5] >= start
+
+
+class ReadingArchive:
+    """Répertoire des segments ; les segments lisibles sont ceux que la base a enregistrés"""
+
+    def __init__(self, directory, cache_size=64, compression=6):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.compression = compression
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.segments_written = 0
+        self.readings_written = 0
+        self.bytes_written = 0
+        self.blocks_read = 0
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ------------------------- Écriture -------------------------
+    def write_segment(self, month, blocks):
+        """Écrit un segment à partir de (meter_id, [(ts, wh), ...]) et retourne (nom, compteurs, lectures, wh)
+
+        Le fichier est synchronisé sur disque avant d'être renommé : une fois le nom retourné,
+        l'appelant peut enregistrer le segment et supprimer les lignes correspondantes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        index = 0
+        while os.path.exists(self.path(segment_name(month, index))):
+            index += 1
+        name = segment_name(month, index)
+        tmp_path = self.path(name) + '.tmp'
+
+        meters = {}
+        total_readings = 0
+        total_wh = 0
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            for meter_id, rows in blocks:
+                if not rows:
+                    continue
+                ts = [row[0] for row in rows]
+                wh = [row[1] for row in rows]
+                deltas = [ts[0] - month] + [b - a for a, b in zip(ts, ts[1:])]
+                data = zlib.compress(_to_bytes(deltas) + _to_bytes(wh), self.compression)
+                meters[str(meter_id)] = [f.tell(), len(data), len(rows), sum(wh), ts[0], ts[-1]]
+                f.write(data)
+                total_readings += len(rows)
+                total_wh += meters[str(meter_id)][3]
+            footer = json.dumps({'month': month, 'meters': meters}, separators=(',', ':')).encode()
+            f.write(footer)
+            f.write(_FOOTER.pack(len(footer)))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        if not meters:
+            os.remove(tmp_path)
+            return None, 0, 0, 0
+
+        os.replace(tmp_path, self.path(name))
+        self._sync_directory()
+
+        self.segments_written += 1
+        self.readings_written += total_readings
+        self.bytes_written += size
+        return name, len(meters), total_readings, total_wh
+
+    def _sync_directory(self):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def remove_orphans(self, registered):
+        """Supprime les segments écrits mais jamais enregistrés (arrêt avant le commit)"""
+        if not os.path.isdir(self.directory):
+            return []
+        registered = set(registered)
+        removed = []
+        for name in os.listdir(self.directory):
+            if name.startswith('readings-') and (name.endswith('.tmp') or
+                                                 (name.endswith(SUFFIX) and name not in registered)):
+                os.remove(self.path(name))
+                removed.append(name)
+        if removed:
+            print(f"[ARCHIVE] {len(removed)} segments non enregistrés supprimés")
+        return removed
+
+    # ------------------------- Lecture -------------------------
+    def reader(self, name):
+        with self._lock:
+            reader = self._readers.get(name)
+            if reader is not None:
+                self._readers.move_to_end(name)
+                return reader
+        reader = SegmentReader(self.path(name))
+        with self._lock:
+            self._readers[name] = reader
+            while len(self._readers) > self.cache_size:
+                self._readers.popitem(last=False)
+        return reader
+
+    def _columns(self, names, meter_id, start, end):
+        for name in names:
+            reader = self.reader(name)
+            if not reader.covers(meter_id, start, end):
+                continue
+            self.blocks_read += 1
+            ts, wh = reader.read(meter_id)
+            lo = bisect_left(ts, start)
+            hi = bisect_left(ts, end)
+            if lo < hi:
+                yield ts[lo:hi], wh[lo:hi]
+
+    def readings(self, names, meter_id, start, end, limit=None):
+        """Lectures archivées (ts, wh) du compteur sur [start, end), par ordre chronologique"""
+        rows = []
+        for ts, wh in self._columns(names, meter_id, start, end):
+            rows.extend(zip(ts, wh))
+        rows.sort()
+        return rows[:limit] if limit is not None else rows
+
+    def total(self, names, meter_id, start, end):
+        """Consommation archivée (Wh) du compteur sur [start, end)"""
+        total = 0
+        for name in names:
+            entry = self.reader(name).index.get(meter_id)
+            if entry is None or entry[4] >= end or entry[5] < start:
+                continue
+            if entry[4] >= start and entry[5] < end:
+                total += entry[3]            # bloc entièrement dans la période : somme de l'index
+                continue
+            for _, wh in self._columns([name], meter_id, start, end):
+                total += sum(wh)
+        return total
+
+    def buckets(self, names, meter_id, granularity, start, end):
+        """{début de période: [wh, lectures]} des lectures archivées sur [start, end)"""
+        buckets = {}
+        for ts, wh in self._columns(names, meter_id, start, end):
+            for t, w in zip(ts, wh):
+                bucket = buckets.setdefault(bucket_start(t, granularity), [0, 0])
+                bucket[0] += w
+                bucket[1] += 1
+        return buckets
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'segments_written': self.segments_written,
+            'readings_written': self.readings_written,
+            'bytes_written': self.bytes_written,
+            'blocks_read': self.blocks_read,
+            'open_segments': len(self._readers),
+        }
@@ -0,0 +1,113 @@
+# bench_changes.py
+# Resynchronisation d'un client revenu en ligne : listes complètes ou flux de modifications
+#   python bench/bench_changes.py --meters 20 --months 24 --changes 10,100,1000
+# 'complet' : GET /meters, /invoices et /payments entiers (ce que font InvoicePage et PaymentHistoryPage)
+# 'delta'   : GET /changes?since=<curseur d'avant la coupure>, pages suivies jusqu'à has_more false
+# Pendant la coupure : --changes écritures, surtout des factures payées (facture + paiement) ; une sur
+# --rename-every renomme un compteur (ses factures et paiements changent aussi dans les listes)
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_PATH', os.path.join(directory, 'bench_changes.db'))
+os.environ.setdefault('INGEST_JOURNAL_PATH', os.path.join(directory, 'ingest.journal'))
+os.environ.setdefault('ARCHIVE_DIR', os.path.join(directory, 'archive'))
+os.environ.setdefault('RETENTION_INTERVAL_S', '0')
+os.environ.setdefault('LIVE_PORT', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+
+def timed(function, repeat):
+    """(CPU ms du meilleur essai, résultat)"""
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        result = function()
+        elapsed = (time.process_time() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def full_reload(client, headers):
+    body = 0
+    for url in ('/meters', '/invoices', '/payments'):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, (url, response.status_code)
+        body += len(response.data)
+    return 3, body, None
+
+
+def delta(client, headers, cursor):
+    requests = body = entries = 0
+    while True:
+        response = client.get('/changes', query_string={'since': cursor}, headers=headers)
+        assert response.status_code == 200 and not response.json['reset'], response.json
+        requests += 1
+        body += len(response.data)
+        entries += len(response.json['changes'])
+        cursor = response.json['cursor']
+        if not response.json['has_more']:
+            return requests, body, entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meters', type=int, default=20)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--changes', default='10,100,1000')
+    parser.add_argument('--rename-every', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        client = server.app.test_client()
+        client.post('/register', json={'email': 'bench@gridpay.test', 'password': 'benchmark', 'phone': '0',
+                                       'name': 'Bench'})
+        token = client.post('/login', json={'email': 'bench@gridpay.test', 'password': 'benchmark'}).json['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        repositories = server.repositories
+        user_id = repositories.users.id_for_email('bench@gridpay.test')
+        unpaid = []
+        for m in range(args.meters):
+            meter = repositories.meters.create(user_id, f"BENCH{m:04d}", f"Compteur {m}")
+            for n in range(args.months):
+                invoice = repositories.invoices.create(meter.id, f"{2000 + n // 12}-{n % 12 + 1:02d}", 10.0 + n,
+                                                       'unpaid', 50)
+                if n % 2:
+                    repositories.payments.create(invoice.id, invoice.amount, 'momo', None)
+                    repositories.invoices.mark_paid(invoice.id)
+                else:
+                    unpaid.append((meter.id, invoice))
+        print(f"[BENCH] {args.meters} compteurs, {args.meters * args.months:,} factures, "
+              f"{args.meters * args.months // 2:,} paiements")
+
+        print(f"[BENCH] {'modifications':>14}{'mode':>10}{'requêtes':>10}{'CPU ms':>10}{'corps o':>12}{'entités':>9}")
+        for changes in (int(value) for value in args.changes.split(',')):
+            cursor = client.get('/changes', headers=headers).json['cursor']
+            for k in range(changes):
+                if k % args.rename_every == args.rename_every - 1 or not unpaid:
+                    repositories.meters.update(k % args.meters + 1, {'meter_name': f"Compteur {k}"})
+                else:
+                    _, invoice = unpaid.pop()
+                    repositories.payments.create(invoice.id, invoice.amount, 'momo', None)
+                    repositories.invoices.mark_paid(invoice.id)
+
+            full_ms, (full_requests, full_body, _) = timed(lambda: full_reload(client, headers), args.repeat)
+            delta_ms, (delta_requests, delta_body, entries) = timed(lambda: delta(client, headers, cursor),
+                                                                    args.repeat)
+            print(f"[BENCH] {changes:>14,}{'complet':>10}{full_requests:>10}{full_ms:>10.1f}{full_body:>12,}")
+            print(f"[BENCH] {changes:>14,}{'delta':>10}{delta_requests:>10}{delta_ms:>10.1f}{delta_body:>12,}"
+                  f"{entries:>9,}")
+    finally:
+        shutil.rmtree(directory)
+        os._exit(0)   # client MQTT et threads de fond du serveur
+
+
+if __name__ == '__main__':
+    main()
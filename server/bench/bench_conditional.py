@@ -0,0 +1,89 @@
+# bench_conditional.py
+# Tableau de bord inactif interrogé comme le client Flutter (_startConsumptionTimer, toutes les 5 s) :
+# GET /meters puis cumulative_consumption de chaque compteur, sans rien de changé entre deux tours
+#   python bench/bench_conditional.py --meters 10 --polls 200
+# 'complet'     : réponses 200 (client sans cache)
+# 'conditionnel': If-None-Match avec l'ETag du tour précédent -> 304 sans requête SQL
+# 'résumé'      : un seul GET /api/consumption/summary par tour (avec et sans If-None-Match)
+# Mesure le temps CPU du processus et les octets de corps renvoyés par tour
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_PATH', os.path.join(directory, 'bench_conditional.db'))
+os.environ.setdefault('INGEST_JOURNAL_PATH', os.path.join(directory, 'ingest.journal'))
+os.environ.setdefault('ARCHIVE_DIR', os.path.join(directory, 'archive'))
+os.environ.setdefault('RETENTION_INTERVAL_S', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+
+
+def poll(client, urls, headers, etags):
+    """Un tour du tableau de bord ; etags : ETag par URL (None : client sans cache)"""
+    body = 0
+    for url in urls:
+        request_headers = dict(headers)
+        if etags is not None and url in etags:
+            request_headers['If-None-Match'] = etags[url]
+        response = client.get(url, headers=request_headers)
+        assert response.status_code in (200, 304), (url, response.status_code)
+        body += len(response.data)
+        if etags is not None and response.status_code == 200:
+            etags[url] = response.headers['ETag']
+    return body
+
+
+def measure(client, urls, headers, polls, conditional):
+    etags = {} if conditional else None
+    poll(client, urls, headers, etags)    # premier tour : réponses complètes dans les deux modes
+    started = time.process_time()
+    body = sum(poll(client, urls, headers, etags) for _ in range(polls))
+    elapsed = time.process_time() - started
+    return elapsed * 1000 / polls, body / polls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meters', type=int, default=10)
+    parser.add_argument('--polls', type=int, default=200)
+    args = parser.parse_args()
+
+    try:
+        client = server.app.test_client()
+        client.post('/register', json={'email': 'bench@gridpay.test', 'password': 'benchmark', 'phone': '0',
+                                       'name': 'Bench'})
+        token = client.post('/login', json={'email': 'bench@gridpay.test', 'password': 'benchmark'}).json['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        numbers = [f"BENCH{m:04d}" for m in range(args.meters)]
+        for number in numbers:
+            client.post('/meters', json={'meter_number': number, 'meter_name': number}, headers=headers)
+        server.flush_consumption_batch([(number, int(time.time()), 1.5, 0) for number in numbers])
+        urls = ['/meters'] + [f'/api/meters/{number}/cumulative_consumption' for number in numbers]
+
+        full_ms, full_bytes = measure(client, urls, headers, args.polls, conditional=False)
+        cond_ms, cond_bytes = measure(client, urls, headers, args.polls, conditional=True)
+        summary = ['/api/consumption/summary']
+        summary_ms, summary_bytes = measure(client, summary, headers, args.polls, conditional=False)
+        summary_cond_ms, summary_cond_bytes = measure(client, summary, headers, args.polls, conditional=True)
+        print(f"[BENCH] {args.meters} compteurs, {args.polls} tours")
+        print(f"[BENCH] {'mode':<22}{'requêtes/tour':>14}{'CPU ms/tour':>14}{'corps o/tour':>14}")
+        for name, requests, ms, body in (('complet', len(urls), full_ms, full_bytes),
+                                         ('conditionnel', len(urls), cond_ms, cond_bytes),
+                                         ('résumé', 1, summary_ms, summary_bytes),
+                                         ('résumé conditionnel', 1, summary_cond_ms, summary_cond_bytes)):
+            print(f"[BENCH] {name:<22}{requests:>14}{ms:>14.2f}{body:>14,.0f}")
+        print(f"[BENCH] conditionnel : CPU -{100 * (1 - cond_ms / full_ms):.0f} %, "
+              f"corps -{100 * (1 - cond_bytes / full_bytes):.0f} %")
+        print(f"[BENCH] résumé : CPU -{100 * (1 - summary_ms / full_ms):.0f} %")
+    finally:
+        shutil.rmtree(directory)
+        os._exit(0)   # client MQTT et threads de fond du serveur
+
+
+if __name__ == '__main__':
+    main()
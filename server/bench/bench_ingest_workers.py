@@ -0,0 +1,125 @@
+# bench_ingest_workers.py
+# Débit d'ingestion (messages/s) selon le nombre de processus, partition par hachage
+#   python bench/bench_ingest_workers.py --messages 1000000 --processes 1,2,4,8
+# Chaque processus reçoit tout le flux (comme un abonnement non partagé), ne décode que ses
+# compteurs, dédoublonne et écrit ses lots dans la même base WAL.
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dedupe import ReadingDeduplicator, ACCEPTED
+from ingest import meter_partition
+from timeseries import READINGS_TABLE, ROLLUP_TABLES, kwh_to_wh, insert_readings, update_rollups
+
+
+def make_messages(count, meters, interval):
+    """Messages MQTT (topic, payload) entrelacés par compteur, comme à l'arrivée réelle"""
+    start_ts = int(time.time()) - count // meters * interval
+    messages = []
+    tick = 0
+    while len(messages) < count:
+        ts = start_ts + tick * interval
+        for meter in range(meters):
+            meter_number = f"MTR{meter:06d}"
+            payload = json.dumps({'meter_number': meter_number, 'consumption': random.uniform(0.1, 0.3),
+                                  'timestamp': ts})
+            messages.append((f"electricity/{meter_number}/consumption", payload.encode()))
+            if len(messages) >= count:
+                break
+        tick += 1
+    return messages
+
+
+def worker(index, processes, path, args, barrier, results):
+    messages = make_messages(args.messages, args.meters, args.interval)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    cursor = conn.cursor()
+    dedupe = ReadingDeduplicator()
+    barrier.wait()
+
+    started = time.perf_counter()
+    batch = []
+    handled = 0
+    for topic, payload in messages:
+        meter_number = topic.split('/')[1]
+        if meter_partition(meter_number, processes) != index:
+            continue
+        data = json.loads(payload.decode('utf-8'))
+        meter_id = int(meter_number[3:]) + 1
+        ts = data['timestamp']
+        if dedupe.check(meter_id, ts) != ACCEPTED:
+            continue
+        batch.append((meter_id, ts, kwh_to_wh(data['consumption'])))
+        if len(batch) >= args.batch:
+            insert_readings(cursor, batch)
+            update_rollups(cursor, batch)
+            conn.commit()
+            handled += len(batch)
+            batch = []
+    if batch:
+        insert_readings(cursor, batch)
+        update_rollups(cursor, batch)
+        conn.commit()
+        handled += len(batch)
+    conn.close()
+    results.put((handled, time.perf_counter() - started))
+
+
+def run(processes, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench_ingest.db')
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(READINGS_TABLE)
+    for table in ROLLUP_TABLES:
+        conn.execute(table)
+    conn.close()
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(i, processes, path, args, barrier, results))
+               for i in range(processes)]
+    for p in workers:
+        p.start()
+    outcomes = [results.get() for _ in workers]
+    for p in workers:
+        p.join()
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.rmdir(os.path.dirname(path))
+
+    handled = sum(n for n, _ in outcomes)
+    elapsed = max(t for _, t in outcomes)
+    return handled, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--meters', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--interval', type=int, default=2, help="secondes entre deux lectures d'un compteur")
+    parser.add_argument('--processes', default='1,2,4,8')
+    args = parser.parse_args()
+
+    baseline = None
+    for processes in [int(p) for p in args.processes.split(',')]:
+        handled, elapsed = run(processes, args)
+        rate = handled / elapsed
+        baseline = baseline or rate
+        print(f"[BENCH] {processes} processus : {handled:,} messages en {elapsed:.1f} s, "
+              f"{rate:,.0f} msg/s (x{rate / baseline:.2f})")
+
+
+if __name__ == '__main__':
+    main()
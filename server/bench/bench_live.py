@@ -0,0 +1,97 @@
+# bench_live.py
+# Flux SSE (live.py) : connexions inactives tenues par un seul thread, diffusion et clients lents
+#   python bench/bench_live.py --clients 5000 --events 200
+# 'inactives' : --clients connexions ouvertes (un utilisateur chacune), threads et mémoire du processus
+# 'diffusion' : un événement par utilisateur, délai jusqu'à réception par tous les clients
+# 'lent'      : un client qui ne lit pas pendant --events lots de consommation sur 10 compteurs
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from live import LiveBroadcaster
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def open_client(port, user_id):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET /api/live HTTP/1.1\r\nAuthorization: Bearer {user_id}\r\n\r\n".encode())
+    await reader.readuntil(b"retry: 5000\n\n")
+    return reader, writer
+
+
+async def run(args):
+    broadcaster = LiveBroadcaster(lambda token: int(token), host='127.0.0.1', port=args.port,
+                                  heartbeat_s=args.heartbeat, queue_size=64, max_clients=args.clients + 10)
+    broadcaster.start()
+
+    threads = threading.active_count()
+    memory = rss_mb()
+    started = time.perf_counter()
+    clients = []
+    for batch in range(0, args.clients, 500):
+        clients += await asyncio.gather(*(open_client(args.port, user_id)
+                                          for user_id in range(batch, min(batch + 500, args.clients))))
+    print(f"[BENCH] inactives : {len(clients):,} connexions en {time.perf_counter() - started:.1f} s, "
+          f"threads {threads} -> {threading.active_count()}, "
+          f"mémoire +{rss_mb() - memory:.1f} Mo (clients de mesure compris)")
+
+    started = time.perf_counter()
+    broadcaster.publish([(user_id, 'consumption', 'MTR', {'meter_number': 'MTR', 'cumulative_consumption': 1.0,
+                                                          'delta': 1.0})
+                         for user_id in range(args.clients)])
+    await asyncio.gather(*(reader.readuntil(b"\n\n") for reader, _ in clients))
+    print(f"[BENCH] diffusion : {args.clients:,} événements reçus en {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    # Client lent : ne lit rien pendant les lots, puis vide sa connexion
+    reader, writer = clients[0]
+    cpu = time.process_time()
+    for sequence in range(args.events):
+        broadcaster.publish([(0, 'consumption', f"MTR{m}", {'meter_number': f"MTR{m}",
+                                                              'cumulative_consumption': sequence + 1.0, 'delta': 1.0})
+                             for m in range(10)])
+    await asyncio.sleep(0.5)
+    received = b''
+    while True:
+        try:
+            received += await asyncio.wait_for(reader.read(1 << 16), 0.5)
+        except asyncio.TimeoutError:
+            break
+    stats = broadcaster.stats()
+    print(f"[BENCH] lent : {args.events * 10:,} événements publiés, {received.count(b'event: '):,} reçus, "
+          f"{stats['merged']:,} fusionnés, {stats['dropped']} abandonnés, "
+          f"CPU {(time.process_time() - cpu) * 1000:.0f} ms")
+
+    for _, writer in clients:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=5000)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--heartbeat', type=int, default=15)
+    args = parser.parse_args()
+
+    # Deux descripteurs par connexion (client de mesure et serveur dans le même processus)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = 2 * args.clients + 100
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
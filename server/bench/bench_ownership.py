@@ -0,0 +1,151 @@
+# bench_ownership.py
+# Listes et contrôles d'accès par utilisateur, avant et après la migration 5 (user_id recopié)
+#   python bench/bench_ownership.py --payments 1000000 --users 10000 --lookups 2000
+# 'avant' : schéma version 4, requêtes paiement -> facture -> compteur filtrées sur m.user_id
+# 'après' : même base migrée (remplissage de user_id chronométré), requêtes de HOT_QUERIES
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import migrations
+from migrations import HOT_QUERIES, migrate
+
+BEFORE = {
+    "factures de l'utilisateur": """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name
+        FROM invoices i
+        JOIN meters m ON i.meter_id = m.id
+        WHERE m.user_id = ?
+        ORDER BY i.issued_at DESC
+    """,
+    "facture de l'utilisateur": """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name
+        FROM invoices i
+        JOIN meters m ON i.meter_id = m.id
+        WHERE i.id = ? AND m.user_id = (SELECT id FROM users WHERE email = ?)
+    """,
+    "paiements de l'utilisateur": """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE m.user_id = (SELECT id FROM users WHERE email = ?)
+        ORDER BY p.paid_at DESC
+    """,
+    "paiement de l'utilisateur": """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE p.id = ? AND m.user_id = (SELECT id FROM users WHERE email = ?)
+    """,
+}
+AFTER = {name: sql for name, sql in HOT_QUERIES if name in BEFORE}
+
+
+def populate(conn, args):
+    """Une facture par compteur et par mois, un paiement par facture (ids consécutifs par utilisateur)"""
+    started = time.perf_counter()
+    invoices_per_user = max(1, args.payments // args.users)
+    per_meter = -(-invoices_per_user // args.meters_per_user)
+    conn.executemany("INSERT INTO users (id, name, email, password, phone) VALUES (?, ?, ?, ?, ?)",
+                     ((u + 1, f"User {u}", f"user{u}@gridpay.test", 'x' * 60, f"+229{u:08d}")
+                      for u in range(args.users)))
+    conn.executemany("INSERT INTO meters (id, user_id, meter_number, meter_name) VALUES (?, ?, ?, '')",
+                     ((u * args.meters_per_user + m + 1, u + 1, f"MTR{u:06d}-{m}")
+                      for u in range(args.users) for m in range(args.meters_per_user)))
+
+    def invoices():
+        for u in range(args.users):
+            for n in range(invoices_per_user):
+                meter_id = u * args.meters_per_user + n % args.meters_per_user + 1
+                month = n // args.meters_per_user
+                yield (meter_id, f"{2000 + month // 12}-{month % 12 + 1:02d}", 10.0 + n, 'paid', 50 + n,
+                       f"{2000 + month // 12}-{month % 12 + 1:02d}-28 12:00:00")
+    conn.executemany("""
+        INSERT INTO invoices (meter_id, month, amount, status, kwh, issued_at) VALUES (?, ?, ?, ?, ?, ?)
+    """, invoices())
+    conn.execute("""
+        INSERT INTO payments (invoice_id, amount, payment_method, transaction_id, paid_at)
+        SELECT id, amount, 'mobile', 'TX-' || id, issued_at FROM invoices
+    """)
+    conn.commit()
+    return time.perf_counter() - started
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(conn, queries, args):
+    """Latences (ms) de chaque requête sur les mêmes utilisateurs et ids tirés au hasard"""
+    payments = conn.execute("SELECT MAX(id) FROM payments").fetchone()[0]
+    rng = random.Random(42)
+    draws = [(rng.randrange(args.users), rng.randrange(1, payments + 1)) for _ in range(args.lookups)]
+    results = {}
+    for name, sql in queries.items():
+        samples = []
+        rows = 0
+        for u, row_id in draws:
+            if name == "factures de l'utilisateur":
+                params = (u + 1,)
+            elif name == "paiements de l'utilisateur":
+                params = (f"user{u}@gridpay.test",)
+            else:
+                # Identifiant existant, propriétaire tiré au hasard : le contrôle d'accès refuse le plus souvent
+                params = (row_id, f"user{u}@gridpay.test")
+            started = time.perf_counter()
+            rows += len(conn.execute(sql, params).fetchall())
+            samples.append((time.perf_counter() - started) * 1000)
+        results[name] = (sum(samples) / len(samples), percentile(samples, 0.99), rows)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payments', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--meters-per-user', type=int, default=2)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        conn = sqlite3.connect(os.path.join(directory, 'bench_ownership.db'))
+        conn.execute("PRAGMA journal_mode=WAL")
+        migrations.MIGRATIONS, later = migrations.MIGRATIONS[:4], migrations.MIGRATIONS
+        migrate(conn)
+        migrations.MIGRATIONS = later
+        elapsed = populate(conn, args)
+        count = conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0]
+        print(f"[BENCH] {count:,} paiements, {args.users:,} utilisateurs en {elapsed:.1f} s")
+
+        before = measure(conn, BEFORE, args)
+        started = time.perf_counter()
+        migrate(conn)
+        print(f"[BENCH] Migration 5 (remplissage de user_id, index) en {time.perf_counter() - started:.1f} s")
+        after = measure(conn, AFTER, args)
+        conn.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"[BENCH] {'requête':<30}{'avant ms':>12}{'p99':>10}{'après ms':>12}{'p99':>10}{'gain':>8}")
+    for name in BEFORE:
+        mean_before, p99_before, rows_before = before[name]
+        mean_after, p99_after, rows_after = after[name]
+        same = '' if rows_before == rows_after else f"  (lignes {rows_before} != {rows_after})"
+        print(f"[BENCH] {name:<30}{mean_before:>12.3f}{p99_before:>10.3f}{mean_after:>12.3f}{p99_after:>10.3f}"
+              f"{mean_before / mean_after:>7.1f}x{same}")
+
+
+if __name__ == '__main__':
+    main()
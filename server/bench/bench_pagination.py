@@ -0,0 +1,101 @@
+# bench_pagination.py
+# Latence d'une page de factures selon sa profondeur, pour un compte commercial
+#   python bench/bench_pagination.py --meters 2000 --months 100 --limit 50
+# 'offset' : ORDER BY ... LIMIT ? OFFSET ? (le parcours saute toutes les lignes des pages précédentes)
+# 'clé'    : list_for_user avec la clé (issued_at, id) de la dernière ligne de la page précédente
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import Database
+from migrations import migrate
+from repository import INVOICE_COLUMNS, SqliteRepositories
+
+OFFSET = f"""
+    SELECT {INVOICE_COLUMNS}
+    FROM invoices i
+    JOIN meters m ON i.meter_id = m.id
+    WHERE i.user_id = ?
+    ORDER BY i.issued_at DESC, i.id
+    LIMIT ? OFFSET ?
+"""
+
+
+def populate(path, args):
+    """Un utilisateur, --meters compteurs, une facture par compteur et par mois (paid une fois sur trois)"""
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (id, name, email, password, phone) VALUES (1, 'Client', 'pro@gridpay.test', 'x', '1')")
+    conn.executemany("INSERT INTO meters (id, user_id, meter_number, meter_name) VALUES (?, 1, ?, '')",
+                     ((m + 1, f"MTR{m:06d}") for m in range(args.meters)))
+    conn.executemany("""
+        INSERT INTO invoices (meter_id, month, amount, status, kwh, issued_at, user_id) VALUES (?, ?, ?, ?, ?, ?, 1)
+    """, ((m + 1, f"{2000 + n // 12}-{n % 12 + 1:02d}", 10.0, 'unpaid' if (m + n) % 3 else 'paid', 50,
+           f"{2000 + n // 12}-{n % 12 + 1:02d}-28 12:00:00")
+          for n in range(args.months) for m in range(args.meters)))
+    conn.commit()
+    conn.close()
+
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return min(samples), rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--meters', type=int, default=2000)
+    parser.add_argument('--months', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'bench_pagination.db')
+        database = Database(path)
+        conn = database.connect()
+        migrate(conn)
+        conn.close()
+        started = time.perf_counter()
+        populate(path, args)
+        total = args.meters * args.months
+        print(f"[BENCH] {total:,} factures pour un utilisateur en {time.perf_counter() - started:.1f} s")
+
+        repositories = SqliteRepositories(database)
+        invoices = repositories.invoices
+        # Clé de la dernière ligne avant chaque profondeur mesurée
+        depths = [0] + [depth for depth in (1000, 10000, 100000, total - args.limit) if 0 < depth < total]
+        conn = sqlite3.connect(path)
+        keys = {0: None}
+        for depth in depths[1:]:
+            keys[depth] = conn.execute(OFFSET.replace(INVOICE_COLUMNS, "i.issued_at, i.id"),
+                                       (1, 1, depth - 1)).fetchone()
+
+        print(f"[BENCH] {'profondeur':>12}{'offset ms':>12}{'clé ms':>12}{'clé statut ms':>16}")
+        for depth in depths:
+            offset_ms, expected = timed(lambda: conn.execute(OFFSET, (1, args.limit, depth)).fetchall(), args.repeat)
+            keyset_ms, rows = timed(lambda: invoices.list_for_user(1, after=keys[depth], limit=args.limit),
+                                    args.repeat)
+            status_ms, _ = timed(lambda: invoices.list_for_user(1, {'status': 'paid'}, keys[depth], args.limit),
+                                 args.repeat)
+            same = '' if [row[0] for row in expected] == [invoice.id for invoice in rows] else '  (pages différentes)'
+            print(f"[BENCH] {depth:>12,}{offset_ms:>12.3f}{keyset_ms:>12.3f}{status_ms:>16.3f}{same}")
+        count_ms, counted = timed(lambda: invoices.count_for_user(1, None, 10000), args.repeat)
+        print(f"[BENCH] total plafonné à 10 000 : {min(counted, 10000):,} en {count_ms:.3f} ms")
+        conn.close()
+        database.close_all()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# bench_read_write.py
+# Latence des lectures (factures et paiements d'un utilisateur) pendant une ingestion à plein débit
+#   python bench/bench_read_write.py --seconds 10 --readers 4 --batch 500
+# 'partagé' : lectures et écritures sur les mêmes connexions, chaque thread prend le verrou d'écriture
+# 'séparé'  : lectures sur des connexions mode=ro, écritures sérialisées par writer.DatabaseWriter
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import Database
+from migrations import migrate
+from repository import SqliteRepositories
+from writer import DatabaseWriter
+
+
+def populate(repositories, args):
+    with repositories.transaction():
+        for u in range(args.users):
+            user = repositories.users.create(f"user{u}@gridpay.test", 'x' * 60, f"+229{u:08d}", f"User {u}")
+            meter = repositories.meters.create(user.id, f"MTR{u:06d}", '')
+            for month in range(1, 13):
+                invoice = repositories.invoices.create(meter.id, f"2026-{month:02d}", 10.0 * month, 'paid', 50 * month)
+                repositories.payments.create(invoice.id, 10.0 * month, 'mobile', f"TX-{u}-{month}")
+
+
+def ingest_batch(repositories, rows, totals):
+    # Même transaction que flush_consumption_batch (server.py)
+    with repositories.transaction(immediate=True):
+        repositories.meters.add_cumulative(totals)
+        repositories.readings.insert(rows)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(repositories, args, ts):
+    stop = threading.Event()
+    latencies = [[] for _ in range(args.readers)]
+    ingested = [0]
+
+    def ingest():
+        while not stop.is_set():
+            ts[0] += 1
+            rows = [(m % args.users + 1, ts[0], 200) for m in range(args.batch)]
+            repositories.write(ingest_batch, repositories, rows, {f"MTR{m % args.users:06d}": 0.2
+                                                                  for m in range(args.batch)})
+            ingested[0] += len(rows)
+
+    def read(index):
+        rng = random.Random(index)
+        samples = latencies[index]
+        while not stop.is_set():
+            u = rng.randrange(args.users)
+            started = time.perf_counter()
+            repositories.invoices.list_for_user(u + 1)
+            repositories.payments.list_for_user(f"user{u}@gridpay.test")
+            samples.append((time.perf_counter() - started) * 1000)
+            repositories.store.reader.release()
+
+    threads = [threading.Thread(target=ingest)] + [threading.Thread(target=read, args=(i,))
+                                                   for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    samples = [value for reader in latencies for value in reader]
+    return {
+        'lectures/s': len(samples) / args.seconds,
+        'p50 ms': percentile(samples, 0.50),
+        'p99 ms': percentile(samples, 0.99),
+        'max ms': max(samples, default=0.0),
+        'ingestion lectures/s': ingested[0] / args.seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    ts = [int(time.time())]
+    results = []
+    try:
+        for name, split in (('partagé', False), ('séparé', True)):
+            database = Database(os.path.join(directory, f'bench_read_write_{split}.db'))
+            conn = database.connect()
+            migrate(conn)
+            conn.close()
+            populate(SqliteRepositories(database), args)
+
+            writer = DatabaseWriter() if split else None
+            if writer:
+                writer.start()
+            repositories = SqliteRepositories(database, reader=database.reader() if split else None,
+                                              writer=writer)
+            results.append((name, run(repositories, args, ts)))
+            if writer:
+                writer.stop()
+            database.close_all()
+    finally:
+        shutil.rmtree(directory)
+
+    columns = list(results[0][1])
+    print(f"[BENCH] {'mode':<10}" + ''.join(f"{column:>22}" for column in columns))
+    for name, result in results:
+        print(f"[BENCH] {name:<10}" + ''.join(f"{result[column]:>22,.2f}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
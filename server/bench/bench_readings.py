@@ -0,0 +1,73 @@
+# bench_readings.py
+# Débit d'insertion et octets par lecture de la table readings (WITHOUT ROWID)
+#   python bench/bench_readings.py --rows 10000000 --meters 5000
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from timeseries import READINGS_TABLE, insert_readings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--meters', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--interval', type=int, default=2, help="secondes entre deux lectures d'un compteur")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench_readings.db')
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(READINGS_TABLE)
+    cursor = conn.cursor()
+
+    # Chaque tick, tous les compteurs publient (ordre d'arrivée réel : entrelacé par compteur)
+    start_ts = int(time.time()) - args.rows // args.meters * args.interval
+    batch = []
+    inserted = 0
+    started = time.perf_counter()
+    tick = 0
+    while inserted < args.rows:
+        ts = start_ts + tick * args.interval
+        for meter_id in range(1, args.meters + 1):
+            batch.append((meter_id, ts, random.randint(100, 300)))
+            if len(batch) >= args.batch:
+                insert_readings(cursor, batch)
+                conn.commit()
+                inserted += len(batch)
+                batch = []
+                if inserted % (args.batch * 100) == 0:
+                    print(f"[BENCH] {inserted:,} lignes, {inserted / (time.perf_counter() - started):,.0f} lignes/s")
+                if inserted >= args.rows:
+                    break
+        tick += 1
+    if batch:
+        insert_readings(cursor, batch)
+        conn.commit()
+        inserted += len(batch)
+    elapsed = time.perf_counter() - started
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    rows = conn.execute("SELECT COUNT(*) FROM readings").fetchone()[0]
+    conn.close()
+
+    size = page_size * page_count
+    print(f"[BENCH] Lignes           : {rows:,}")
+    print(f"[BENCH] Débit d'insertion : {inserted / elapsed:,.0f} lignes/s ({elapsed:.1f} s)")
+    print(f"[BENCH] Taille du fichier : {size / 1e6:,.1f} Mo")
+    print(f"[BENCH] Octets par lecture : {size / rows:.1f}")
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    main()
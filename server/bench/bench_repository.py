@@ -0,0 +1,86 @@
+# bench_repository.py
+# Opérations par seconde des dépôts, backend SQLite contre backend en mémoire
+#   python bench/bench_repository.py --users 1000 --meters-per-user 3 --lookups 100000
+# L'écart entre les deux donne le coût de SQLite (requête, conversion des lignes) pour chaque accès.
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import Database
+from migrations import migrate
+from repository import SqliteRepositories, MemoryRepositories
+
+
+def populate(repositories, args):
+    started = time.perf_counter()
+    meter_id = 0
+    for u in range(args.users):
+        user = repositories.users.create(f"user{u}@gridpay.test", 'x' * 60, f"+229{u:08d}", f"User {u}")
+        for m in range(args.meters_per_user):
+            meter = repositories.meters.create(user.id, f"MTR{u:06d}-{m}", '')
+            meter_id = meter.id
+            for month in range(1, args.invoices_per_meter + 1):
+                repositories.invoices.create(meter_id, f"2026-{month:02d}", 10.0 * month, 'paid', 50 * month)
+    return time.perf_counter() - started
+
+
+def timed(name, count, operation):
+    started = time.perf_counter()
+    for i in range(count):
+        operation(i)
+    elapsed = time.perf_counter() - started
+    return name, count / elapsed
+
+
+def run(repositories, args):
+    rng = random.Random(42)
+    users = [rng.randrange(args.users) for _ in range(args.lookups)]
+    results = [('remplissage', args.users / populate(repositories, args))]
+    results.append(timed("utilisateur par email", args.lookups,
+                         lambda i: repositories.users.get_by_email(f"user{users[i]}@gridpay.test")))
+    results.append(timed("compteurs de l'utilisateur", args.lookups,
+                         lambda i: repositories.meters.list_for_user(users[i] + 1)))
+    results.append(timed("factures de l'utilisateur", args.lookups // 10,
+                         lambda i: repositories.invoices.list_for_user(users[i] + 1)))
+    results.append(timed("seuil (dernière facture payée)", args.lookups,
+                         lambda i: repositories.invoices.latest_paid_kwh(users[i] + 1)))
+    now = int(time.time())
+    results.append(timed("lot de 500 lectures", args.lookups // 100,
+                         lambda i: repositories.readings.insert(
+                             [(m % 100 + 1, now + i, 200) for m in range(500)])))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--meters-per-user', type=int, default=3)
+    parser.add_argument('--invoices-per-meter', type=int, default=6)
+    parser.add_argument('--lookups', type=int, default=100_000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    database = Database(os.path.join(directory, 'bench_repository.db'))
+    conn = database.connect()
+    migrate(conn)
+    conn.close()
+
+    try:
+        sqlite_results = run(SqliteRepositories(database), args)
+        memory_results = run(MemoryRepositories(), args)
+    finally:
+        database.close_all()
+        shutil.rmtree(directory)
+
+    print(f"[BENCH] {'opération':<32} {'sqlite op/s':>14} {'mémoire op/s':>14}")
+    for (name, sqlite_rate), (_, memory_rate) in zip(sqlite_results, memory_results):
+        print(f"[BENCH] {name:<32} {sqlite_rate:>14,.0f} {memory_rate:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# bench_shards.py
+# Écritures concurrentes de plusieurs processus (workers gunicorn) sur une base, puis sur N partitions
+#   python bench/bench_shards.py --shards 4 --processes 4 --seconds 10
+# Chaque processus a ses propres connexions et écrit dans son thread, comme un worker :
+#   'facturation' : une facture et son paiement par transaction (ids attribués par l'annuaire)
+#   'ingestion'   : lots de lectures + cumul des compteurs, une transaction par partition touchée
+# Puis lectures réparties (export de toutes les factures) : une seule base contre N partitions en parallèle
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import Database
+from migrations import migrate
+from repository import SqliteRepositories
+from shards import ShardDirectory, ShardedRepositories, directory_path, shard_path
+
+
+def open_repositories(path, shards):
+    """Dépôts d'un processus : SqliteRepositories sur une base, ShardedRepositories au-delà"""
+    if shards == 1:
+        database = Database(path)
+        conn = database.connect()
+        migrate(conn)
+        conn.close()
+        return SqliteRepositories(database), [database]
+    databases = [Database(shard_path(path, index)) for index in range(shards)] + [Database(directory_path(path))]
+    repositories = ShardedRepositories([SqliteRepositories(database) for database in databases[:-1]],
+                                       ShardDirectory(databases[-1]))
+    repositories.prepare()
+    return repositories, databases
+
+
+def populate(path, args, shards):
+    repositories, databases = open_repositories(path, shards)
+    with repositories.transaction():
+        for u in range(args.users):
+            user = repositories.users.create(f"user{u}@gridpay.test", 'x' * 60, f"+229{u:08d}", f"User {u}")
+            repositories.meters.create(user.id, f"MTR{u:06d}", '')
+    with repositories.transaction():
+        for u in range(args.users):
+            meter = repositories.meters.get_by_number(f"MTR{u:06d}")
+            for month in range(1, 13):
+                invoice = repositories.invoices.create(meter.id, f"2025-{month:02d}", 10.0 * month, 'paid', 50 * month)
+                repositories.payments.create(invoice.id, 10.0 * month, 'mobile', f"TX-{u}-{month}")
+    close(repositories, databases)
+
+
+def close(repositories, databases):
+    for database in databases:
+        database.close_all()
+    if isinstance(repositories, ShardedRepositories):
+        repositories.pool.shutdown()
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def worker(path, shards, workload, index, args, start, results):
+    repositories, databases = open_repositories(path, shards)
+    ids = repositories.meters.ids_for_numbers([f"MTR{u:06d}" for u in range(args.users)])
+    numbers = sorted(ids)
+    rng = random.Random(index)
+    samples = []
+    rows = 0
+    ts = int(time.time()) + index * 10 ** 7
+    while time.time() < start:
+        time.sleep(0.001)
+    stop = start + args.seconds
+    sequence = 0
+    while time.time() < stop:
+        started = time.perf_counter()
+        if workload == 'facturation':
+            meter_id = ids[rng.choice(numbers)]
+            sequence += 1
+            with repositories.transaction(immediate=True):
+                invoice = repositories.invoices.create(meter_id, f"B{index}-{sequence}", 25.0, 'paid', 120)
+                repositories.payments.create(invoice.id, 25.0, 'mobile', f"BENCH-{index}-{sequence}")
+            rows += 1
+        else:
+            ts += 1
+            chosen = rng.sample(numbers, min(args.batch, len(numbers)))
+            with repositories.transaction(immediate=True):
+                repositories.meters.add_cumulative({number: 0.2 for number in chosen})
+                repositories.readings.insert([(ids[number], ts, 200) for number in chosen])
+            rows += len(chosen)
+        samples.append((time.perf_counter() - started) * 1000)
+    close(repositories, databases)
+    results.put((rows, samples))
+
+
+def run(path, shards, workload, args):
+    results = multiprocessing.Queue()
+    start = time.time() + 1.0     # le temps que chaque processus ouvre ses connexions
+    processes = [multiprocessing.Process(target=worker, args=(path, shards, workload, index, args, start, results))
+                 for index in range(args.processes)]
+    for process in processes:
+        process.start()
+    collected = [results.get(timeout=args.seconds + 60) for _ in processes]
+    for process in processes:
+        process.join()
+    samples = [value for _, part in collected for value in part]
+    return {
+        'lignes/s': sum(rows for rows, _ in collected) / args.seconds,
+        'transactions/s': len(samples) / args.seconds,
+        'p50 ms': percentile(samples, 0.50),
+        'p99 ms': percentile(samples, 0.99),
+    }
+
+
+def scan(path, shards, args):
+    """Export complet des factures (lectures réparties en parallèle sur les partitions)"""
+    repositories, databases = open_repositories(path, shards)
+    samples = []
+    rows = 0
+    for _ in range(args.scans):
+        started = time.perf_counter()
+        rows = sum(1 for _ in repositories.invoices.export({}, 0))
+        samples.append((time.perf_counter() - started) * 1000)
+    close(repositories, databases)
+    return rows, sum(samples) / len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--scans', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        for shards in (1, args.shards):
+            path = os.path.join(directory, f'bench_shards_{shards}.db')
+            populate(path, args, shards)
+            for workload in ('facturation', 'ingestion'):
+                results.append((f"{workload} x{shards}", run(path, shards, workload, args)))
+            rows, elapsed = scan(path, shards, args)
+            print(f"[BENCH] {shards} partition(s) : export de {rows:,} factures en {elapsed:.1f} ms")
+    finally:
+        shutil.rmtree(directory)
+
+    columns = list(results[0][1])
+    print(f"[BENCH] {'mode':<18}" + ''.join(f"{column:>18}" for column in columns))
+    for name, result in results:
+        print(f"[BENCH] {name:<18}" + ''.join(f"{result[column]:>18,.2f}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+import argparse
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time
+
+from retention import ARCHIVED_BEFORE
+from timeseries import bucket_start, kwh_to_wh, read_timestamp
+
+
+# -----------------------------------------------------------------------------------------------
+# Import en masse (reprise des données d'un distributeur) : fichiers CSV ou JSONL, gzip ou non
+#   users    : email, name, phone, password_hash (bcrypt) ou password (haché ici, lent)
+#   meters   : email (propriétaire), meter_number, meter_name, status
+#   readings : meter_number, ts ou timestamp (epoch ou ISO 8601, sans fuseau : heure locale comme
+#              l'ingestion MQTT), wh ou kwh ; accepte les messages des capteurs et l'export de journal.py
+# Le fichier est lu ligne à ligne ; les lignes valides sont écrites par lots (executemany), un lot
+# par transaction. Une ligne déjà présente (email, numéro de compteur, lecture) est ignorée :
+# relancer un import interrompu ne crée pas de doublon.
+# -----------------------------------------------------------------------------------------------
+KINDS = ('users', 'meters', 'readings')
+FORMATS = ('csv', 'jsonl')
+METER_STATUSES = ('active', 'inactive')
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+MAX_ERROR_SAMPLES = 20
+
+
+def detect_format(filename):
+    """Format d'après l'extension (.csv, .jsonl, .ndjson, éventuellement suivie de .gz)"""
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return 'jsonl' if name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def open_source(path):
+    """Fichier binaire, décompressé à la volée s'il est gzip (détecté sur l'en-tête, pas sur le nom)"""
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+def read_records(stream, fmt):
+    """(numéro de ligne, enregistrement) du flux binaire, sans le charger en mémoire
+
+    CSV : dictionnaire par ligne (en-tête obligatoire) ; JSONL : texte brut, décodé par l'importeur
+    pour qu'une ligne illisible ne soit qu'une erreur de ligne.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for number, line in enumerate(text, 1):
+            if line.strip():
+                yield number, line
+
+
+# ------------------------- Conversion des lignes -------------------------
+def _field(record, name, default=None):
+    value = record.get(name)
+    if value is None or str(value).strip() == '':
+        if default is None:
+            raise ValueError(f"champ '{name}' manquant")
+        return default
+    return str(value).strip()
+
+
+def user_row(record, hash_password=None):
+    email = _field(record, 'email')
+    if not EMAIL_PATTERN.match(email):
+        raise ValueError(f"email invalide: {email!r}")
+    password = record.get('password_hash') or None
+    if password is None:
+        plain = _field(record, 'password')
+        if hash_password is None:
+            raise ValueError("password_hash manquant")
+        if len(plain) < 8:
+            raise ValueError("mot de passe de moins de 8 caractères")
+        password = hash_password(plain)
+    return email, password, _field(record, 'phone'), _field(record, 'name')
+
+
+def meter_row(record):
+    status = _field(record, 'status', 'active')
+    if status not in METER_STATUSES:
+        raise ValueError(f"status invalide: {status!r}")
+    return _field(record, 'email'), _field(record, 'meter_number'), _field(record, 'meter_name', ''), status
+
+
+def reading_row(record):
+    if record.get('wh') not in (None, ''):
+        wh = int(float(record['wh']))
+    else:
+        wh = kwh_to_wh(float(_field(record, 'kwh')))
+    if wh < 0:
+        raise ValueError(f"consommation négative: {wh} Wh")
+    # 'timestamp' : messages MQTT des capteurs et export de journal.py
+    ts = record.get('ts') if record.get('ts') not in (None, '') else record.get('timestamp')
+    if ts in (None, ''):
+        raise ValueError("champ 'ts' (ou 'timestamp') manquant")
+    return _field(record, 'meter_number'), read_timestamp(str(ts).strip()), wh
+
+
+# ------------------------- Importeur -------------------------
+class BulkImporter:
+    """Convertit les enregistrements un à un et les écrit par lots via repositories.write()
+
+    defer_indexes : supprime les index secondaires non uniques de la table pendant l'import et les
+    reconstruit à la fin (une construction triée au lieu d'une mise à jour par ligne). À réserver
+    aux reprises initiales : les requêtes qui s'en servent sont lentes pendant l'import.
+    lock : verrou tenu pendant un import de lectures (celui de la rétention, qui archive par mois).
+    """
+
+    def __init__(self, repositories, kind, chunk_rows=5000, hash_password=None, defer_indexes=False,
+                 lock=None, progress_interval_s=5):
+        if kind not in KINDS:
+            raise ValueError(f"Type d'import inconnu: {kind}")
+        self.repositories = repositories
+        self.kind = kind
+        self.chunk_rows = chunk_rows
+        self.hash_password = hash_password
+        self.defer_indexes = defer_indexes
+        self.lock = lock if lock is not None and kind == 'readings' else contextlib.nullcontext()
+        self.progress_interval_s = progress_interval_s
+
+        # Métriques
+        self.state = 'pending'
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.errors = 0
+        self.error_samples = []
+        self.chunks = 0
+        self.started = None
+        self.finished = None
+        self._last_progress = 0.0
+
+    def run(self, records):
+        """Importe (numéro de ligne, enregistrement) ; retourne les métriques"""
+        self.state = 'running'
+        self.started = time.time()
+        self._last_progress = time.monotonic()
+        try:
+            with self.lock, self._deferred_indexes():
+                chunk = []
+                for line, record in records:
+                    self.rows += 1
+                    try:
+                        if isinstance(record, str):
+                            record = json.loads(record)
+                        chunk.append(self._convert(record))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        self._error(line, e)
+                    if len(chunk) >= self.chunk_rows:
+                        self._flush(chunk)
+                        chunk = []
+                if chunk:
+                    self._flush(chunk)
+        except Exception as e:
+            self.state = 'failed'
+            self._error(None, e)
+            raise
+        finally:
+            self.finished = time.time()
+        self.state = 'done'
+        self._report()
+        return self.stats()
+
+    def _convert(self, record):
+        if self.kind == 'users':
+            return user_row(record, self.hash_password)
+        if self.kind == 'meters':
+            return meter_row(record)
+        return reading_row(record)
+
+    def _flush(self, chunk):
+        repositories = self.repositories
+        if self.kind == 'users':
+            inserted = repositories.write(repositories.users.import_many, chunk)
+        elif self.kind == 'meters':
+            inserted = repositories.write(repositories.meters.import_many, chunk)
+        else:
+            ids = repositories.meters.ids_for_numbers({meter_number for meter_number, _, _ in chunk})
+            rows = [(ids[meter_number], ts, wh) for meter_number, ts, wh in chunk if meter_number in ids]
+            self.skipped += len(chunk) - len(rows)      # compteur inconnu
+            chunk = rows
+            inserted = repositories.write(self._write_readings, rows) if rows else 0
+        self.inserted += inserted
+        self.skipped += len(chunk) - inserted
+        self.chunks += 1
+        if time.monotonic() - self._last_progress >= self.progress_interval_s:
+            self._report()
+
+    def _write_readings(self, rows):
+        readings = self.repositories.readings
+        with self.repositories.transaction():
+            inserted = readings.import_many(rows)
+            # Lectures de mois déjà archivés : la prochaine passe de rétention les archive à leur tour
+            first_month = bucket_start(min(ts for _, ts, _ in rows), 'month')
+            if inserted and first_month < readings.retention_state(ARCHIVED_BEFORE):
+                readings.set_retention_state(ARCHIVED_BEFORE, first_month)
+        return inserted
+
+    @contextlib.contextmanager
+    def _deferred_indexes(self):
+        if not self.defer_indexes:
+            yield
+            return
+        definitions = self.repositories.write(self.repositories.drop_indexes, self.kind)
+        try:
+            yield
+        finally:
+            if definitions:
+                started = time.perf_counter()
+                self.repositories.write(self.repositories.create_indexes, definitions)
+                print(f"[IMPORT] {len(definitions)} index de {self.kind} reconstruits en "
+                      f"{time.perf_counter() - started:.1f} s")
+
+    def _error(self, line, error):
+        self.errors += 1
+        if len(self.error_samples) < MAX_ERROR_SAMPLES:
+            self.error_samples.append({'line': line, 'error': str(error)})
+
+    def _report(self):
+        self._last_progress = time.monotonic()
+        print(f"[IMPORT] {self.kind}: {self.rows} lignes, {self.inserted} insérées, {self.skipped} ignorées, "
+              f"{self.errors} erreurs ({self.rows_per_s():,.0f} lignes/s)")
+
+    def rows_per_s(self):
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.time()) - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'state': self.state,
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'error_samples': self.error_samples,
+            'chunks': self.chunks,
+            'rows_per_s': round(self.rows_per_s(), 1),
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class ImportJob:
+    """Import d'un fichier déposé (endpoint d'administration) dans un thread ; le fichier est supprimé à la fin"""
+
+    def __init__(self, job_id, importer, path, fmt, on_done=None):
+        self.id = job_id
+        self.importer = importer
+        self.path = path
+        self.format = fmt
+        self.on_done = on_done
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"import-{self.id}", daemon=True).start()
+
+    def _run(self):
+        try:
+            with open_source(self.path) as stream:
+                self.importer.run(read_records(stream, self.format))
+            if self.on_done:
+                self.on_done()
+        except Exception as e:
+            print(f"[IMPORT ERROR] Import {self.id} ({self.importer.kind}) interrompu: {e}")
+        finally:
+            os.remove(self.path)
+
+    def stats(self):
+        return {'id': self.id, 'format': self.format, **self.importer.stats()}
+
+
+if __name__ == '__main__':
+    # Import hors du serveur (reprise initiale)
+    #   python bulk_import.py users clients.csv.gz
+    #   python bulk_import.py meters compteurs.jsonl --defer-indexes
+    #   python bulk_import.py readings lectures-2024.csv.gz --chunk-rows 20000
+    from flask_bcrypt import generate_password_hash
+    from archive import ReadingArchive
+    from db import Database
+    from migrations import migrate
+    from repository import SqliteRepositories
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('kind', choices=KINDS)
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=FORMATS)
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', os.path.join(here, 'gridpay.db')))
+    parser.add_argument('--archive', default=os.environ.get('ARCHIVE_DIR', os.path.join(here, 'archive')))
+    parser.add_argument('--chunk-rows', type=int, default=5000)
+    parser.add_argument('--defer-indexes', action='store_true')
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    database = Database(args.db)
+    conn = database.connect()
+    migrate(conn)
+    conn.close()
+
+    importer = BulkImporter(
+        SqliteRepositories(database, ReadingArchive(args.archive)),
+        args.kind,
+        chunk_rows=args.chunk_rows,
+        hash_password=lambda password: generate_password_hash(password, args.bcrypt_rounds).decode('utf-8'),
+        defer_indexes=args.defer_indexes
+    )
+    with open_source(args.path) as source:
+        result = importer.run(read_records(source, args.format or detect_format(args.path)))
+    for sample in result['error_samples']:
+        print(f"[IMPORT] ligne {sample['line']}: {sample['error']}")
+    database.close_all()
@@ -0,0 +1,76 @@
+from pagination import encode_cursor, decode_cursor
+
+
+# -----------------------------------------------------------------------------------------------
+# Synchronisation différentielle (GET /changes) des compteurs, factures et paiements d'un utilisateur
+#   Le journal des modifications (migration 7) reçoit une ligne par insertion, modification ou
+#   suppression, dans la transaction de l'écriture. Un client garde le curseur de sa dernière
+#   synchronisation et ne reçoit ensuite que les entités modifiées depuis, chacune une seule fois
+#   avec son état actuel : après des heures hors ligne, un compteur renommé dix fois reste une ligne.
+#   Curseur : (origine de la base, séquence). Premier appel, autre base (restauration, partition
+#   après rebalance) ou curseur antérieur à la purge du journal : reset, le client recharge ses listes.
+# -----------------------------------------------------------------------------------------------
+CURSOR = 'changes'
+
+
+class ChangeFeed:
+    """Pages du flux de modifications d'un utilisateur, lues dans repositories.changes"""
+
+    def __init__(self, repositories):
+        self.repositories = repositories
+        # Entité -> lecture de l'état actuel de ses lignes (celles de l'utilisateur seulement)
+        self.getters = {
+            'meter': lambda user_id, ids: repositories.meters.get_many(user_id, ids),
+            'invoice': lambda user_id, ids: repositories.invoices.get_many(user_id, ids),
+            'payment': lambda user_id, ids: repositories.payments.get_many(user_id, ids),
+        }
+
+    def page(self, user_id, since, limit):
+        """Réponse de GET /changes (au plus limit entités) ; ValueError si le curseur est illisible
+
+        Les modifications sont regroupées par entité sur tout l'intervalle depuis le curseur, pas
+        page par page : une entité modifiée cent fois n'occupe qu'une place dans une seule page.
+        """
+        origin, latest, pruned = self.repositories.changes.state(user_id)
+        after = None
+        if since:
+            cursor_origin, seq = decode_cursor(CURSOR, since)
+            if cursor_origin == origin and pruned <= seq <= latest:
+                after = seq
+        if after is None:
+            # Curseur lu avant le rechargement : une écriture concurrente sera renvoyée, pas perdue
+            return {'changes': [], 'cursor': encode_cursor(CURSOR, (origin, latest)), 'has_more': False,
+                    'reset': True}
+
+        # Entités par dernière modification : celles de la page sont toutes celles dont la dernière
+        # modification précède le nouveau curseur, les autres viendront après lui
+        rows = self.repositories.changes.since(user_id, after, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        # Sans suite, avancer jusqu'à la dernière séquence de la base : le curseur ne vieillit pas
+        # (purge) chez un client dont les données ne changent pas
+        seq = rows[-1][0] if rows else after
+        if not has_more:
+            seq = max(seq, latest)
+        return {'changes': self.entries(user_id, rows), 'cursor': encode_cursor(CURSOR, (origin, seq)),
+                'has_more': has_more, 'reset': False}
+
+    def entries(self, user_id, rows):
+        """rows : (seq, entité, id, dernière opération, insérée) -> entrées de la réponse, état actuel lu par lots"""
+        ids = {}
+        for _, entity, entity_id, op, _ in rows:
+            if op != 'delete':
+                ids.setdefault(entity, []).append(entity_id)
+        current = {(entity, row.id): row
+                   for entity, entity_ids in ids.items() for row in self.getters[entity](user_id, entity_ids)}
+
+        entries = []
+        for _, entity, entity_id, _, inserted in rows:
+            row = current.get((entity, entity_id))
+            # Supprimée, ou sortie des listes (compteur ou facture supprimés, autre propriétaire)
+            if row is None:
+                entries.append({'entity': entity, 'id': entity_id, 'op': 'delete'})
+            else:
+                entries.append({'entity': entity, 'id': entity_id, 'op': 'insert' if inserted else 'update',
+                                'data': row.to_dict()})
+        return entries
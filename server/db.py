@@ -0,0 +1,195 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+import weakref
+from urllib.request import pathname2url
+
+
+MEMORY = ':memory:'
+
+
+# -----------------------------------------------------------------------------------------------
+# Connexions SQLite réutilisées par thread
+# -----------------------------------------------------------------------------------------------
+def _is_locked(error):
+    # 'database is locked' (WAL, busy_timeout écoulé) ou 'database table is locked' (cache partagé)
+    return 'locked' in str(error)
+
+
+class RetryingCursor(sqlite3.Cursor):
+    """Curseur qui relance une requête refusée pour verrou, avec un délai aléatoire croissant"""
+
+    def execute(self, sql, parameters=()):
+        return self.connection.retry(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Un itérateur serait consommé par la première tentative
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        return self.connection.retry(super().executemany, sql, seq_of_parameters)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connexion prêtée à un thread : close() la rend au gestionnaire au lieu de la fermer"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.database = None     # Database propriétaire, fixé par Database._open
+        self.depth = 0           # nombre de connect() non encore refermés dans le thread
+
+    def cursor(self, factory=RetryingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        return self.retry(super().commit)
+
+    def retry(self, operation, *args):
+        database = self.database
+        delay = database.retry_delay
+        for attempt in range(database.retries + 1):
+            try:
+                return operation(*args)
+            except sqlite3.OperationalError as e:
+                if not _is_locked(e) or attempt == database.retries:
+                    raise
+                database.lock_retries += 1
+                time.sleep(delay * (0.5 + random.random()))
+                delay *= 2
+
+    def close(self):
+        """Fin d'utilisation : annule une transaction non validée quand le dernier utilisateur la rend"""
+        self.depth = max(self.depth - 1, 0)
+        if self.depth == 0 and self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+
+class Database:
+    """Gestionnaire de connexions : une connexion par thread, rendue à un pool en fin de requête"""
+
+    def __init__(self, path, busy_timeout_ms=5000, cached_statements=256, pool_size=16,
+                 retries=5, retry_delay_ms=20, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.pool_size = pool_size
+        self.retries = retries
+        self.retry_delay = retry_delay_ms / 1000.0
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._all = weakref.WeakSet()
+        self._anchor = None
+        self._reader = None
+
+        # Métriques
+        self.opened = 0
+        self.reused = 0
+        self.lock_retries = 0
+
+        if path == MEMORY:
+            # Base en mémoire partagée entre threads, conservée tant que l'ancre reste ouverte
+            self._uri = f"file:gridpay-{id(self)}?mode=memory&cache=shared"
+            self._anchor = self._open()
+        elif readonly:
+            # Lecture seule : aucune connexion de ce gestionnaire ne peut prendre le verrou d'écriture
+            self._uri = f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+        else:
+            self._uri = None
+
+    def _open(self):
+        conn = sqlite3.connect(self._uri or self.path, uri=bool(self._uri), factory=PooledConnection,
+                               check_same_thread=False, timeout=self.busy_timeout_ms / 1000.0,
+                               cached_statements=self.cached_statements)
+        conn.database = self
+        if self.readonly:
+            # Le mode WAL est déjà fixé dans le fichier par le gestionnaire en écriture
+            conn.execute("PRAGMA query_only=1")
+        else:
+            # Base neuve : pages libérables par PRAGMA incremental_vacuum (sans effet une fois le fichier créé)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        if not self._uri:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        with self._lock:
+            self._all.add(conn)
+            self.opened += 1
+        return conn
+
+    def reader(self):
+        """Gestionnaire jumeau en lecture seule (mode=ro) : lectures sur un instantané WAL, sans verrou
+
+        Une base ':memory:' n'a pas de fichier à rouvrir : ses lecteurs restent sur ce gestionnaire.
+        """
+        if self.path == MEMORY or self.readonly:
+            return self
+        with self._lock:
+            if self._reader is None:
+                self._reader = Database(self.path, busy_timeout_ms=self.busy_timeout_ms,
+                                        cached_statements=self.cached_statements, pool_size=self.pool_size,
+                                        retries=self.retries, retry_delay_ms=self.retry_delay * 1000,
+                                        readonly=True)
+            return self._reader
+
+    def connect(self):
+        """Connexion du thread courant ; chaque appel doit être suivi d'un close()"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                if conn is not None:
+                    self.reused += 1
+            if conn is None:
+                conn = self._open()
+            self._local.conn = conn
+        conn.depth += 1
+        return conn
+
+    def release(self):
+        """Rend la connexion du thread au pool (fin de requête HTTP)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        conn.depth = 0
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.really_close()
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._all)
+            self._idle.clear()
+            reader, self._reader = self._reader, None
+        if reader is not None:
+            reader.close_all()
+        self._local = threading.local()
+        for conn in connections:
+            conn.really_close()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'readonly': self.readonly,
+            'opened': self.opened,
+            'reused': self.reused,
+            'idle': len(self._idle),
+            'lock_retries': self.lock_retries,
+        }
@@ -1,43 +1,306 @@
+-- Schéma GridPay (version 7), généré à partir de migrations.py
+-- python migrations.py chemin.db applique les migrations à une base existante
+
+-- Avant toute table : pages libérées par PRAGMA incremental_vacuum (rétention des lectures)
+PRAGMA auto_vacuum = INCREMENTAL;
+
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
 
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT NOT NULL,
     email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
     phone TEXT,
-    password TEXT NOT NULL
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
-
-
 CREATE TABLE IF NOT EXISTS meters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            meter_number TEXT UNIQUE NOT NULL,
-            meter_name TEXT,
-            status TEXT DEFAULT 'active',
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    meter_number TEXT UNIQUE NOT NULL,
+    meter_name TEXT,
+    status TEXT DEFAULT 'active',
+    cumulative_consumption REAL DEFAULT 0.0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
 
 CREATE TABLE IF NOT EXISTS invoices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            meter_id INTEGER NOT NULL,
-            month TEXT NOT NULL,              
-            amount REAL NOT NULL,
-            status TEXT DEFAULT 'unpaid',
-            kwh INTEGER NOT NULL,
-            issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (meter_id) REFERENCES meters(id) ON DELETE CASCADE
-        )
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    meter_id INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT DEFAULT 'unpaid',
+    kwh INTEGER NOT NULL,
+    issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    user_id INTEGER,
+    FOREIGN KEY (meter_id) REFERENCES meters(id) ON DELETE CASCADE
+);
 
 CREATE TABLE IF NOT EXISTS payments (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     invoice_id INTEGER NOT NULL,
     amount REAL NOT NULL,
     payment_method TEXT NOT NULL,
-    transaction_id TEXT NOT NULL,
-    status_payment TEXT NOT NUll,
+    transaction_id TEXT UNIQUE,
+    status TEXT DEFAULT 'completed',
     paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (invoice_id) REFERENCES invoices(id)
-);
\ No newline at end of file
+    user_id INTEGER,
+    FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS readings (
+    meter_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,              -- secondes epoch
+    wh INTEGER NOT NULL,
+    PRIMARY KEY (meter_id, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS consumption_minute (
+    meter_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,          -- début de la période, secondes epoch UTC
+    wh INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    PRIMARY KEY (meter_id, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS consumption_hour (
+    meter_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,          -- début de la période, secondes epoch UTC
+    wh INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    PRIMARY KEY (meter_id, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS consumption_day (
+    meter_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,          -- début de la période, secondes epoch UTC
+    wh INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    PRIMARY KEY (meter_id, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS consumption_month (
+    meter_id INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,          -- début de la période, secondes epoch UTC
+    wh INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    PRIMARY KEY (meter_id, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+    journal TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS late_readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    meter_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    wh INTEGER NOT NULL,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS reading_archives (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    month INTEGER NOT NULL,           -- début du mois, secondes epoch UTC
+    path TEXT UNIQUE NOT NULL,        -- relatif au répertoire d'archive
+    meters INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    wh INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS retention (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    entity TEXT NOT NULL,             -- 'meter', 'invoice', 'payment'
+    entity_id INTEGER NOT NULL,
+    op TEXT NOT NULL,                 -- 'insert', 'update', 'delete'
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS change_log_state (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    origin TEXT NOT NULL,
+    pruned_seq INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_meter_month ON invoices (meter_id, month);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_meter_status_issued ON invoices (meter_id, status, issued_at);
+
+CREATE INDEX IF NOT EXISTS idx_meters_user_created ON meters (user_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone);
+
+CREATE INDEX IF NOT EXISTS idx_reading_archives_month ON reading_archives (month);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_user_issued
+    ON invoices (user_id, issued_at DESC, id, meter_id, month, amount, status, kwh);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_paid
+    ON payments (user_id, paid_at DESC, id, invoice_id, amount, payment_method, transaction_id, status);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_user_status_issued
+    ON invoices (user_id, status, issued_at DESC, id, meter_id, month, amount, kwh);
+
+CREATE INDEX IF NOT EXISTS idx_invoices_meter_issued
+    ON invoices (meter_id, issued_at DESC, id, user_id, month, amount, status, kwh);
+
+CREATE INDEX IF NOT EXISTS idx_payments_user_status_paid
+    ON payments (user_id, status, paid_at DESC, id, invoice_id, amount, payment_method, transaction_id);
+
+CREATE INDEX IF NOT EXISTS idx_payments_invoice_paid_id ON payments (invoice_id, paid_at DESC, id);
+
+CREATE INDEX IF NOT EXISTS idx_meters_user_status_created ON meters (user_id, status, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_change_log_user ON change_log (user_id, seq, entity, entity_id, op);
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_owner_insert AFTER INSERT ON invoices
+WHEN NEW.user_id IS NULL
+BEGIN
+    UPDATE invoices SET user_id = (SELECT user_id FROM meters WHERE id = NEW.meter_id) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_owner_meter AFTER UPDATE OF meter_id ON invoices
+BEGIN
+    UPDATE invoices SET user_id = (SELECT user_id FROM meters WHERE id = NEW.meter_id) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_owner AFTER UPDATE OF user_id ON meters
+BEGIN
+    UPDATE invoices SET user_id = NEW.user_id WHERE meter_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_owner_insert AFTER INSERT ON payments
+WHEN NEW.user_id IS NULL
+BEGIN
+    UPDATE payments SET user_id = (SELECT user_id FROM invoices WHERE id = NEW.invoice_id) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_owner_invoice AFTER UPDATE OF invoice_id ON payments
+BEGIN
+    UPDATE payments SET user_id = (SELECT user_id FROM invoices WHERE id = NEW.invoice_id) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_owner_payments AFTER UPDATE OF user_id ON invoices
+BEGIN
+    UPDATE payments SET user_id = NEW.user_id WHERE invoice_id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_log_insert AFTER INSERT ON meters
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT owner, 'meter', id, 'insert' FROM (SELECT NEW.id AS id, NEW.user_id AS owner) WHERE owner IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_log_update AFTER UPDATE OF meter_number, meter_name, status ON meters
+WHEN NEW.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'meter', id, 'update' FROM (SELECT NEW.id AS id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_log_owner AFTER UPDATE OF user_id ON meters
+WHEN OLD.user_id IS NOT NULL AND NEW.user_id IS NOT OLD.user_id
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'meter', id, 'delete' FROM (SELECT OLD.id AS id);
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'meter', id, 'insert' FROM (SELECT NEW.id AS id) WHERE NEW.user_id IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_log_delete AFTER DELETE ON meters
+WHEN OLD.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'meter', id, 'delete' FROM (SELECT OLD.id AS id);
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'invoice', id, 'delete' FROM (SELECT id FROM invoices WHERE meter_id = OLD.id);
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'payment', id, 'delete' FROM (SELECT id FROM payments WHERE invoice_id IN (SELECT id FROM invoices WHERE meter_id = OLD.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_log_invoices AFTER UPDATE OF meter_number, meter_name ON meters
+WHEN NEW.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'invoice', id, 'update' FROM (SELECT id FROM invoices WHERE meter_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_meters_log_payments AFTER UPDATE OF meter_number, meter_name ON meters
+WHEN NEW.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'payment', id, 'update' FROM (SELECT id FROM payments WHERE invoice_id IN (SELECT id FROM invoices WHERE meter_id = NEW.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_log_insert AFTER INSERT ON invoices
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT owner, 'invoice', id, 'insert' FROM (SELECT NEW.id AS id, COALESCE(NEW.user_id, (SELECT user_id FROM meters WHERE id = NEW.meter_id)) AS owner) WHERE owner IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_log_update AFTER UPDATE OF meter_id, month, amount, status, kwh ON invoices
+WHEN NEW.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'invoice', id, 'update' FROM (SELECT NEW.id AS id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_log_owner AFTER UPDATE OF user_id ON invoices
+WHEN OLD.user_id IS NOT NULL AND NEW.user_id IS NOT OLD.user_id
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'invoice', id, 'delete' FROM (SELECT OLD.id AS id);
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'invoice', id, 'insert' FROM (SELECT NEW.id AS id) WHERE NEW.user_id IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_log_delete AFTER DELETE ON invoices
+WHEN OLD.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'invoice', id, 'delete' FROM (SELECT OLD.id AS id);
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'payment', id, 'delete' FROM (SELECT id FROM payments WHERE invoice_id = OLD.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_invoices_log_payments AFTER UPDATE OF month, amount, status ON invoices
+WHEN NEW.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'payment', id, 'update' FROM (SELECT id FROM payments WHERE invoice_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_log_insert AFTER INSERT ON payments
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT owner, 'payment', id, 'insert' FROM (SELECT NEW.id AS id, COALESCE(NEW.user_id, (SELECT user_id FROM invoices WHERE id = NEW.invoice_id)) AS owner) WHERE owner IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_log_update AFTER UPDATE OF invoice_id, amount, payment_method, transaction_id, status, paid_at ON payments
+WHEN NEW.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'payment', id, 'update' FROM (SELECT NEW.id AS id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_log_owner AFTER UPDATE OF user_id ON payments
+WHEN OLD.user_id IS NOT NULL AND NEW.user_id IS NOT OLD.user_id
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'payment', id, 'delete' FROM (SELECT OLD.id AS id);
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT NEW.user_id, 'payment', id, 'insert' FROM (SELECT NEW.id AS id) WHERE NEW.user_id IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_payments_log_delete AFTER DELETE ON payments
+WHEN OLD.user_id IS NOT NULL
+BEGIN
+    INSERT INTO change_log (user_id, entity, entity_id, op) SELECT OLD.user_id, 'payment', id, 'delete' FROM (SELECT OLD.id AS id);
+END;
+
+INSERT INTO schema_version (version, description) VALUES
+    (1, 'Schéma initial'),
+    (2, 'Colonnes manquantes des anciennes bases'),
+    (3, 'Index des requêtes fréquentes'),
+    (4, 'Archive et rétention des lectures brutes'),
+    (5, 'Propriétaire des factures et paiements'),
+    (6, 'Index des listes paginées'),
+    (7, 'Journal des modifications');
+
+-- Origine des curseurs de GET /changes (propre à chaque base)
+INSERT INTO change_log_state (id, origin) VALUES (1, lower(hex(randomblob(8))));
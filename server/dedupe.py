@@ -0,0 +1,96 @@
+import sys
+
+
+ACCEPTED = 0
+DUPLICATE = 1
+LATE = 2
+
+
+# -----------------------------------------------------------------------------------------------
+# Dédoublonnage des lectures par compteur
+# -----------------------------------------------------------------------------------------------
+class ReadingDeduplicator:
+    """Par compteur : plus haute seconde vue + bitmap des `window_s` secondes précédentes"""
+
+    def __init__(self, window_s=900):
+        self.window = window_s
+        self._mask = (1 << window_s) - 1
+        self._hwm = {}     # meter_id -> plus haut timestamp accepté
+        self._bits = {}    # meter_id -> bit i = lecture vue à hwm - i
+
+        # Métriques
+        self.accepted = 0
+        self.duplicates = 0
+        self.late = 0
+
+    def __contains__(self, meter_id):
+        return meter_id in self._hwm
+
+    def seed(self, meter_id, timestamps):
+        """Initialise la fenêtre d'un compteur à partir des lectures déjà en base"""
+        for ts in sorted(timestamps):
+            self._mark(meter_id, ts)
+
+    def check(self, meter_id, ts):
+        """Retourne ACCEPTED, DUPLICATE ou LATE et enregistre la lecture acceptée"""
+        result = self._mark(meter_id, ts)
+        if result == ACCEPTED:
+            self.accepted += 1
+        elif result == DUPLICATE:
+            self.duplicates += 1
+        else:
+            self.late += 1
+        return result
+
+    def _mark(self, meter_id, ts):
+        hwm = self._hwm.get(meter_id)
+        if hwm is None or ts - hwm >= self.window:
+            self._hwm[meter_id] = ts
+            self._bits[meter_id] = 1
+            return ACCEPTED
+
+        if ts > hwm:
+            self._hwm[meter_id] = ts
+            self._bits[meter_id] = ((self._bits[meter_id] << (ts - hwm)) | 1) & self._mask
+            return ACCEPTED
+
+        age = hwm - ts
+        if age >= self.window:
+            return LATE
+        bit = 1 << age
+        bits = self._bits[meter_id]
+        if bits & bit:
+            return DUPLICATE
+        self._bits[meter_id] = bits | bit
+        return ACCEPTED
+
+    def snapshot(self, meter_ids):
+        """État des fenêtres de ces compteurs et des métriques, pour annuler les check() suivants"""
+        windows = {meter_id: (self._hwm.get(meter_id), self._bits.get(meter_id)) for meter_id in meter_ids}
+        return windows, (self.accepted, self.duplicates, self.late)
+
+    def restore(self, snapshot):
+        """Revient à l'état d'un snapshot (lot dont l'écriture a échoué)"""
+        windows, (self.accepted, self.duplicates, self.late) = snapshot
+        for meter_id, (hwm, bits) in windows.items():
+            if hwm is None:
+                self.forget(meter_id)
+            else:
+                self._hwm[meter_id] = hwm
+                self._bits[meter_id] = bits
+
+    def forget(self, meter_id):
+        self._hwm.pop(meter_id, None)
+        self._bits.pop(meter_id, None)
+
+    def stats(self):
+        # Borne haute par compteur : entiers hwm + bitmap pleine + deux entrées de dict
+        per_meter = sys.getsizeof(2 ** 62) + sys.getsizeof(self._mask) + 2 * 2 * 8
+        return {
+            'window_s': self.window,
+            'meters': len(self._hwm),
+            'bytes_per_meter_max': per_meter,
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'late': self.late,
+        }
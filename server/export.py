@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+import time
+import zlib
+
+from repository import Invoice, Payment
+
+
+# -----------------------------------------------------------------------------------------------
+# Exports comptables en flux : lignes lues par paquets sur un curseur, encodées en CSV ou NDJSON
+# (éventuellement gzip) et envoyées par blocs, sans jamais construire la liste complète.
+# Ordre stable par clé (id, ou compteur puis ts pour les lectures) : un export interrompu reprend
+# avec after=<clé de la dernière ligne reçue>.
+# -----------------------------------------------------------------------------------------------
+DATASETS = ('invoices', 'payments', 'readings')
+FORMATS = ('csv', 'ndjson')
+COLUMNS = {
+    'invoices': Invoice.FIELDS,
+    'payments': Payment.FIELDS,
+    'readings': ('meter_id', 'meter_number', 'ts', 'wh'),
+}
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+def sql_timestamp(epoch):
+    """Epoch -> 'AAAA-MM-JJ HH:MM:SS' (UTC), le format des colonnes CURRENT_TIMESTAMP"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
+
+
+def parse_after(dataset, value):
+    """Clé de reprise : id pour factures et paiements, '<meter_id>:<ts>' pour les lectures"""
+    if value is None or value == '':
+        return (0, -1) if dataset == 'readings' else 0
+    if dataset == 'readings':
+        meter_id, _, ts = value.partition(':')
+        return int(meter_id), int(ts)
+    return int(value)
+
+
+def export_rows(repositories, dataset, filters, after, start=0, end=None):
+    """Tuples dans l'ordre de COLUMNS[dataset], à partir de la clé `after` exclue
+
+    Lectures : [start, end) borne ts ; les filtres email/meter_number choisissent les compteurs.
+    """
+    if dataset == 'invoices':
+        for invoice in repositories.invoices.export(filters, after):
+            yield tuple(getattr(invoice, name) for name in Invoice.FIELDS)
+    elif dataset == 'payments':
+        for payment in repositories.payments.export(filters, after):
+            yield tuple(getattr(payment, name) for name in Payment.FIELDS)
+    else:
+        after_meter, after_ts = after
+        end = end if end is not None else int(time.time()) + 1
+        # Le compteur de la dernière ligne reçue est repris juste après son ts
+        for meter_id, meter_number in repositories.meters.export_ids(filters, after_meter - 1 if after_meter else 0):
+            lo = max(start, after_ts + 1) if meter_id == after_meter else start
+            for ts, wh in repositories.readings.export(meter_id, lo, end):
+                yield meter_id, meter_number, ts, wh
+
+
+def encode(rows, columns, fmt, chunk_bytes=64 * 1024):
+    """Blocs d'octets CSV (avec en-tête) ou NDJSON d'environ chunk_bytes"""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, separators=(',', ':')))
+            buffer.write('\n')
+    for row in rows:
+        write(row)
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresse un flux de blocs au format gzip, bloc par bloc"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
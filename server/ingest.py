@@ -0,0 +1,221 @@
+import queue
+import threading
+import time
+import zlib
+
+
+def meter_partition(meter_number, partitions):
+    """Partition stable d'un compteur, identique dans tous les processus"""
+    return zlib.crc32(meter_number.encode()) % partitions
+
+
+# -----------------------------------------------------------------------------------------------
+# Pipeline d'ingestion MQTT (write-behind)
+# -----------------------------------------------------------------------------------------------
+class IngestPipeline:
+    """File bornée + écrivain dédié qui vide les lectures par lots"""
+
+    def __init__(self, flush_handler, batch_size=500, flush_interval_ms=200, max_queue=50000,
+                 max_retries=5, retry_backoff_ms=100, retry_backoff_max_ms=5000, failed_handler=None,
+                 idle_handler=None, quarantine_handler=None):
+        self.flush_handler = flush_handler
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.queue = queue.Queue(maxsize=max_queue)
+        # Lot en échec : retenté avec un délai doublé à chaque essai, puis confié à failed_handler(batch)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000.0
+        self.retry_backoff_max = retry_backoff_max_ms / 1000.0
+        self.failed_handler = failed_handler
+        # Base joignable malgré l'échec : lot coupé en deux jusqu'à isoler les lectures qui le font
+        # échouer, confiées une à une à quarantine_handler(reading, erreur) au lieu d'être retentées
+        self.quarantine_handler = quarantine_handler
+        # File sous un lot : idle_handler() rend des lectures à réécrire (écartées plus tôt)
+        self.idle_handler = idle_handler
+
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+        # Métriques
+        self.received = 0
+        self.dropped = 0
+        self.rejected = 0       # refusées avant la file (timestamp absent, illisible ou futur, kWh invalide)
+        self.rejections = {}    # motif -> lectures refusées
+        self.flushed = 0
+        self.batches = 0
+        self.errors = 0
+        self.retries = 0
+        self.failed = 0
+        self.recovered = 0
+        self.quarantined = 0
+        self.max_depth = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        """Démarre le thread écrivain"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Arrête l'écrivain après avoir vidé la file"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout)
+
+    def submit(self, reading):
+        """Ajoute une lecture sans bloquer le thread réseau MQTT"""
+        try:
+            self.queue.put_nowait(reading)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        with self._lock:
+            self.received += 1
+            depth = self.queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def reject(self, reason):
+        """Compte une lecture refusée avant la file"""
+        with self._lock:
+            self.rejected += 1
+            self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+    def _next_batch(self):
+        """Attend N lectures ou M millisecondes, selon ce qui arrive en premier"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self._running or not self.queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            if self.idle_handler and self.queue.qsize() < self.batch_size:
+                self._recover()
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        written = self._flush(batch)
+        if not written:
+            return
+
+        self.batches += 1
+        self.flushed += written
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def _recover(self):
+        """Réécrit, par lots, les lectures rendues par idle_handler"""
+        try:
+            readings = self.idle_handler()
+        except Exception as e:
+            self.errors += 1
+            print(f"[INGEST ERROR] Reprise des lectures écartées impossible: {e}")
+            return
+        for i in range(0, len(readings), self.batch_size):
+            self.recovered += len(readings[i:i + self.batch_size])
+            self._write(readings[i:i + self.batch_size])
+
+    def _flush(self, batch):
+        """Écrit le lot, en le retentant après un échec (verrou occupé, disque plein passager...) ;
+        rend le nombre de lectures écrites"""
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.flush_handler(batch)
+                return len(batch)
+            except Exception as e:
+                error = e
+                self.errors += 1
+                print(f"[INGEST ERROR] Échec écriture du lot ({len(batch)} lectures, essai {attempt + 1}): {e}")
+            if attempt < self.max_retries:
+                self.retries += 1
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_backoff_max)
+
+        print(f"[INGEST ERROR] Lot abandonné après {self.max_retries + 1} essais ({len(batch)} lectures)")
+        # Un lot vide s'écrit : la base répond, l'échec vient de lectures du lot
+        if self.quarantine_handler and self._attempt([]):
+            return self._isolate(batch, error)
+        self._fail(batch)
+        return 0
+
+    def _attempt(self, batch):
+        try:
+            self.flush_handler(batch)
+            return True
+        except Exception:
+            self.errors += 1
+            return False
+
+    def _isolate(self, batch, error):
+        """Écrit séparément les moitiés du lot ; une lecture qui échoue seule part en quarantaine"""
+        if len(batch) == 1:
+            self._quarantine(batch[0], error)
+            return 0
+        written = 0
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            try:
+                self.flush_handler(half)
+                written += len(half)
+            except Exception as e:
+                self.errors += 1
+                written += self._isolate(half, e)
+        return written
+
+    def _quarantine(self, reading, error):
+        print(f"[INGEST ERROR] Lecture mise en quarantaine {reading[:3]}: {error}")
+        try:
+            self.quarantine_handler(reading, error)
+            self.quarantined += 1
+        except Exception as e:
+            print(f"[INGEST ERROR] Quarantaine impossible: {e}")
+            self._fail([reading])
+
+    def _fail(self, batch):
+        self.failed += len(batch)
+        if self.failed_handler:
+            self.failed_handler(batch)
+
+    def stats(self):
+        """Métriques de la file d'ingestion"""
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'max_queue_depth': self.max_depth,
+            'received': self.received,
+            'dropped': self.dropped,
+            'rejected': self.rejected,
+            'rejections': dict(self.rejections),
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'errors': self.errors,
+            'retries': self.retries,
+            'failed': self.failed,
+            'recovered': self.recovered,
+            'quarantined': self.quarantined,
+            'last_batch_size': self.last_batch_size,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'batch_size': self.batch_size,
+            'flush_interval_ms': int(self.flush_interval * 1000),
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
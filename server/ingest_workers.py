@@ -0,0 +1,102 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+
+# -----------------------------------------------------------------------------------------------
+# Ingestion multi-processus : N workers MQTT sous un superviseur
+#   python ingest_workers.py --workers 4 [--partition hash|shared]
+# L'API Flask tourne à part avec INGEST_MODE=workers (elle ne s'abonne plus aux consommations)
+# -----------------------------------------------------------------------------------------------
+RESTART_DELAY_MIN = 1      # secondes
+RESTART_DELAY_MAX = 30
+STABLE_AFTER = 60          # un worker vivant depuis plus longtemps repart avec le délai minimal
+STATS_INTERVAL = 60
+
+
+def run_worker(index, workers, partition):
+    """Point d'entrée d'un worker : le démarrage de server.py lance journal, pipeline et client MQTT"""
+    os.environ['INGEST_MODE'] = 'worker'
+    os.environ['INGEST_WORKER_INDEX'] = str(index)
+    os.environ['INGEST_WORKERS'] = str(workers)
+    os.environ['INGEST_PARTITION'] = partition
+
+    import server
+
+    while True:
+        time.sleep(STATS_INTERVAL)
+        stats = server.ingest_pipeline.stats()
+        print(f"[WORKER {index}] reçues={stats['received']} écrites={stats['flushed']} "
+              f"rejetées={stats['dropped']} file={stats['queue_depth']}")
+
+
+class Supervisor:
+    """Démarre les workers et relance ceux qui s'arrêtent, avec un délai croissant"""
+
+    def __init__(self, workers, partition):
+        self.workers = workers
+        self.partition = partition
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = {}
+        self.started_at = {}
+        self.delays = {index: RESTART_DELAY_MIN for index in range(workers)}
+        self.restart_at = {}
+        self.restarts = 0
+
+    def start(self, index):
+        process = self.context.Process(target=run_worker, args=(index, self.workers, self.partition),
+                                       name=f"ingest-worker-{index}", daemon=False)
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+        print(f"[SUPERVISOR] Worker {index}/{self.workers} démarré (pid {process.pid}, partition {self.partition})")
+
+    def check(self):
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            if index not in self.restart_at:
+                if now - self.started_at[index] > STABLE_AFTER:
+                    self.delays[index] = RESTART_DELAY_MIN
+                delay = self.delays[index]
+                self.restart_at[index] = now + delay
+                self.delays[index] = min(delay * 2, RESTART_DELAY_MAX)
+                print(f"[SUPERVISOR] Worker {index} arrêté (code {process.exitcode}), relance dans {delay}s")
+
+            if now >= self.restart_at[index]:
+                del self.restart_at[index]
+                self.restarts += 1
+                self.start(index)
+
+    def run(self):
+        for index in range(self.workers):
+            self.start(index)
+        try:
+            while True:
+                time.sleep(0.5)
+                self.check()
+        except KeyboardInterrupt:
+            print("[SUPERVISOR] Arrêt des workers")
+        finally:
+            self.stop()
+
+    def stop(self, timeout=10):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join(timeout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingestion MQTT sur plusieurs processus")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--partition', choices=('hash', 'shared'), default='hash',
+                        help="hash : chaque worker reçoit tout et garde ses compteurs (ordre préservé) ; "
+                             "shared : abonnement partagé $share/gridpay, le broker répartit les messages")
+    args = parser.parse_args()
+
+    Supervisor(args.workers, args.partition).run()
@@ -0,0 +1,200 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+
+# -----------------------------------------------------------------------------------------------
+# Journal d'ingestion : fichier en ajout seul, enregistrements préfixés par leur longueur
+#   [longueur u32][crc32 u32][seq u64][ts i64][kwh f64][numéro du compteur]
+# -----------------------------------------------------------------------------------------------
+_HEADER = struct.Struct('<II')
+_BODY = struct.Struct('<Qqd')
+
+
+def read_journal(path, after_seq=0):
+    """Relit le journal par mmap et produit (seq, meter_number, ts, kwh) pour seq > after_seq"""
+    for seq, meter_number, ts, kwh, _ in _scan(path):
+        if seq > after_seq:
+            yield seq, meter_number, ts, kwh
+
+
+def _scan(path):
+    """Parcourt les enregistrements valides ; s'arrête à une fin tronquée ou corrompue"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            size = len(data)
+            while offset + _HEADER.size <= size:
+                length, crc = _HEADER.unpack_from(data, offset)
+                start = offset + _HEADER.size
+                end = start + length
+                if length < _BODY.size or end > size:
+                    break
+                record = data[start:end]
+                if zlib.crc32(record) != crc:
+                    break
+                seq, ts, kwh = _BODY.unpack_from(record)
+                offset = end
+                yield seq, record[_BODY.size:].decode(), ts, kwh, offset
+
+
+class IngestJournal:
+    """Journal des lectures reçues, synchronisé sur disque par groupes (fsync)"""
+
+    def __init__(self, path, fsync_interval_ms=50, group_size=1000, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.fsync_interval = fsync_interval_ms / 1000.0
+        self.group_size = group_size
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._thread = None
+        self._running = False
+        self._pending = 0
+        self.last_seq = 0
+        # Séquences journalisées pas encore écrites en base : le checkpoint ne les dépasse jamais
+        self._unapplied = set()
+        # Parmi elles, celles qui ne sont plus en file (file pleine, lot abandonné) : à relire ici
+        self._deferred = set()
+
+        # Métriques
+        self.appended = 0
+        self.fsyncs = 0
+
+    def open(self, checkpoint_seq=0):
+        """Ouvre le journal et coupe une éventuelle fin d'enregistrement incomplète"""
+        valid_end = 0
+        for seq, _, _, _, offset in _scan(self.path):
+            self.last_seq = seq
+            valid_end = offset
+        if os.path.exists(self.path) and os.path.getsize(self.path) > valid_end:
+            print(f"[JOURNAL] Fin corrompue ignorée à l'octet {valid_end}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_end)
+
+        self.last_seq = max(self.last_seq, checkpoint_seq)
+        self._file = open(self.path, 'ab')
+
+    def start(self):
+        """Démarre le thread de fsync groupé"""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="ingest-journal", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        self.sync()
+        self._file.close()
+
+    def append(self, meter_number, ts, kwh):
+        """Ajoute une lecture et retourne son numéro de séquence"""
+        with self._lock:
+            self.last_seq += 1
+            record = _BODY.pack(self.last_seq, ts, kwh) + meter_number.encode()
+            self._file.write(_HEADER.pack(len(record), zlib.crc32(record)) + record)
+            self._pending += 1
+            self.appended += 1
+            seq = self.last_seq
+            self._unapplied.add(seq)
+            if self._pending >= self.group_size:
+                self._sync_locked()
+        return seq
+
+    def checkpoint_after(self, seqs):
+        """Checkpoint une fois seqs écrites : dernière séquence sous laquelle tout est en base
+
+        Une lecture écartée ou un lot en échec bloque le checkpoint à sa séquence, pour qu'elle soit
+        rejouée au redémarrage ; les lectures suivantes déjà écrites le sont aussi, et le dédoublonnage
+        (amorcé depuis la base) les écarte.
+        """
+        with self._lock:
+            waiting = self._unapplied.difference(seqs)
+            if waiting:
+                return min(waiting) - 1
+            return max(self.last_seq, max(seqs, default=0))
+
+    def applied(self, seqs):
+        """seqs sont en base (transaction validée)"""
+        with self._lock:
+            self._unapplied.difference_update(seqs)
+            self._deferred.difference_update(seqs)
+
+    def defer(self, seqs):
+        """seqs ne sont plus en file : take_deferred() les relira dans le journal"""
+        with self._lock:
+            self._deferred.update(seq for seq in seqs if seq in self._unapplied)
+
+    def take_deferred(self):
+        """Lectures différées relues dans le journal : [(meter_number, ts, kwh, seq), ...]"""
+        with self._lock:
+            if not self._deferred:
+                return []
+            seqs = self._deferred
+            self._deferred = set()
+            self._sync_locked()
+        return [(meter_number, ts, kwh, seq)
+                for seq, meter_number, ts, kwh in read_journal(self.path, min(seqs) - 1) if seq in seqs]
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if not self._pending:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self.fsyncs += 1
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[JOURNAL ERROR] Erreur fsync: {e}")
+
+    def compact(self, checkpoint_seq):
+        """Vide le journal s'il est trop gros et entièrement appliqué en base"""
+        with self._lock:
+            if self._file is None or checkpoint_seq < self.last_seq:
+                return False
+            self._file.flush()
+            if self._file.tell() < self.max_bytes:
+                return False
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        print(f"[JOURNAL] Journal vidé jusqu'à la séquence {checkpoint_seq}")
+        return True
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'last_seq': self.last_seq,
+            'appended': self.appended,
+            'fsyncs': self.fsyncs,
+            'pending_fsync': self._pending,
+            'unapplied': len(self._unapplied),
+            'deferred': len(self._deferred),
+        }
+
+
+if __name__ == '__main__':
+    # Export d'un journal en JSON lines (format des messages MQTT) pour ré-ingestion
+    #   python journal.py ingest.journal [after_seq]
+    journal_path = sys.argv[1]
+    after = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for entry_seq, entry_meter, entry_ts, entry_kwh in read_journal(journal_path, after):
+        print(json.dumps({'seq': entry_seq, 'meter_number': entry_meter, 'timestamp': entry_ts, 'kwh': entry_kwh}))
@@ -0,0 +1,243 @@
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+
+# -----------------------------------------------------------------------------------------------
+# Flux temps réel (Server-Sent Events) : consommation, seuils et relais poussés aux applications
+#   Un seul thread asyncio sert toutes les connexions (port séparé de Flask, aucun thread par client).
+#   Les événements sont rangés par (type, compteur) dans la file bornée de chaque client : un client
+#   lent ne reçoit que la dernière valeur de chaque compteur (les deltas de consommation s'additionnent).
+#   GET <path> avec Authorization: Bearer <jwt>, ou ?ticket=<ticket> pour EventSource (ticket de courte
+#   durée réservé au flux : une URL finit dans les journaux des proxys, un jeton d'accès n'y va jamais).
+#   Le serveur parle HTTP en clair : en production, il n'est exposé que derrière un proxy TLS.
+# -----------------------------------------------------------------------------------------------
+HEAD_MAX = 8192
+HEAD_TIMEOUT = 10    # secondes pour recevoir l'en-tête de la requête
+
+
+def _merge_consumption(old, new):
+    delta = None if old['delta'] is None or new['delta'] is None else round(old['delta'] + new['delta'], 6)
+    return {**new, 'delta': delta}
+
+
+# Fusion de deux événements en attente pour le même compteur (par défaut : le dernier remplace)
+MERGES = {'consumption': _merge_consumption}
+
+
+def encode_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+
+class LiveClient:
+    """Connexion SSE : événements en attente, au plus un par (type, compteur)"""
+
+    def __init__(self, user_id, writer, limit):
+        self.user_id = user_id
+        self.writer = writer
+        self.limit = limit
+        self.pending = OrderedDict()
+        self.ready = asyncio.Event()
+        self.merged = 0
+        self.dropped = 0
+
+    def push(self, event, key, data):
+        slot = (event, key)
+        previous = self.pending.pop(slot, None)
+        if previous is not None:
+            merge = MERGES.get(event)
+            data = merge(previous, data) if merge else data
+            self.merged += 1
+        elif len(self.pending) >= self.limit:
+            # File pleine de compteurs différents : abandonner l'événement le plus ancien
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.pending[slot] = data
+        self.ready.set()
+
+    def take(self):
+        events = self.pending
+        self.pending = OrderedDict()
+        self.ready.clear()
+        return b''.join(encode_event(event, data) for (event, _), data in events.items())
+
+
+class LiveBroadcaster:
+    """Serveur SSE asyncio dans son propre thread ; publish() est appelable depuis n'importe quel thread"""
+
+    def __init__(self, authenticate, host='0.0.0.0', port=5001, path='/api/live', heartbeat_s=15,
+                 queue_size=256, max_clients=10000, write_timeout_s=30, authenticate_ticket=None):
+        self.authenticate = authenticate    # authenticate(jeton) -> user_id ou None
+        self.authenticate_ticket = authenticate_ticket    # idem pour ?ticket= ; None : refusé
+        self.host = host
+        self.port = port
+        self.path = path
+        self.heartbeat = heartbeat_s
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.write_timeout = write_timeout_s
+
+        self.loop = None
+        self._server = None
+        self._thread = None
+        self._by_user = {}      # user_id -> set de LiveClient (lu sans verrou par publish)
+        self._clients = 0
+
+        # Métriques
+        self.connected = 0
+        self.rejected = 0
+        self.published = 0
+        self.delivered = 0
+        self.heartbeats = 0
+        self.slow_disconnects = 0
+        self.merged = 0
+        self.dropped = 0
+
+    # ------------------------- Démarrage -------------------------
+    def start(self):
+        """Démarre la boucle asyncio et attend que le port soit ouvert (False si l'écoute échoue)"""
+        if self._thread and self._thread.is_alive():
+            return True
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), name="live-sse", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self._server is not None
+
+    def _run(self, started):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self._server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, limit=HEAD_MAX, backlog=1024))
+            print(f"[LIVE] Flux SSE sur {self.host}:{self.port}{self.path}")
+        except OSError as e:
+            print(f"[LIVE ERROR] Écoute impossible sur le port {self.port}: {e}")
+            return
+        finally:
+            started.set()
+        self.loop.run_forever()
+
+    # ------------------------- Publication -------------------------
+    def publish(self, events):
+        """Diffuse des (user_id, type, compteur, données) ; sans client connecté, ne réveille pas la boucle"""
+        events = [event for event in events if event[0] in self._by_user]
+        if not events or self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._deliver, events)
+
+    def _deliver(self, events):
+        for user_id, event, key, data in events:
+            self.published += 1
+            for client in self._by_user.get(user_id, ()):
+                client.push(event, key, data)
+
+    # ------------------------- Connexions -------------------------
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEAD_TIMEOUT)
+            method, target, headers = self._parse(head)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+
+        url = urlsplit(target)
+        authorization = headers.get('authorization', '')
+        ticket = parse_qs(url.query).get('ticket', [''])[0]
+        if method != 'GET' or url.path != self.path:
+            await self._refuse(writer, '404 Not Found', "Flux inconnu")
+            return
+        if self._clients >= self.max_clients:
+            await self._refuse(writer, '503 Service Unavailable', "Trop de connexions")
+            return
+        if authorization.startswith('Bearer '):
+            user_id = self.authenticate(authorization[7:])
+        elif ticket and self.authenticate_ticket is not None:
+            user_id = self.authenticate_ticket(ticket)
+        else:
+            user_id = None
+        if user_id is None:
+            await self._refuse(writer, '401 Unauthorized', "Jeton invalide ou expiré")
+            return
+
+        client = LiveClient(user_id, writer, self.queue_size)
+        self._by_user.setdefault(user_id, set()).add(client)
+        self._clients += 1
+        self.connected += 1
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                         b"Cache-Control: no-cache\r\n"
+                         b"Connection: keep-alive\r\n"
+                         b"X-Accel-Buffering: no\r\n\r\n"
+                         b"retry: 5000\n\n")
+            await self._stream(client)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.merged += client.merged
+            self.dropped += client.dropped
+            clients = self._by_user.get(user_id)
+            clients.discard(client)
+            if not clients:
+                del self._by_user[user_id]
+            self._clients -= 1
+            writer.close()
+
+    async def _stream(self, client):
+        while True:
+            try:
+                await asyncio.wait_for(client.ready.wait(), self.heartbeat)
+            except asyncio.TimeoutError:
+                # Commentaire SSE : garde la connexion ouverte à travers les proxys, détecte les départs
+                client.writer.write(b": ping\n\n")
+                self.heartbeats += 1
+            else:
+                count = len(client.pending)
+                client.writer.write(client.take())
+                self.delivered += count
+            try:
+                # Pendant l'attente, les nouveaux événements du client fusionnent dans sa file
+                await asyncio.wait_for(client.writer.drain(), self.write_timeout)
+            except asyncio.TimeoutError:
+                self.slow_disconnects += 1
+                raise
+
+    @staticmethod
+    def _parse(head):
+        lines = head.decode('latin-1').split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _refuse(self, writer, status, message):
+        self.rejected += 1
+        body = json.dumps({'message': message}).encode('utf-8')
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def stats(self):
+        clients = [client for user_clients in list(self._by_user.values()) for client in list(user_clients)]
+        return {
+            'clients': self._clients,
+            'users': len(self._by_user),
+            'connected': self.connected,
+            'rejected': self.rejected,
+            'published': self.published,
+            'delivered': self.delivered,
+            'merged': self.merged + sum(client.merged for client in clients),
+            'dropped': self.dropped + sum(client.dropped for client in clients),
+            'heartbeats': self.heartbeats,
+            'slow_disconnects': self.slow_disconnects,
+            'running': self._server is not None,
+        }
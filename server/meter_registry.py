@@ -0,0 +1,266 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_ENERGY_THRESHOLD = 100.0  # Seuil par défaut (kWh) sans facture payée
+
+
+# -----------------------------------------------------------------------------------------------
+# Registre en mémoire des compteurs
+# -----------------------------------------------------------------------------------------------
+class MeterEntry:
+    """État en mémoire d'un compteur"""
+    __slots__ = ('id', 'user_id', 'meter_number', 'meter_name', 'status', 'cumulative', 'cumulative_order',
+                 'threshold', 'threshold_version')
+
+    def __init__(self, id, user_id, meter_number, meter_name, status, cumulative, threshold=None, cumulative_order=0):
+        self.id = id
+        self.user_id = user_id
+        self.meter_number = meter_number
+        self.meter_name = meter_name
+        self.status = status
+        self.cumulative = cumulative or 0.0
+        self.cumulative_order = cumulative_order    # ordre de l'écriture dont vient le cumul (next_order)
+        self.threshold = threshold
+        self.threshold_version = 0
+
+    @property
+    def active(self):
+        return self.status == 'active'
+
+
+class MeterRegistry:
+    """Table meter_number -> compteur, chargée en bloc et tenue à jour par les routes"""
+
+    def __init__(self, repositories, negative_ttl=60, negative_max=100000, authoritative=False):
+        self.repositories = repositories
+        self.negative_ttl = negative_ttl
+        self.negative_max = negative_max
+        # Seul processus à créer des compteurs (routes, imports) : une fois chargé, un numéro absent
+        # du registre n'existe pas en base, aucune lecture SQL pour le vérifier
+        self.authoritative = authoritative
+        self._loaded = False
+
+        self.lock = threading.RLock()
+        self._by_number = {}
+        self._by_id = {}
+        self._by_user = {}    # user_id -> {meter_id: compteur}
+        self._user_ids = {}   # email -> user_id
+        self._unknown = OrderedDict()    # meter_number -> expiration du cache négatif (LRU)
+        self._order = 0       # dernière écriture de cumuls validée (next_order)
+        self._order_lock = threading.Lock()
+
+        # Numéros inconnus : écartés sans requête, et lus en base (hors registre de référence)
+        self.unknown_dropped = 0
+        self.unknown_fetches = 0
+
+        # Compteurs du cache des seuils
+        self.threshold_hits = 0
+        self.threshold_misses = 0
+        self.threshold_invalidations = 0
+
+    # ------------------------- Chargement -------------------------
+    def load(self, verbose=True):
+        """Charge tous les compteurs, seuils et utilisateurs en une seule passe
+
+        Retourne les (meter_id, user_id) ajoutés, supprimés ou modifiés (nom, statut, cumul) depuis
+        le chargement précédent.
+        """
+        # Sous le verrou : un lot d'ingestion ne peut pas s'intercaler entre la lecture et le remplacement
+        with self.lock:
+            changed = self._load()
+            self._loaded = True
+        if verbose:
+            print(f"[REGISTRY] {len(self._by_number)} compteurs et {len(self._user_ids)} utilisateurs chargés")
+        return changed
+
+    def _load(self):
+        # Écritures de cumuls validées avant la lecture : toutes visibles dans les compteurs lus
+        order = self._order
+        meters = self.repositories.meters.all_with_thresholds()
+        users = self.repositories.users.emails()
+
+        previous = self._by_id
+        self._by_number = {}
+        self._by_id = {}
+        self._by_user = {}
+        self._unknown.clear()
+        changed = []
+        for meter, kwh in meters:
+            threshold = float(kwh) if kwh is not None else DEFAULT_ENERGY_THRESHOLD
+            entry = MeterEntry(meter.id, meter.user_id, meter.meter_number, meter.meter_name, meter.status,
+                               meter.cumulative_consumption, threshold, order)
+            self._add(entry)
+            old = previous.get(entry.id)
+            if old is None or (old.meter_name, old.status, old.cumulative) != (entry.meter_name, entry.status,
+                                                                               entry.cumulative):
+                changed.append((entry.id, entry.user_id))
+        changed.extend((entry.id, entry.user_id) for entry in previous.values() if entry.id not in self._by_id)
+        self._user_ids = {email: user_id for user_id, email in users}
+        return changed
+
+    def _add(self, entry):
+        self._by_number[entry.meter_number] = entry
+        self._by_id[entry.id] = entry
+        self._by_user.setdefault(entry.user_id, {})[entry.id] = entry
+        self._unknown.pop(entry.meter_number, None)
+
+    # ------------------------- Lecture -------------------------
+    def lookup(self, meter_number):
+        """Retourne le compteur ou None (cache négatif pour les numéros inconnus)"""
+        entry = self._by_number.get(meter_number)
+        if entry is not None:
+            return entry
+
+        if self.authoritative and self._loaded:
+            self.unknown_dropped += 1
+            return None
+
+        with self.lock:
+            expires = self._unknown.get(meter_number)
+            if expires is not None:
+                if expires > time.monotonic():
+                    self._unknown.move_to_end(meter_number)
+                    self.unknown_dropped += 1
+                    return None
+                del self._unknown[meter_number]
+
+        # Compteur créé par un autre processus : une seule lecture par TTL
+        self.unknown_fetches += 1
+        entry = self._fetch(meter_number)
+        with self.lock:
+            if entry is not None:
+                self._add(entry)
+            else:
+                # Numéros les moins récemment vus écartés d'abord : un flot de topics fantaisistes
+                # ne vide pas le cache des autres
+                self._unknown[meter_number] = time.monotonic() + self.negative_ttl
+                while len(self._unknown) > self.negative_max:
+                    self._unknown.popitem(last=False)
+        return entry
+
+    def _fetch(self, meter_number):
+        order = self._order
+        meter = self.repositories.meters.get_by_number(meter_number)
+        if meter is None:
+            return None
+        return MeterEntry(meter.id, meter.user_id, meter.meter_number, meter.meter_name, meter.status,
+                          meter.cumulative_consumption, cumulative_order=order)
+
+    def get_by_id(self, meter_id):
+        return self._by_id.get(meter_id)
+
+    def meters_of(self, user_id):
+        """Compteurs d'un utilisateur, du plus récent au plus ancien (sans requête SQL)"""
+        meters = self._by_user.get(user_id)
+        if not meters:
+            return []
+        return sorted(meters.copy().values(), key=lambda entry: entry.id, reverse=True)
+
+    def is_active(self, meter_number):
+        entry = self.lookup(meter_number)
+        return entry is not None and entry.active
+
+    def user_id_for(self, email):
+        """ID de l'utilisateur à partir de son email (sans requête SQL)"""
+        return self._user_ids.get(email)
+
+    def owned_by(self, meter_number, email):
+        """Retourne le compteur s'il appartient à l'utilisateur, sinon None"""
+        entry = self.lookup(meter_number)
+        if entry is None or entry.user_id != self._user_ids.get(email):
+            return None
+        return entry
+
+    def threshold(self, meter_number):
+        """Seuil d'énergie du compteur, recalculé seulement s'il a été invalidé"""
+        entry = self.lookup(meter_number)
+        if entry is None:
+            return DEFAULT_ENERGY_THRESHOLD
+
+        threshold = entry.threshold
+        if threshold is not None:
+            self.threshold_hits += 1
+            return threshold
+
+        self.threshold_misses += 1
+        while True:
+            # Une invalidation pendant la lecture rend le résultat douteux : relire
+            version = entry.threshold_version
+            threshold = self._fetch_threshold(entry.id)
+            with self.lock:
+                if entry.threshold_version == version:
+                    entry.threshold = threshold
+                    return threshold
+
+    def _fetch_threshold(self, meter_id):
+        # Le kwh de la dernière facture payée sert de seuil
+        kwh = self.repositories.invoices.latest_paid_kwh(meter_id)
+        return float(kwh) if kwh is not None else DEFAULT_ENERGY_THRESHOLD
+
+    # ------------------------- Écriture -------------------------
+    def put(self, meter_id, user_id, meter_number, meter_name=None, status='active', cumulative=0.0):
+        with self.lock:
+            self._add(MeterEntry(meter_id, user_id, meter_number, meter_name, status, cumulative,
+                                 cumulative_order=self._order))
+
+    def add_user(self, user_id, email):
+        with self.lock:
+            self._user_ids[email] = user_id
+
+    def update(self, meter_id, meter_name, status):
+        entry = self._by_id.get(meter_id)
+        if entry is not None:
+            entry.meter_name = meter_name
+            entry.status = status
+
+    def remove(self, meter_id):
+        with self.lock:
+            entry = self._by_id.pop(meter_id, None)
+            if entry is not None:
+                self._by_number.pop(entry.meter_number, None)
+                self._by_user.get(entry.user_id, {}).pop(meter_id, None)
+
+    def next_order(self):
+        """Numéro d'une écriture de cumuls, à prendre dans le thread écrivain juste après son commit"""
+        with self._order_lock:
+            self._order += 1
+            return self._order
+
+    def set_cumulative(self, meter_number, value, order):
+        """Cumul lu en base par l'écriture `order` ; ignoré si une écriture validée après est déjà appliquée
+
+        Les écritures attendent le thread écrivain sans verrou du registre : elles appliquent leurs cumuls
+        dans un ordre quelconque, seul le plus récent compte. Retourne None si le compteur est inconnu.
+        """
+        with self.lock:
+            entry = self._by_number.get(meter_number)
+            if entry is None:
+                return None
+            if order > entry.cumulative_order:
+                entry.cumulative = value
+                entry.cumulative_order = order
+            return entry.cumulative
+
+    def invalidate_threshold(self, meter_id):
+        """À appeler après le commit d'un changement d'une facture payée du compteur"""
+        with self.lock:
+            entry = self._by_id.get(meter_id)
+            if entry is not None:
+                entry.threshold = None
+                entry.threshold_version += 1
+                self.threshold_invalidations += 1
+
+    def stats(self):
+        return {
+            'meters': len(self._by_number),
+            'users': len(self._user_ids),
+            'authoritative': self.authoritative,
+            'negative_cache': len(self._unknown),
+            'unknown_dropped': self.unknown_dropped,
+            'unknown_fetches': self.unknown_fetches,
+            'threshold_hits': self.threshold_hits,
+            'threshold_misses': self.threshold_misses,
+            'threshold_invalidations': self.threshold_invalidations,
+        }
@@ -0,0 +1,579 @@
+import sqlite3
+import sys
+
+from timeseries import READINGS_TABLE, ROLLUP_TABLES
+
+
+# -----------------------------------------------------------------------------------------------
+# Migrations du schéma, appliquées dans l'ordre et enregistrées dans schema_version
+# -----------------------------------------------------------------------------------------------
+SCHEMA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+
+def _initial_schema(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            phone TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            meter_number TEXT UNIQUE NOT NULL,
+            meter_name TEXT,
+            status TEXT DEFAULT 'active',
+            cumulative_consumption REAL DEFAULT 0.0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meter_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            amount REAL NOT NULL,
+            status TEXT DEFAULT 'unpaid',
+            kwh INTEGER NOT NULL,
+            issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (meter_id) REFERENCES meters(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            invoice_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            payment_method TEXT NOT NULL,
+            transaction_id TEXT UNIQUE,
+            status TEXT DEFAULT 'completed',
+            paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Historique des lectures brutes (WITHOUT ROWID : regroupées par compteur et par temps)
+    cursor.execute(READINGS_TABLE)
+
+    # Agrégats minute/heure/jour/mois
+    for rollup_table in ROLLUP_TABLES:
+        cursor.execute(rollup_table)
+
+    # Dernière séquence appliquée en base, par journal d'ingestion (un par worker)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+            journal TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    ''')
+
+    # Lectures arrivées après la fenêtre de dédoublonnage, à rapprocher manuellement
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS late_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meter_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            wh INTEGER NOT NULL,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+# Colonnes absentes des bases créées avec les premières versions du schéma
+# (ALTER TABLE n'accepte pas de DEFAULT CURRENT_TIMESTAMP : ces dates restent NULL)
+_ADDED_COLUMNS = [
+    ('users', 'created_at', 'DATETIME'),
+    ('meters', 'meter_name', 'TEXT'),
+    ('meters', 'cumulative_consumption', 'REAL DEFAULT 0.0'),
+    ('meters', 'created_at', 'DATETIME'),
+    ('meters', 'updated_at', 'DATETIME'),
+    ('invoices', 'kwh', 'INTEGER NOT NULL DEFAULT 0'),
+    ('payments', 'status', "TEXT DEFAULT 'completed'"),
+]
+
+
+def _add_missing_columns(cursor):
+    for table, column, definition in _ADDED_COLUMNS:
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _has_index(cursor, table, column):
+    """Vrai si un index de la table commence par cette colonne"""
+    cursor.execute(f"PRAGMA index_list({table})")
+    for index in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"PRAGMA index_info({index})")
+        columns = [row[2] for row in cursor.fetchall()]
+        if columns and columns[0] == column:
+            return True
+    return False
+
+
+def _add_indexes(cursor):
+    cursor.execute("""
+        SELECT meter_id, month, COUNT(*)
+        FROM invoices
+        GROUP BY meter_id, month
+        HAVING COUNT(*) > 1
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        raise RuntimeError(f"Factures en double (meter_id, month, nombre) à corriger avant migration: {duplicates}")
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_invoices_meter_month ON invoices (meter_id, month)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_invoices_meter_status_issued ON invoices (meter_id, status, issued_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_invoice_paid ON payments (invoice_id, paid_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_meters_user_created ON meters (user_id, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone)")
+
+    # Les anciennes bases n'ont pas de contrainte UNIQUE sur transaction_id
+    if not _has_index(cursor, 'payments', 'transaction_id'):
+        cursor.execute("CREATE INDEX idx_payments_transaction ON payments (transaction_id)")
+
+
+def _add_retention(cursor):
+    # Segments de l'archive des lectures brutes (voir archive.py), enregistrés dans la transaction
+    # qui supprime les lignes archivées : une lecture est soit en base, soit dans un segment
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reading_archives (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            month INTEGER NOT NULL,           -- début du mois, secondes epoch UTC
+            path TEXT UNIQUE NOT NULL,        -- relatif au répertoire d'archive
+            meters INTEGER NOT NULL,
+            readings INTEGER NOT NULL,
+            wh INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reading_archives_month ON reading_archives (month)")
+
+    # État de la rétention : 'horizon' (aucune lecture brute insérée avant) et 'archived_before'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS retention (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+
+
+def _add_ownership(cursor):
+    # Propriétaire recopié sur les factures et les paiements : les listes et contrôles d'accès par
+    # utilisateur lisent un seul index au lieu de remonter paiement -> facture -> compteur
+    for table in ('invoices', 'payments'):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if 'user_id' not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN user_id INTEGER")
+    cursor.execute("UPDATE invoices SET user_id = (SELECT user_id FROM meters WHERE meters.id = invoices.meter_id)")
+    cursor.execute("UPDATE payments SET user_id = (SELECT user_id FROM invoices WHERE invoices.id = payments.invoice_id)")
+
+    # Les dépôts renseignent user_id à l'insertion ; les déclencheurs couvrent les autres écritures
+    # (insertion sans user_id, facture changée de compteur, compteur changé de propriétaire)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_owner_insert AFTER INSERT ON invoices
+        WHEN NEW.user_id IS NULL
+        BEGIN
+            UPDATE invoices SET user_id = (SELECT user_id FROM meters WHERE id = NEW.meter_id) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_owner_meter AFTER UPDATE OF meter_id ON invoices
+        BEGIN
+            UPDATE invoices SET user_id = (SELECT user_id FROM meters WHERE id = NEW.meter_id) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_meters_owner AFTER UPDATE OF user_id ON meters
+        BEGIN
+            UPDATE invoices SET user_id = NEW.user_id WHERE meter_id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_owner_insert AFTER INSERT ON payments
+        WHEN NEW.user_id IS NULL
+        BEGIN
+            UPDATE payments SET user_id = (SELECT user_id FROM invoices WHERE id = NEW.invoice_id) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_owner_invoice AFTER UPDATE OF invoice_id ON payments
+        BEGIN
+            UPDATE payments SET user_id = (SELECT user_id FROM invoices WHERE id = NEW.invoice_id) WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_invoices_owner_payments AFTER UPDATE OF user_id ON invoices
+        BEGIN
+            UPDATE payments SET user_id = NEW.user_id WHERE invoice_id = NEW.id;
+        END
+    ''')
+
+    # Index couvrants dans l'ordre des listes (date décroissante, puis id) : un parcours de plage,
+    # sans tri ni lecture de la table ; seuls le compteur (et la facture) sont lus par clé primaire
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_invoices_user_issued
+        ON invoices (user_id, issued_at DESC, id, meter_id, month, amount, status, kwh)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_payments_user_paid
+        ON payments (user_id, paid_at DESC, id, invoice_id, amount, payment_method, transaction_id, status)
+    """)
+
+
+def _add_list_indexes(cursor):
+    # Listes paginées par clé (pagination.py) : chaque filtre d'égalité a son index couvrant dans
+    # l'ordre de la liste ; les mois se lisent dans ces mêmes index, sans accès à la table
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_invoices_user_status_issued
+        ON invoices (user_id, status, issued_at DESC, id, meter_id, month, amount, kwh)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_invoices_meter_issued
+        ON invoices (meter_id, issued_at DESC, id, user_id, month, amount, status, kwh)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_payments_user_status_paid
+        ON payments (user_id, status, paid_at DESC, id, invoice_id, amount, payment_method, transaction_id)
+    """)
+    # Remplace (invoice_id, paid_at), qui obligeait à trier les paiements d'une facture
+    cursor.execute("DROP INDEX IF EXISTS idx_payments_invoice_paid")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_invoice_paid_id ON payments (invoice_id, paid_at DESC, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_meters_user_status_created ON meters (user_id, status, created_at)")
+
+
+# Journal des modifications (GET /changes) : (table, entité, colonnes servies aux clients,
+# propriétaire d'une ligne insérée sans user_id, lignes dépendantes)
+#   Les colonnes de consommation (cumulative_consumption, updated_at seul) n'y figurent pas :
+#   l'ingestion n'écrit pas dans le journal. Les lignes dépendantes affichent des colonnes de la
+#   ligne modifiée (numéro et nom du compteur, montant, mois et statut de la facture) ou
+#   disparaissent des listes avec elle (jointures) : (entité, colonnes, ids dans {row})
+CHANGE_LOG_TABLES = [
+    ('meters', 'meter', "meter_number, meter_name, status", None, [
+        ('invoice', "meter_number, meter_name", "SELECT id FROM invoices WHERE meter_id = {row}.id"),
+        ('payment', "meter_number, meter_name",
+         "SELECT id FROM payments WHERE invoice_id IN (SELECT id FROM invoices WHERE meter_id = {row}.id)"),
+    ]),
+    ('invoices', 'invoice', "meter_id, month, amount, status, kwh",
+     "(SELECT user_id FROM meters WHERE id = NEW.meter_id)", [
+        ('payment', "month, amount, status", "SELECT id FROM payments WHERE invoice_id = {row}.id"),
+    ]),
+    ('payments', 'payment', "invoice_id, amount, payment_method, transaction_id, status, paid_at",
+     "(SELECT user_id FROM invoices WHERE id = NEW.invoice_id)", []),
+]
+
+
+def _log_rows(user, entity, ids, op, where=""):
+    """Instruction d'un déclencheur : une ligne du journal par id de la sous-requête ids"""
+    return (f"INSERT INTO change_log (user_id, entity, entity_id, op) "
+            f"SELECT {user}, '{entity}', id, '{op}' FROM ({ids}){where};")
+
+
+def _add_change_log(cursor):
+    # Une ligne par modification d'un compteur, d'une facture ou d'un paiement, écrite par des
+    # déclencheurs dans la transaction qui modifie la ligne : aucune écriture n'y échappe (routes,
+    # imports, rééquilibrage des partitions). seq croît sans jamais être réutilisé (AUTOINCREMENT).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            entity TEXT NOT NULL,             -- 'meter', 'invoice', 'payment'
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,                 -- 'insert', 'update', 'delete'
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Couvrant : les modifications d'un utilisateur après un curseur, sans lecture de la table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_log_user ON change_log (user_id, seq, entity, entity_id, op)")
+
+    # origin : identifiant de cette base (une restauration, une autre partition ou une base recréée
+    # invalident les curseurs) ; pruned_seq : dernière séquence supprimée par la purge
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            origin TEXT NOT NULL,
+            pruned_seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO change_log_state (id, origin) VALUES (1, lower(hex(randomblob(8))))")
+
+    for table, entity, columns, owner, dependents in CHANGE_LOG_TABLES:
+        # Propriétaire encore inconnu à l'insertion : lu sur la ligne parente (les déclencheurs de la
+        # migration 5 le recopient ensuite, dans un ordre non garanti)
+        user = f"COALESCE(NEW.user_id, {owner})" if owner else "NEW.user_id"
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_insert AFTER INSERT ON {table}
+            BEGIN
+                {_log_rows("owner", entity, f"SELECT NEW.id AS id, {user} AS owner", 'insert',
+                           " WHERE owner IS NOT NULL")}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_update AFTER UPDATE OF {columns} ON {table}
+            WHEN NEW.user_id IS NOT NULL
+            BEGIN
+                {_log_rows("NEW.user_id", entity, "SELECT NEW.id AS id", 'update')}
+            END
+        ''')
+        # Changement de propriétaire : la ligne quitte les listes de l'ancien et entre dans celles du nouveau
+        # (les lignes dépendantes suivent par les déclencheurs de la migration 5)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_owner AFTER UPDATE OF user_id ON {table}
+            WHEN OLD.user_id IS NOT NULL AND NEW.user_id IS NOT OLD.user_id
+            BEGIN
+                {_log_rows("OLD.user_id", entity, "SELECT OLD.id AS id", 'delete')}
+                {_log_rows("NEW.user_id", entity, "SELECT NEW.id AS id", 'insert', " WHERE NEW.user_id IS NOT NULL")}
+            END
+        ''')
+        cascade = " ".join(_log_rows("OLD.user_id", dependent, ids.format(row='OLD'), 'delete')
+                           for dependent, _, ids in dependents)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_delete AFTER DELETE ON {table}
+            WHEN OLD.user_id IS NOT NULL
+            BEGIN
+                {_log_rows("OLD.user_id", entity, "SELECT OLD.id AS id", 'delete')}
+                {cascade}
+            END
+        ''')
+        for dependent, dependent_columns, ids in dependents:
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{dependent}s AFTER UPDATE OF {dependent_columns} ON {table}
+                WHEN NEW.user_id IS NOT NULL
+                BEGIN
+                    {_log_rows("NEW.user_id", dependent, ids.format(row='NEW'), 'update')}
+                END
+            ''')
+
+
+MIGRATIONS = [
+    (1, "Schéma initial", _initial_schema),
+    (2, "Colonnes manquantes des anciennes bases", _add_missing_columns),
+    (3, "Index des requêtes fréquentes", _add_indexes),
+    (4, "Archive et rétention des lectures brutes", _add_retention),
+    (5, "Propriétaire des factures et paiements", _add_ownership),
+    (6, "Index des listes paginées", _add_list_indexes),
+    (7, "Journal des modifications", _add_change_log),
+]
+
+
+def current_version(conn):
+    conn.execute(SCHEMA_VERSION_TABLE)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """Applique les migrations manquantes, chacune dans sa propre transaction"""
+    # Base neuve : libérer les pages par PRAGMA incremental_vacuum (impossible une fois les tables créées)
+    if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    version = current_version(conn)
+    applied = []
+    for number, description, migration in MIGRATIONS:
+        if number <= version:
+            continue
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE : un seul processus (API ou worker) applique une migration donnée
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (number,))
+            if cursor.fetchone():
+                conn.rollback()
+                continue
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                           (number, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"[DB] Migration {number} appliquée: {description}")
+        applied.append(number)
+    return applied
+
+
+# -----------------------------------------------------------------------------------------------
+# Plans d'exécution des requêtes fréquentes (mêmes WHERE / ORDER BY que repository.py)
+# -----------------------------------------------------------------------------------------------
+HOT_QUERIES = [
+    ("login", "SELECT u.id, u.name, u.email, u.phone, u.created_at, u.password FROM users u WHERE u.email=?"),
+    ("inscription (téléphone)", "SELECT id FROM users WHERE phone=?"),
+    ("compteur par numéro", "SELECT m.id, m.user_id, m.meter_number FROM meters m WHERE m.meter_number=?"),
+    ("compteurs de l'utilisateur", """
+        SELECT m.id, m.user_id, m.meter_number, m.meter_name, m.status, m.cumulative_consumption,
+               m.created_at, m.updated_at
+        FROM meters m
+        WHERE m.user_id=?
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT ?
+    """),
+    ("compteurs de l'utilisateur par statut", """
+        SELECT m.id, m.user_id, m.meter_number, m.meter_name, m.status, m.cumulative_consumption,
+               m.created_at, m.updated_at
+        FROM meters m
+        WHERE m.user_id=? AND m.status = ?
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT ?
+    """),
+    ("factures de l'utilisateur", """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name
+        FROM invoices i
+        JOIN meters m ON i.meter_id = m.id
+        WHERE i.user_id = ? AND i.issued_at <= ? AND (i.issued_at < ? OR i.id > ?)
+        ORDER BY i.issued_at DESC, i.id
+        LIMIT ?
+    """),
+    ("factures de l'utilisateur par statut", """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name
+        FROM invoices i
+        JOIN meters m ON i.meter_id = m.id
+        WHERE i.user_id = ? AND i.status = ? AND i.issued_at <= ? AND (i.issued_at < ? OR i.id > ?)
+        ORDER BY i.issued_at DESC, i.id
+        LIMIT ?
+    """),
+    ("factures de l'utilisateur par compteur", """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name
+        FROM invoices i
+        JOIN meters m ON i.meter_id = m.id
+        WHERE i.user_id = ? AND i.meter_id = ? AND i.issued_at <= ? AND (i.issued_at < ? OR i.id > ?)
+        ORDER BY i.issued_at DESC, i.id
+        LIMIT ?
+    """),
+    ("nombre de factures de l'utilisateur", """
+        SELECT COUNT(*) FROM (SELECT 1 FROM invoices i WHERE i.user_id = ? AND i.month >= ? AND i.month <= ? LIMIT ?)
+    """),
+    ("facture du mois", "SELECT id FROM invoices WHERE meter_id = ? AND month = ? AND id != ?"),
+    ("factures du compteur", """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at
+        FROM invoices i
+        WHERE i.meter_id = ? AND i.issued_at <= ? AND (i.issued_at < ? OR i.id > ?)
+        ORDER BY i.issued_at DESC, i.id
+        LIMIT ?
+    """),
+    ("seuil d'énergie", """
+        SELECT kwh
+        FROM invoices
+        WHERE meter_id = ? AND status = 'paid'
+        ORDER BY issued_at DESC, id DESC
+        LIMIT 1
+    """),
+    ("facture de l'utilisateur", """
+        SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name
+        FROM invoices i
+        JOIN meters m ON i.meter_id = m.id
+        WHERE i.id = ? AND i.user_id = (SELECT id FROM users WHERE email = ?)
+    """),
+    ("paiement de l'utilisateur", """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE p.id = ? AND p.user_id = (SELECT id FROM users WHERE email = ?)
+    """),
+    ("paiement par transaction", "SELECT id FROM payments WHERE transaction_id=?"),
+    ("paiements de l'utilisateur", """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE p.user_id = (SELECT id FROM users WHERE email = ?) AND p.paid_at <= ? AND (p.paid_at < ? OR p.id > ?)
+        ORDER BY p.paid_at DESC, p.id
+        LIMIT ?
+    """),
+    ("paiements de l'utilisateur par statut", """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE p.user_id = (SELECT id FROM users WHERE email = ?) AND p.status = ?
+        ORDER BY p.paid_at DESC, p.id
+        LIMIT ?
+    """),
+    ("paiements de l'utilisateur par mois", """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE p.user_id = (SELECT id FROM users WHERE email = ?) AND p.paid_at >= ? AND p.paid_at < ? || '~'
+        ORDER BY p.paid_at DESC, p.id
+        LIMIT ?
+    """),
+    ("paiements de l'utilisateur par compteur", """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE +p.user_id = (SELECT id FROM users WHERE email = ?)
+          AND p.invoice_id IN (SELECT id FROM invoices WHERE meter_id = ?)
+        ORDER BY p.paid_at DESC, p.id
+        LIMIT ?
+    """),
+    ("paiements de la facture", """
+        SELECT p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at,
+               i.amount, i.month, i.status, m.meter_number, m.meter_name
+        FROM payments p
+        JOIN invoices i ON p.invoice_id = i.id
+        JOIN meters m ON i.meter_id = m.id
+        WHERE p.invoice_id = ?
+        ORDER BY p.paid_at DESC, p.id
+        LIMIT ?
+    """),
+    ("modifications de l'utilisateur", """
+        SELECT MAX(seq), entity, entity_id, op, SUM(op = 'insert') > 0
+        FROM change_log
+        WHERE user_id = ? AND seq > ?
+        GROUP BY entity, entity_id
+        ORDER BY 1
+        LIMIT ?
+    """),
+]
+
+
+def explain(conn, sql):
+    """Détails du plan d'exécution (paramètres liés à NULL)"""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count('?')).fetchall()
+    return [row[3] for row in rows]
+
+
+def check_query_plans(conn, queries=HOT_QUERIES):
+    """Retourne (nom, plan) des requêtes qui parcourent une table entière au lieu d'un index"""
+    failures = []
+    for name, sql in queries:
+        plan = explain(conn, sql)
+        # SCAN (subquery-N) : lecture d'une sous-requête déjà bornée, pas d'une table
+        if any(step.startswith('SCAN') and not step.startswith('SCAN (subquery') for step in plan):
+            failures.append((name, plan))
+    return failures
+
+
+if __name__ == '__main__':
+    # Migration d'une base puis vérification des plans
+    #   python migrations.py [chemin.db]     (':memory:' pour une base vide)
+    path = sys.argv[1] if len(sys.argv) > 1 else ':memory:'
+    connection = sqlite3.connect(path)
+    migrate(connection)
+    print(f"[DB] Version du schéma: {current_version(connection)}")
+
+    scans = check_query_plans(connection)
+    for query_name, query_plan in scans:
+        print(f"[DB ERROR] Parcours complet pour « {query_name} »: {query_plan}")
+    if scans:
+        sys.exit(1)
+    print(f"[DB] {len(HOT_QUERIES)} requêtes fréquentes servies par un index")
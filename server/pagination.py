@@ -0,0 +1,115 @@
+import base64
+import json
+import re
+
+
+# -----------------------------------------------------------------------------------------------
+# Pagination par clé (keyset) des listes de compteurs, factures et paiements
+#   Les listes sont triées par date décroissante puis id ; une page reprend après la clé (date, id)
+#   de la dernière ligne de la précédente, transmise au client dans un curseur opaque. La requête
+#   reprend par un parcours de plage de l'index : une page profonde coûte autant que la première.
+#   Sans limit ni cursor, la liste est renvoyée entière (clients existants).
+# -----------------------------------------------------------------------------------------------
+MONTH_PATTERN = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+# Filtres acceptés par liste (paramètre de requête -> clé des filtres des dépôts)
+FILTERS = {
+    'meters': ('status',),
+    'invoices': ('status', 'month_from', 'month_to', 'meter_id'),
+    'meter_invoices': ('status', 'month_from', 'month_to'),
+    'payments': ('status', 'month_from', 'month_to', 'meter_id'),
+    'invoice_payments': ('status',),
+}
+
+
+def encode_cursor(listing, key):
+    """Curseur opaque : nom de la liste et clé (date, id) de la dernière ligne de la page"""
+    raw = json.dumps([listing, *key], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(listing, token):
+    """Clé (date, id) d'un curseur émis pour la même liste ; ValueError sinon
+
+    La date est None pour les compteurs créés avant la colonne created_at.
+    """
+    try:
+        name, date, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Curseur invalide")
+    if name != listing or not isinstance(date, (str, type(None))) or not isinstance(row_id, int):
+        raise ValueError("Curseur invalide")
+    return date, row_id
+
+
+class Page:
+    """Filtres, clé de reprise et taille de page d'une requête de liste
+
+    limit None : liste entière (ni limit ni cursor dans la requête). Les dépôts reçoivent fetch,
+    une ligne de plus que la page, pour savoir s'il en reste une suivante.
+    """
+
+    def __init__(self, listing, filters, after=None, limit=None, total=False, count_max=10000):
+        self.listing = listing
+        self.filters = filters
+        self.after = after
+        self.limit = limit
+        self.total = total
+        self.count_max = count_max
+
+    @classmethod
+    def from_args(cls, listing, args, default_limit=50, max_limit=500, count_max=10000):
+        """Page d'après les paramètres de requête ; ValueError (message pour le client) si invalides
+
+        limit, cursor, total=1, et selon la liste : status, month_from / month_to (AAAA-MM, inclus),
+        meter_id.
+        """
+        filters = {}
+        for name in FILTERS[listing]:
+            value = args.get(name)
+            if value is None or value == '':
+                continue
+            if name in ('month_from', 'month_to') and not MONTH_PATTERN.match(value):
+                raise ValueError(f"Format de mois invalide pour {name} (AAAA-MM)")
+            if name == 'meter_id':
+                if not value.isdigit():
+                    raise ValueError("meter_id invalide")
+                value = int(value)
+            filters[name] = value
+
+        after = decode_cursor(listing, args['cursor']) if args.get('cursor') else None
+        limit = None
+        if 'limit' in args:
+            if not args['limit'].isdigit() or not 1 <= int(args['limit']) <= max_limit:
+                raise ValueError(f"limit doit être compris entre 1 et {max_limit}")
+            limit = int(args['limit'])
+        elif after is not None:
+            limit = default_limit
+        return cls(listing, filters, after, limit, args.get('total') == '1', count_max)
+
+    @property
+    def fetch(self):
+        return self.limit + 1 if self.limit is not None else None
+
+    def result(self, rows, date_of, count):
+        """(lignes de la page, champs de pagination de la réponse)
+
+        count : fonction(cap) -> nombre de lignes de la liste filtrée, compté jusqu'à cap + 1 au
+        plus ; appelée seulement avec total=1 sur une liste de plus d'une page. Au-delà de
+        count_max, total est une borne basse (total_exact false).
+        """
+        meta = {}
+        if self.limit is not None:
+            more = len(rows) > self.limit
+            rows = rows[:self.limit]
+            meta['limit'] = self.limit
+            meta['next_cursor'] = encode_cursor(self.listing, (date_of(rows[-1]), rows[-1].id)) if more else None
+        if self.total:
+            if self.limit is None or (self.after is None and not more):
+                meta['total'] = len(rows)
+                meta['total_exact'] = True
+            else:
+                counted = count(self.count_max)
+                meta['total'] = min(counted, self.count_max)
+                meta['total_exact'] = counted <= self.count_max
+        return rows, meta
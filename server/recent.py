@@ -0,0 +1,176 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+
+# -----------------------------------------------------------------------------------------------
+# Dernières lectures par compteur, en mémoire, pour les tableaux de bord
+#   Un bloc de `capacity` emplacements (ts, wh) par compteur, pris dans deux tableaux préalloués
+#   au démarrage selon le budget mémoire : l'ingestion écrit les entiers en place, sans créer
+#   d'objet par lecture. Seuls les compteurs consultés ont un tampon ; au-delà du budget, le
+#   compteur consulté le moins récemment rend le sien.
+# -----------------------------------------------------------------------------------------------
+class RecentReadings:
+    """Tampons circulaires (ts, wh) par compteur, dans un budget mémoire fixe"""
+
+    def __init__(self, capacity=1440, budget_bytes=64 * 1024 * 1024):
+        self.capacity = capacity
+        self._ts = array('q')
+        self._wh = array('q')
+        self.bytes_per_meter = capacity * (self._ts.itemsize + self._wh.itemsize)
+        self.slots = max(1, budget_bytes // self.bytes_per_meter)
+
+        # Préallocation de tous les emplacements
+        self._ts.frombytes(bytes(self._ts.itemsize * capacity * self.slots))
+        self._wh.frombytes(bytes(self._wh.itemsize * capacity * self.slots))
+        self._head = array('q', bytes(8 * self.slots))     # prochain emplacement écrit du tampon
+        self._count = array('q', bytes(8 * self.slots))    # emplacements occupés
+        self._floor = array('q', bytes(8 * self.slots))    # plus haut ts chargé depuis la base
+        self._slot = OrderedDict()                          # meter_id -> tampon, du moins au plus récemment consulté
+        self._free = list(range(self.slots - 1, -1, -1))
+        self._loading = {}                                  # meter_id -> lectures validées pendant son chargement
+        self._loaders = {}                                  # meter_id -> requêtes de chargement en cours
+        self.lock = threading.Lock()
+
+        # Métriques
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.appended = 0
+
+    def __contains__(self, meter_id):
+        return meter_id in self._slot
+
+    # ------------------------- Écriture -------------------------
+    def append_rows(self, rows):
+        """Lectures (meter_id, ts, wh) validées en base ; ignorées pour les compteurs sans tampon"""
+        with self.lock:
+            slots = self._slot
+            loading = self._loading
+            for meter_id, ts, wh in rows:
+                slot = slots.get(meter_id)
+                # Lot validé avant le chargement du tampon : ses lectures y sont déjà
+                if slot is not None and ts > self._floor[slot]:
+                    self._write(slot, ts, wh)
+                    self.appended += 1
+                elif slot is None and meter_id in loading:
+                    # Requête de chargement en cours : gardées pour le remplissage
+                    loading[meter_id].append((ts, wh))
+
+    def _write(self, slot, ts, wh):
+        head = self._head[slot]
+        position = slot * self.capacity + head
+        self._ts[position] = ts
+        self._wh[position] = wh
+        self._head[slot] = head + 1 if head + 1 < self.capacity else 0
+        if self._count[slot] < self.capacity:
+            self._count[slot] += 1
+
+    def fetch(self, meter_id, loader, since=None):
+        """(lectures du tampon comme read(), True si le tampon vient d'être chargé par loader())
+
+        loader() -> [(ts, wh), ...] chronologique ; la requête s'exécute hors du verrou, que
+        l'écriture d'un lot d'ingestion attend. Les lectures validées pendant la requête sont
+        gardées à part puis ajoutées au remplissage : aucune ne manque au tampon.
+        """
+        with self.lock:
+            if meter_id in self._slot:
+                return self._rows(self._snapshot(meter_id), since), False
+            self._loading.setdefault(meter_id, [])
+            self._loaders[meter_id] = self._loaders.get(meter_id, 0) + 1
+
+        try:
+            rows = loader()
+        except Exception:
+            with self.lock:
+                self._done_loading(meter_id)
+            raise
+
+        with self.lock:
+            if meter_id not in self._slot:
+                self._fill(meter_id, rows, self._loading.get(meter_id, []))
+            self._done_loading(meter_id)
+            # Copie sous le même verrou : un autre chargement ne peut pas reprendre ce tampon avant
+            snapshot = self._snapshot(meter_id)
+        return self._rows(snapshot, since), True
+
+    def _done_loading(self, meter_id):
+        self._loaders[meter_id] -= 1
+        if not self._loaders[meter_id]:
+            del self._loaders[meter_id]
+            self._loading.pop(meter_id, None)
+
+    def _fill(self, meter_id, rows, arrived):
+        floor = rows[-1][0] if rows else 0
+        # Lectures validées après l'instantané de la requête (les autres y figurent déjà)
+        rows = rows + sorted(row for row in arrived if row[0] > floor)
+        if not self._free:
+            _, slot = self._slot.popitem(last=False)
+            self._free.append(slot)
+            self.evictions += 1
+        slot = self._free.pop()
+        self._head[slot] = 0
+        self._count[slot] = 0
+        self._floor[slot] = rows[-1][0] if rows else 0
+        for ts, wh in rows[-self.capacity:]:
+            self._write(slot, ts, wh)
+        self._slot[meter_id] = slot
+        self.loads += 1
+
+    def discard(self, meter_id):
+        with self.lock:
+            slot = self._slot.pop(meter_id, None)
+            if slot is not None:
+                self._free.append(slot)
+
+    # ------------------------- Lecture -------------------------
+    def read(self, meter_id, since=None):
+        """[(ts, wh), ...] chronologique du tampon (ts >= since), ou None si le compteur n'en a pas"""
+        with self.lock:
+            snapshot = self._snapshot(meter_id)
+        return self._rows(snapshot, since)
+
+    def _snapshot(self, meter_id):
+        """Copie (ts, wh) du tampon, à appeler sous le verrou"""
+        slot = self._slot.get(meter_id)
+        if slot is None:
+            return None
+        self._slot.move_to_end(meter_id)
+        self.hits += 1
+        count = self._count[slot]
+        base = slot * self.capacity
+        first = (self._head[slot] - count) % self.capacity
+        # Au plus deux morceaux contigus : fin puis début du tampon
+        ends = [(first, min(first + count, self.capacity)), (0, max(first + count - self.capacity, 0))]
+        ts = array('q')
+        wh = array('q')
+        for lo, hi in ends:
+            ts.extend(self._ts[base + lo:base + hi])
+            wh.extend(self._wh[base + lo:base + hi])
+        return ts, wh
+
+    @staticmethod
+    def _rows(snapshot, since):
+        if snapshot is None:
+            return None
+        ts, wh = snapshot
+        rows = list(zip(ts, wh))
+        # Une lecture tardive acceptée par le dédoublonnage peut arriver après une plus récente
+        if any(a > b for a, b in zip(ts, ts[1:])):
+            rows.sort()
+        if since is not None:
+            rows = [row for row in rows if row[0] >= since]
+        return rows
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'slots': self.slots,
+            'meters': len(self._slot),
+            'bytes_per_meter': self.bytes_per_meter,
+            'allocated_bytes': self.bytes_per_meter * self.slots,
+            'hits': self.hits,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'appended': self.appended,
+        }
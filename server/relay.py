@@ -0,0 +1,257 @@
+import queue
+import threading
+import time
+
+
+ON = 'ON'
+OFF = 'OFF'
+
+
+# -----------------------------------------------------------------------------------------------
+# Répartiteur des commandes de relais
+# -----------------------------------------------------------------------------------------------
+class RelayState:
+    """État du relais d'un compteur : demandé (desired) et confirmé par l'appareil (confirmed)"""
+    __slots__ = ('desired', 'confirmed', 'queued', 'awaiting', 'failed', 'attempts',
+                 'requested_at', 'sent_at', 'confirmed_at', 'guard')
+
+    def __init__(self):
+        self.desired = None
+        self.confirmed = None
+        self.queued = False      # numéro présent dans la file sortante
+        self.awaiting = False    # commande publiée, acquittement attendu
+        self.failed = False      # plus de relance après max_retries sans acquittement
+        self.attempts = 0
+        self.requested_at = None
+        self.sent_at = None
+        self.confirmed_at = None
+        self.guard = None        # guard() -> bool, revérifiée avant chaque envoi de la demande
+
+    def to_dict(self):
+        return {
+            'desired': self.desired,
+            'confirmed': self.confirmed,
+            'pending': self.queued or self.awaiting,
+            'failed': self.failed,
+            'attempts': self.attempts,
+            'requested_at': self.requested_at,
+            'sent_at': self.sent_at,
+            'confirmed_at': self.confirmed_at,
+        }
+
+
+class RelayDispatcher:
+    """File sortante unique : écarte les commandes redondantes, fusionne les rafales,
+    relance tant que l'appareil n'a pas confirmé l'état demandé"""
+
+    def __init__(self, publish, ack_timeout_s=10, max_retries=3, resend_after_s=60, on_change=None):
+        self.publish = publish          # publish(meter_number, command) -> bool
+        self.on_change = on_change      # on_change(meter_number, état) : nouvelle demande ou acquittement
+        self.ack_timeout = ack_timeout_s
+        self.max_retries = max_retries
+        self.resend_after = resend_after_s
+
+        self._lock = threading.Lock()
+        self._states = {}               # meter_number -> RelayState
+        self._awaiting = set()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._running = False
+
+        # Métriques
+        self.requested = 0
+        self.redundant = 0
+        self.merged = 0
+        self.published = 0
+        self.retries = 0
+        self.acks = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    def start(self):
+        """Démarre le thread d'envoi"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="relay-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout)
+
+    def request(self, meter_number, command, guard=None):
+        """Demande un état ; retourne True si une publication est planifiée, False si elle est inutile
+
+        guard : appelée avant le premier envoi et avant chaque relance ; False annule la demande
+        (commande automatique dont la cause a pu disparaître, par exemple un paiement).
+        """
+        now = time.time()
+        with self._lock:
+            self.requested += 1
+            state = self._states.get(meter_number)
+            if state is None:
+                state = self._states[meter_number] = RelayState()
+
+            if state.desired == command:
+                # Déjà confirmé, déjà en route, ou échec récent : rien à publier
+                recently_failed = state.failed and now - (state.sent_at or 0) < self.resend_after
+                if state.confirmed == command or state.queued or state.awaiting or recently_failed:
+                    if guard is None:
+                        # Demande explicite : la commande en cours ne peut plus être annulée
+                        state.guard = None
+                    self.redundant += 1
+                    return False
+
+            if state.queued:
+                # Rafale : la commande en file sera publiée avec le dernier état demandé
+                self.merged += 1
+            state.desired = command
+            state.guard = guard
+            state.requested_at = now
+            state.attempts = 0
+            state.failed = False
+            self._awaiting.discard(meter_number)
+            state.awaiting = False
+            self._enqueue(meter_number, state)
+            snapshot = state.to_dict()
+        self._changed(meter_number, snapshot)
+        return True
+
+    def on_ack(self, meter_number, confirmed):
+        """État rapporté par l'appareil sur electricity/<n>/relay/state"""
+        with self._lock:
+            self.acks += 1
+            state = self._states.get(meter_number)
+            if state is None:
+                state = self._states[meter_number] = RelayState()
+            state.confirmed = confirmed
+            state.confirmed_at = time.time()
+            if confirmed == state.desired:
+                state.awaiting = False
+                state.failed = False
+                self._awaiting.discard(meter_number)
+            snapshot = state.to_dict()
+        self._changed(meter_number, snapshot)
+
+    def _changed(self, meter_number, snapshot):
+        # Hors verrou : l'écouteur peut être lent ou rappeler le répartiteur
+        if self.on_change is not None:
+            try:
+                self.on_change(meter_number, snapshot)
+            except Exception as e:
+                print(f"[RELAY ERROR] Écouteur: {e}")
+
+    def state(self, meter_number):
+        with self._lock:
+            state = self._states.get(meter_number)
+            return state.to_dict() if state else None
+
+    def forget(self, meter_number):
+        with self._lock:
+            self._states.pop(meter_number, None)
+            self._awaiting.discard(meter_number)
+
+    def _enqueue(self, meter_number, state):
+        if not state.queued:
+            state.queued = True
+            self._queue.put(meter_number)
+
+    def _run(self):
+        while self._running:
+            try:
+                meter_number = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                meter_number = None
+
+            if meter_number is not None:
+                self._send(meter_number)
+            self._check_timeouts()
+
+    def _send(self, meter_number):
+        with self._lock:
+            state = self._states.get(meter_number)
+            if state is None or not state.queued:
+                return
+            guard = state.guard
+
+        # Garde hors verrou : elle peut lire la base
+        if guard is not None and not self._allowed(meter_number, guard):
+            self._cancel(meter_number, state, guard)
+            return
+
+        with self._lock:
+            if not state.queued:
+                return
+            if state.guard is not guard:
+                # Nouvelle demande pendant la vérification : vérifier la sienne
+                self._queue.put(meter_number)
+                return
+            state.queued = False
+            command = state.desired
+            if command == state.confirmed:
+                # Confirmé entre-temps (ou rafale revenue à l'état courant)
+                return
+            state.attempts += 1
+            state.sent_at = time.time()
+            state.awaiting = True
+            self._awaiting.add(meter_number)
+
+        # Publication hors verrou ; un échec est rattrapé par la relance sur délai
+        if self.publish(meter_number, command):
+            self.published += 1
+
+    def _allowed(self, meter_number, guard):
+        try:
+            return guard()
+        except Exception as e:
+            # Garde indisponible : la commande part comme sans garde
+            print(f"[RELAY ERROR] Garde de {meter_number}: {e}")
+            return True
+
+    def _cancel(self, meter_number, state, guard):
+        with self._lock:
+            if state.guard is not guard or not state.queued:
+                return
+            state.queued = False
+            state.guard = None
+            state.desired = state.confirmed
+            self.cancelled += 1
+            snapshot = state.to_dict()
+        print(f"[RELAY] Commande annulée pour {meter_number} : sa cause a disparu")
+        self._changed(meter_number, snapshot)
+
+    def _check_timeouts(self):
+        now = time.time()
+        with self._lock:
+            for meter_number in list(self._awaiting):
+                state = self._states[meter_number]
+                if now - state.sent_at < self.ack_timeout:
+                    continue
+                self._awaiting.discard(meter_number)
+                state.awaiting = False
+                if state.attempts > self.max_retries:
+                    state.failed = True
+                    self.failures += 1
+                    print(f"[RELAY ERROR] Pas d'acquittement de {meter_number} pour {state.desired} "
+                          f"après {state.attempts} envois")
+                else:
+                    self.retries += 1
+                    self._enqueue(meter_number, state)
+
+    def stats(self):
+        return {
+            'meters': len(self._states),
+            'queue_depth': self._queue.qsize(),
+            'awaiting_ack': len(self._awaiting),
+            'requested': self.requested,
+            'redundant': self.redundant,
+            'merged': self.merged,
+            'published': self.published,
+            'retries': self.retries,
+            'acks': self.acks,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'running': bool(self._thread and self._thread.is_alive()),
+        }
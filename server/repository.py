@@ -0,0 +1,1655 @@
+import bisect
+import heapq
+import os
+import threading
+import time
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+from timeseries import (GRANULARITIES, bucket_start, bucket_ceil, insert_readings, update_rollups,
+                        get_readings, get_series, sum_range)
+
+# Tables dont les lignes passent dans l'archive lors de la rétention (voir retention.py)
+ARCHIVED_TABLES = ('readings', 'consumption_minute')
+
+
+# -----------------------------------------------------------------------------------------------
+# Entités
+# -----------------------------------------------------------------------------------------------
+def _pick(entity, fields):
+    return {name: getattr(entity, name) for name in fields}
+
+
+@dataclass
+class User:
+    id: int
+    name: str
+    email: str
+    phone: Optional[str]
+    created_at: Optional[str]
+    password: Optional[str] = field(default=None, repr=False)
+
+    def to_dict(self, fields=('id', 'name', 'email', 'phone', 'created_at')):
+        return _pick(self, fields)
+
+
+@dataclass
+class Meter:
+    id: int
+    user_id: int
+    meter_number: str
+    meter_name: Optional[str]
+    status: str
+    cumulative_consumption: float
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+    @property
+    def active(self):
+        return self.status == 'active'
+
+    def to_dict(self, fields=('id', 'meter_number', 'meter_name', 'status', 'created_at', 'updated_at')):
+        return _pick(self, fields)
+
+
+@dataclass
+class Invoice:
+    id: int
+    meter_id: int
+    month: str
+    amount: float
+    status: str
+    kwh: int
+    issued_at: Optional[str]
+    meter_number: Optional[str] = None
+    meter_name: Optional[str] = None
+
+    FIELDS = ('id', 'meter_id', 'meter_number', 'meter_name', 'month', 'amount', 'status', 'kwh', 'issued_at')
+    METER_FIELDS = ('id', 'month', 'amount', 'status', 'kwh', 'issued_at')
+
+    def to_dict(self, fields=FIELDS):
+        return _pick(self, fields)
+
+
+@dataclass
+class Payment:
+    id: int
+    invoice_id: int
+    amount: float
+    payment_method: str
+    transaction_id: Optional[str]
+    status: str
+    paid_at: Optional[str]
+    invoice_amount: Optional[float] = None
+    invoice_month: Optional[str] = None
+    invoice_status: Optional[str] = None
+    meter_number: Optional[str] = None
+    meter_name: Optional[str] = None
+
+    FIELDS = ('id', 'invoice_id', 'amount', 'payment_method', 'transaction_id', 'status', 'paid_at',
+              'invoice_amount', 'invoice_month', 'invoice_status', 'meter_number', 'meter_name')
+    CREATED_FIELDS = FIELDS[:8]
+    INVOICE_FIELDS = ('id', 'amount', 'payment_method', 'transaction_id', 'status', 'paid_at')
+
+    def to_dict(self, fields=FIELDS):
+        return _pick(self, fields)
+
+
+# -----------------------------------------------------------------------------------------------
+# Lectures archivées : chaque lecture est soit en base soit dans un segment, jamais les deux
+# -----------------------------------------------------------------------------------------------
+def _merge_archived_range(archive, segments, meter_id, start, end, limit, rows):
+    if not segments:
+        return rows
+    archived = archive.readings(segments, meter_id, start, end, limit)
+    return list(heapq.merge(archived, rows))[:limit]
+
+
+def _merge_archived_series(archive, segments, meter_id, granularity, start, end, limit, rows):
+    if not segments:
+        return rows
+    # Périodes qui commencent dans [start, end) : jusqu'à la fin de la dernière
+    buckets = archive.buckets(segments, meter_id, granularity, bucket_start(start, granularity),
+                              bucket_ceil(end, granularity))
+    for bucket, wh, n in rows:
+        merged = buckets.setdefault(bucket, [0, 0])
+        merged[0] += wh
+        merged[1] += n
+    return [(bucket, wh, n) for bucket, (wh, n) in sorted(buckets.items())][:limit]
+
+
+# -----------------------------------------------------------------------------------------------
+# Backend SQLite
+# -----------------------------------------------------------------------------------------------
+USER_COLUMNS = "u.id, u.name, u.email, u.phone, u.created_at"
+METER_COLUMNS = ("m.id, m.user_id, m.meter_number, m.meter_name, m.status, m.cumulative_consumption, "
+                 "m.created_at, m.updated_at")
+INVOICE_COLUMNS = "i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at, m.meter_number, m.meter_name"
+PAYMENT_COLUMNS = ("p.id, p.invoice_id, p.amount, p.payment_method, p.transaction_id, p.status, p.paid_at, "
+                   "i.amount, i.month, i.status, m.meter_number, m.meter_name")
+
+
+def _export_where(filters, columns):
+    """Clauses WHERE des filtres d'export renseignés (email, meter_number, month, status, start, end)
+
+    columns : filtre -> colonne, ou condition complète avec son paramètre ;
+    start/end bornent la date de la ligne sur [start, end).
+    """
+    clauses = []
+    params = []
+    for name, operator in (('email', '='), ('meter_number', '='), ('month', '='), ('status', '='),
+                           ('start', '>='), ('end', '<')):
+        value = filters.get(name)
+        if value is not None:
+            column = columns[name]
+            clauses.append(column if '?' in column else f"{column} {operator} ?")
+            params.append(value)
+    return ''.join(f" AND {clause}" for clause in clauses), params
+
+
+def _list_where(filters, columns):
+    """Clauses WHERE des filtres de liste renseignés (pagination.py : status, month_from, month_to, meter_id)
+
+    columns : filtre -> condition complète avec son paramètre.
+    """
+    clauses = []
+    params = []
+    for name, value in (filters or {}).items():
+        if value is not None:
+            clauses.append(f" AND {columns[name]}")
+            params.append(value)
+    return ''.join(clauses), params
+
+
+def _keyset(date_column, id_column, after, id_descending=False, nullable=False):
+    """Reprise après la clé (date, id) de la dernière ligne reçue, liste triée par date décroissante
+
+    `date <= ?` borne le parcours de plage de l'index ; le reste ne départage que les lignes de même
+    date. nullable : les dates NULL (anciennes lignes) viennent en dernier, comme dans ORDER BY ... DESC.
+    """
+    if after is None:
+        return "", []
+    date, row_id = after
+    operator = '<' if id_descending else '>'
+    if date is None:
+        return f" AND {date_column} IS NULL AND {id_column} {operator} ?", [row_id]
+    if nullable:
+        return (f" AND ({date_column} <= ? AND ({date_column} < ? OR {id_column} {operator} ?)"
+                f" OR {date_column} IS NULL)", [date, date, row_id])
+    return f" AND {date_column} <= ? AND ({date_column} < ? OR {id_column} {operator} ?)", [date, date, row_id]
+
+
+def _limit(limit):
+    return -1 if limit is None else limit      # LIMIT -1 : toutes les lignes
+
+
+def _count_rows(store, source, params, cap):
+    """Lignes de `source` (FROM ... WHERE ...) comptées sur l'index, jusqu'à cap + 1 au plus"""
+    with store.read() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 {source} LIMIT ?)", [*params, cap + 1])
+        return cursor.fetchone()[0]
+
+
+def _rows_for_ids(store, sql, params, ids):
+    """Lignes de `sql` dont la clause {ids} reçoit les ids par paquets de 500"""
+    ids = list(ids)
+    rows = []
+    with store.read() as cursor:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute(sql.format(ids=', '.join('?' * len(chunk))), [*params, *chunk])
+            rows += cursor.fetchall()
+    return rows
+
+
+class SqliteStore:
+    """Accès aux connexions du gestionnaire db.Database ; transactions imbriquables par thread
+
+    reader : gestionnaire en lecture seule (Database.reader()) pour les lectures hors transaction ;
+    dans une transaction, les lectures restent sur la connexion qui écrit (elles voient ses écritures).
+    """
+
+    def __init__(self, database, reader=None):
+        self.database = database
+        self.reader = reader or database
+        self._local = threading.local()
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Bloc validé d'un coup ; un bloc imbriqué rejoint la transaction englobante
+
+        immediate : prend le verrou d'écriture dès le début, pour que les lectures du bloc
+        voient le dernier état validé jusqu'au commit.
+        """
+        conn = self.database.connect()
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        try:
+            if immediate and depth == 0 and not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            yield conn.cursor()
+            if depth == 0:
+                conn.commit()
+        except Exception:
+            if depth == 0:
+                conn.rollback()
+            raise
+        finally:
+            self._local.depth = depth
+            conn.close()
+
+    @contextmanager
+    def read(self):
+        database = self.database if getattr(self._local, 'depth', 0) else self.reader
+        conn = database.connect()
+        try:
+            yield conn.cursor()
+        finally:
+            conn.close()
+
+    def stream(self, sql, params=(), batch=1000):
+        """Lignes d'une requête lues par paquets sur un même curseur : mémoire constante quel que soit
+        le nombre de lignes. Le générateur doit être consommé dans le thread qui l'a créé."""
+        with self.read() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    return
+                yield from rows
+
+
+class SqliteUserRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, user_id):
+        with self.store.read() as cursor:
+            cursor.execute(f"SELECT {USER_COLUMNS} FROM users u WHERE u.id=?", (user_id,))
+            row = cursor.fetchone()
+        return User(*row) if row else None
+
+    def get_by_email(self, email, with_password=False):
+        with self.store.read() as cursor:
+            cursor.execute(f"SELECT {USER_COLUMNS}, u.password FROM users u WHERE u.email=?", (email,))
+            row = cursor.fetchone()
+        if not row:
+            return None
+        user = User(*row)
+        if not with_password:
+            user.password = None
+        return user
+
+    def id_for_email(self, email):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id FROM users WHERE email=?", (email,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def phone_exists(self, phone):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id FROM users WHERE phone=?", (phone,))
+            return cursor.fetchone() is not None
+
+    def create(self, email, password, phone, name, row_id=None):
+        """row_id : id imposé (base partitionnée, attribué par l'annuaire de shards.py)"""
+        with self.store.transaction() as cursor:
+            cursor.execute("INSERT INTO users (id, email, password, phone, name) VALUES (?, ?, ?, ?, ?)",
+                           (row_id, email, password, phone, name))
+            cursor.execute(f"SELECT {USER_COLUMNS} FROM users u WHERE u.id=?", (cursor.lastrowid,))
+            row = cursor.fetchone()
+        return User(*row) if row else None
+
+    def import_many(self, rows, ids=None):
+        """Import en masse de (email, password, phone, name) ; un email déjà présent est ignoré
+
+        ids : id imposé de chaque ligne (base partitionnée). Retourne le nombre d'utilisateurs insérés.
+        """
+        ids = ids or [None] * len(rows)
+        with self.store.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO users (id, email, password, phone, name) VALUES (?, ?, ?, ?, ?)",
+                               [(row_id,) + tuple(row) for row_id, row in zip(ids, rows)])
+            return cursor.rowcount
+
+    def emails(self):
+        """(id, email) de tous les utilisateurs"""
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id, email FROM users")
+            return cursor.fetchall()
+
+
+class SqliteMeterRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, meter_id, user_id=None):
+        with self.store.read() as cursor:
+            if user_id is None:
+                cursor.execute(f"SELECT {METER_COLUMNS} FROM meters m WHERE m.id=?", (meter_id,))
+            else:
+                cursor.execute(f"SELECT {METER_COLUMNS} FROM meters m WHERE m.id=? AND m.user_id=?",
+                               (meter_id, user_id))
+            row = cursor.fetchone()
+        return Meter(*row) if row else None
+
+    def get_by_number(self, meter_number):
+        with self.store.read() as cursor:
+            cursor.execute(f"SELECT {METER_COLUMNS} FROM meters m WHERE m.meter_number=?", (meter_number,))
+            row = cursor.fetchone()
+        return Meter(*row) if row else None
+
+    def owned_by_email(self, meter_id, email):
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT m.id
+                FROM meters m
+                JOIN users u ON m.user_id = u.id
+                WHERE m.id = ? AND u.email = ?
+            """, (meter_id, email))
+            return cursor.fetchone() is not None
+
+    LIST_FILTERS = {'status': "m.status = ?"}
+
+    def list_for_user(self, user_id, filters=None, after=None, limit=None):
+        """Compteurs de l'utilisateur, du plus récent au plus ancien (création puis id décroissants)
+
+        after : clé (created_at, id) de la dernière ligne de la page précédente.
+        """
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        keyset, keys = _keyset('m.created_at', 'm.id', after, id_descending=True, nullable=True)
+        with self.store.read() as cursor:
+            cursor.execute(f"""
+                SELECT {METER_COLUMNS}
+                FROM meters m
+                WHERE m.user_id=?{where}{keyset}
+                ORDER BY m.created_at DESC, m.id DESC
+                LIMIT ?
+            """, [user_id, *params, *keys, _limit(limit)])
+            return [Meter(*row) for row in cursor.fetchall()]
+
+    def count_for_user(self, user_id, filters=None, cap=10000):
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        return _count_rows(self.store, f"FROM meters m WHERE m.user_id = ?{where}", [user_id, *params], cap)
+
+    def get_many(self, user_id, meter_ids):
+        """Compteurs de l'utilisateur parmi meter_ids (les autres sont absents du résultat)"""
+        rows = _rows_for_ids(self.store, f"""
+            SELECT {METER_COLUMNS} FROM meters m WHERE m.user_id = ? AND m.id IN ({{ids}})
+        """, [user_id], meter_ids)
+        return [Meter(*row) for row in rows]
+
+    def numbers_for_email(self, email):
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT m.meter_number
+                FROM meters m
+                JOIN users u ON m.user_id = u.id
+                WHERE u.email = ?
+            """, (email,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def all_with_thresholds(self):
+        """(compteur, kwh de la dernière facture payée ou None) pour tous les compteurs"""
+        with self.store.read() as cursor:
+            cursor.execute(f"""
+                SELECT {METER_COLUMNS},
+                       (SELECT i.kwh FROM invoices i
+                        WHERE i.meter_id = m.id AND i.status = 'paid'
+                        ORDER BY i.issued_at DESC, i.id DESC
+                        LIMIT 1)
+                FROM meters m
+            """)
+            return [(Meter(*row[:-1]), row[-1]) for row in cursor.fetchall()]
+
+    def create(self, user_id, meter_number, meter_name, row_id=None):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO meters (id, user_id, meter_number, meter_name)
+                VALUES (?, ?, ?, ?)
+            """, (row_id, user_id, meter_number, meter_name))
+            cursor.execute(f"SELECT {METER_COLUMNS} FROM meters m WHERE m.id=?", (cursor.lastrowid,))
+            row = cursor.fetchone()
+        return Meter(*row) if row else None
+
+    def update(self, meter_id, changes):
+        """Met à jour les champs donnés (meter_name, status) et retourne le compteur"""
+        fields = [f"{name} = ?" for name in changes] + ["updated_at = CURRENT_TIMESTAMP"]
+        with self.store.transaction() as cursor:
+            cursor.execute(f"UPDATE meters SET {', '.join(fields)} WHERE id = ?",
+                           list(changes.values()) + [meter_id])
+            cursor.execute(f"SELECT {METER_COLUMNS} FROM meters m WHERE m.id=?", (meter_id,))
+            row = cursor.fetchone()
+        return Meter(*row) if row else None
+
+    def delete(self, meter_id):
+        with self.store.transaction() as cursor:
+            cursor.execute("DELETE FROM meters WHERE id=?", (meter_id,))
+
+    def add_cumulative(self, totals):
+        """Ajoute {meter_number: kWh} aux consommations cumulées ; retourne {meter_number: nouveau cumul}"""
+        meter_numbers = list(totals)
+        cumulatives = {}
+        with self.store.transaction() as cursor:
+            cursor.executemany("""
+                UPDATE meters
+                SET cumulative_consumption = cumulative_consumption + ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE meter_number = ?
+            """, [(delta, meter_number) for meter_number, delta in totals.items()])
+            for i in range(0, len(meter_numbers), 500):
+                chunk = meter_numbers[i:i + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f"""
+                    SELECT meter_number, cumulative_consumption FROM meters WHERE meter_number IN ({placeholders})
+                """, chunk)
+                cumulatives.update(cursor.fetchall())
+        return cumulatives
+
+    def import_many(self, rows, ids=None):
+        """Import en masse de (email du propriétaire, meter_number, meter_name, status)
+
+        Propriétaire inconnu ou numéro déjà pris : ligne ignorée. ids : id imposé de chaque ligne
+        (base partitionnée). Retourne le nombre de compteurs insérés.
+        """
+        ids = ids or [None] * len(rows)
+        with self.store.transaction() as cursor:
+            cursor.executemany("""
+                INSERT OR IGNORE INTO meters (id, user_id, meter_number, meter_name, status)
+                SELECT ?, id, ?, ?, ? FROM users WHERE email = ?
+            """, [(row_id, meter_number, meter_name, status, email)
+                  for row_id, (email, meter_number, meter_name, status) in zip(ids, rows)])
+            return cursor.rowcount
+
+    def export_ids(self, filters, after=0):
+        """(id, meter_number) des compteurs filtrés (email, meter_number), par id croissant après `after`"""
+        where, params = _export_where({name: filters.get(name) for name in ('email', 'meter_number')},
+                                      {'email': "m.user_id = (SELECT id FROM users WHERE email = ?)",
+                                       'meter_number': "m.meter_number"})
+        return self.store.stream(f"SELECT m.id, m.meter_number FROM meters m WHERE m.id > ?{where} ORDER BY m.id",
+                                 [after] + params)
+
+    def ids_for_numbers(self, meter_numbers):
+        """{meter_number: id} des compteurs connus"""
+        meter_numbers = list(meter_numbers)
+        ids = {}
+        with self.store.read() as cursor:
+            for i in range(0, len(meter_numbers), 500):
+                chunk = meter_numbers[i:i + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f"SELECT meter_number, id FROM meters WHERE meter_number IN ({placeholders})", chunk)
+                ids.update(cursor.fetchall())
+        return ids
+
+    def reset_cumulative(self, meter_number):
+        with self.store.transaction() as cursor:
+            cursor.execute("UPDATE meters SET cumulative_consumption = 0.0 WHERE meter_number = ?",
+                           (meter_number,))
+
+
+class SqliteInvoiceRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def _one(self, cursor, where, params):
+        cursor.execute(f"""
+            SELECT {INVOICE_COLUMNS}
+            FROM invoices i
+            JOIN meters m ON i.meter_id = m.id
+            WHERE {where}
+        """, params)
+        row = cursor.fetchone()
+        return Invoice(*row) if row else None
+
+    def get(self, invoice_id, email=None):
+        """Facture (avec numéro et nom du compteur) ; avec email, seulement si elle appartient à l'utilisateur"""
+        with self.store.read() as cursor:
+            if email is None:
+                return self._one(cursor, "i.id = ?", (invoice_id,))
+            return self._one(cursor, "i.id = ? AND i.user_id = (SELECT id FROM users WHERE email = ?)",
+                             (invoice_id, email))
+
+    # Mois de facturation inclus ; chaque filtre est lu dans un index couvrant (migration 6)
+    LIST_FILTERS = {'status': "i.status = ?", 'month_from': "i.month >= ?", 'month_to': "i.month <= ?",
+                    'meter_id': "i.meter_id = ?"}
+
+    def list_for_user(self, user_id, filters=None, after=None, limit=None):
+        """Factures de l'utilisateur, date d'émission décroissante puis id
+
+        after : clé (issued_at, id) de la dernière ligne de la page précédente.
+        """
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        keyset, keys = _keyset('i.issued_at', 'i.id', after)
+        with self.store.read() as cursor:
+            cursor.execute(f"""
+                SELECT {INVOICE_COLUMNS}
+                FROM invoices i
+                JOIN meters m ON i.meter_id = m.id
+                WHERE i.user_id = ?{where}{keyset}
+                ORDER BY i.issued_at DESC, i.id
+                LIMIT ?
+            """, [user_id, *params, *keys, _limit(limit)])
+            return [Invoice(*row) for row in cursor.fetchall()]
+
+    def count_for_user(self, user_id, filters=None, cap=10000):
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        return _count_rows(self.store, f"FROM invoices i WHERE i.user_id = ?{where}", [user_id, *params], cap)
+
+    def get_many(self, user_id, invoice_ids):
+        """Factures de l'utilisateur parmi invoice_ids, telles que dans ses listes (compteur existant)"""
+        rows = _rows_for_ids(self.store, f"""
+            SELECT {INVOICE_COLUMNS}
+            FROM invoices i
+            JOIN meters m ON i.meter_id = m.id
+            WHERE i.user_id = ? AND i.id IN ({{ids}})
+        """, [user_id], invoice_ids)
+        return [Invoice(*row) for row in rows]
+
+    def list_for_meter(self, meter_id, filters=None, after=None, limit=None):
+        """Factures du compteur, sans numéro ni nom du compteur (déjà connus de l'appelant)"""
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        keyset, keys = _keyset('i.issued_at', 'i.id', after)
+        with self.store.read() as cursor:
+            cursor.execute(f"""
+                SELECT i.id, i.meter_id, i.month, i.amount, i.status, i.kwh, i.issued_at
+                FROM invoices i
+                WHERE i.meter_id = ?{where}{keyset}
+                ORDER BY i.issued_at DESC, i.id
+                LIMIT ?
+            """, [meter_id, *params, *keys, _limit(limit)])
+            return [Invoice(*row) for row in cursor.fetchall()]
+
+    def count_for_meter(self, meter_id, filters=None, cap=10000):
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        return _count_rows(self.store, f"FROM invoices i WHERE i.meter_id = ?{where}", [meter_id, *params], cap)
+
+    EXPORT_COLUMNS = {'email': "i.user_id = (SELECT id FROM users WHERE email = ?)",
+                      'meter_number': "m.meter_number", 'month': "i.month", 'status': "i.status",
+                      'start': "i.issued_at", 'end': "i.issued_at"}
+
+    def export(self, filters, after=0):
+        """Factures filtrées par id croissant après `after` (reprise par curseur), en flux"""
+        where, params = _export_where(filters, self.EXPORT_COLUMNS)
+        rows = self.store.stream(f"""
+            SELECT {INVOICE_COLUMNS}
+            FROM invoices i
+            JOIN meters m ON i.meter_id = m.id
+            WHERE i.id > ?{where}
+            ORDER BY i.id
+        """, [after] + params)
+        return (Invoice(*row) for row in rows)
+
+    def exists_for_month(self, meter_id, month, exclude_id=None):
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT id FROM invoices
+                WHERE meter_id = ? AND month = ? AND id != ?
+            """, (meter_id, month, exclude_id or 0))
+            return cursor.fetchone() is not None
+
+    def latest_paid_kwh(self, meter_id):
+        """kwh de la dernière facture payée du compteur, ou None"""
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT kwh
+                FROM invoices
+                WHERE meter_id = ? AND status = 'paid'
+                ORDER BY issued_at DESC, id DESC
+                LIMIT 1
+            """, (meter_id,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def create(self, meter_id, month, amount, status, kwh, row_id=None):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO invoices (id, meter_id, month, amount, status, kwh, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, (SELECT user_id FROM meters WHERE id = ?))
+            """, (row_id, meter_id, month, amount, status, kwh, meter_id))
+            return self._one(cursor, "i.id = ?", (cursor.lastrowid,))
+
+    def update(self, invoice_id, changes):
+        """Met à jour les champs donnés (amount, status, kwh, month) et retourne la facture"""
+        with self.store.transaction() as cursor:
+            cursor.execute(f"UPDATE invoices SET {', '.join(f'{name} = ?' for name in changes)} WHERE id = ?",
+                           list(changes.values()) + [invoice_id])
+            return self._one(cursor, "i.id = ?", (invoice_id,))
+
+    def mark_paid(self, invoice_id):
+        with self.store.transaction() as cursor:
+            cursor.execute("UPDATE invoices SET status = 'paid' WHERE id = ?", (invoice_id,))
+
+    def delete(self, invoice_id):
+        with self.store.transaction() as cursor:
+            cursor.execute("DELETE FROM invoices WHERE id=?", (invoice_id,))
+
+
+class SqlitePaymentRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def _query(self, cursor, where, params, order=""):
+        cursor.execute(f"""
+            SELECT {PAYMENT_COLUMNS}
+            FROM payments p
+            JOIN invoices i ON p.invoice_id = i.id
+            JOIN meters m ON i.meter_id = m.id
+            WHERE {where}
+            {order}
+        """, params)
+        return [Payment(*row) for row in cursor.fetchall()]
+
+    def get(self, payment_id, email=None):
+        with self.store.read() as cursor:
+            if email is None:
+                payments = self._query(cursor, "p.id = ?", (payment_id,))
+            else:
+                payments = self._query(cursor, "p.id = ? AND p.user_id = (SELECT id FROM users WHERE email = ?)",
+                                       (payment_id, email))
+        return payments[0] if payments else None
+
+    # Mois de paiement inclus : 'AAAA-MM~' suit toutes les dates du mois ('~' après chiffres, '-' et
+    # espace), p.paid_at < ? || '~' reste un parcours de plage de l'index
+    LIST_FILTERS = {'status': "p.status = ?", 'month_from': "p.paid_at >= ?", 'month_to': "p.paid_at < ? || '~'",
+                    'meter_id': "p.invoice_id IN (SELECT id FROM invoices WHERE meter_id = ?)"}
+    OWNER = "p.user_id = (SELECT id FROM users WHERE email = ?)"
+
+    def _owner(self, filters):
+        # Filtre compteur : partir de ses factures (peu de paiements, triés) plutôt que de parcourir
+        # tous les paiements de l'utilisateur ; '+' écarte l'index du propriétaire
+        return '+' + self.OWNER if (filters or {}).get('meter_id') is not None else self.OWNER
+
+    def _list(self, where, params, filters, after, limit):
+        conditions, values = _list_where(filters, self.LIST_FILTERS)
+        keyset, keys = _keyset('p.paid_at', 'p.id', after)
+        with self.store.read() as cursor:
+            return self._query(cursor, f"{where}{conditions}{keyset}", [*params, *values, *keys, _limit(limit)],
+                               "ORDER BY p.paid_at DESC, p.id LIMIT ?")
+
+    def list_for_user(self, email, filters=None, after=None, limit=None):
+        """Paiements de l'utilisateur, date décroissante puis id ; after : clé (paid_at, id)"""
+        return self._list(self._owner(filters), [email], filters, after, limit)
+
+    def count_for_user(self, email, filters=None, cap=10000):
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        return _count_rows(self.store, f"FROM payments p WHERE {self._owner(filters)}{where}", [email, *params], cap)
+
+    def list_for_invoice(self, invoice_id, filters=None, after=None, limit=None):
+        return self._list("p.invoice_id = ?", [invoice_id], filters, after, limit)
+
+    def get_many(self, user_id, payment_ids):
+        """Paiements de l'utilisateur parmi payment_ids, tels que dans ses listes (facture et compteur existants)"""
+        rows = _rows_for_ids(self.store, f"""
+            SELECT {PAYMENT_COLUMNS}
+            FROM payments p
+            JOIN invoices i ON p.invoice_id = i.id
+            JOIN meters m ON i.meter_id = m.id
+            WHERE p.user_id = ? AND p.id IN ({{ids}})
+        """, [user_id], payment_ids)
+        return [Payment(*row) for row in rows]
+
+    def count_for_invoice(self, invoice_id, filters=None, cap=10000):
+        where, params = _list_where(filters, self.LIST_FILTERS)
+        return _count_rows(self.store, f"FROM payments p WHERE p.invoice_id = ?{where}", [invoice_id, *params], cap)
+
+    EXPORT_COLUMNS = {'email': "p.user_id = (SELECT id FROM users WHERE email = ?)",
+                      'meter_number': "m.meter_number", 'month': "i.month", 'status': "p.status",
+                      'start': "p.paid_at", 'end': "p.paid_at"}
+
+    def export(self, filters, after=0):
+        """Paiements filtrés (month : mois de la facture) par id croissant après `after`, en flux"""
+        where, params = _export_where(filters, self.EXPORT_COLUMNS)
+        rows = self.store.stream(f"""
+            SELECT {PAYMENT_COLUMNS}
+            FROM payments p
+            JOIN invoices i ON p.invoice_id = i.id
+            JOIN meters m ON i.meter_id = m.id
+            WHERE p.id > ?{where}
+            ORDER BY p.id
+        """, [after] + params)
+        return (Payment(*row) for row in rows)
+
+    def transaction_exists(self, transaction_id):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id FROM payments WHERE transaction_id=?", (transaction_id,))
+            return cursor.fetchone() is not None
+
+    def create(self, invoice_id, amount, payment_method, transaction_id, row_id=None):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO payments (id, invoice_id, amount, payment_method, transaction_id, user_id)
+                VALUES (?, ?, ?, ?, ?, (SELECT user_id FROM invoices WHERE id = ?))
+            """, (row_id, invoice_id, amount, payment_method, transaction_id, invoice_id))
+            return cursor.lastrowid
+
+
+class SqliteReadingRepository:
+    def __init__(self, store, archive=None):
+        self.store = store
+        self.archive = archive
+
+    def insert(self, rows):
+        """Lectures (meter_id, ts, wh) : historique brut et agrégats dans la même transaction"""
+        with self.store.transaction() as cursor:
+            insert_readings(cursor, rows)
+            update_rollups(cursor, rows)
+
+    def import_many(self, rows):
+        """Lectures historiques (meter_id, ts, wh) : une lecture déjà connue (en base ou archivée) est ignorée
+
+        Les lignes sont insérées dans l'ordre de la clé primaire. Retourne le nombre de lectures insérées.
+        """
+        fresh = []
+        with self.store.transaction() as cursor:
+            for meter_id, meter_rows in groupby(sorted(rows), key=itemgetter(0)):
+                meter_rows = list(meter_rows)
+                start, end = meter_rows[0][1], meter_rows[-1][1] + 1
+                cursor.execute("SELECT ts FROM readings WHERE meter_id = ? AND ts >= ? AND ts < ?",
+                               (meter_id, start, end))
+                known = {row[0] for row in cursor.fetchall()}
+                segments = self._segments(cursor, start, end)
+                if segments:
+                    known.update(ts for ts, _ in self.archive.readings(segments, meter_id, start, end))
+                for row in meter_rows:
+                    if row[1] not in known:
+                        known.add(row[1])
+                        fresh.append(row)
+            insert_readings(cursor, fresh)
+            update_rollups(cursor, fresh)
+        return len(fresh)
+
+    def store_late(self, rows):
+        if not rows:
+            return
+        with self.store.transaction() as cursor:
+            cursor.executemany("INSERT INTO late_readings (meter_id, ts, wh) VALUES (?, ?, ?)", rows)
+
+    def recent_timestamps(self, meter_ids, since):
+        """{meter_id: [ts, ...]} des lectures depuis `since`"""
+        meter_ids = list(meter_ids)
+        seen = {meter_id: [] for meter_id in meter_ids}
+        with self.store.read() as cursor:
+            for i in range(0, len(meter_ids), 500):
+                chunk = meter_ids[i:i + 500]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f"""
+                    SELECT meter_id, ts
+                    FROM readings
+                    WHERE meter_id IN ({placeholders}) AND ts >= ?
+                """, chunk + [since])
+                for meter_id, ts in cursor.fetchall():
+                    seen[meter_id].append(ts)
+        return seen
+
+    def range(self, meter_id, start, end, limit=1000):
+        """Lectures en base et archivées, par ordre chronologique"""
+        with self.store.read() as cursor:
+            rows = get_readings(cursor, meter_id, start, end, limit)
+            segments = self._segments(cursor, start, end)
+        return _merge_archived_range(self.archive, segments, meter_id, start, end, limit, rows)
+
+    def series(self, meter_id, granularity, start, end, limit=1000):
+        with self.store.read() as cursor:
+            rows = get_series(cursor, meter_id, granularity, start, end, limit)
+            # Les agrégats minute archivés sont recalculés depuis les lectures brutes
+            segments = self._segments(cursor, start, bucket_ceil(end, granularity)) if granularity == 'minute' else []
+        return _merge_archived_series(self.archive, segments, meter_id, granularity, start, end, limit, rows)
+
+    def total(self, meter_id, start, end):
+        with self.store.read() as cursor:
+            total, plan = sum_range(cursor, meter_id, start, end)
+            for table, lo, hi in plan:
+                segments = self._segments(cursor, lo, hi) if table in ARCHIVED_TABLES else []
+                if segments:
+                    total += self.archive.total(segments, meter_id, lo, hi)
+        return total, plan
+
+    def export(self, meter_id, start, end):
+        """Lectures (ts, wh) du compteur sur [start, end), en base et archivées, en flux mois par mois"""
+        with self.store.read() as cursor:
+            cursor.execute("SELECT MIN(bucket), MAX(bucket) FROM consumption_month WHERE meter_id = ?", (meter_id,))
+            first, last = cursor.fetchone()
+        if first is None:
+            return
+        month = max(bucket_start(max(start, 0), 'month'), first)
+        while month <= last and month < end:
+            lo, hi = max(start, month), min(end, bucket_ceil(month + 1, 'month'))
+            rows = self.store.stream("SELECT ts, wh FROM readings WHERE meter_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                                     (meter_id, lo, hi))
+            with self.store.read() as cursor:
+                segments = self._segments(cursor, lo, hi)
+            if segments:
+                rows = heapq.merge(self.archive.readings(segments, meter_id, lo, hi), rows)
+            yield from rows
+            month = bucket_ceil(month + 1, 'month')
+
+    # ------------------------- Rétention -------------------------
+    def _segments(self, cursor, start, end):
+        """Segments d'archive des mois qui chevauchent [start, end)"""
+        if self.archive is None:
+            return []
+        cursor.execute("""
+            SELECT path FROM reading_archives
+            WHERE month >= ? AND month < ?
+            ORDER BY month, id
+        """, (bucket_start(start, 'month'), end))
+        return [row[0] for row in cursor.fetchall()]
+
+    def retention_state(self, name):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT value FROM retention WHERE name = ?", (name,))
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def set_retention_state(self, name, value):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO retention (name, value) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value
+            """, (name, value))
+
+    def segment_names(self):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT path FROM reading_archives")
+            return [row[0] for row in cursor.fetchall()]
+
+    def months_with_readings(self, start, end):
+        """Débuts des mois de [start, end) qui ont des lectures (agrégats mensuels)"""
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT bucket FROM consumption_month
+                WHERE bucket >= ? AND bucket < ?
+                ORDER BY bucket
+            """, (start, end))
+            return [row[0] for row in cursor.fetchall()]
+
+    def meters_in_month(self, month):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT meter_id FROM consumption_month WHERE bucket = ? ORDER BY meter_id", (month,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def raw_range(self, meter_id, start, end):
+        """Lectures en base seulement, sans limite"""
+        with self.store.read() as cursor:
+            return get_readings(cursor, meter_id, start, end, -1)
+
+    def minute_counts(self, meter_id, start, end):
+        """(minute, lectures) des agrégats minute du compteur sur [start, end), par ordre chronologique"""
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT bucket, readings FROM consumption_minute
+                WHERE meter_id = ? AND bucket >= ? AND bucket < ?
+                ORDER BY bucket
+            """, (meter_id, start, end))
+            return cursor.fetchall()
+
+    def register_segment(self, month, path, meters, readings, wh):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO reading_archives (month, path, meters, readings, wh) VALUES (?, ?, ?, ?, ?)
+            """, (month, path, meters, readings, wh))
+
+    def delete_raw(self, spans):
+        """Supprime lectures brutes et agrégats minute des plages (meter_id, début, fin)"""
+        with self.store.transaction() as cursor:
+            for table, column in (('readings', 'ts'), ('consumption_minute', 'bucket')):
+                cursor.executemany(f"""
+                    DELETE FROM {table}
+                    WHERE meter_id = ? AND {column} >= ? AND {column} < ?
+                """, spans)
+
+    def vacuum(self, pages=0):
+        """Rend au système les pages libérées (auto_vacuum=INCREMENTAL) ; retourne les pages libres restantes"""
+        with self.store.transaction() as cursor:
+            cursor.execute("PRAGMA auto_vacuum")
+            if cursor.fetchone()[0] != 2:
+                return None
+            # execute() ne fait qu'un pas (une page) : executescript() va jusqu'au bout
+            cursor.connection.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            cursor.execute("PRAGMA freelist_count")
+            return cursor.fetchone()[0]
+
+    def checkpoint(self, journal):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT seq FROM ingest_checkpoint WHERE journal = ?", (journal,))
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def advance_checkpoint(self, journal, seq):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO ingest_checkpoint (journal, seq) VALUES (?, ?)
+                ON CONFLICT (journal) DO UPDATE SET seq = MAX(seq, excluded.seq)
+            """, (journal, seq))
+
+
+class SqliteChangeRepository:
+    """Journal des modifications (migration 7), écrit par les déclencheurs ; lu par GET /changes"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def state(self, user_id):
+        """(origine de la base, dernière séquence, dernière séquence purgée)"""
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT origin, MAX(pruned_seq, (SELECT COALESCE(MAX(seq), 0) FROM change_log)), pruned_seq
+                FROM change_log_state
+            """)
+            return cursor.fetchone()
+
+    def since(self, user_id, seq, limit):
+        """Entités de l'utilisateur modifiées après seq, une ligne chacune, par dernière modification
+
+        (dernière seq, entité, id, dernière opération, insérée après seq). Avec un seul MAX(),
+        SQLite lit les colonnes hors agrégat (op) sur la ligne de ce maximum.
+        """
+        with self.store.read() as cursor:
+            cursor.execute("""
+                SELECT MAX(seq), entity, entity_id, op, SUM(op = 'insert') > 0
+                FROM change_log
+                WHERE user_id = ? AND seq > ?
+                GROUP BY entity, entity_id
+                ORDER BY 1
+                LIMIT ?
+            """, (user_id, seq, limit))
+            return [(last, entity, entity_id, op, bool(inserted))
+                    for last, entity, entity_id, op, inserted in cursor.fetchall()]
+
+    def prune(self, before):
+        """Supprime les modifications antérieures à `before` ('AAAA-MM-JJ HH:MM:SS' UTC) ; retourne leur nombre
+
+        Les dates suivent les séquences : la plus récente à supprimer se trouve en remontant depuis la
+        fin du journal, puis la suppression est une plage de clés primaires.
+        """
+        with self.store.transaction() as cursor:
+            cursor.execute("SELECT seq FROM change_log WHERE changed_at < ? ORDER BY seq DESC LIMIT 1", (before,))
+            row = cursor.fetchone()
+            if row is None:
+                return 0
+            cursor.execute("DELETE FROM change_log WHERE seq <= ?", row)
+            deleted = cursor.rowcount
+            cursor.execute("UPDATE change_log_state SET pruned_seq = MAX(pruned_seq, ?)", row)
+            return deleted
+
+
+class SqliteRepositories:
+    """Dépôts adossés à SQLite (db.Database), lectures archivées lues dans archive.ReadingArchive
+
+    reader : gestionnaire en lecture seule pour les lectures ; writer : writer.DatabaseWriter
+    qui exécute les écritures passées à write() dans son thread.
+    """
+
+    def __init__(self, database, archive=None, reader=None, writer=None):
+        self.store = SqliteStore(database, reader)
+        self.writer = writer
+        self.users = SqliteUserRepository(self.store)
+        self.meters = SqliteMeterRepository(self.store)
+        self.invoices = SqliteInvoiceRepository(self.store)
+        self.payments = SqlitePaymentRepository(self.store)
+        self.readings = SqliteReadingRepository(self.store, archive)
+        self.changes = SqliteChangeRepository(self.store)
+
+    def transaction(self, immediate=False):
+        return self.store.transaction(immediate)
+
+    def write(self, operation, *args):
+        """Exécute operation(*args) dans le thread écrivain et retourne son résultat"""
+        if self.writer is None:
+            return operation(*args)
+        return self.writer.call(operation, *args)
+
+    def drop_indexes(self, table):
+        """Supprime les index secondaires non uniques de la table ; retourne leur définition"""
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'
+            """, (table,))
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX "{name}"')
+        return [sql for _, sql in indexes]
+
+    def create_indexes(self, definitions):
+        with self.store.transaction() as cursor:
+            for sql in definitions:
+                cursor.execute(sql)
+
+
+# -----------------------------------------------------------------------------------------------
+# Backend en mémoire (benchmarks) : mêmes méthodes, aucune persistance ni annulation
+# (à date égale, même ordre que les plans SQLite : index parcouru à l'envers pour les compteurs)
+# -----------------------------------------------------------------------------------------------
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+def _real(value):
+    # Affinité REAL des colonnes SQLite
+    return float(value) if isinstance(value, (int, float)) else value
+
+
+def _export_match(filters, values):
+    """Même sémantique que _export_where ; values : filtre -> fonction qui lit la valeur de la ligne"""
+    for name, value in filters.items():
+        if value is None:
+            continue
+        actual = values[name]()
+        if name == 'start' and not actual >= value:
+            return False
+        if name == 'end' and not actual < value:
+            return False
+        if name not in ('start', 'end') and actual != value:
+            return False
+    return True
+
+
+def _list_match(filters, values):
+    """Même sémantique que _list_where (mois inclus) ; values : filtre -> fonction qui lit la valeur de la ligne"""
+    for name, value in (filters or {}).items():
+        if value is None:
+            continue
+        actual = values[name]()
+        if name == 'month_from' and not actual >= value:
+            return False
+        if name == 'month_to' and not actual <= value:
+            return False
+        if name in ('status', 'meter_id') and actual != value:
+            return False
+    return True
+
+
+def _page_rows(rows, date, after=None, limit=None, id_descending=False):
+    """Lignes triées par date décroissante puis id (croissant, ou décroissant), après la clé (date, id) `after`"""
+    def key(row_date, row_id):
+        return row_date or '', row_id if id_descending else -row_id
+    rows = sorted(rows, key=lambda row: key(date(row), row.id), reverse=True)
+    if after is not None:
+        last = key(*after)
+        rows = [row for row in rows if key(date(row), row.id) < last]
+    return rows if limit is None else rows[:limit]
+
+
+class MemoryStore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}
+        self.meters = {}
+        self.invoices = {}
+        self.payments = {}
+        self.readings = {}                                  # (meter_id, ts) -> wh
+        self.rollups = {g: {} for g in GRANULARITIES}       # (meter_id, bucket) -> [wh, n]
+        self.late = []
+        self.checkpoints = {}
+        self.retention = {}
+        self.segments = []                                  # (month, path)
+        self.change_log = []                                # (seq, user_id, entity, entity_id, op, changed_at)
+        self.change_origin = os.urandom(8).hex()
+        self.change_pruned = 0
+        self._ids = defaultdict(int)
+
+        # Index secondaires (équivalents des index SQLite)
+        self.user_by_email = {}
+        self.meter_by_number = {}
+        self.meters_by_user = defaultdict(dict)             # user_id -> {meter_id: None}, ordre d'insertion
+        self.invoices_by_meter = defaultdict(dict)          # meter_id -> {invoice_id: None}
+        self.payments_by_invoice = defaultdict(dict)        # invoice_id -> {payment_id: None}
+
+    def next_id(self, table):
+        self._ids[table] += 1
+        return self._ids[table]
+
+    def log_change(self, user_id, entity, entity_ids, op):
+        """Équivalent des déclencheurs du journal des modifications (migration 7)"""
+        if user_id is None:
+            return
+        now = _now()
+        for entity_id in entity_ids:
+            self.change_log.append((self.next_id('change_log'), user_id, entity, entity_id, op, now))
+
+    def invoice_owner(self, invoice):
+        meter = self.meters.get(invoice.meter_id) if invoice else None
+        return meter.user_id if meter else None
+
+    def meter_payments(self, meter_id):
+        return [p for i in self.invoices_by_meter.get(meter_id, ()) for p in self.payments_by_invoice.get(i, ())]
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        with self.lock:
+            yield None
+
+
+class MemoryUserRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def _copy(self, user, with_password=False):
+        copy = replace(user)
+        if not with_password:
+            copy.password = None
+        return copy
+
+    def get(self, user_id):
+        user = self.store.users.get(user_id)
+        return self._copy(user) if user else None
+
+    def get_by_email(self, email, with_password=False):
+        user = self.store.user_by_email.get(email)
+        return self._copy(user, with_password) if user else None
+
+    def id_for_email(self, email):
+        user = self.get_by_email(email)
+        return user.id if user else None
+
+    def phone_exists(self, phone):
+        return any(user.phone == phone for user in list(self.store.users.values()))
+
+    def create(self, email, password, phone, name):
+        with self.store.lock:
+            user = User(self.store.next_id('users'), name, email, phone, _now(), password)
+            self.store.users[user.id] = user
+            self.store.user_by_email[email] = user
+        return self._copy(user)
+
+    def import_many(self, rows):
+        inserted = 0
+        with self.store.lock:
+            for email, password, phone, name in rows:
+                if email not in self.store.user_by_email:
+                    self.create(email, password, phone, name)
+                    inserted += 1
+        return inserted
+
+    def emails(self):
+        return [(user.id, user.email) for user in list(self.store.users.values())]
+
+
+class MemoryMeterRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, meter_id, user_id=None):
+        meter = self.store.meters.get(meter_id)
+        if meter is None or (user_id is not None and meter.user_id != user_id):
+            return None
+        return replace(meter)
+
+    def get_by_number(self, meter_number):
+        meter = self.store.meter_by_number.get(meter_number)
+        return replace(meter) if meter else None
+
+    def owned_by_email(self, meter_id, email):
+        meter = self.store.meters.get(meter_id)
+        user = self.store.users.get(meter.user_id) if meter else None
+        return user is not None and user.email == email
+
+    def list_for_user(self, user_id, filters=None, after=None, limit=None):
+        meters = [replace(self.store.meters[m]) for m in list(self.store.meters_by_user.get(user_id, ()))]
+        meters = [m for m in meters if _list_match(filters, {'status': lambda: m.status})]
+        return _page_rows(meters, lambda m: m.created_at, after, limit, id_descending=True)
+
+    def count_for_user(self, user_id, filters=None, cap=10000):
+        return len(self.list_for_user(user_id, filters))
+
+    def get_many(self, user_id, meter_ids):
+        return [meter for meter in (self.get(meter_id, user_id) for meter_id in meter_ids) if meter]
+
+    def numbers_for_email(self, email):
+        user = self.store.user_by_email.get(email)
+        if user is None:
+            return []
+        return [self.store.meters[m].meter_number for m in list(self.store.meters_by_user.get(user.id, ()))]
+
+    def all_with_thresholds(self):
+        invoices = MemoryInvoiceRepository(self.store)
+        return [(replace(m), invoices.latest_paid_kwh(m.id)) for m in list(self.store.meters.values())]
+
+    def create(self, user_id, meter_number, meter_name):
+        with self.store.lock:
+            now = _now()
+            meter = Meter(self.store.next_id('meters'), user_id, meter_number, meter_name, 'active', 0.0, now, now)
+            self.store.meters[meter.id] = meter
+            self.store.meter_by_number[meter_number] = meter
+            self.store.meters_by_user[user_id][meter.id] = None
+            self.store.log_change(user_id, 'meter', [meter.id], 'insert')
+        return replace(meter)
+
+    def import_many(self, rows):
+        inserted = 0
+        with self.store.lock:
+            for email, meter_number, meter_name, status in rows:
+                user = self.store.user_by_email.get(email)
+                if user is None or meter_number in self.store.meter_by_number:
+                    continue
+                meter = self.create(user.id, meter_number, meter_name)
+                self.store.meters[meter.id].status = status
+                inserted += 1
+        return inserted
+
+    def export_ids(self, filters, after=0):
+        user = self.store.user_by_email.get(filters['email']) if filters.get('email') is not None else None
+        for meter_id in sorted(self.store.meters):
+            meter = self.store.meters.get(meter_id)
+            if meter is None or meter_id <= after:
+                continue
+            if filters.get('email') is not None and (user is None or meter.user_id != user.id):
+                continue
+            if filters.get('meter_number') is not None and meter.meter_number != filters['meter_number']:
+                continue
+            yield meter.id, meter.meter_number
+
+    def ids_for_numbers(self, meter_numbers):
+        ids = {}
+        for meter_number in meter_numbers:
+            meter = self.store.meter_by_number.get(meter_number)
+            if meter is not None:
+                ids[meter_number] = meter.id
+        return ids
+
+    def update(self, meter_id, changes):
+        with self.store.lock:
+            meter = self.store.meters.get(meter_id)
+            if meter is None:
+                return None
+            for name, value in changes.items():
+                setattr(meter, name, value)
+            meter.updated_at = _now()
+            # Même ordre que les déclencheurs SQLite (le dernier créé s'exécute en premier)
+            if 'meter_name' in changes or 'meter_number' in changes:
+                self.store.log_change(meter.user_id, 'payment', self.store.meter_payments(meter_id), 'update')
+                self.store.log_change(meter.user_id, 'invoice', self.store.invoices_by_meter.get(meter_id, ()),
+                                      'update')
+            self.store.log_change(meter.user_id, 'meter', [meter_id], 'update')
+        return replace(meter)
+
+    def delete(self, meter_id):
+        with self.store.lock:
+            meter = self.store.meters.pop(meter_id, None)
+            if meter is not None:
+                self.store.meter_by_number.pop(meter.meter_number, None)
+                self.store.meters_by_user[meter.user_id].pop(meter_id, None)
+                # Factures et paiements du compteur disparaissent des listes (jointures)
+                self.store.log_change(meter.user_id, 'meter', [meter_id], 'delete')
+                self.store.log_change(meter.user_id, 'invoice', self.store.invoices_by_meter.get(meter_id, ()),
+                                      'delete')
+                self.store.log_change(meter.user_id, 'payment', self.store.meter_payments(meter_id), 'delete')
+
+    def add_cumulative(self, totals):
+        cumulatives = {}
+        with self.store.lock:
+            now = _now()
+            for meter_number, delta in totals.items():
+                meter = self.store.meter_by_number.get(meter_number)
+                if meter is not None:
+                    meter.cumulative_consumption += delta
+                    meter.updated_at = now
+                    cumulatives[meter_number] = meter.cumulative_consumption
+        return cumulatives
+
+    def reset_cumulative(self, meter_number):
+        with self.store.lock:
+            meter = self.store.meter_by_number.get(meter_number)
+            if meter is not None:
+                meter.cumulative_consumption = 0.0
+
+
+class MemoryInvoiceRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def _joined(self, invoice):
+        meter = self.store.meters.get(invoice.meter_id)
+        if meter is None:
+            return None
+        return replace(invoice, meter_number=meter.meter_number, meter_name=meter.meter_name)
+
+    def _user_id(self, email):
+        user = self.store.user_by_email.get(email)
+        return user.id if user else None
+
+    def get(self, invoice_id, email=None):
+        invoice = self.store.invoices.get(invoice_id)
+        joined = self._joined(invoice) if invoice else None
+        if joined is None or email is None:
+            return joined
+        meter = self.store.meters[invoice.meter_id]
+        return joined if meter.user_id == self._user_id(email) else None
+
+    def _of_meter(self, meter_id):
+        return [self.store.invoices[i] for i in list(self.store.invoices_by_meter.get(meter_id, ()))]
+
+    def _matches(self, invoice, filters):
+        return _list_match(filters, {'status': lambda: invoice.status, 'month_from': lambda: invoice.month,
+                                     'month_to': lambda: invoice.month, 'meter_id': lambda: invoice.meter_id})
+
+    def list_for_user(self, user_id, filters=None, after=None, limit=None):
+        invoices = [self._joined(i) for m in list(self.store.meters_by_user.get(user_id, ()))
+                    for i in self._of_meter(m) if self._matches(i, filters)]
+        return _page_rows(invoices, lambda i: i.issued_at, after, limit)
+
+    def count_for_user(self, user_id, filters=None, cap=10000):
+        return len(self.list_for_user(user_id, filters))
+
+    def get_many(self, user_id, invoice_ids):
+        invoices = [self.store.invoices.get(invoice_id) for invoice_id in invoice_ids]
+        joined = [self._joined(i) for i in invoices if i and self.store.invoice_owner(i) == user_id]
+        return [i for i in joined if i]
+
+    def export(self, filters, after=0):
+        for invoice_id in sorted(self.store.invoices):
+            invoice = self.store.invoices.get(invoice_id)
+            joined = self._joined(invoice) if invoice and invoice_id > after else None
+            if joined is not None and _export_match(filters, {
+                    'email': lambda: self.store.users[self.store.meters[invoice.meter_id].user_id].email,
+                    'meter_number': lambda: joined.meter_number, 'month': lambda: joined.month,
+                    'status': lambda: joined.status, 'start': lambda: joined.issued_at,
+                    'end': lambda: joined.issued_at}):
+                yield joined
+
+    def list_for_meter(self, meter_id, filters=None, after=None, limit=None):
+        invoices = [replace(i) for i in self._of_meter(meter_id) if self._matches(i, filters)]
+        return _page_rows(invoices, lambda i: i.issued_at, after, limit)
+
+    def count_for_meter(self, meter_id, filters=None, cap=10000):
+        return len(self.list_for_meter(meter_id, filters))
+
+    def exists_for_month(self, meter_id, month, exclude_id=None):
+        return any(i.month == month and i.id != exclude_id for i in self._of_meter(meter_id))
+
+    def latest_paid_kwh(self, meter_id):
+        paid = [i for i in self._of_meter(meter_id) if i.status == 'paid']
+        return max(paid, key=lambda i: (i.issued_at, i.id)).kwh if paid else None
+
+    def create(self, meter_id, month, amount, status, kwh):
+        with self.store.lock:
+            invoice = Invoice(self.store.next_id('invoices'), meter_id, month, _real(amount), status, kwh, _now())
+            self.store.invoices[invoice.id] = invoice
+            self.store.invoices_by_meter[meter_id][invoice.id] = None
+            self.store.log_change(self.store.invoice_owner(invoice), 'invoice', [invoice.id], 'insert')
+        return self._joined(invoice)
+
+    def update(self, invoice_id, changes):
+        with self.store.lock:
+            invoice = self.store.invoices.get(invoice_id)
+            if invoice is None:
+                return None
+            for name, value in changes.items():
+                setattr(invoice, name, _real(value) if name == 'amount' else value)
+            owner = self.store.invoice_owner(invoice)
+            if changes.keys() & {'month', 'amount', 'status'}:
+                self.store.log_change(owner, 'payment', self.store.payments_by_invoice.get(invoice_id, ()), 'update')
+            self.store.log_change(owner, 'invoice', [invoice_id], 'update')
+        return self._joined(invoice)
+
+    def mark_paid(self, invoice_id):
+        self.update(invoice_id, {'status': 'paid'})
+
+    def delete(self, invoice_id):
+        with self.store.lock:
+            invoice = self.store.invoices.pop(invoice_id, None)
+            if invoice is not None:
+                self.store.invoices_by_meter[invoice.meter_id].pop(invoice_id, None)
+                owner = self.store.invoice_owner(invoice)
+                self.store.log_change(owner, 'invoice', [invoice_id], 'delete')
+                self.store.log_change(owner, 'payment', self.store.payments_by_invoice.get(invoice_id, ()), 'delete')
+
+
+class MemoryPaymentRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def _joined(self, payment):
+        invoice = self.store.invoices.get(payment.invoice_id)
+        meter = self.store.meters.get(invoice.meter_id) if invoice else None
+        if meter is None:
+            return None
+        return replace(payment, invoice_amount=invoice.amount, invoice_month=invoice.month,
+                       invoice_status=invoice.status, meter_number=meter.meter_number, meter_name=meter.meter_name)
+
+    def _owner(self, payment):
+        invoice = self.store.invoices[payment.invoice_id]
+        user = self.store.users.get(self.store.meters[invoice.meter_id].user_id)
+        return user.email if user else None
+
+    def get(self, payment_id, email=None):
+        payment = self.store.payments.get(payment_id)
+        joined = self._joined(payment) if payment else None
+        if joined is None or email is None:
+            return joined
+        return joined if self._owner(payment) == email else None
+
+    def _of_invoice(self, invoice_id):
+        return [self.store.payments[p] for p in list(self.store.payments_by_invoice.get(invoice_id, ()))]
+
+    def _matches(self, payment, filters):
+        # Mois de paiement (AAAA-MM de paid_at), comme le filtre SQL
+        return _list_match(filters, {'status': lambda: payment.status, 'month_from': lambda: payment.paid_at[:7],
+                                     'month_to': lambda: payment.paid_at[:7],
+                                     'meter_id': lambda: self.store.invoices[payment.invoice_id].meter_id})
+
+    def list_for_user(self, email, filters=None, after=None, limit=None):
+        user = self.store.user_by_email.get(email)
+        if user is None:
+            return []
+        payments = [self._joined(p)
+                    for m in list(self.store.meters_by_user.get(user.id, ()))
+                    for i in list(self.store.invoices_by_meter.get(m, ()))
+                    for p in self._of_invoice(i) if self._matches(p, filters)]
+        return _page_rows([p for p in payments if p], lambda p: p.paid_at, after, limit)
+
+    def count_for_user(self, email, filters=None, cap=10000):
+        return len(self.list_for_user(email, filters))
+
+    def get_many(self, user_id, payment_ids):
+        payments = [self.store.payments.get(payment_id) for payment_id in payment_ids]
+        joined = [self._joined(p) for p in payments
+                  if p and self.store.invoice_owner(self.store.invoices.get(p.invoice_id)) == user_id]
+        return [p for p in joined if p]
+
+    def export(self, filters, after=0):
+        for payment_id in sorted(self.store.payments):
+            payment = self.store.payments.get(payment_id)
+            joined = self._joined(payment) if payment and payment_id > after else None
+            if joined is not None and _export_match(filters, {
+                    'email': lambda: self._owner(payment), 'meter_number': lambda: joined.meter_number,
+                    'month': lambda: joined.invoice_month, 'status': lambda: joined.status,
+                    'start': lambda: joined.paid_at, 'end': lambda: joined.paid_at}):
+                yield joined
+
+    def list_for_invoice(self, invoice_id, filters=None, after=None, limit=None):
+        payments = [self._joined(p) for p in self._of_invoice(invoice_id) if self._matches(p, filters)]
+        return _page_rows([p for p in payments if p], lambda p: p.paid_at, after, limit)
+
+    def count_for_invoice(self, invoice_id, filters=None, cap=10000):
+        return len(self.list_for_invoice(invoice_id, filters))
+
+    def transaction_exists(self, transaction_id):
+        return any(p.transaction_id == transaction_id for p in list(self.store.payments.values()))
+
+    def create(self, invoice_id, amount, payment_method, transaction_id):
+        with self.store.lock:
+            payment = Payment(self.store.next_id('payments'), invoice_id, _real(amount), payment_method,
+                              transaction_id, 'completed', _now())
+            self.store.payments[payment.id] = payment
+            self.store.payments_by_invoice[invoice_id][payment.id] = None
+            self.store.log_change(self.store.invoice_owner(self.store.invoices.get(invoice_id)), 'payment',
+                                  [payment.id], 'insert')
+        return payment.id
+
+
+class MemoryReadingRepository:
+    def __init__(self, store, archive=None):
+        self.store = store
+        self.archive = archive
+
+    def insert(self, rows):
+        with self.store.lock:
+            readings = self.store.readings
+            for meter_id, ts, wh in rows:
+                readings[(meter_id, ts)] = readings.get((meter_id, ts), 0) + wh
+                for granularity in GRANULARITIES:
+                    bucket = self.store.rollups[granularity].setdefault(
+                        (meter_id, bucket_start(ts, granularity)), [0, 0])
+                    bucket[0] += wh
+                    bucket[1] += 1
+
+    def import_many(self, rows):
+        fresh = []
+        with self.store.lock:
+            for meter_id, meter_rows in groupby(sorted(rows), key=itemgetter(0)):
+                meter_rows = list(meter_rows)
+                start, end = meter_rows[0][1], meter_rows[-1][1] + 1
+                segments = self._segments(start, end)
+                known = {ts for ts, _ in self.archive.readings(segments, meter_id, start, end)} if segments else set()
+                for row in meter_rows:
+                    if row[1] not in known and (meter_id, row[1]) not in self.store.readings:
+                        known.add(row[1])
+                        fresh.append(row)
+            self.insert(fresh)
+        return len(fresh)
+
+    def store_late(self, rows):
+        with self.store.lock:
+            self.store.late.extend(rows)
+
+    def recent_timestamps(self, meter_ids, since):
+        meter_ids = set(meter_ids)
+        seen = {meter_id: [] for meter_id in meter_ids}
+        for meter_id, ts in list(self.store.readings):
+            if meter_id in meter_ids and ts >= since:
+                seen[meter_id].append(ts)
+        return seen
+
+    def raw_range(self, meter_id, start, end):
+        return sorted((ts, wh) for (m, ts), wh in list(self.store.readings.items())
+                      if m == meter_id and start <= ts < end)
+
+    def minute_counts(self, meter_id, start, end):
+        return sorted((bucket, n) for (m, bucket), (wh, n) in list(self.store.rollups['minute'].items())
+                      if m == meter_id and start <= bucket < end)
+
+    def range(self, meter_id, start, end, limit=1000):
+        rows = self.raw_range(meter_id, start, end)[:limit]
+        return _merge_archived_range(self.archive, self._segments(start, end), meter_id, start, end, limit, rows)
+
+    def series(self, meter_id, granularity, start, end, limit=1000):
+        first = bucket_start(start, granularity)
+        rows = sorted((bucket, wh, n) for (m, bucket), (wh, n) in list(self.store.rollups[granularity].items())
+                      if m == meter_id and first <= bucket < end)[:limit]
+        segments = self._segments(start, bucket_ceil(end, granularity)) if granularity == 'minute' else []
+        return _merge_archived_series(self.archive, segments, meter_id, granularity, start, end, limit, rows)
+
+    def total(self, meter_id, start, end):
+        total = sum(wh for ts, wh in self.raw_range(meter_id, start, end))
+        segments = self._segments(start, end)
+        if segments:
+            total += self.archive.total(segments, meter_id, start, end)
+        return total, [('readings', start, end)]
+
+    def export(self, meter_id, start, end):
+        return iter(self.range(meter_id, start, end, None))
+
+    def _segments(self, start, end):
+        if self.archive is None:
+            return []
+        first = bucket_start(start, 'month')
+        return [path for month, path in list(self.store.segments) if first <= month < end]
+
+    def retention_state(self, name):
+        return self.store.retention.get(name, 0)
+
+    def set_retention_state(self, name, value):
+        self.store.retention[name] = value
+
+    def segment_names(self):
+        return [path for _, path in list(self.store.segments)]
+
+    def months_with_readings(self, start, end):
+        return sorted({bucket for (_, bucket) in list(self.store.rollups['month']) if start <= bucket < end})
+
+    def meters_in_month(self, month):
+        return sorted(m for (m, bucket) in list(self.store.rollups['month']) if bucket == month)
+
+    def register_segment(self, month, path, meters, readings, wh):
+        with self.store.lock:
+            self.store.segments.append((month, path))
+
+    def delete_raw(self, spans):
+        ranges = {}
+        for meter_id, start, end in spans:
+            ranges.setdefault(meter_id, []).append((start, end))
+        with self.store.lock:
+            for table in (self.store.readings, self.store.rollups['minute']):
+                for key in [k for k in table if any(start <= k[1] < end for start, end in ranges.get(k[0], ()))]:
+                    del table[key]
+
+    def vacuum(self, pages=0):
+        return None
+
+    def checkpoint(self, journal):
+        return self.store.checkpoints.get(journal, 0)
+
+    def advance_checkpoint(self, journal, seq):
+        with self.store.lock:
+            self.store.checkpoints[journal] = max(self.store.checkpoints.get(journal, 0), seq)
+
+
+class MemoryChangeRepository:
+    def __init__(self, store):
+        self.store = store
+
+    def state(self, user_id):
+        log = self.store.change_log
+        latest = log[-1][0] if log else 0
+        return self.store.change_origin, max(self.store.change_pruned, latest), self.store.change_pruned
+
+    def since(self, user_id, seq, limit):
+        log = list(self.store.change_log)
+        latest = {}
+        for last, row_user, entity, entity_id, op, _ in log[bisect.bisect_right(log, (seq, float('inf'))):]:
+            if row_user == user_id:
+                previous = latest.pop((entity, entity_id), None)
+                inserted = op == 'insert' or (previous is not None and previous[4])
+                latest[(entity, entity_id)] = (last, entity, entity_id, op, inserted)
+        return list(latest.values())[:limit]
+
+    def prune(self, before):
+        with self.store.lock:
+            log = self.store.change_log
+            count = 0
+            while count < len(log) and log[count][5] < before:
+                count += 1
+            if count:
+                self.store.change_pruned = max(self.store.change_pruned, log[count - 1][0])
+                del log[:count]
+        return count
+
+
+class MemoryRepositories:
+    """Dépôts en mémoire, interchangeables avec SqliteRepositories"""
+
+    def __init__(self, archive=None):
+        self.store = MemoryStore()
+        self.users = MemoryUserRepository(self.store)
+        self.meters = MemoryMeterRepository(self.store)
+        self.invoices = MemoryInvoiceRepository(self.store)
+        self.payments = MemoryPaymentRepository(self.store)
+        self.readings = MemoryReadingRepository(self.store, archive)
+        self.changes = MemoryChangeRepository(self.store)
+
+    def transaction(self, immediate=False):
+        return self.store.transaction(immediate)
+
+    def write(self, operation, *args):
+        return operation(*args)
+
+    def drop_indexes(self, table):
+        return []
+
+    def create_indexes(self, definitions):
+        pass
@@ -0,0 +1,206 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+from timeseries import bucket_start, bucket_ceil
+
+
+# -----------------------------------------------------------------------------------------------
+# Rétention des lectures brutes : au-delà de `raw_days`, seuls les agrégats heure/jour/mois restent
+# en base ; lectures brutes et agrégats minute passent, mois par mois, dans l'archive compressée.
+#   1. 'horizon' : l'ingestion n'insère plus de lecture brute avant cette date (lectures tardives)
+#   2. par lot d'au plus `chunk_rows` lectures (plages (compteur, ts) découpées à la minute) : écrire
+#      un segment, puis dans une transaction l'enregistrer et supprimer les lignes correspondantes
+#      (une lecture est soit en base, soit archivée)
+#   3. 'archived_before' avance d'un mois ; PRAGMA incremental_vacuum rend les pages libérées
+# Les écritures passent par repositories.write() (thread écrivain) ; lectures et segments restent ici.
+# -----------------------------------------------------------------------------------------------
+HORIZON = 'horizon'
+ARCHIVED_BEFORE = 'archived_before'
+
+
+def retention_cutoff(raw_days, now=None):
+    """Début du mois le plus ancien à garder en base (on n'archive que des mois entiers)"""
+    now = int(now if now is not None else time.time())
+    return bucket_start(now - raw_days * 86400, 'month')
+
+
+def _commit_chunk(repositories, month, spans, name, meters, count, wh):
+    """Enregistre le segment et supprime les lignes archivées dans la même transaction"""
+    with repositories.transaction():
+        if name:
+            repositories.readings.register_segment(month, name, meters, count, wh)
+        repositories.readings.delete_raw(spans)
+
+
+def _chunks(readings, meter_ids, month, month_end, chunk_rows, chunk_meters):
+    """Lots de plages (meter_id, début, fin) d'au plus chunk_rows lectures et chunk_meters compteurs
+
+    Les lectures sont comptées sur les agrégats minute et les plages coupées à la minute : une minute
+    n'est jamais à moitié archivée, les agrégats minute restants ne recoupent pas l'archive.
+    """
+    chunk = []
+    rows = 0
+    for meter_id in meter_ids:
+        start = month
+        for bucket, count in readings.minute_counts(meter_id, month, month_end):
+            if rows and rows + count > chunk_rows:
+                if bucket > start:
+                    chunk.append((meter_id, start, bucket))
+                    start = bucket
+                yield chunk
+                chunk = []
+                rows = 0
+            rows += count
+        chunk.append((meter_id, start, month_end))
+        if len(chunk) >= chunk_meters:
+            yield chunk
+            chunk = []
+            rows = 0
+    if chunk:
+        yield chunk
+
+
+def run_retention(repositories, archive, raw_days, now=None, chunk_meters=100, chunk_rows=50000,
+                  vacuum_pages=0):
+    """Archive les mois antérieurs à la date limite ; retourne les métriques de la passe"""
+    readings = repositories.readings
+    cutoff = retention_cutoff(raw_days, now)
+    started = time.perf_counter()
+    stats = {'cutoff': cutoff, 'months': 0, 'segments': 0, 'readings': 0, 'free_pages': None}
+
+    # 1. Geler les mois à archiver : les lectures plus anciennes vont désormais dans late_readings
+    if readings.retention_state(HORIZON) < cutoff:
+        repositories.write(readings.set_retention_state, HORIZON, cutoff)
+
+    # Segments écrits par une passe interrompue avant son commit
+    archive.remove_orphans(readings.segment_names())
+
+    # 2. Mois par mois, par lots bornés en lectures : une opération d'écriture courte, une plage en mémoire à la fois
+    for month in readings.months_with_readings(readings.retention_state(ARCHIVED_BEFORE), cutoff):
+        month_end = bucket_ceil(month + 1, 'month')
+        meter_ids = readings.meters_in_month(month)
+        for spans in _chunks(readings, meter_ids, month, month_end, chunk_rows, chunk_meters):
+            blocks = ((meter_id, readings.raw_range(meter_id, start, end)) for meter_id, start, end in spans)
+            name, meters, count, wh = archive.write_segment(month, blocks)
+            repositories.write(_commit_chunk, repositories, month, spans, name, meters, count, wh)
+            if name:
+                stats['segments'] += 1
+                stats['readings'] += count
+
+        repositories.write(readings.set_retention_state, ARCHIVED_BEFORE, month_end)
+        stats['months'] += 1
+        print(f"[RETENTION] Mois {time.strftime('%Y-%m', time.gmtime(month))} archivé ({len(meter_ids)} compteurs)")
+
+        # 3. Rendre les pages libérées au fil de l'eau (base en auto_vacuum=INCREMENTAL)
+        stats['free_pages'] = repositories.write(readings.vacuum, vacuum_pages)
+
+    if readings.retention_state(ARCHIVED_BEFORE) < cutoff:
+        repositories.write(readings.set_retention_state, ARCHIVED_BEFORE, cutoff)
+    stats['duration_s'] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+def prune_change_log(repositories, days, now=None):
+    """Supprime du journal des modifications (GET /changes) ce qui a plus de `days` jours
+
+    Retourne le nombre de lignes supprimées ; les curseurs plus anciens reçoivent reset.
+    """
+    now = int(now if now is not None else time.time())
+    before = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - days * 86400))
+    return repositories.write(repositories.changes.prune, before)
+
+
+class RetentionJob:
+    """Passe de rétention périodique dans un thread"""
+
+    def __init__(self, repositories, archive, raw_days, interval_s=3600, chunk_meters=100, chunk_rows=50000,
+                 vacuum_pages=0, change_log_days=0):
+        self.repositories = repositories
+        self.archive = archive
+        self.raw_days = raw_days
+        self.interval_s = interval_s
+        self.chunk_meters = chunk_meters
+        self.chunk_rows = chunk_rows
+        self.vacuum_pages = vacuum_pages
+        self.change_log_days = change_log_days     # 0 : journal des modifications jamais purgé
+        # Tenu pendant une passe ; un import de lectures historiques le prend aussi (bulk_import.py)
+        self.lock = threading.Lock()
+
+        # Métriques
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None
+
+    def run_once(self):
+        with self.lock:
+            self.last_run = run_retention(self.repositories, self.archive, self.raw_days,
+                                          chunk_meters=self.chunk_meters, chunk_rows=self.chunk_rows,
+                                          vacuum_pages=self.vacuum_pages)
+            if self.change_log_days > 0:
+                self.last_run['changes_pruned'] = prune_change_log(self.repositories, self.change_log_days)
+        self.runs += 1
+        return self.last_run
+
+    def start(self):
+        def loop():
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[RETENTION ERROR] Erreur rétention: {e}")
+                time.sleep(self.interval_s)
+
+        threading.Thread(target=loop, name="retention", daemon=True).start()
+
+    def stats(self):
+        return {
+            'raw_days': self.raw_days,
+            'change_log_days': self.change_log_days,
+            'interval_s': self.interval_s,
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run': self.last_run,
+            'archive': self.archive.stats(),
+        }
+
+
+if __name__ == '__main__':
+    # Passe de rétention hors du serveur
+    #   python retention.py [--db chemin.db] [--archive répertoire] [--days 35]
+    #   python retention.py --enable-incremental-vacuum   (base existante : VACUUM complet, serveur arrêté)
+    from archive import ReadingArchive
+    from db import Database
+    from migrations import migrate
+    from repository import SqliteRepositories
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', os.path.join(here, 'gridpay.db')))
+    parser.add_argument('--archive', default=os.environ.get('ARCHIVE_DIR', os.path.join(here, 'archive')))
+    parser.add_argument('--days', type=int, default=int(os.environ.get('RETENTION_RAW_DAYS', 35)))
+    parser.add_argument('--chunk-meters', type=int, default=100)
+    parser.add_argument('--chunk-rows', type=int, default=50000)
+    parser.add_argument('--enable-incremental-vacuum', action='store_true')
+    args = parser.parse_args()
+
+    database = Database(args.db)
+    conn = database.connect()
+    migrate(conn)
+    if args.enable_incremental_vacuum:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"[DB] auto_vacuum = {conn.execute('PRAGMA auto_vacuum').fetchone()[0]} (2 = INCREMENTAL)")
+        conn.close()
+        sys.exit(0)
+    conn.close()
+
+    reading_archive = ReadingArchive(args.archive)
+    result = run_retention(SqliteRepositories(database, reading_archive), reading_archive, args.days,
+                           chunk_meters=args.chunk_meters, chunk_rows=args.chunk_rows)
+    if result['free_pages'] is None and result['months']:
+        print("[RETENTION] Base sans auto_vacuum=INCREMENTAL : lancer --enable-incremental-vacuum pour rendre l'espace")
+    print(f"[RETENTION] {result}")
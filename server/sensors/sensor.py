@@ -12,10 +12,17 @@ METER_NUMBER = "CNT-452-999"
 # === Topics MQTT ===
 TOPIC_CONSUMPTION = f"electricity/{METER_NUMBER}/consumption"
 TOPIC_RELAY = f"electricity/{METER_NUMBER}/relay"
+TOPIC_RELAY_STATE = f"electricity/{METER_NUMBER}/relay/state"  # acquittement (état réel du relais)
 
 # === relais (par default OFF) ===
 relay_state = True
 
+# === Publie l'état du relais (retenu : le serveur le reçoit aussi à la reconnexion) ===
+def publish_relay_state(client):
+    state = "ON" if relay_state else "OFF"
+    client.publish(TOPIC_RELAY_STATE, json.dumps({"state": state}), qos=1, retain=True)
+    print(f"[RELAY] État {state} acquitté")
+
 # === Callback : (command ON/OFF) ===
 def on_message(client, userdata, msg):
     global relay_state
@@ -31,6 +38,8 @@ def on_message(client, userdata, msg):
             print("[RELAY] Power OFF -> Arrêt de l’envoi des données")
         else:
             print(f"[RELAY] Commande inconnue : {data}")
+            return
+        publish_relay_state(client)
     except Exception as e:
         print(f"[ERROR] Impossible de décoder le message: {payload}, Erreur: {e}")
 
@@ -41,7 +50,8 @@ client.on_message = on_message
 print("[INFO] Connexion au broker MQTT...")
 client.connect(BROKER, PORT)
 client.loop_start()
-client.subscribe(TOPIC_RELAY)
+client.subscribe(TOPIC_RELAY, qos=1)
+publish_relay_state(client)
 
 print("[INFO] Sensor simulator started...")
 print("[INFO] Relais par défaut = OFF (aucune donnée envoyée tant que ON n’est pas reçu)")
@@ -1,27 +1,273 @@
 import json
-import sqlite3
+import math
 import paho.mqtt.client as mqtt
-from flask import Flask, request, jsonify
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask import Flask, request, jsonify, Response, stream_with_context
+from flask_jwt_extended import JWTManager, create_access_token, decode_token, jwt_required, get_jwt_identity
 from flask_bcrypt import Bcrypt
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone
 import re
 import threading
 import time
+import os
+import shutil
+import tempfile
+from ingest import IngestPipeline, meter_partition
+from meter_registry import MeterRegistry
+from journal import IngestJournal, read_journal
+from dedupe import ReadingDeduplicator, ACCEPTED, LATE
+from relay import RelayDispatcher, RelayState
+from db import Database
+from writer import DatabaseWriter
+from migrations import migrate
+from repository import SqliteRepositories, MemoryRepositories, Invoice, Payment
+from shards import ShardedRepositories, ShardDirectory, shard_path, directory_path
+from archive import ReadingArchive
+from recent import RecentReadings
+from retention import RetentionJob, HORIZON
+from bulk_import import BulkImporter, ImportJob, KINDS as IMPORT_KINDS, FORMATS as IMPORT_FORMATS, detect_format
+from pagination import Page
+from versions import ChangeVersions, meters_key, billing_key, meter_key
+from changes import ChangeFeed
+from live import LiveBroadcaster
+from export import DATASETS as EXPORT_DATASETS, FORMATS as EXPORT_FORMATS, COLUMNS as EXPORT_COLUMNS, CONTENT_TYPES as EXPORT_CONTENT_TYPES, export_rows, encode, gzip_chunks, parse_after, sql_timestamp
+from timeseries import GRANULARITIES, bucket_ceil, parse_timestamp, read_timestamp, kwh_to_wh
 
 app = Flask(__name__)
 app.config['JWT_SECRET_KEY'] = 'ton_secret_key_très_long_et_complexe_en_production'
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=1)
 
+# Ingestion MQTT : taille des lots, intervalle d'écriture et capacité de la file
+app.config['INGEST_BATCH_SIZE'] = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+app.config['INGEST_FLUSH_INTERVAL_MS'] = int(os.environ.get('INGEST_FLUSH_INTERVAL_MS', 200))
+app.config['INGEST_MAX_QUEUE'] = int(os.environ.get('INGEST_MAX_QUEUE', 50000))
+# Lot en échec : nouveaux essais, délai initial doublé à chaque essai jusqu'au plafond
+app.config['INGEST_MAX_RETRIES'] = int(os.environ.get('INGEST_MAX_RETRIES', 5))
+app.config['INGEST_RETRY_BACKOFF_MS'] = int(os.environ.get('INGEST_RETRY_BACKOFF_MS', 100))
+app.config['INGEST_RETRY_BACKOFF_MAX_MS'] = int(os.environ.get('INGEST_RETRY_BACKOFF_MAX_MS', 5000))
+# Lecture maximale acceptée (kWh par message) et fichier JSONL des lectures qu'aucune écriture n'accepte
+app.config['INGEST_MAX_KWH'] = float(os.environ.get('INGEST_MAX_KWH', 1000))
+app.config['INGEST_QUARANTINE_PATH'] = os.environ.get('INGEST_QUARANTINE_PATH', 'ingest.quarantine.jsonl')
+
+# Journal d'ingestion : chemin et intervalle de fsync groupé
+app.config['INGEST_JOURNAL_PATH'] = os.environ.get('INGEST_JOURNAL_PATH', 'ingest.journal')
+app.config['INGEST_JOURNAL_FSYNC_MS'] = int(os.environ.get('INGEST_JOURNAL_FSYNC_MS', 50))
+
+# Dédoublonnage : fenêtre par compteur (= retard maximal accepté) et sort des lectures trop tardives
+app.config['INGEST_DEDUPE_WINDOW_S'] = int(os.environ.get('INGEST_DEDUPE_WINDOW_S', 900))
+app.config['INGEST_LATE_POLICY'] = os.environ.get('INGEST_LATE_POLICY', 'store')  # 'store' ou 'reject'
+# Avance maximale d'un timestamp sur l'horloge du serveur (dérive des capteurs) ; au-delà, lecture refusée
+app.config['INGEST_MAX_CLOCK_SKEW_S'] = int(os.environ.get('INGEST_MAX_CLOCK_SKEW_S', 300))
+
+# Mode d'ingestion : 'inline' (dans ce processus), 'workers' (API seule, ingestion par ingest_workers.py)
+# ou 'worker' (un des processus lancés par ingest_workers.py)
+app.config['INGEST_MODE'] = os.environ.get('INGEST_MODE', 'inline')
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', 1))
+app.config['INGEST_WORKER_INDEX'] = int(os.environ.get('INGEST_WORKER_INDEX', 0))
+app.config['INGEST_PARTITION'] = os.environ.get('INGEST_PARTITION', 'hash')  # 'hash' ou 'shared'
+app.config['REGISTRY_REFRESH_S'] = int(os.environ.get('REGISTRY_REFRESH_S', 5))
+if app.config['INGEST_MODE'] == 'worker':
+    app.config['INGEST_JOURNAL_PATH'] += f".{app.config['INGEST_WORKER_INDEX']}"
+    app.config['INGEST_QUARANTINE_PATH'] += f".{app.config['INGEST_WORKER_INDEX']}"
+
+# Commandes de relais : délai d'acquittement, relances, puis nouvel essai après un échec
+app.config['RELAY_ACK_TIMEOUT_S'] = int(os.environ.get('RELAY_ACK_TIMEOUT_S', 10))
+app.config['RELAY_MAX_RETRIES'] = int(os.environ.get('RELAY_MAX_RETRIES', 3))
+app.config['RELAY_RESEND_AFTER_S'] = int(os.environ.get('RELAY_RESEND_AFTER_S', 60))
+
+# Flux SSE (live.py) : port du serveur asyncio (0 = désactivé), battement de cœur, file par client,
+# connexions simultanées, part du seuil qui déclenche l'alerte 'warning', durée des tickets ?ticket=.
+# Le port parle HTTP en clair : en production il n'est joignable que derrière un proxy TLS
+app.config['LIVE_PORT'] = int(os.environ.get('LIVE_PORT', 5001))
+app.config['LIVE_HEARTBEAT_S'] = int(os.environ.get('LIVE_HEARTBEAT_S', 15))
+app.config['LIVE_QUEUE_SIZE'] = int(os.environ.get('LIVE_QUEUE_SIZE', 256))
+app.config['LIVE_MAX_CLIENTS'] = int(os.environ.get('LIVE_MAX_CLIENTS', 10000))
+app.config['LIVE_WARNING_RATIO'] = float(os.environ.get('LIVE_WARNING_RATIO', 0.9))
+app.config['LIVE_TICKET_TTL_S'] = int(os.environ.get('LIVE_TICKET_TTL_S', 60))
+
+# Base SQLite : chemin absolu (indépendant du répertoire courant) ou ':memory:' (mémoire partagée)
+app.config['DATABASE_PATH'] = os.environ.get(
+    'DATABASE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gridpay.db'))
+app.config['DATABASE_BUSY_TIMEOUT_MS'] = int(os.environ.get('DATABASE_BUSY_TIMEOUT_MS', 5000))
+app.config['DATABASE_CACHED_STATEMENTS'] = int(os.environ.get('DATABASE_CACHED_STATEMENTS', 256))
+app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 16))
+# Séparation lecture/écriture : lectures sur des connexions mode=ro, écritures par un seul thread
+app.config['DATABASE_READONLY_READS'] = os.environ.get('DATABASE_READONLY_READS', '1') == '1'
+app.config['DATABASE_WRITER_QUEUE'] = int(os.environ.get('DATABASE_WRITER_QUEUE', 10000))
+app.config['DATABASE_WRITE_TIMEOUT_S'] = int(os.environ.get('DATABASE_WRITE_TIMEOUT_S', 30))
+# Partitionnement : nombre de fichiers SQLite (1 = base unique) et annuaire global (emails, compteurs)
+app.config['DATABASE_SHARDS'] = int(os.environ.get('DATABASE_SHARDS', 1))
+app.config['DATABASE_DIRECTORY_PATH'] = os.environ.get(
+    'DATABASE_DIRECTORY_PATH', directory_path(app.config['DATABASE_PATH']))
+
+# Accès aux données : 'sqlite' ou 'memory' (benchmarks, aucune persistance)
+app.config['REPOSITORY_BACKEND'] = os.environ.get('REPOSITORY_BACKEND', 'sqlite')
+
+# Rétention : lectures brutes gardées en base (jours), puis archivées par mois ; 0 = pas de passe automatique
+app.config['ARCHIVE_DIR'] = os.environ.get(
+    'ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+app.config['RETENTION_RAW_DAYS'] = int(os.environ.get('RETENTION_RAW_DAYS', 35))
+app.config['RETENTION_INTERVAL_S'] = int(os.environ.get('RETENTION_INTERVAL_S', 3600))
+app.config['RETENTION_CHUNK_METERS'] = int(os.environ.get('RETENTION_CHUNK_METERS', 100))
+app.config['RETENTION_CHUNK_ROWS'] = int(os.environ.get('RETENTION_CHUNK_ROWS', 50000))
+app.config['RETENTION_VACUUM_PAGES'] = int(os.environ.get('RETENTION_VACUUM_PAGES', 0))  # 0 = toutes
+# Journal des modifications (GET /changes) : jours gardés par la passe de rétention (0 = sans purge) ;
+# un client hors ligne plus longtemps recharge ses listes
+app.config['CHANGE_LOG_DAYS'] = int(os.environ.get('CHANGE_LOG_DAYS', 90))
+
+# Dernières lectures en mémoire (/api/meters/<n>/recent) : fenêtre chargée depuis la base à la première
+# consultation, rythme d'envoi des capteurs (2 s, sensors/sensor.py), emplacements par compteur (par
+# défaut la fenêtre à ce rythme : 1800 pour une heure), budget mémoire total des tampons.
+# Au-delà de la fenêtre, l'historique se lit sur /api/meters/<n>/readings
+app.config['RECENT_WINDOW_S'] = int(os.environ.get('RECENT_WINDOW_S', 3600))
+app.config['RECENT_REPORT_INTERVAL_S'] = int(os.environ.get('RECENT_REPORT_INTERVAL_S', 2))
+app.config['RECENT_BUFFER_SIZE'] = int(os.environ.get(
+    'RECENT_BUFFER_SIZE', -(-app.config['RECENT_WINDOW_S'] // app.config['RECENT_REPORT_INTERVAL_S'])))
+app.config['RECENT_BUFFER_BUDGET_MB'] = int(os.environ.get('RECENT_BUFFER_BUDGET_MB', 64))
+
+# Listes paginées (limit / cursor) : taille par défaut et maximale d'une page, plafond du total (total=1)
+app.config['PAGE_SIZE_DEFAULT'] = int(os.environ.get('PAGE_SIZE_DEFAULT', 50))
+app.config['PAGE_SIZE_MAX'] = int(os.environ.get('PAGE_SIZE_MAX', 500))
+app.config['PAGE_COUNT_MAX'] = int(os.environ.get('PAGE_COUNT_MAX', 10000))
+
+# GET conditionnels (ETag / If-None-Match) sur les versions en mémoire : à désactiver si plusieurs
+# processus API servent les mêmes utilisateurs (chacun ne voit que ses propres écritures)
+app.config['CONDITIONAL_GET'] = int(os.environ.get('CONDITIONAL_GET', 1))
+
+# Administration : emails autorisés sur /api/admin/* (séparés par des virgules)
+app.config['ADMIN_EMAILS'] = {email.strip() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+# Import en masse : lignes par transaction, répertoire des fichiers déposés en attente d'import
+app.config['IMPORT_CHUNK_ROWS'] = int(os.environ.get('IMPORT_CHUNK_ROWS', 5000))
+app.config['IMPORT_UPLOAD_DIR'] = os.environ.get('IMPORT_UPLOAD_DIR', tempfile.gettempdir())
+
 # Initialisation des extensions
 jwt = JWTManager(app)
 bcrypt = Bcrypt(app)
 
+@jwt.token_verification_loader
+def reject_live_ticket(jwt_header, jwt_data):
+    """Les tickets du flux SSE (/api/live/ticket) ne valent pas jeton d'accès sur les routes de l'API"""
+    return jwt_data.get('scope') != 'live'
+
 
 BROKER = "broker.hivemq.com"
 PORT = 8884  # TLS sécurisé
+CONSUMPTION_TOPIC = "electricity/+/consumption"  # Abonnement unique pour tous les compteurs
+SHARED_CONSUMPTION_TOPIC = f"$share/gridpay/{CONSUMPTION_TOPIC}"  # Groupe partagé entre workers
+RELAY_STATE_TOPIC = "electricity/+/relay/state"  # Acquittements des relais (état réel)
 mqtt_client = None
 mqtt_topics = []
+database_options = {
+    'busy_timeout_ms': app.config['DATABASE_BUSY_TIMEOUT_MS'],
+    'cached_statements': app.config['DATABASE_CACHED_STATEMENTS'],
+    'pool_size': app.config['DATABASE_POOL_SIZE'],
+}
+db = Database(app.config['DATABASE_PATH'], **database_options)
+# Base partitionnée : partition 0 = db, puis gridpay-1.db, ... et l'annuaire
+databases = [db] + [Database(shard_path(app.config['DATABASE_PATH'], index), **database_options)
+                    for index in range(1, app.config['DATABASE_SHARDS'])]
+if app.config['DATABASE_SHARDS'] > 1:
+    databases.append(Database(app.config['DATABASE_DIRECTORY_PATH'], **database_options))
+db_writer = DatabaseWriter(
+    max_queue=app.config['DATABASE_WRITER_QUEUE'],
+    timeout_s=app.config['DATABASE_WRITE_TIMEOUT_S']
+)
+ingest_pipeline = None
+reading_deduplicator = ReadingDeduplicator(app.config['INGEST_DEDUPE_WINDOW_S'])
+ingest_journal = IngestJournal(
+    app.config['INGEST_JOURNAL_PATH'],
+    fsync_interval_ms=app.config['INGEST_JOURNAL_FSYNC_MS']
+)
+reading_archive = ReadingArchive(app.config['ARCHIVE_DIR'])
+if app.config['REPOSITORY_BACKEND'] == 'memory':
+    repositories = MemoryRepositories(reading_archive)
+elif app.config['DATABASE_SHARDS'] > 1:
+    repositories = ShardedRepositories(
+        [SqliteRepositories(
+            database,
+            reading_archive,
+            reader=database.reader() if app.config['DATABASE_READONLY_READS'] else None
+        ) for database in databases[:-1]],
+        ShardDirectory(
+            databases[-1],
+            reader=databases[-1].reader() if app.config['DATABASE_READONLY_READS'] else None
+        ),
+        writer=db_writer
+    )
+else:
+    repositories = SqliteRepositories(
+        db,
+        reading_archive,
+        reader=db.reader() if app.config['DATABASE_READONLY_READS'] else None,
+        writer=db_writer
+    )
+retention_job = RetentionJob(
+    repositories,
+    reading_archive,
+    app.config['RETENTION_RAW_DAYS'],
+    interval_s=app.config['RETENTION_INTERVAL_S'],
+    chunk_meters=app.config['RETENTION_CHUNK_METERS'],
+    chunk_rows=app.config['RETENTION_CHUNK_ROWS'],
+    vacuum_pages=app.config['RETENTION_VACUUM_PAGES'],
+    change_log_days=app.config['CHANGE_LOG_DAYS']
+)
+# Mode 'inline' : compteurs créés par ce seul processus, registre de référence (numéro inconnu = aucune requête)
+meter_registry = MeterRegistry(repositories, authoritative=app.config['INGEST_MODE'] == 'inline')
+change_feed = ChangeFeed(repositories)
+change_versions = ChangeVersions()
+recent_readings = RecentReadings(
+    app.config['RECENT_BUFFER_SIZE'],
+    budget_bytes=app.config['RECENT_BUFFER_BUDGET_MB'] * 1024 * 1024
+)
+relay_dispatcher = RelayDispatcher(
+    lambda meter_number, command: send_mqtt_command(meter_number, command),
+    ack_timeout_s=app.config['RELAY_ACK_TIMEOUT_S'],
+    max_retries=app.config['RELAY_MAX_RETRIES'],
+    resend_after_s=app.config['RELAY_RESEND_AFTER_S'],
+    on_change=lambda meter_number, state: publish_relay_change(meter_number, state)
+)
+live_broadcaster = LiveBroadcaster(
+    lambda token: live_user_id(token),
+    authenticate_ticket=lambda ticket: live_ticket_user_id(ticket),
+    port=app.config['LIVE_PORT'],
+    heartbeat_s=app.config['LIVE_HEARTBEAT_S'],
+    queue_size=app.config['LIVE_QUEUE_SIZE'],
+    max_clients=app.config['LIVE_MAX_CLIENTS']
+)
+import_jobs = {}
+
+
+def view_version(key):
+    """Version courante d'une vue (versions.py), None si les GET conditionnels sont désactivés"""
+    if not app.config['CONDITIONAL_GET']:
+        return None
+    return change_versions.current(key)
+
+def user_view_version(scope, user_email):
+    """Version d'une vue de l'utilisateur (meters_key ou billing_key), sans requête SQL"""
+    user_id = meter_registry.user_id_for(user_email)
+    return view_version(scope(user_id)) if user_id is not None else None
+
+def not_modified(version):
+    """Réponse 304 si le client a déjà cette version (If-None-Match), sinon None"""
+    if version is None or not request.if_none_match.contains_weak(version.etag):
+        return None
+    return with_version(Response(status=304), version)
+
+def with_version(response, version):
+    """Ajoute ETag faible et Last-Modified ; no-cache : le client revalide à chaque consultation"""
+    if version is not None:
+        response.set_etag(version.etag, weak=True)
+        response.last_modified = version.last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Rend les connexions SQLite du thread (écriture et lecture seule) au pool à la fin de chaque requête"""
+    for database in databases:
+        database.release()
+        database.reader().release()
 
 
 
@@ -30,63 +276,18 @@ mqtt_topics = []
 # ---------------------------------------------------------------------------------------------
 
 def init_db():
-    """Initialise la base de données avec la table users"""
-    conn = sqlite3.connect('gridpay.db')
-    cursor = conn.cursor()
-    
-    # Création des tables si elle n'exist pas
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            phone TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    cursor.execute('''
-       CREATE TABLE IF NOT EXISTS meters (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            meter_number TEXT UNIQUE NOT NULL,
-            meter_name TEXT,
-            status TEXT DEFAULT 'active',
-            cumulative_consumption REAL DEFAULT 0.0,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-        )
-    ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS invoices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            meter_id INTEGER NOT NULL,
-            month TEXT NOT NULL,              
-            amount REAL NOT NULL,
-            status TEXT DEFAULT 'unpaid',
-            kwh INTEGER NOT NULL,
-            issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (meter_id) REFERENCES meters(id) ON DELETE CASCADE
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            payment_method TEXT NOT NULL,
-            transaction_id TEXT UNIQUE,
-            status TEXT DEFAULT 'completed',
-            paid_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (invoice_id) REFERENCES invoices(id) ON DELETE CASCADE
-        )
-    ''')
-    
-    
-    conn.commit()
-    conn.close()
+    """Met le schéma de la base à jour (migrations versionnées, voir migrations.py)"""
+    if app.config['REPOSITORY_BACKEND'] == 'memory':
+        return
+    if app.config['DATABASE_SHARDS'] > 1:
+        # Migrations de chaque partition, annuaire construit depuis les partitions s'il est vide
+        repositories.prepare()
+        return
+    conn = db.connect()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
 
 # Initialiser la base au démarrage
 init_db()
@@ -116,28 +317,22 @@ def login():
         if not is_valid_email(email):
             return jsonify({'message': 'Format d\'email invalide'}), 400
         
-        # Vérification dans la base de données - CORRECTION: Sélectionner tous les champs
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, email, password, phone, created_at FROM users WHERE email=?", (email,))
-        user = cursor.fetchone()
-        conn.close()
+        # Vérification dans la base de données (avec le hash du mot de passe)
+        user = repositories.users.get_by_email(email, with_password=True)
 
         if user:
-            user_id, name, user_email, hashed_password, phone, created_at = user
-            
             # Vérification du mot de passe AVEC FLASK-BCRYPT
-            if bcrypt.check_password_hash(hashed_password, password):
-                token = create_access_token(identity=user_email)
+            if bcrypt.check_password_hash(user.password, password):
+                token = create_access_token(identity=user.email)
                 
                 # CORRECTION: Renvoyer toutes les informations utilisateur
                 return jsonify({
                     'token': token,
-                    'user_id': user_id,
-                    'email': user_email,
-                    'name': name,
-                    'phone': phone,
-                    'created_at': created_at
+                    'user_id': user.id,
+                    'email': user.email,
+                    'name': user.name,
+                    'phone': user.phone,
+                    'created_at': user.created_at
                 }), 200
             else:
                 return jsonify({'message': 'Email ou mot de passe incorrect'}), 401
@@ -170,42 +365,26 @@ def register():
         # Hachage du mot de passe AVEC FLASK-BCRYPT
         hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier si l'email existe déjà
-        cursor.execute("SELECT id FROM users WHERE email=?", (email,))
-        if cursor.fetchone():
-            conn.close()
+        if repositories.users.id_for_email(email) is not None:
             return jsonify({'message': 'Cet email est déjà utilisé'}), 409
         
         # Vérifier si le numéro de téléphone existe déjà
-        cursor.execute("SELECT id FROM users WHERE phone=?", (phone,))
-        if cursor.fetchone():
-            conn.close()
+        if repositories.users.phone_exists(phone):
             return jsonify({'message': 'Ce numéro de téléphone est déjà utilisé'}), 409
         
         # Insérer le nouvel utilisateur
-        cursor.execute(
-            "INSERT INTO users (email, password, phone, name) VALUES (?, ?, ?, ?)",
-            (email, hashed_password, phone, name)
-        )
-        conn.commit()
-        
-        # Récupérer toutes les informations de l'utilisateur créé - CORRECTION
-        cursor.execute("SELECT id, name, email, phone, created_at FROM users WHERE id=?", (cursor.lastrowid,))
-        new_user = cursor.fetchone()
-        conn.close()
+        new_user = repositories.write(repositories.users.create, email, hashed_password, phone, name)
         
         if new_user:
-            user_id, name, email, phone, created_at = new_user
+            meter_registry.add_user(new_user.id, new_user.email)
             return jsonify({
                 'message': 'Utilisateur créé avec succès',
-                'user_id': user_id,
-                'name': name,
-                'email': email,
-                'phone': phone,
-                'created_at': created_at
+                'user_id': new_user.id,
+                'name': new_user.name,
+                'email': new_user.email,
+                'phone': new_user.phone,
+                'created_at': new_user.created_at
             }), 201
         else:
             return jsonify({'message': 'Utilisateur créé mais erreur de récupération'}), 201
@@ -213,86 +392,50 @@ def register():
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
     
-def init_mqtt_for_user_auto(user_email):
-    """Réinitialise automatiquement MQTT pour tous les compteurs d'un utilisateur"""
-    try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        # Récupérer tous les compteurs de l'utilisateur
-        cursor.execute("""
-            SELECT meter_number 
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE u.email = ?
-        """, (user_email,))
-        
-        meters = cursor.fetchall()
-        conn.close()
-        
-        if meters:
-            # Créer les topics pour tous les compteurs
-            consumption_topics = [f"electricity/{meter[0]}/consumption" for meter in meters]
-            relay_topics = [f"electricity/{meter[0]}/relay" for meter in meters]
-            
-            all_topics = consumption_topics + relay_topics
-            
-            # Réinitialiser MQTT avec tous ces topics
-            init_mqtt(all_topics)
-            print(f"[MQTT AUTO] Réinitialisé pour {len(meters)} compteurs de {user_email}")
-        
-    except Exception as e:
-        print(f"[MQTT AUTO ERROR] Erreur réinitialisation automatique: {e}")
-
 #------------------------------------------------------------------------------------------------
 #                                      GESTION DU COMPTUER
 #------------------------------------------------------------------------------------------------
 # -------------------- GESTION DES COMPTEURS (METERS) --------------------
 
+def list_page(listing):
+    """Pagination et filtres d'une liste (pagination.py) ; ValueError si les paramètres sont invalides
+    
+    Sans limit ni cursor, la liste est entière. Avec : {'next_cursor', 'limit'} dans la réponse,
+    et avec total=1 : {'total', 'total_exact'}.
+    """
+    return Page.from_args(listing, request.args, app.config['PAGE_SIZE_DEFAULT'], app.config['PAGE_SIZE_MAX'],
+                          app.config['PAGE_COUNT_MAX'])
+
 @app.route('/meters', methods=['GET'])
 @jwt_required()
 def get_user_meters():
-    """Récupère tous les compteurs de l'utilisateur connecté"""
+    """Récupère les compteurs de l'utilisateur connecté (filtre : status ; pagination : limit, cursor)"""
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # -----------Rien de changé depuis la dernière consultation : 304 sans requête SQL-----------
+        version = user_view_version(meters_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # -----------Récupérer l'ID de l'utilisateur-----------
-        cursor.execute("SELECT id FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
+        user_id = repositories.users.id_for_email(user_email)
         
-        if not user:
-            conn.close()
+        if user_id is None:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        user_id = user[0]
-        
-        # ---------Récupérer tous les compteurs de l'utilisateur----------
-        cursor.execute("""
-            SELECT id, meter_number, meter_name, status, created_at, updated_at 
-            FROM meters 
-            WHERE user_id=?
-            ORDER BY created_at DESC
-        """, (user_id,))
-        
-        meters = cursor.fetchall()
-        conn.close()
+        try:
+            page = list_page('meters')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
-        #------ Formater les résultats -------
-        meters_list = []
-        for meter in meters:
-            meters_list.append({
-                'id': meter[0],
-                'meter_number': meter[1],
-                'meter_name': meter[2],
-                'status': meter[3],
-                'created_at': meter[4],
-                'updated_at': meter[5]
-            })
+        # ---------Récupérer les compteurs de l'utilisateur (une page)----------
+        meters = repositories.meters.list_for_user(user_id, page.filters, page.after, page.fetch)
+        meters, meta = page.result(meters, lambda meter: meter.created_at,
+                                   lambda cap: repositories.meters.count_for_user(user_id, page.filters, cap))
         
-        return jsonify({'meters': meters_list}), 200
+        return with_version(jsonify({'meters': [meter.to_dict() for meter in meters], **meta}), version), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -314,56 +457,26 @@ def add_meter():
         if not meter_number:
             return jsonify({'message': 'Le numéro de compteur est requis'}), 400
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # -----Récupérer l'ID de l'utilisateur--------
-        cursor.execute("SELECT id FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
+        user_id = repositories.users.id_for_email(user_email)
         
-        if not user:
-            conn.close()
+        if user_id is None:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        user_id = user[0]
-        
         # ----------Vérifier si le compteur existe déjà-------
-        cursor.execute("SELECT id FROM meters WHERE meter_number=?", (meter_number,))
-        if cursor.fetchone():
-            conn.close()
+        if repositories.meters.get_by_number(meter_number):
             return jsonify({'message': 'Ce numéro de compteur est déjà utilisé'}), 409
         
         #----------- Ajouter le nouveau compteur----
-        cursor.execute("""
-            INSERT INTO meters (user_id, meter_number, meter_name) 
-            VALUES (?, ?, ?)
-        """, (user_id, meter_number, meter_name))
-        
-        conn.commit()
-        
-        #------------ Récupérer les détails du compteur créé-----
-        cursor.execute("""
-            SELECT id, meter_number, meter_name, status, created_at, updated_at 
-            FROM meters 
-            WHERE id=?
-        """, (cursor.lastrowid,))
-        
-        new_meter = cursor.fetchone()
-        conn.close()
+        new_meter = repositories.write(repositories.meters.create, user_id, meter_number, meter_name)
         
         if new_meter:
-            # Après avoir ajouté le compteur, réinitialiser MQTT
-            init_mqtt_for_user_auto(user_email)  # ← ASSUREZ-VOUS QUE CETTE FONCTION EXISTE
+            # Le topic du compteur est déjà couvert par l'abonnement générique : pas de reconnexion MQTT
+            meter_registry.put(new_meter.id, user_id, new_meter.meter_number, new_meter.meter_name, new_meter.status)
+            change_versions.bump(meters_key(user_id))
             return jsonify({
                 'message': 'Compteur ajouté avec succès',
-                'meter': {
-                    'id': new_meter[0],
-                    'meter_number': new_meter[1],
-                    'meter_name': new_meter[2],
-                    'status': new_meter[3],
-                    'created_at': new_meter[4],
-                    'updated_at': new_meter[5]
-                }
+                'meter': new_meter.to_dict()
             }), 201
         else:
             return jsonify({'message': 'Compteur créé mais erreur de récupération'}), 201
@@ -379,75 +492,32 @@ def update_meter(meter_id):
         user_email = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         #-------------Récupérer l'ID de l'utilisateur-----------
-        cursor.execute("SELECT id FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
+        user_id = repositories.users.id_for_email(user_email)
         
-        if not user:
-            conn.close()
+        if user_id is None:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        user_id = user[0]
-        
         # ------------Vérifier que le compteur appartient à l'utilisateur--------
-        cursor.execute("SELECT id FROM meters WHERE id=? AND user_id=?", (meter_id, user_id))
-        if not cursor.fetchone():
-            conn.close()
+        if not repositories.meters.get(meter_id, user_id):
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
-        # ---------Préparer la requête de mise à jour---------
-        update_fields = []
-        update_values = []
-        
-        if 'meter_name' in data:
-            update_fields.append("meter_name = ?")
-            update_values.append(data['meter_name'])
-        
-        if 'status' in data:
-            update_fields.append("status = ?")
-            update_values.append(data['status'])
+        # ---------Champs à mettre à jour---------
+        changes = {field: data[field] for field in ('meter_name', 'status') if field in data}
         
-        if not update_fields:
-            conn.close()
+        if not changes:
             return jsonify({'message': 'Aucune donnée à mettre à jour'}), 400
         
-        # -----------Ajouter la date de mise à jour-------------
-        update_fields.append("updated_at = CURRENT_TIMESTAMP")
-        update_values.append(meter_id)
-        
-        # ----------Exécuter la mise à jour---------------
-        cursor.execute(f"""
-            UPDATE meters 
-            SET {', '.join(update_fields)}
-            WHERE id = ?
-        """, update_values)
-        
-        conn.commit()
-        
-        # -----------Récupérer le compteur mis à jour-------------
-        cursor.execute("""
-            SELECT id, meter_number, meter_name, status, created_at, updated_at 
-            FROM meters 
-            WHERE id=?
-        """, (meter_id,))
-        
-        updated_meter = cursor.fetchone()
-        conn.close()
+        # ----------Exécuter la mise à jour (updated_at compris)---------------
+        updated_meter = repositories.write(repositories.meters.update, meter_id, changes)
         
         if updated_meter:
+            meter_registry.update(meter_id, updated_meter.meter_name, updated_meter.status)
+            # Le nom du compteur figure aussi dans les factures et paiements
+            change_versions.bump(meters_key(user_id), billing_key(user_id), meter_key(meter_id))
             return jsonify({
                 'message': 'Compteur mis à jour avec succès',
-                'meter': {
-                    'id': updated_meter[0],
-                    'meter_number': updated_meter[1],
-                    'meter_name': updated_meter[2],
-                    'status': updated_meter[3],
-                    'created_at': updated_meter[4],
-                    'updated_at': updated_meter[5]
-                }
+                'meter': updated_meter.to_dict()
             }), 200
         else:
             return jsonify({'message': 'Erreur lors de la récupération du compteur mis à jour'}), 500
@@ -462,29 +532,21 @@ def delete_meter(meter_id):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         #----------- Récupérer l'ID de l'utilisateur------------
-        cursor.execute("SELECT id FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
+        user_id = repositories.users.id_for_email(user_email)
         
-        if not user:
-            conn.close()
+        if user_id is None:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        user_id = user[0]
-        
         # -----------Vérifier que le compteur appartient à l'utilisateur------------
-        cursor.execute("SELECT id FROM meters WHERE id=? AND user_id=?", (meter_id, user_id))
-        if not cursor.fetchone():
-            conn.close()
+        if not repositories.meters.get(meter_id, user_id):
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
         #--------- --Supprimer le compteur------------
-        cursor.execute("DELETE FROM meters WHERE id=?", (meter_id,))
-        conn.commit()
-        conn.close()
+        repositories.write(repositories.meters.delete, meter_id)
+        meter_registry.remove(meter_id)
+        recent_readings.discard(meter_id)
+        change_versions.bump(meters_key(user_id), billing_key(user_id), meter_key(meter_id))
         
         return jsonify({'message': 'Compteur supprimé avec succès'}), 200
         
@@ -498,41 +560,23 @@ def get_meter(meter_id):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # La suppression du compteur incrémente aussi cette version : pas de 304 pour un compteur disparu
+        version = user_view_version(meters_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         #------------ Récupérer l'ID de l'utilisateur -------------
-
-        cursor.execute("SELECT id FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
+        user_id = repositories.users.id_for_email(user_email)
         
-        if not user:
-            conn.close()
+        if user_id is None:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        user_id = user[0]
-        
         # ------------- Récupérer le compteur -----------
-        cursor.execute("""
-            SELECT id, meter_number, meter_name, status, created_at, updated_at 
-            FROM meters 
-            WHERE id=? AND user_id=?
-        """, (meter_id, user_id))
-        
-        meter = cursor.fetchone()
-        conn.close()
+        meter = repositories.meters.get(meter_id, user_id)
         
         if meter:
-            return jsonify({
-                'meter': {
-                    'id': meter[0],
-                    'meter_number': meter[1],
-                    'meter_name': meter[2],
-                    'status': meter[3],
-                    'created_at': meter[4],
-                    'updated_at': meter[5]
-                }
-            }), 200
+            return with_version(jsonify({'meter': meter.to_dict()}), version), 200
         else:
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
             
@@ -548,52 +592,37 @@ def get_meter(meter_id):
 @app.route('/invoices', methods=['GET'])
 @jwt_required()
 def get_user_invoices():
-    """Récupère toutes les factures de l'utilisateur connecté"""
+    """Récupère les factures de l'utilisateur connecté
+    
+    Filtres : status, month_from / month_to (mois de facturation AAAA-MM, inclus), meter_id ;
+    pagination : limit, cursor, total=1.
+    """
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # Rien de changé dans les factures et paiements de l'utilisateur : 304 sans requête SQL
+        version = user_view_version(billing_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # Récupérer l'ID de l'utilisateur
-        cursor.execute("SELECT id FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
+        user_id = repositories.users.id_for_email(user_email)
         
-        if not user:
-            conn.close()
+        if user_id is None:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        user_id = user[0]
-        
-        # Récupérer toutes les factures de l'utilisateur avec les infos du compteur
-        cursor.execute("""
-            SELECT i.id, i.meter_id, m.meter_number, m.meter_name, 
-                   i.month, i.amount, i.status, i.kwh, i.issued_at
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            WHERE m.user_id = ?
-            ORDER BY i.issued_at DESC
-        """, (user_id,))
+        try:
+            page = list_page('invoices')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
-        invoices = cursor.fetchall()
-        conn.close()
+        # Factures de l'utilisateur avec les infos du compteur
+        invoices = repositories.invoices.list_for_user(user_id, page.filters, page.after, page.fetch)
+        invoices, meta = page.result(invoices, lambda invoice: invoice.issued_at,
+                                     lambda cap: repositories.invoices.count_for_user(user_id, page.filters, cap))
         
-        # Formater les résultats
-        invoices_list = []
-        for invoice in invoices:
-            invoices_list.append({
-                'id': invoice[0],
-                'meter_id': invoice[1],
-                'meter_number': invoice[2],
-                'meter_name': invoice[3],
-                'month': invoice[4],
-                'amount': invoice[5],
-                'status': invoice[6],
-                'kwh': invoice[7],
-                'issued_at': invoice[8]
-            })
-        
-        return jsonify({'invoices': invoices_list}), 200
+        return with_version(jsonify({'invoices': [invoice.to_dict() for invoice in invoices], **meta}), version), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -619,65 +648,25 @@ def add_invoice():
         if not all([meter_id, month, amount, kwh]):
             return jsonify({'message': 'Tous les champs obligatoires sont requis'}), 400
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que le compteur appartient à l'utilisateur
-        cursor.execute("""
-            SELECT m.id 
-            FROM meters m 
-            JOIN users u ON m.user_id = u.id 
-            WHERE m.id = ? AND u.email = ?
-        """, (meter_id, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        if not repositories.meters.owned_by_email(meter_id, user_email):
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
         # Vérifier si une facture existe déjà pour ce mois et ce compteur
-        cursor.execute("""
-            SELECT id FROM invoices 
-            WHERE meter_id = ? AND month = ?
-        """, (meter_id, month))
-        
-        if cursor.fetchone():
-            conn.close()
+        if repositories.invoices.exists_for_month(meter_id, month):
             return jsonify({'message': 'Une facture existe déjà pour ce mois et ce compteur'}), 409
         
         # Ajouter la nouvelle facture
-        cursor.execute("""
-            INSERT INTO invoices (meter_id, month, amount, status, kwh) 
-            VALUES (?, ?, ?, ?, ?)
-        """, (meter_id, month, amount, status, kwh))
-        
-        conn.commit()
-        
-        # Récupérer les détails de la facture créée
-        cursor.execute("""
-            SELECT i.id, i.meter_id, m.meter_number, m.meter_name, 
-                   i.month, i.amount, i.status, i.kwh, i.issued_at
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            WHERE i.id = ?
-        """, (cursor.lastrowid,))
-        
-        new_invoice = cursor.fetchone()
-        conn.close()
+        new_invoice = repositories.write(repositories.invoices.create, meter_id, month, amount, status, kwh)
+        change_versions.bump(billing_key(meter_registry.user_id_for(user_email)))
         
         if new_invoice:
+            # Seule une facture payée peut changer le seuil du compteur
+            if new_invoice.status == 'paid':
+                meter_registry.invalidate_threshold(new_invoice.meter_id)
             return jsonify({
                 'message': 'Facture ajoutée avec succès',
-                'invoice': {
-                    'id': new_invoice[0],
-                    'meter_id': new_invoice[1],
-                    'meter_number': new_invoice[2],
-                    'meter_name': new_invoice[3],
-                    'month': new_invoice[4],
-                    'amount': new_invoice[5],
-                    'status': new_invoice[6],
-                    'kwh': new_invoice[7],
-                    'issued_at': new_invoice[8]
-                }
+                'invoice': new_invoice.to_dict()
             }), 201
         else:
             return jsonify({'message': 'Facture créée mais erreur de récupération'}), 201
@@ -693,83 +682,32 @@ def update_invoice(invoice_id):
         user_email = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que la facture appartient à l'utilisateur
-        cursor.execute("""
-            SELECT i.id 
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE i.id = ? AND u.email = ?
-        """, (invoice_id, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        invoice = repositories.invoices.get(invoice_id, user_email)
+        if not invoice:
             return jsonify({'message': 'Facture non trouvée ou accès non autorisé'}), 404
         
-        # Préparer la requête de mise à jour
-        update_fields = []
-        update_values = []
-        
-        if 'amount' in data:
-            update_fields.append("amount = ?")
-            update_values.append(data['amount'])
-        
-        if 'status' in data:
-            update_fields.append("status = ?")
-            update_values.append(data['status'])
-        
-        if 'kwh' in data:
-            update_fields.append("kwh = ?")
-            update_values.append(data['kwh'])
+        # Une seule facture par mois et par compteur (index unique)
+        if 'month' in data and repositories.invoices.exists_for_month(invoice.meter_id, data['month'], invoice_id):
+            return jsonify({'message': 'Une facture existe déjà pour ce mois et ce compteur'}), 409
         
-        if 'month' in data:
-            update_fields.append("month = ?")
-            update_values.append(data['month'])
+        # Champs à mettre à jour
+        changes = {field: data[field] for field in ('amount', 'status', 'kwh', 'month') if field in data}
         
-        if not update_fields:
-            conn.close()
+        if not changes:
             return jsonify({'message': 'Aucune donnée à mettre à jour'}), 400
         
-        update_values.append(invoice_id)
-        
         # Exécuter la mise à jour
-        cursor.execute(f"""
-            UPDATE invoices 
-            SET {', '.join(update_fields)}
-            WHERE id = ?
-        """, update_values)
-        
-        conn.commit()
-        
-        # Récupérer la facture mise à jour
-        cursor.execute("""
-            SELECT i.id, i.meter_id, m.meter_number, m.meter_name, 
-                   i.month, i.amount, i.status, i.kwh, i.issued_at
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            WHERE i.id = ?
-        """, (invoice_id,))
-        
-        updated_invoice = cursor.fetchone()
-        conn.close()
+        updated_invoice = repositories.write(repositories.invoices.update, invoice_id, changes)
+        change_versions.bump(billing_key(meter_registry.user_id_for(user_email)))
         
         if updated_invoice:
+            # Le seuil dépend du statut et du kwh des factures payées
+            if ('status' in data or 'kwh' in data) and 'paid' in (invoice.status, updated_invoice.status):
+                meter_registry.invalidate_threshold(updated_invoice.meter_id)
             return jsonify({
                 'message': 'Facture mise à jour avec succès',
-                'invoice': {
-                    'id': updated_invoice[0],
-                    'meter_id': updated_invoice[1],
-                    'meter_number': updated_invoice[2],
-                    'meter_name': updated_invoice[3],
-                    'month': updated_invoice[4],
-                    'amount': updated_invoice[5],
-                    'status': updated_invoice[6],
-                    'kwh': updated_invoice[7],
-                    'issued_at': updated_invoice[8]
-                }
+                'invoice': updated_invoice.to_dict()
             }), 200
         else:
             return jsonify({'message': 'Erreur lors de la récupération de la facture mise à jour'}), 500
@@ -784,26 +722,16 @@ def delete_invoice(invoice_id):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que la facture appartient à l'utilisateur
-        cursor.execute("""
-            SELECT i.id 
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE i.id = ? AND u.email = ?
-        """, (invoice_id, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        invoice = repositories.invoices.get(invoice_id, user_email)
+        if not invoice:
             return jsonify({'message': 'Facture non trouvée ou accès non autorisé'}), 404
         
         # Supprimer la facture
-        cursor.execute("DELETE FROM invoices WHERE id=?", (invoice_id,))
-        conn.commit()
-        conn.close()
+        repositories.write(repositories.invoices.delete, invoice_id)
+        change_versions.bump(billing_key(meter_registry.user_id_for(user_email)))
+        if invoice.status == 'paid':
+            meter_registry.invalidate_threshold(invoice.meter_id)
         
         return jsonify({'message': 'Facture supprimée avec succès'}), 200
         
@@ -817,36 +745,17 @@ def get_invoice(invoice_id):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # Rien de changé dans les factures et paiements de l'utilisateur : 304 sans requête SQL
+        version = user_view_version(billing_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # Récupérer la facture avec vérification de propriété
-        cursor.execute("""
-            SELECT i.id, i.meter_id, m.meter_number, m.meter_name, 
-                   i.month, i.amount, i.status, i.kwh, i.issued_at
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE i.id = ? AND u.email = ?
-        """, (invoice_id, user_email))
-        
-        invoice = cursor.fetchone()
-        conn.close()
+        invoice = repositories.invoices.get(invoice_id, user_email)
         
         if invoice:
-            return jsonify({
-                'invoice': {
-                    'id': invoice[0],
-                    'meter_id': invoice[1],
-                    'meter_number': invoice[2],
-                    'meter_name': invoice[3],
-                    'month': invoice[4],
-                    'amount': invoice[5],
-                    'status': invoice[6],
-                    'kwh': invoice[7],
-                    'issued_at': invoice[8]
-                }
-            }), 200
+            return with_version(jsonify({'invoice': invoice.to_dict()}), version), 200
         else:
             return jsonify({'message': 'Facture non trouvée ou accès non autorisé'}), 404
             
@@ -856,49 +765,33 @@ def get_invoice(invoice_id):
 @app.route('/meters/<int:meter_id>/invoices', methods=['GET'])
 @jwt_required()
 def get_meter_invoices(meter_id):
-    """Récupère toutes les factures d'un compteur spécifique"""
+    """Récupère les factures d'un compteur spécifique (filtres : status, month_from, month_to ;
+    pagination : limit, cursor, total=1)"""
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # Rien de changé dans les factures et paiements de l'utilisateur : 304 sans requête SQL
+        version = user_view_version(billing_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # Vérifier que le compteur appartient à l'utilisateur
-        cursor.execute("""
-            SELECT m.id 
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE m.id = ? AND u.email = ?
-        """, (meter_id, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        if not repositories.meters.owned_by_email(meter_id, user_email):
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
-        # Récupérer les factures du compteur
-        cursor.execute("""
-            SELECT id, month, amount, status, kwh, issued_at
-            FROM invoices 
-            WHERE meter_id = ?
-            ORDER BY issued_at DESC
-        """, (meter_id,))
-        
-        invoices = cursor.fetchall()
-        conn.close()
+        try:
+            page = list_page('meter_invoices')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
-        # Formater les résultats
-        invoices_list = []
-        for invoice in invoices:
-            invoices_list.append({
-                'id': invoice[0],
-                'month': invoice[1],
-                'amount': invoice[2],
-                'status': invoice[3],
-                'kwh': invoice[4],
-                'issued_at': invoice[5]
-            })
+        # Récupérer les factures du compteur
+        invoices = repositories.invoices.list_for_meter(meter_id, page.filters, page.after, page.fetch)
+        invoices, meta = page.result(invoices, lambda invoice: invoice.issued_at,
+                                     lambda cap: repositories.invoices.count_for_meter(meter_id, page.filters, cap))
         
-        return jsonify({'invoices': invoices_list}), 200
+        return with_version(jsonify({'invoices': [invoice.to_dict(Invoice.METER_FIELDS) for invoice in invoices], **meta}),
+                            version), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -931,63 +824,39 @@ def add_payment():
         if not all([invoice_id, amount, payment_method]):
             return jsonify({'message': 'invoice_id, amount et payment_method sont requis'}), 400
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que la facture appartient à l'utilisateur et récupérer les infos
-        cursor.execute("""
-            SELECT i.id, i.amount, i.status, i.meter_id, m.meter_number
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE i.id = ? AND u.email = ?
-        """, (invoice_id, user_email))
-        
-        invoice = cursor.fetchone()
+        invoice = repositories.invoices.get(invoice_id, user_email)
         
         if not invoice:
-            conn.close()
             return jsonify({'message': 'Facture non trouvée ou accès non autorisé'}), 404
         
-        invoice_db_id, invoice_amount, invoice_status, meter_id, meter_number = invoice
+        meter_number = invoice.meter_number
         
         # Vérifier que le montant du paiement est valide
         if float(amount) <= 0:
-            conn.close()
             return jsonify({'message': 'Le montant du paiement doit être positif'}), 400
         
         # Vérifier si un paiement avec ce transaction_id existe déjà
-        if transaction_id:
-            cursor.execute("SELECT id FROM payments WHERE transaction_id=?", (transaction_id,))
-            if cursor.fetchone():
-                conn.close()
-                return jsonify({'message': 'Un paiement avec ce transaction_id existe déjà'}), 409
-        
-        # Ajouter le nouveau paiement
-        cursor.execute("""
-            INSERT INTO payments (invoice_id, amount, payment_method, transaction_id) 
-            VALUES (?, ?, ?, ?)
-        """, (invoice_id, amount, payment_method, transaction_id))
-        
-        # Mettre à jour le statut de la facture si le paiement est complet
-        payment_complete = False
-        if float(amount) >= float(invoice_amount):
-            cursor.execute("UPDATE invoices SET status = 'paid' WHERE id = ?", (invoice_id,))
-            payment_complete = True
-        
-        conn.commit()
+        if transaction_id and repositories.payments.transaction_exists(transaction_id):
+            return jsonify({'message': 'Un paiement avec ce transaction_id existe déjà'}), 409
         
-        # Récupérer les détails du paiement créé
-        cursor.execute("""
-            SELECT p.id, p.invoice_id, p.amount, p.payment_method, 
-                   p.transaction_id, p.status, p.paid_at,
-                   i.amount as invoice_amount
-            FROM payments p
-            JOIN invoices i ON p.invoice_id = i.id
-            WHERE p.id = ?
-        """, (cursor.lastrowid,))
+        # Paiement et statut de la facture dans la même transaction
+        payment_complete = float(amount) >= float(invoice.amount)
+        def record_payment():
+            with repositories.transaction():
+                payment_id = repositories.payments.create(invoice_id, amount, payment_method, transaction_id)
+                if payment_complete:
+                    repositories.invoices.mark_paid(invoice_id)
+            return payment_id
+        
+        payment_id = repositories.write(record_payment)
+        change_versions.bump(billing_key(meter_registry.user_id_for(user_email)))
         
-        new_payment = cursor.fetchone()
+        if payment_complete and invoice.status != 'paid':
+            meter_registry.invalidate_threshold(invoice.meter_id)
+        
+        # Récupérer les détails du paiement créé
+        new_payment = repositories.payments.get(payment_id)
         
         # ----------------------------------------------------------------
         # ENVOI DE LA COMMANDE ON AU BROKER MQTT SI PAIEMENT COMPLET
@@ -995,28 +864,15 @@ def add_payment():
         command_sent = False
         if payment_complete and meter_number:
             command = "ON"
-            if send_mqtt_command(meter_number, command):
-                print(f"[PAYMENT] Commande {command} envoyée pour le compteur {meter_number}")
-                command_sent = True
-            else:
-                print(f"[PAYMENT ERROR] Échec envoi commande pour {meter_number}")
-        
-        conn.close()
+            if relay_dispatcher.request(meter_number, command):
+                print(f"[PAYMENT] Commande {command} planifiée pour le compteur {meter_number}")
+            command_sent = True
         # ----------------------------------------------------------------
         
         if new_payment:
             return jsonify({
                 'message': 'Paiement ajouté avec succès',
-                'payment': {
-                    'id': new_payment[0],
-                    'invoice_id': new_payment[1],
-                    'amount': new_payment[2],
-                    'payment_method': new_payment[3],
-                    'transaction_id': new_payment[4],
-                    'status': new_payment[5],
-                    'paid_at': new_payment[6],
-                    'invoice_amount': new_payment[7]
-                },
+                'payment': new_payment.to_dict(Payment.CREATED_FIELDS),
                 'command_sent': command_sent,
                 'meter_number': meter_number if command_sent else None
             }), 201
@@ -1029,49 +885,31 @@ def add_payment():
 @app.route('/payments', methods=['GET'])
 @jwt_required()
 def get_user_payments():
-    """Récupère tous les paiements de l'utilisateur connecté"""
+    """Récupère les paiements de l'utilisateur connecté
+    
+    Filtres : status, month_from / month_to (mois du paiement AAAA-MM, inclus), meter_id ;
+    pagination : limit, cursor, total=1.
+    """
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        # Récupérer tous les paiements de l'utilisateur avec les infos des factures
-        cursor.execute("""
-            SELECT p.id, p.invoice_id, p.amount, p.payment_method, 
-                   p.transaction_id, p.status, p.paid_at,
-                   i.amount as invoice_amount, i.month, i.status as invoice_status,
-                   m.meter_number, m.meter_name
-            FROM payments p
-            JOIN invoices i ON p.invoice_id = i.id
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE u.email = ?
-            ORDER BY p.paid_at DESC
-        """, (user_email,))
-        
-        payments = cursor.fetchall()
-        conn.close()
+        # Rien de changé dans les factures et paiements de l'utilisateur : 304 sans requête SQL
+        version = user_view_version(billing_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
-        # Formater les résultats
-        payments_list = []
-        for payment in payments:
-            payments_list.append({
-                'id': payment[0],
-                'invoice_id': payment[1],
-                'amount': payment[2],
-                'payment_method': payment[3],
-                'transaction_id': payment[4],
-                'status': payment[5],
-                'paid_at': payment[6],
-                'invoice_amount': payment[7],
-                'invoice_month': payment[8],
-                'invoice_status': payment[9],
-                'meter_number': payment[10],
-                'meter_name': payment[11]
-            })
+        try:
+            page = list_page('payments')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
-        return jsonify({'payments': payments_list}), 200
+        # Paiements de l'utilisateur avec les infos des factures
+        payments = repositories.payments.list_for_user(user_email, page.filters, page.after, page.fetch)
+        payments, meta = page.result(payments, lambda payment: payment.paid_at,
+                                     lambda cap: repositories.payments.count_for_user(user_email, page.filters, cap))
+        
+        return with_version(jsonify({'payments': [payment.to_dict() for payment in payments], **meta}), version), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -1079,50 +917,32 @@ def get_user_payments():
 @app.route('/invoices/<int:invoice_id>/payments', methods=['GET'])
 @jwt_required()
 def get_invoice_payments(invoice_id):
-    """Récupère tous les paiements d'une facture spécifique"""
+    """Récupère les paiements d'une facture spécifique (filtre : status ; pagination : limit, cursor, total=1)"""
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # Rien de changé dans les factures et paiements de l'utilisateur : 304 sans requête SQL
+        version = user_view_version(billing_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # Vérifier que la facture appartient à l'utilisateur
-        cursor.execute("""
-            SELECT i.id 
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE i.id = ? AND u.email = ?
-        """, (invoice_id, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        if not repositories.invoices.get(invoice_id, user_email):
             return jsonify({'message': 'Facture non trouvée ou accès non autorisé'}), 404
         
-        # Récupérer les paiements de la facture
-        cursor.execute("""
-            SELECT id, amount, payment_method, transaction_id, status, paid_at
-            FROM payments 
-            WHERE invoice_id = ?
-            ORDER BY paid_at DESC
-        """, (invoice_id,))
-        
-        payments = cursor.fetchall()
-        conn.close()
+        try:
+            page = list_page('invoice_payments')
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
-        # Formater les résultats
-        payments_list = []
-        for payment in payments:
-            payments_list.append({
-                'id': payment[0],
-                'amount': payment[1],
-                'payment_method': payment[2],
-                'transaction_id': payment[3],
-                'status': payment[4],
-                'paid_at': payment[5]
-            })
+        # Récupérer les paiements de la facture
+        payments = repositories.payments.list_for_invoice(invoice_id, page.filters, page.after, page.fetch)
+        payments, meta = page.result(payments, lambda payment: payment.paid_at,
+                                     lambda cap: repositories.payments.count_for_invoice(invoice_id, page.filters, cap))
         
-        return jsonify({'payments': payments_list}), 200
+        return with_version(jsonify({'payments': [payment.to_dict(Payment.INVOICE_FIELDS) for payment in payments], **meta}),
+                            version), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -1134,156 +954,64 @@ def get_payment(payment_id):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        # Rien de changé dans les factures et paiements de l'utilisateur : 304 sans requête SQL
+        version = user_view_version(billing_key, user_email)
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # Récupérer le paiement avec vérification de propriété
-        cursor.execute("""
-            SELECT p.id, p.invoice_id, p.amount, p.payment_method, 
-                   p.transaction_id, p.status, p.paid_at,
-                   i.amount as invoice_amount, i.month, i.status as invoice_status,
-                   m.meter_number, m.meter_name
-            FROM payments p
-            JOIN invoices i ON p.invoice_id = i.id
-            JOIN meters m ON i.meter_id = m.id
-            JOIN users u ON m.user_id = u.id
-            WHERE p.id = ? AND u.email = ?
-        """, (payment_id, user_email))
-        
-        payment = cursor.fetchone()
-        conn.close()
+        payment = repositories.payments.get(payment_id, user_email)
         
         if payment:
-            return jsonify({
-                'payment': {
-                    'id': payment[0],
-                    'invoice_id': payment[1],
-                    'amount': payment[2],
-                    'payment_method': payment[3],
-                    'transaction_id': payment[4],
-                    'status': payment[5],
-                    'paid_at': payment[6],
-                    'invoice_amount': payment[7],
-                    'invoice_month': payment[8],
-                    'invoice_status': payment[9],
-                    'meter_number': payment[10],
-                    'meter_name': payment[11]
-                }
-            }), 200
+            return with_version(jsonify({'payment': payment.to_dict()}), version), 200
         else:
             return jsonify({'message': 'Paiement non trouvé ou accès non autorisé'}), 404
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
-# -----------------------------------------------------------------------------------------------
-# Traitement consommation avec vérification de seuil (sans modification de base)
-# -----------------------------------------------------------------------------------------------
-def process_consumption_data(data):
-    """Traite les données de consommation et vérifie le seuil pour coupure automatique"""
+
+#------------------------------------------------------------------------------------------------
+#                                  SYNCHRONISATION DIFFÉRENTIELLE
+#------------------------------------------------------------------------------------------------
+@app.route('/changes', methods=['GET'])
+@jwt_required()
+def get_changes():
+    """Compteurs, factures et paiements modifiés depuis le curseur `since` (changes.py)
+    
+    Chaque entité une seule fois : {'entity', 'id', 'op': 'insert' | 'update', 'data'} avec son état
+    actuel, ou {'entity', 'id', 'op': 'delete'}. limit : entités par réponse (PAGE_SIZE_MAX au plus) ;
+    has_more : rappeler avec le nouveau cursor. reset : sans since, ou curseur trop ancien ou d'une autre
+    base, recharger les listes complètes puis reprendre avec le cursor renvoyé.
+    """
     try:
-        meter_number = data.get('meter_number')
-        kwh = data.get('kwh', 0)
+        user_email = get_jwt_identity()
+        user_id = repositories.users.id_for_email(user_email)
         
-        # Vérifications initiales
-        if not meter_number:
-            print("[MQTT ERROR] Numéro de compteur manquant dans les données")
-            return
+        if user_id is None:
+            return jsonify({'message': 'Utilisateur non trouvé'}), 404
         
-        if not kwh:
-            print("[MQTT ERROR] Valeur de consommation manquante")
-            return
+        limit = request.args.get('limit', str(app.config['PAGE_SIZE_MAX']))
+        if not limit.isdigit() or not 1 <= int(limit) <= app.config['PAGE_SIZE_MAX']:
+            return jsonify({'message': f"limit doit être compris entre 1 et {app.config['PAGE_SIZE_MAX']}"}), 400
         
-        # Convertir en float avec validation
         try:
-            consumption = float(kwh)
-            if consumption < 0:
-                print(f"[MQTT ERROR] Consommation négative: {consumption}kWh")
-                return
-        except ValueError:
-            print(f"[MQTT ERROR] Valeur de consommation invalide: {kwh}")
-            return
-        
-        # Vérifier que le compteur existe ET appartient à un utilisateur actif
-        if not is_valid_meter(meter_number):
-            print(f"[MQTT WARNING] Compteur {meter_number} invalide ou inactif")
-            return
-        
-        # Récupérer la consommation actuelle
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT cumulative_consumption 
-            FROM meters 
-            WHERE meter_number = ?
-        """, (meter_number,))
-        
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            print(f"[MQTT ERROR] Compteur {meter_number} non trouvé")
-            return
+            page = change_feed.page(user_id, request.args.get('since'), int(limit))
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
         
-        current_cumulative = result[0]
-        new_cumulative = current_cumulative + consumption
-        
-        # Mettre à jour la consommation cumulative
-        cursor.execute("""
-            UPDATE meters 
-            SET cumulative_consumption = ?, 
-                updated_at = CURRENT_TIMESTAMP
-            WHERE meter_number = ?
-        """, (new_cumulative, meter_number))
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"[MQTT SUCCESS] Consommation enregistrée pour {meter_number}: {consumption}kWh, Total: {new_cumulative}kWh")
-        
-        # -----------------------------------------------------------------
-        # VÉRIFICATION MANUELLE DU SEUIL (sans colonne energy_threshold)
-        # On utilise un seuil fixe ou on récupère depuis les factures
-        # -----------------------------------------------------------------
-        energy_threshold = get_energy_threshold_for_meter(meter_number)
-        
-        if energy_threshold is not None and new_cumulative >= energy_threshold:
-            print(f"[MQTT ALERT] Seuil atteint pour {meter_number}: {new_cumulative}/{energy_threshold}kWh")
+        return jsonify(page), 200
             
-            # Envoyer la commande OFF
-            if send_mqtt_command(meter_number, "OFF"):
-                print(f"[MQTT] Commande OFF envoyée automatiquement pour {meter_number}")
-            else:
-                print(f"[MQTT ERROR] Échec envoi commande OFF pour {meter_number}")
-        
     except Exception as e:
-        print(f"[MQTT ERROR] Erreur traitement données: {e}")
-
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+# -----------------------------------------------------------------------------------------------
+# Seuil d'énergie d'un compteur
+# -----------------------------------------------------------------------------------------------
 def get_energy_threshold_for_meter(meter_number):
     """Détermine le seuil d'énergie pour un compteur"""
     try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        # Méthode 1: Récupérer depuis la dernière facture payée
-        cursor.execute("""
-            SELECT i.kwh 
-            FROM invoices i
-            JOIN meters m ON i.meter_id = m.id
-            WHERE m.meter_number = ? AND i.status = 'paid'
-            ORDER BY i.issued_at DESC
-            LIMIT 1
-        """, (meter_number,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            # Utiliser le kwh de la dernière facture payée comme seuil
-            return float(result[0])
-        else:
-            # Méthode 2: Seuil par défaut (100 kWh)
-            return 100.0
+        # kwh de la dernière facture payée, ou seuil par défaut (100 kWh), mis en cache par le registre
+        return meter_registry.threshold(meter_number)
             
     except Exception as e:
         print(f"[THRESHOLD ERROR] Erreur récupération seuil: {e}")
@@ -1302,39 +1030,15 @@ def check_energy_threshold(meter_number):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que le compteur appartient à l'utilisateur
-        cursor.execute("""
-            SELECT m.id 
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE m.meter_number = ? AND u.email = ?
-        """, (meter_number, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        meter = meter_registry.owned_by(meter_number, user_email)
+        if not meter:
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
-        # Récupérer la consommation cumulative
-        cursor.execute("""
-            SELECT cumulative_consumption 
-            FROM meters 
-            WHERE meter_number = ?
-        """, (meter_number,))
-        
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            return jsonify({'message': 'Erreur récupération consommation'}), 500
-        
-        current_consumption = result[0]
+        # Consommation cumulative et seuil servis depuis le registre
+        current_consumption = meter.cumulative
         energy_threshold = get_energy_threshold_for_meter(meter_number)
         
-        conn.close()
-        
         threshold_reached = current_consumption >= energy_threshold
         
         return jsonify({
@@ -1368,35 +1072,22 @@ def send_meter_command():
         if command not in ['ON', 'OFF']:
             return jsonify({'message': 'Commande invalide. Utilisez ON ou OFF'}), 400
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que le compteur appartient à l'utilisateur
-        cursor.execute("""
-            SELECT m.id 
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE m.meter_number = ? AND u.email = ?
-        """, (meter_number, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        if not meter_registry.owned_by(meter_number, user_email):
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
-        conn.close()
+        # Planifier la commande (ignorée si le relais est déjà dans cet état)
+        relay_dispatcher.request(meter_number, command)
         
-        # Envoyer la commande MQTT
-        if send_mqtt_command(meter_number, command):
-            # Si commande ON, réinitialiser la consommation cumulative
-            if command == "ON":
-                reset_cumulative_consumption(meter_number)
-            
-            return jsonify({
-                'message': f'Commande {command} envoyée avec succès',
-                'meter_number': meter_number
-            }), 200
-        else:
-            return jsonify({'message': 'Erreur lors de l\'envoi de la commande'}), 500
+        # Si commande ON, réinitialiser la consommation cumulative
+        if command == "ON":
+            reset_cumulative_consumption(meter_number)
+        
+        return jsonify({
+            'message': f'Commande {command} envoyée avec succès',
+            'meter_number': meter_number,
+            'relay': relay_dispatcher.state(meter_number)
+        }), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -1404,17 +1095,15 @@ def send_meter_command():
 def reset_cumulative_consumption(meter_number):
     """Réinitialise la consommation cumulative d'un compteur"""
     try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE meters 
-            SET cumulative_consumption = 0.0 
-            WHERE meter_number = ?
-        """, (meter_number,))
-        
-        conn.commit()
-        conn.close()
+        def reset():
+            repositories.meters.reset_cumulative(meter_number)
+            return meter_registry.next_order()
+        
+        # Ordre du commit : un lot validé avant la remise à zéro mais appliqué après ne la défait pas
+        meter_registry.set_cumulative(meter_number, 0.0, repositories.write(reset))
+        meter = meter_registry.lookup(meter_number)
+        if meter is not None:
+            change_versions.bump(meter_key(meter.id), meters_key(meter.user_id))
         print(f"[DB] Consommation réinitialisée pour {meter_number}")
         
     except Exception as e:
@@ -1428,23 +1117,14 @@ def reset_cumulative_consumption(meter_number):
 
 
 
+
 #-----------------------------------------------------------------------------------------------
 #                                  FONCTIONS DE GESTION DE CONSOMMATION                                      
 # ---------------------------------------------------------------------------------------------
 def is_valid_meter(meter_number):
     """Vérifie si le compteur existe ET est actif"""
     try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, status 
-            FROM meters 
-            WHERE meter_number = ? AND status = 'active'
-        """, (meter_number,))
-        
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        return meter_registry.is_active(meter_number)
         
     except Exception as e:
         print(f"[DB ERROR] Erreur vérification compteur: {e}")
@@ -1453,62 +1133,171 @@ def is_valid_meter(meter_number):
 def add_consumption(meter_number, consumption):
     """Ajoute de la consommation de manière cumulative pour un compteur EXISTANT"""
     try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT cumulative_consumption FROM meters WHERE meter_number = ?", (meter_number,))
-        result = cursor.fetchone()
-        
-        if not result:
-            conn.close()
-            print(f"[DB ERROR] Compteur {meter_number} non trouvé lors de l'ajout")
-            return False
-        
-        current_cumulative = result[0]
-        new_cumulative = current_cumulative + consumption
+        return flush_consumption_batch([(meter_number, int(time.time()), consumption, 0)]) > 0
         
-        # Mettre à jour la consommation cumulative
-        cursor.execute("""
-            UPDATE meters 
-            SET cumulative_consumption = ?, 
-                updated_at = CURRENT_TIMESTAMP
-            WHERE meter_number = ?
-        """, (new_cumulative, meter_number))
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"[DB] Consommation ajoutée pour {meter_number}: {consumption}kWh, Total: {new_cumulative}kWh")
-        
-        # Vérifier automatiquement le seuil après chaque ajout
+    except Exception as e:
+        print(f"[DB ERROR] Erreur ajout consommation: {e}")
+        return False
+
+def flush_consumption_batch(readings):
+    """Écrit un lot de lectures (fusionnées par compteur) en une seule transaction"""
+    # Checkpoint du journal une fois le lot écrit : jamais au-delà d'une lecture pas encore en base
+    seqs = [reading[3] for reading in readings if reading[3]]
+    checkpoint = ingest_journal.checkpoint_after(seqs) if seqs else 0
+    
+    # Compteurs actifs du lot (registre en mémoire, aucune lecture SQL)
+    batch = []
+    for meter_number, ts, consumption, seq in readings:
+        meter = meter_registry.lookup(meter_number)
+        if meter is not None and meter.active:
+            batch.append((meter, ts, consumption))
+    
+    # Fenêtres de dédoublonnage avant le lot : restaurées si l'écriture échoue, pour qu'un nouvel
+    # essai ou un rejeu du journal ne prenne pas ces lectures pour des doublons
+    dedupe_state = reading_deduplicator.snapshot({meter.id for meter, _, _ in batch})
+    
+    # Première lecture d'un compteur depuis le démarrage : amorcer sa fenêtre depuis la base
+    unseen = {meter.id for meter, _, _ in batch if meter.id not in reading_deduplicator}
+    if unseen:
+        seed_dedupe_window(unseen, min(ts for _, ts, _ in batch))
+    
+    # Écarter les doublons (redélivrances QoS 1, renvois capteur) et isoler les lectures tardives
+    accepted = []
+    late_rows = []
+    for meter, ts, consumption in batch:
+        verdict = reading_deduplicator.check(meter.id, ts)
+        if verdict == ACCEPTED:
+            accepted.append((meter, ts, consumption))
+        elif verdict == LATE and app.config['INGEST_LATE_POLICY'] == 'store':
+            late_rows.append((meter.id, ts, kwh_to_wh(consumption)))
+    
+    def write_batch():
+        # Cumuls, historique brut, agrégats, lectures tardives et checkpoint dans la même transaction
+        # (verrou d'écriture pris d'emblée : l'horizon de rétention lu ici ne bouge pas avant le commit)
+        with repositories.transaction(immediate=True):
+            # Mois gelés par la rétention : leurs lectures brutes sont archivées, celles-ci sont tardives
+            horizon = repositories.readings.retention_state(HORIZON)
+            totals = {}
+            rows = []
+            for meter, ts, consumption in accepted:
+                if ts < horizon:
+                    if app.config['INGEST_LATE_POLICY'] == 'store':
+                        late_rows.append((meter.id, ts, kwh_to_wh(consumption)))
+                    continue
+                totals[meter.meter_number] = totals.get(meter.meter_number, 0.0) + consumption
+                rows.append((meter.id, ts, kwh_to_wh(consumption)))
+            
+            cumulatives = repositories.meters.add_cumulative(totals)
+            repositories.readings.insert(rows)
+            repositories.readings.store_late(late_rows)
+            # Le lot est appliqué : avancer le checkpoint du journal jusqu'à la première lecture en attente
+            if checkpoint:
+                repositories.readings.advance_checkpoint(app.config['INGEST_JOURNAL_PATH'], checkpoint)
+        return totals, rows, cumulatives, meter_registry.next_order()
+    
+    # Sans verrou du registre pendant l'écriture : les cumuls relus dans la transaction sont appliqués
+    # selon l'ordre des commits (remise à zéro ou rechargement du registre pendant l'attente)
+    try:
+        totals, rows, cumulatives, order = repositories.write(write_batch)
+    except Exception:
+        reading_deduplicator.restore(dedupe_state)
+        raise
+    ingest_journal.applied(seqs)
+    recent_readings.append_rows(rows)
+    new_totals = {n: value if meter_registry.set_cumulative(n, value, order) is not None else None
+                  for n, value in cumulatives.items()}
+    # Cumul et updated_at des compteurs du lot ont changé
+    touched = {meter.id: meter.user_id for meter, _, _ in accepted if meter.meter_number in totals}
+    change_versions.bump(*(meter_key(meter_id) for meter_id in touched),
+                         *{meters_key(user_id) for user_id in touched.values()})
+    
+    ingest_journal.compact(checkpoint)
+    
+    print(f"[DB] Lot enregistré: {len(readings)} lectures, {len(new_totals)} compteurs")
+    
+    # Vérifier automatiquement le seuil après chaque lot
+    events = []
+    reached = []
+    for meter_number, new_cumulative in new_totals.items():
+        if new_cumulative is None:
+            continue
         energy_threshold = get_energy_threshold_for_meter(meter_number)
+        events.extend(consumption_events(meter_number, new_cumulative, totals[meter_number], energy_threshold))
         if new_cumulative >= energy_threshold:
+            reached.append(meter_number)
+    # Consommations et alertes du lot poussées avant les commandes OFF qu'elles déclenchent
+    live_broadcaster.publish(events)
+    for meter_number in reached:
+        # Le répartiteur écarte les OFF déjà demandés ou confirmés ; la garde annule un OFF devenu
+        # inutile (paiement) avant son envoi ou sa relance
+        if relay_dispatcher.request(meter_number, "OFF",
+                                    guard=lambda meter_number=meter_number: threshold_still_reached(meter_number)):
             print(f"[THRESHOLD] Seuil atteint! Envoi commande OFF pour {meter_number}")
-            send_mqtt_command(meter_number, "OFF")
-        
-        return True
-        
-    except Exception as e:
-        print(f"[DB ERROR] Erreur ajout consommation: {e}")
+    
+    return len(new_totals)
+
+def threshold_still_reached(meter_number):
+    """Garde des OFF de seuil : le compteur dépasse-t-il encore son seuil au moment de l'envoi ?
+    
+    Hors mode inline, un paiement ou une remise à zéro validés par un autre processus n'ont mis à jour
+    que son propre registre : cumul et seuil sont relus en base avant chaque envoi (premier et relances).
+    """
+    meter = meter_registry.lookup(meter_number)
+    if meter is None or not meter.active:
         return False
+    cumulative = meter.cumulative
+    if app.config['INGEST_MODE'] != 'inline':
+        stored = repositories.meters.get_by_number(meter_number)
+        if stored is None or stored.status != 'active':
+            return False
+        cumulative = stored.cumulative_consumption or 0.0
+        meter_registry.invalidate_threshold(meter.id)
+    return cumulative >= meter_registry.threshold(meter_number)
+
+def consumption_events(meter_number, cumulative, delta, energy_threshold):
+    """Événements SSE d'un compteur après un lot : consommation, et alerte au franchissement d'un palier
+    
+    'warning' à LIVE_WARNING_RATIO du seuil, 'reached' au seuil ; delta None (cumul relu en base) :
+    pas d'alerte, le franchissement n'est pas connu.
+    """
+    meter = meter_registry.lookup(meter_number)
+    if meter is None:
+        return []
+    events = [(meter.user_id, 'consumption', meter_number, {
+        'meter_number': meter_number,
+        'cumulative_consumption': cumulative,
+        'delta': delta
+    })]
+    if delta is not None:
+        previous = cumulative - delta
+        for level, limit in (('warning', energy_threshold * app.config['LIVE_WARNING_RATIO']),
+                             ('reached', energy_threshold)):
+            if previous < limit <= cumulative:
+                events.append((meter.user_id, 'threshold', meter_number, {
+                    'meter_number': meter_number,
+                    'level': level,
+                    'cumulative_consumption': cumulative,
+                    'energy_threshold': energy_threshold,
+                    'remaining': max(energy_threshold - cumulative, 0)
+                }))
+    return events
+
+def seed_dedupe_window(meter_ids, since):
+    """Charge les timestamps récents des compteurs pour que la fenêtre survive aux redémarrages"""
+    window_start = since - app.config['INGEST_DEDUPE_WINDOW_S']
+    seen = repositories.readings.recent_timestamps(meter_ids, window_start)
+    # Lectures futures enregistrées avant leur refus à l'ingestion : ignorées, comme à l'ingestion
+    latest = time.time() + app.config['INGEST_MAX_CLOCK_SKEW_S']
+    for meter_id, timestamps in seen.items():
+        reading_deduplicator.seed(meter_id, [ts for ts in timestamps if ts <= latest])
 
 def get_cumulative_consumption(meter_number):
     """Récupère la consommation cumulative d'un compteur"""
     try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
+        meter = meter_registry.lookup(meter_number)
         
-        cursor.execute("""
-            SELECT cumulative_consumption 
-            FROM meters 
-            WHERE meter_number = ?
-        """, (meter_number,))
-        
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result:
-            return result[0]
+        if meter:
+            return meter.cumulative
         else:
             return None
             
@@ -1522,12 +1311,7 @@ def get_cumulative_consumption(meter_number):
 # Vérifier si un compteur existe en base
 # -----------------------------------------------------------------------------------------------
 def meter_exists(meter_number):
-    conn = sqlite3.connect('gridpay.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM meters WHERE meter_number = ?", (meter_number,))
-    exists = cursor.fetchone() is not None
-    conn.close()
-    return exists
+    return meter_registry.lookup(meter_number) is not None
 
 
 # -----------------------------------------------------------------------------------------------
@@ -1537,7 +1321,8 @@ def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("[MQTT] Connecté au broker avec succès")
         for topic in mqtt_topics:
-            client.subscribe(topic)
+            # QoS 1 : les redélivrances sont écartées par le dédoublonnage
+            client.subscribe(topic, qos=1)
             print(f"[MQTT] Abonné au topic: {topic}")
     else:
         print(f"[MQTT] Erreur de connexion: {rc}")
@@ -1546,14 +1331,31 @@ def on_connect(client, userdata, flags, rc):
 def on_message(client, userdata, msg):
     """Callback quand on reçoit des données de consommation MQTT"""
     try:
-        payload = msg.payload.decode()
-        data = json.loads(payload)
-
         # Extraire le numéro de compteur du topic
         topic_parts = msg.topic.split('/')
-        if len(topic_parts) >= 2:
-            meter_number = topic_parts[1]  # electricity/{meter_number}/consumption
-            data['meter_number'] = meter_number
+        if len(topic_parts) < 3:
+            return
+        meter_number = topic_parts[1]  # electricity/{meter_number}/consumption
+
+        # Acquittement du relais : electricity/{meter_number}/relay/state
+        if topic_parts[2:] == ['relay', 'state']:
+            on_relay_state(meter_number, msg.payload)
+            return
+        if len(topic_parts) != 3 or topic_parts[2] != 'consumption':
+            return
+
+        # Worker en partition par hachage : ne garder que ses compteurs (ordre préservé par compteur)
+        if (app.config['INGEST_MODE'] == 'worker' and app.config['INGEST_PARTITION'] == 'hash'
+                and meter_partition(meter_number, app.config['INGEST_WORKERS']) != app.config['INGEST_WORKER_INDEX']):
+            return
+
+        # Filtrer les compteurs inconnus avant de décoder le message (cache négatif du registre)
+        if not meter_registry.is_active(meter_number):
+            return
+
+        payload = msg.payload.decode()
+        data = json.loads(payload)
+        data['meter_number'] = meter_number
 
         print(f"[MQTT] Données reçues sur {msg.topic}: {data}")
 
@@ -1564,11 +1366,28 @@ def on_message(client, userdata, msg):
         print(f"[MQTT ERROR] Erreur traitement: {e}")
 
 
+def on_relay_state(meter_number, payload):
+    """Enregistre l'état du relais rapporté par l'appareil"""
+    data = json.loads(payload.decode())
+    state = data.get('state')
+    if state not in ('ON', 'OFF'):
+        print(f"[RELAY] État inconnu pour {meter_number}: {data}")
+        return
+    relay_dispatcher.on_ack(meter_number, state)
+
+def publish_relay_change(meter_number, state):
+    """Pousse l'état du relais (nouvelle commande ou acquittement) aux applications du propriétaire"""
+    meter = meter_registry.lookup(meter_number)
+    if meter is not None:
+        relay = {field: state[field] for field in ('desired', 'confirmed', 'pending', 'failed')}
+        live_broadcaster.publish([(meter.user_id, 'relay', meter_number, {'meter_number': meter_number, **relay})])
+
+
 # -----------------------------------------------------------------------------------------------
 # Traitement consommation
 # -----------------------------------------------------------------------------------------------
 def process_consumption_data(data):
-    """Traite les données de consommation et les stocke en base"""
+    """Valide les données de consommation et les place dans la file d'ingestion"""
     try:
         meter_number = data.get('meter_number')
         kwh = data.get('kwh', 0)
@@ -1582,45 +1401,104 @@ def process_consumption_data(data):
             print("[MQTT ERROR] Valeur de consommation manquante")
             return
         
-        # Convertir en float avec validation
+        # Convertir en float avec validation (NaN et Infinity passent json.loads et float())
         try:
             consumption = float(kwh)
-            if consumption < 0:
-                print(f"[MQTT ERROR] Consommation négative: {consumption}kWh")
-                return
-        except ValueError:
+        except (TypeError, ValueError):
+            ingest_pipeline.reject('kwh')
             print(f"[MQTT ERROR] Valeur de consommation invalide: {kwh}")
             return
+        if not math.isfinite(consumption) or consumption > app.config['INGEST_MAX_KWH']:
+            ingest_pipeline.reject('kwh')
+            print(f"[MQTT ERROR] Valeur de consommation hors limites pour {meter_number}: {kwh}")
+            return
+        if consumption < 0:
+            print(f"[MQTT ERROR] Consommation négative: {consumption}kWh")
+            return
         
-        # ➡️ Vérifier que le compteur existe ET appartient à un utilisateur actif
-        if not is_valid_meter(meter_number):
-
-            print(f"[MQTT WARNING] Compteur {meter_number} invalide ou inactif")
+        # Timestamp du capteur converti une seule fois, à l'ingestion. Sans lui, pas d'heure d'arrivée :
+        # deux lectures de la même seconde passeraient pour des doublons, un renvoi serait compté deux fois
+        try:
+            ts = read_timestamp(data.get('timestamp'))
+        except ValueError as e:
+            ingest_pipeline.reject('timestamp')
+            print(f"[MQTT ERROR] Lecture refusée pour {meter_number}: {e}")
+            return
+        # Un timestamp futur déplacerait la fenêtre de dédoublonnage : les vraies lectures suivantes
+        # passeraient pour tardives jusqu'à cette date
+        if ts > time.time() + app.config['INGEST_MAX_CLOCK_SKEW_S']:
+            ingest_pipeline.reject('future')
+            print(f"[MQTT ERROR] Lecture refusée pour {meter_number}: timestamp dans le futur ({ts})")
             return
         
-        # ➡️ Ajouter la consommation (sans re-vérification)
-        if add_consumption(meter_number, consumption):
-            print(f"[MQTT SUCCESS] Consommation enregistrée pour {meter_number}: {consumption}kWh")
-        else:
-            print(f"[MQTT ERROR] Échec enregistrement pour {meter_number}")
+        # ➡️ Journaliser (durable au prochain fsync groupé) puis mettre en file pour l'écrivain
+        seq = ingest_journal.append(meter_number, ts, consumption)
+        if not ingest_pipeline.submit((meter_number, ts, consumption, seq)):
+            # Le checkpoint reste sous cette lecture ; l'écrivain la relira dans le journal quand la file baissera
+            ingest_journal.defer([seq])
+            print(f"[MQTT ERROR] File d'ingestion pleine pour {meter_number}, lecture conservée dans le journal")
         
     except Exception as e:
         print(f"[MQTT ERROR] Erreur traitement données: {e}")
 
+# -----------------------------------------------------------------------------------------------
+# Reprise après arrêt : rejouer le journal au-delà du checkpoint
+# -----------------------------------------------------------------------------------------------
+def defer_failed_batch(batch):
+    """Lot abandonné par l'écrivain après ses essais : ses lectures seront relues dans le journal"""
+    ingest_journal.defer([reading[3] for reading in batch])
+
+def quarantine_reading(reading, error):
+    """Lecture qu'aucune écriture n'accepte : conservée dans INGEST_QUARANTINE_PATH (format de l'import
+    en masse, pour la réimporter une fois corrigée) et retirée du journal pour que le checkpoint avance"""
+    meter_number, ts, kwh, seq = reading
+    with open(app.config['INGEST_QUARANTINE_PATH'], 'a') as quarantine:
+        quarantine.write(json.dumps({'meter_number': meter_number, 'timestamp': ts, 'kwh': kwh,
+                                     'seq': seq, 'error': str(error)}) + '\n')
+        quarantine.flush()
+        os.fsync(quarantine.fileno())
+    ingest_journal.applied([seq])
+
+def get_ingest_checkpoint():
+    return repositories.readings.checkpoint(app.config['INGEST_JOURNAL_PATH'])
+
+def replay_ingest_journal(path, after_seq):
+    """Réapplique en base les lectures journalisées après after_seq"""
+    replayed = 0
+    batch = []
+    for seq, meter_number, ts, kwh in read_journal(path, after_seq):
+        batch.append((meter_number, ts, kwh, seq))
+        if len(batch) >= app.config['INGEST_BATCH_SIZE']:
+            flush_consumption_batch(batch)
+            replayed += len(batch)
+            batch = []
+    if batch:
+        flush_consumption_batch(batch)
+        replayed += len(batch)
+    
+    if replayed:
+        print(f"[JOURNAL] {replayed} lectures rejouées depuis la séquence {after_seq}")
+    return replayed
+
 # -----------------------------------------------------------------------------------------------
 # Initialisation MQTT
 # -----------------------------------------------------------------------------------------------
-def init_mqtt(topics):
-    """Initialise et connecte le client MQTT avec une liste de topics"""
+def init_mqtt():
+    """Initialise et connecte le client MQTT (une seule fois, abonnement générique)"""
     global mqtt_client, mqtt_topics
 
-    mqtt_topics = topics
+    if mqtt_client:
+        return
 
-    try:
-        if mqtt_client:
-            mqtt_client.loop_stop()
-            mqtt_client.disconnect()
+    # En mode 'workers' l'API ne fait que publier ; chaque worker s'abonne pour sa part
+    if app.config['INGEST_MODE'] == 'inline':
+        mqtt_topics = [CONSUMPTION_TOPIC]
+    elif app.config['INGEST_MODE'] == 'worker':
+        mqtt_topics = [SHARED_CONSUMPTION_TOPIC if app.config['INGEST_PARTITION'] == 'shared' else CONSUMPTION_TOPIC]
+    # Tous les processus qui commandent des relais suivent leurs acquittements
+    mqtt_topics.append(RELAY_STATE_TOPIC)
 
+    try:
         mqtt_client = mqtt.Client(transport="websockets")
         mqtt_client.on_connect = on_connect
         mqtt_client.on_message = on_message
@@ -1628,8 +1506,9 @@ def init_mqtt(topics):
         # Activer TLS obligatoire pour PythonAnywhere (seuls 443/8883/8884 sortent)
         mqtt_client.tls_set()
 
-        print(f"[MQTT] Connexion au broker {BROKER}:{PORT} pour {len(topics)} topics...")
-        mqtt_client.connect(BROKER, PORT, 60)
+        # loop_start gère la (re)connexion ; on_connect rétablit l'abonnement
+        print(f"[MQTT] Connexion au broker {BROKER}:{PORT} pour {len(mqtt_topics)} topics...")
+        mqtt_client.connect_async(BROKER, PORT, 60)
         mqtt_client.loop_start()
 
     except Exception as e:
@@ -1647,7 +1526,10 @@ def send_mqtt_command(meter_number, command):
         try:
             topic = f"electricity/{meter_number}/relay"
             message = {"command": command}
-            mqtt_client.publish(topic, json.dumps(message))
+            result = mqtt_client.publish(topic, json.dumps(message), qos=1)
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                print(f"[MQTT ERROR] Commande {command} non publiée sur {topic} (rc={result.rc})")
+                return False
             print(f"[MQTT] Commande {command} envoyée sur {topic}")
             return True
         except Exception as e:
@@ -1668,43 +1550,270 @@ def get_cumulative_consumption_route(meter_number):
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Vérifier que le compteur appartient à l'utilisateur
-        cursor.execute("""
-            SELECT m.id, m.meter_name
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE m.meter_number = ? AND u.email = ?
-        """, (meter_number, user_email))
-        
-        meter = cursor.fetchone()
+        meter = meter_registry.owned_by(meter_number, user_email)
         
         if not meter:
-            conn.close()
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
-        meter_id, meter_name = meter
+        meter_name = meter.meter_name
+        
+        # Cumul inchangé depuis la dernière consultation (tableau de bord inactif) : 304
+        version = view_version(meter_key(meter.id))
+        response = not_modified(version)
+        if response is not None:
+            return response
         
         # Récupérer la consommation cumulative
         cumulative_consumption = get_cumulative_consumption(meter_number)
         
         if cumulative_consumption is None:
-            conn.close()
             return jsonify({'message': 'Erreur lors de la récupération de la consommation'}), 500
         
-        conn.close()
-        
-        return jsonify({
+        return with_version(jsonify({
             'meter_number': meter_number,
             'meter_name': meter_name,
             'cumulative_consumption': cumulative_consumption
+        }), version), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+    
+
+@app.route('/api/consumption/summary', methods=['GET'])
+@jwt_required()
+def get_consumption_summary():
+    """Tableau de bord en un appel : cumul, seuil, reste, relais de chaque compteur et total du foyer
+    
+    Remplace /meters suivi d'un cumulative_consumption par compteur. Tout vient de la mémoire
+    (registre, cache des seuils, répartiteur des relais) : aucune requête SQL une fois les seuils en cache.
+    """
+    try:
+        user_email = get_jwt_identity()
+        
+        user_id = meter_registry.user_id_for(user_email)
+        if user_id is None:
+            return jsonify({'message': 'Utilisateur non trouvé'}), 404
+        
+        meters = []
+        total_consumption = 0.0
+        for meter in meter_registry.meters_of(user_id):
+            energy_threshold = get_energy_threshold_for_meter(meter.meter_number)
+            relay = relay_dispatcher.state(meter.meter_number) or RelayState().to_dict()
+            meters.append({
+                'meter_id': meter.id,
+                'meter_number': meter.meter_number,
+                'meter_name': meter.meter_name,
+                'status': meter.status,
+                'cumulative_consumption': meter.cumulative,
+                'energy_threshold': energy_threshold,
+                'remaining': max(energy_threshold - meter.cumulative, 0),
+                'threshold_reached': meter.cumulative >= energy_threshold,
+                'relay': {field: relay[field] for field in ('desired', 'confirmed', 'pending', 'failed')}
+            })
+            total_consumption += meter.cumulative
+        
+        response = jsonify({
+            'meters': meters,
+            'meter_count': len(meters),
+            'total_consumption': total_consumption
+        })
+        
+        # Résumé construit en mémoire : ETag calculé sur le corps, 304 si le client l'a déjà
+        if app.config['CONDITIONAL_GET']:
+            response.add_etag(weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.make_conditional(request)
+        return response
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+    
+
+@app.route('/api/live/ticket', methods=['POST'])
+@jwt_required()
+def create_live_ticket():
+    """Ticket du flux SSE pour EventSource, qui ne peut pas envoyer d'en-tête Authorization
+    
+    GET /api/live?ticket=<ticket> : valable LIVE_TICKET_TTL_S secondes, pour le flux seulement. Les
+    autres clients gardent Authorization: Bearer <jwt>, hors des URL (journaux des proxys).
+    """
+    try:
+        user_email = get_jwt_identity()
+        if meter_registry.user_id_for(user_email) is None:
+            return jsonify({'message': 'Utilisateur non trouvé'}), 404
+        
+        ticket = create_access_token(identity=user_email, additional_claims={'scope': 'live'},
+                                     expires_delta=timedelta(seconds=app.config['LIVE_TICKET_TTL_S']))
+        return jsonify({'ticket': ticket, 'expires_in': app.config['LIVE_TICKET_TTL_S']}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+@app.route('/api/meters/<string:meter_number>/readings', methods=['GET'])
+@jwt_required()
+def get_meter_readings(meter_number):
+    """Historique des lectures brutes d'un compteur (from/to en epoch ou ISO)"""
+    try:
+        user_email = get_jwt_identity()
+        
+        # Vérifier que le compteur appartient à l'utilisateur
+        meter = meter_registry.owned_by(meter_number, user_email)
+        if not meter:
+            return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
+        
+        now = int(time.time())
+        start = parse_timestamp(request.args.get('from', now - 86400))
+        end = parse_timestamp(request.args.get('to', now + 1))
+        limit = request.args.get('limit', 1000, type=int)
+        if limit < 1:
+            # SQLite lit LIMIT -1 comme « sans limite » : le plafond serait contourné
+            return jsonify({'message': 'limit doit être compris entre 1 et 10000'}), 400
+        limit = min(limit, 10000)
+        
+        readings = repositories.readings.range(meter.id, start, end, limit)
+        
+        return jsonify({
+            'meter_number': meter_number,
+            'from': start,
+            'to': end,
+            'readings': [{'ts': ts, 'wh': wh} for ts, wh in readings]
         }), 200
         
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+@app.route('/api/meters/<string:meter_number>/recent', methods=['GET'])
+@jwt_required()
+def get_meter_recent_readings(meter_number):
+    """Dernières lectures d'un compteur servies depuis la mémoire (tableau de bord, since=epoch pour les nouvelles)
     
+    Au plus RECENT_BUFFER_SIZE lectures des RECENT_WINDOW_S dernières secondes (une heure par défaut) ;
+    un capteur plus rapide que RECENT_REPORT_INTERVAL_S ne garde que ses plus récentes.
+    """
+    try:
+        user_email = get_jwt_identity()
+        
+        # Vérifier que le compteur appartient à l'utilisateur (registre en mémoire)
+        meter = meter_registry.owned_by(meter_number, user_email)
+        if not meter:
+            return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
+        
+        since = parse_timestamp(request.args['since']) if 'since' in request.args else None
+        now = int(time.time())
+        window_start = now - app.config['RECENT_WINDOW_S']
+        
+        def load():
+            return repositories.readings.range(meter.id, window_start, now + 1, app.config['RECENT_WINDOW_S'])
+        
+        if app.config['INGEST_MODE'] == 'workers':
+            # Les lectures sont écrites par les workers : ce processus ne voit que la base
+            source = 'db'
+            readings = load()
+            if since is not None:
+                readings = [(ts, wh) for ts, wh in readings if ts >= since]
+        else:
+            # Chargement et lecture d'un seul tenant : une éviction ne peut pas s'intercaler
+            readings, loaded = recent_readings.fetch(meter.id, load, since)
+            source = 'db' if loaded else 'memory'
+        
+        return jsonify({
+            'meter_number': meter_number,
+            'source': source,
+            'readings': [{'ts': ts, 'wh': wh} for ts, wh in readings]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+@app.route('/api/meters/<string:meter_number>/consumption', methods=['GET'])
+@jwt_required()
+def get_meter_consumption_total(meter_number):
+    """Consommation totale d'un compteur sur une période, lue dans les agrégats les plus grossiers possibles"""
+    try:
+        user_email = get_jwt_identity()
+        
+        # Vérifier que le compteur appartient à l'utilisateur
+        meter = meter_registry.owned_by(meter_number, user_email)
+        if not meter:
+            return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
+        
+        now = int(time.time())
+        start = parse_timestamp(request.args.get('from', now - 86400))
+        end = parse_timestamp(request.args.get('to', now + 1))
+        
+        total_wh, plan = repositories.readings.total(meter.id, start, end)
+        
+        return jsonify({
+            'meter_number': meter_number,
+            'from': start,
+            'to': end,
+            'wh': total_wh,
+            'kwh': total_wh / 1000,
+            'sources': [{'table': table, 'from': lo, 'to': hi} for table, lo, hi in plan]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+@app.route('/api/meters/<string:meter_number>/consumption/<string:granularity>', methods=['GET'])
+@jwt_required()
+def get_meter_consumption_series(meter_number, granularity):
+    """Consommation d'un compteur par minute, heure, jour ou mois"""
+    try:
+        user_email = get_jwt_identity()
+        
+        if granularity not in GRANULARITIES:
+            return jsonify({'message': 'Granularité invalide. Utilisez minute, hour, day ou month'}), 400
+        
+        # Vérifier que le compteur appartient à l'utilisateur
+        meter = meter_registry.owned_by(meter_number, user_email)
+        if not meter:
+            return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
+        
+        now = int(time.time())
+        start = parse_timestamp(request.args.get('from', now - 86400))
+        end = parse_timestamp(request.args.get('to', now + 1))
+        limit = request.args.get('limit', 1000, type=int)
+        if limit < 1:
+            # SQLite lit LIMIT -1 comme « sans limite » : le plafond serait contourné
+            return jsonify({'message': 'limit doit être compris entre 1 et 10000'}), 400
+        limit = min(limit, 10000)
+        
+        buckets = repositories.readings.series(meter.id, granularity, start, end, limit)
+        
+        return jsonify({
+            'meter_number': meter_number,
+            'granularity': granularity,
+            'from': start,
+            'to': end,
+            'buckets': [{'start': bucket, 'wh': wh, 'readings': n} for bucket, wh, n in buckets]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+@app.route('/api/meters/<string:meter_number>/relay', methods=['GET'])
+@jwt_required()
+def get_meter_relay(meter_number):
+    """État du relais : dernière commande demandée et dernier état confirmé par l'appareil"""
+    try:
+        user_email = get_jwt_identity()
+        
+        if not meter_registry.owned_by(meter_number, user_email):
+            return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
+        
+        state = relay_dispatcher.state(meter_number) or RelayState().to_dict()
+        return jsonify({'meter_number': meter_number, 'relay': state}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
 
 @app.route('/api/mqtt/command', methods=['POST'])
 @jwt_required()
@@ -1726,31 +1835,17 @@ def send_command():
         
         # Vérifier que l'utilisateur possède ce compteur
         user_email = get_jwt_identity()
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT m.id 
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE m.meter_number = ? AND u.email = ?
-        """, (meter_number, user_email))
-        
-        if not cursor.fetchone():
-            conn.close()
+        if not meter_registry.owned_by(meter_number, user_email):
             return jsonify({'message': 'Compteur non trouvé ou accès non autorisé'}), 404
         
-        conn.close()
-        
-        # Envoyer la commande MQTT
-        if send_mqtt_command(meter_number, command):
-            return jsonify({
-                'message': f'Commande {command} envoyée avec succès',
-                'meter_number': meter_number,
-                'topic': f"electricity/{meter_number}/relay"
-            }), 200
-        else:
-            return jsonify({'message': 'Erreur lors de l\'envoi de la commande'}), 500
+        # Planifier la commande (ignorée si le relais est déjà dans cet état)
+        relay_dispatcher.request(meter_number, command)
+        return jsonify({
+            'message': f'Commande {command} envoyée avec succès',
+            'meter_number': meter_number,
+            'topic': f"electricity/{meter_number}/relay",
+            'relay': relay_dispatcher.state(meter_number)
+        }), 200
             
     except Exception as e:
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
@@ -1763,35 +1858,24 @@ def init_mqtt_for_user():
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
         # Récupérer tous les compteurs de l'utilisateur
-        cursor.execute("""
-            SELECT meter_number 
-            FROM meters m
-            JOIN users u ON m.user_id = u.id
-            WHERE u.email = ?
-        """, (user_email,))
-        
-        meters = cursor.fetchall()
-        conn.close()
+        meters = repositories.meters.numbers_for_email(user_email)
         
         if not meters:
             return jsonify({'message': 'Aucun compteur trouvé pour cet utilisateur'}), 404
         
         # Créer les topics pour tous les compteurs
-        consumption_topics = [f"electricity/{meter[0]}/consumption" for meter in meters]
-        relay_topics = [f"electricity/{meter[0]}/relay" for meter in meters]
+        consumption_topics = [f"electricity/{meter_number}/consumption" for meter_number in meters]
+        relay_topics = [f"electricity/{meter_number}/relay" for meter_number in meters]
         
         all_topics = consumption_topics + relay_topics
         
-        # Initialiser MQTT avec tous ces topics
-        init_mqtt(all_topics)
+        # Les topics sont couverts par l'abonnement générique : démarrer le client si besoin
+        init_mqtt()
         
         return jsonify({
             'message': f'MQTT initialisé pour {len(meters)} compteurs',
-            'meters': [meter[0] for meter in meters],
+            'meters': meters,
             'topics_consumption': consumption_topics,
             'topics_relay': relay_topics
         }), 200
@@ -1800,6 +1884,207 @@ def init_mqtt_for_user():
         return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
 
 
+@app.route('/api/ingest/stats', methods=['GET'])
+@jwt_required()
+def get_ingest_stats():
+    """Métriques de la file d'ingestion MQTT (profondeur, lots, pertes), réservées aux administrateurs
+    
+    Chemins des bases et du journal, répartition des partitions : rien qui concerne un client.
+    """
+    try:
+        if not is_admin():
+            return jsonify({'message': 'Accès réservé aux administrateurs'}), 403
+        
+        if ingest_pipeline is None:
+            return jsonify({
+                'mode': app.config['INGEST_MODE'],
+                'workers': app.config['INGEST_WORKERS'],
+                'registry': meter_registry.stats(),
+                'relay': relay_dispatcher.stats(),
+                'live': live_broadcaster.stats(),
+                'retention': retention_job.stats(),
+                'db': db.stats(),
+                'db_reader': db.reader().stats(),
+                'db_writer': db_writer.stats(),
+                'shards': repositories.stats() if isinstance(repositories, ShardedRepositories) else None
+            }), 200
+        
+        return jsonify({
+            'mode': app.config['INGEST_MODE'],
+            'ingest': ingest_pipeline.stats(),
+            'journal': ingest_journal.stats(),
+            'dedupe': reading_deduplicator.stats(),
+            'registry': meter_registry.stats(),
+            'relay': relay_dispatcher.stats(),
+            'live': live_broadcaster.stats(),
+            'retention': retention_job.stats(),
+            'recent': recent_readings.stats(),
+            'db': db.stats(),
+            'db_reader': db.reader().stats(),
+            'db_writer': db_writer.stats(),
+            'shards': repositories.stats() if isinstance(repositories, ShardedRepositories) else None
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+
+#-----------------------------------------------------------------------------------------------
+#                                  EXPORTS (FLUX CSV / NDJSON)                                      
+# ---------------------------------------------------------------------------------------------
+
+def is_admin():
+    """L'utilisateur du jeton fait partie de ADMIN_EMAILS"""
+    return get_jwt_identity() in app.config['ADMIN_EMAILS']
+
+@app.route('/api/export/<dataset>', methods=['GET'])
+@jwt_required()
+def export_data(dataset):
+    """Exporte factures, paiements ou lectures en flux (mémoire constante)
+    
+    Paramètres : format (csv|ndjson), gzip=1, meter (numéro), user (email, administrateurs),
+    month (AAAA-MM), status, from/to (epoch ou ISO), after (clé de la dernière ligne reçue :
+    id, ou '<meter_id>:<ts>' pour les lectures). Un utilisateur n'exporte que ses propres données.
+    """
+    try:
+        if dataset not in EXPORT_DATASETS:
+            return jsonify({'message': f"Export invalide (valeurs: {', '.join(EXPORT_DATASETS)})"}), 400
+        
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'message': f"Format invalide (valeurs: {', '.join(EXPORT_FORMATS)})"}), 400
+        
+        user_email = get_jwt_identity()
+        if not is_admin():
+            if request.args.get('user') not in (None, user_email):
+                return jsonify({'message': 'Accès réservé aux administrateurs'}), 403
+        else:
+            user_email = request.args.get('user')
+        
+        month = request.args.get('month')
+        if month is not None and not re.match(r'^\d{4}-\d{2}$', month):
+            return jsonify({'message': 'Format de mois invalide (AAAA-MM)'}), 400
+        
+        try:
+            after = parse_after(dataset, request.args.get('after'))
+        except ValueError:
+            return jsonify({'message': 'Curseur de reprise (after) invalide'}), 400
+        
+        start = parse_timestamp(request.args['from']) if 'from' in request.args else None
+        end = parse_timestamp(request.args['to']) if 'to' in request.args else None
+        filters = {'email': user_email, 'meter_number': request.args.get('meter'), 'month': month,
+                   'status': request.args.get('status')}
+        
+        if dataset == 'readings':
+            # Le mois borne les ts des lectures
+            if month is not None:
+                month_start = int(datetime.strptime(month, '%Y-%m').replace(tzinfo=timezone.utc).timestamp())
+                month_end = bucket_ceil(month_start + 1, 'month')
+                start = max(start or 0, month_start)
+                end = min(end, month_end) if end is not None else month_end
+            rows = export_rows(repositories, dataset, filters, after, start or 0, end)
+        else:
+            filters['start'] = sql_timestamp(start) if start is not None else None
+            filters['end'] = sql_timestamp(end) if end is not None else None
+            rows = export_rows(repositories, dataset, filters, after)
+        
+        chunks = encode(rows, EXPORT_COLUMNS[dataset], fmt)
+        filename = f"gridpay-{dataset}.{fmt}"
+        mimetype = EXPORT_CONTENT_TYPES[fmt]
+        if request.args.get('gzip') == '1':
+            chunks = gzip_chunks(chunks)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        
+        def generate():
+            # Les en-têtes sont partis : une erreur ici ne peut que tronquer l'export (reprendre avec after)
+            try:
+                yield from chunks
+            except Exception as e:
+                print(f"[EXPORT ERROR] Export {dataset} interrompu: {e}")
+        
+        return Response(stream_with_context(generate()), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
+#-----------------------------------------------------------------------------------------------
+#                                  ADMINISTRATION : IMPORT EN MASSE                                      
+# ---------------------------------------------------------------------------------------------
+
+def reload_after_import():
+    """Nouveaux utilisateurs et compteurs : recharger le registre, périmer tous les ETags"""
+    meter_registry.load()
+    change_versions.reset()
+
+@app.route('/api/admin/import/<kind>', methods=['POST'])
+@jwt_required()
+def start_import(kind):
+    """Importe un fichier CSV ou JSONL (gzip accepté) d'utilisateurs, de compteurs ou de lectures
+    
+    Corps : le fichier brut, ou un formulaire multipart avec le champ 'file'.
+    Paramètres : format (csv|jsonl, sinon d'après le nom du fichier), defer_indexes=1.
+    L'import tourne en arrière-plan : suivre sa progression sur /api/admin/import/<id>.
+    """
+    try:
+        if not is_admin():
+            return jsonify({'message': 'Accès réservé aux administrateurs'}), 403
+        
+        if kind not in IMPORT_KINDS:
+            return jsonify({'message': f"Type d'import invalide (valeurs: {', '.join(IMPORT_KINDS)})"}), 400
+        
+        upload = request.files.get('file')
+        filename = upload.filename if upload else request.args.get('filename', '')
+        fmt = request.args.get('format') or detect_format(filename or '')
+        if fmt not in IMPORT_FORMATS:
+            return jsonify({'message': f"Format invalide (valeurs: {', '.join(IMPORT_FORMATS)})"}), 400
+        
+        # Copier le fichier par blocs sur disque : l'import le relit après la réponse
+        fd, path = tempfile.mkstemp(prefix='gridpay-import-', dir=app.config['IMPORT_UPLOAD_DIR'])
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(upload.stream if upload else request.stream, f, 1 << 20)
+        
+        importer = BulkImporter(
+            repositories,
+            kind,
+            chunk_rows=app.config['IMPORT_CHUNK_ROWS'],
+            hash_password=lambda password: bcrypt.generate_password_hash(password).decode('utf-8'),
+            defer_indexes=request.args.get('defer_indexes') == '1',
+            lock=retention_job.lock
+        )
+        # Nouveaux utilisateurs et compteurs : recharger le registre une fois l'import terminé
+        job = ImportJob(len(import_jobs) + 1, importer, path, fmt,
+                        on_done=reload_after_import if kind != 'readings' else None)
+        import_jobs[job.id] = job
+        job.start()
+        print(f"[IMPORT] Import {job.id} ({kind}, {fmt}) démarré par {get_jwt_identity()}")
+        
+        return jsonify({'message': 'Import démarré', 'job': job.stats()}), 202
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+@app.route('/api/admin/import/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_import(job_id):
+    """Progression d'un import : lignes lues, insérées, ignorées, erreurs, lignes/s"""
+    try:
+        if not is_admin():
+            return jsonify({'message': 'Accès réservé aux administrateurs'}), 403
+        
+        job = import_jobs.get(job_id)
+        if job is None:
+            return jsonify({'message': 'Import non trouvé'}), 404
+        
+        return jsonify({'job': job.stats()}), 200
+        
+    except Exception as e:
+        return jsonify({'message': f'Erreur serveur: {str(e)}'}), 500
+
+
 
 # ---------------- More -----------------------
 
@@ -1815,20 +2100,10 @@ def protected():
 @jwt_required()
 def get_user(user_id):
     try:
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, email, phone, name, created_at FROM users WHERE id=?", (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        user = repositories.users.get(user_id)
 
         if user:
-            return jsonify({
-                'id': user[0],
-                'email': user[1],
-                'phone': user[2],
-                'name': user[3],
-                'created_at': user[4]
-            }), 200
+            return jsonify(user.to_dict()), 200
         else:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
             
@@ -1842,20 +2117,10 @@ def get_current_user():
     try:
         user_email = get_jwt_identity()
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name, email, phone, created_at FROM users WHERE email=?", (user_email,))
-        user = cursor.fetchone()
-        conn.close()
+        user = repositories.users.get_by_email(user_email)
 
         if user:
-            return jsonify({
-                'id': user[0],
-                'name': user[1],
-                'email': user[2],
-                'phone': user[3],
-                'created_at': user[4]
-            }), 200
+            return jsonify(user.to_dict()), 200
         else:
             return jsonify({'message': 'Utilisateur non trouvé'}), 404
             
@@ -1867,31 +2132,54 @@ def init_mqtt_at_startup():
     try:
         print("[MQTT] Initialisation au démarrage...")
         
-        conn = sqlite3.connect('gridpay.db')
-        cursor = conn.cursor()
-        
-        # Récupérer tous les compteurs existants
-        cursor.execute("SELECT meter_number FROM meters")
-        meters = cursor.fetchall()
-        conn.close()
-        
-        if meters:
-            # Créer les topics pour tous les compteurs
-            consumption_topics = [f"electricity/{meter[0]}/consumption" for meter in meters]
-            relay_topics = [f"electricity/{meter[0]}/relay" for meter in meters]
-            
-            all_topics = consumption_topics + relay_topics
-            
-            # Initialiser MQTT
-            init_mqtt(all_topics)
-            print(f"[MQTT] ✅ Initialisé pour {len(meters)} compteurs au démarrage")
-            print(f"[MQTT] 📡 Topics: {all_topics}")
-        else:
-            print("[MQTT] ⚠️ Aucun compteur trouvé pour l'initialisation")
+        # Un seul abonnement pour tous les compteurs, filtrés par le registre
+        init_mqtt()
+        print(f"[MQTT] ✅ Initialisé pour {meter_registry.stats()['meters']} compteurs au démarrage")
+        print(f"[MQTT] 📡 Topics: {mqtt_topics}")
             
     except Exception as e:
         print(f"[MQTT STARTUP ERROR] ❌ Erreur initialisation: {e}")
 
+def live_user_id(token):
+    """Utilisateur d'un jeton JWT présenté au flux SSE, None si invalide ou expiré"""
+    try:
+        with app.app_context():
+            email = decode_token(token)[app.config.get('JWT_IDENTITY_CLAIM', 'sub')]
+    except Exception:
+        return None
+    return meter_registry.user_id_for(email)
+
+def live_ticket_user_id(ticket):
+    """Utilisateur d'un ticket de /api/live/ticket présenté en ?ticket=, None si invalide, expiré ou
+    s'il s'agit d'un jeton d'accès (jamais accepté dans l'URL : journaux des proxys)"""
+    try:
+        with app.app_context():
+            claims = decode_token(ticket)
+    except Exception:
+        return None
+    if claims.get('scope') != 'live':
+        return None
+    return meter_registry.user_id_for(claims[app.config.get('JWT_IDENTITY_CLAIM', 'sub')])
+
+def start_registry_refresh(interval):
+    """Recharge le registre toutes les `interval` secondes (cumuls, statuts, seuils des autres processus)"""
+    def refresh():
+        while True:
+            time.sleep(interval)
+            try:
+                # Cumuls écrits par les workers d'ingestion : invalider les vues des compteurs modifiés
+                events = []
+                for meter_id, user_id in meter_registry.load(verbose=False):
+                    change_versions.bump(meter_key(meter_id), meters_key(user_id))
+                    meter = meter_registry.get_by_id(meter_id)
+                    if meter is not None:
+                        events.extend(consumption_events(meter.meter_number, meter.cumulative, None, meter.threshold))
+                live_broadcaster.publish(events)
+            except Exception as e:
+                print(f"[REGISTRY ERROR] Erreur rechargement: {e}")
+    
+    threading.Thread(target=refresh, name="registry-refresh", daemon=True).start()
+
 #-----------------------------------------------------------------------------------------------
 
     
@@ -1903,12 +2191,49 @@ def init_mqtt_at_startup():
 with app.app_context():
     print("Initialisation de l'application...")
     init_db()
+    db_writer.start()
+    meter_registry.load()
+    
+    if app.config['INGEST_MODE'] != 'workers':
+        # Rejouer les lectures reçues mais pas encore en base, puis rouvrir le journal en ajout
+        replay_ingest_journal(app.config['INGEST_JOURNAL_PATH'], get_ingest_checkpoint())
+        ingest_journal.open(get_ingest_checkpoint())
+        ingest_journal.start()
+        
+        ingest_pipeline = IngestPipeline(
+            flush_consumption_batch,
+            batch_size=app.config['INGEST_BATCH_SIZE'],
+            flush_interval_ms=app.config['INGEST_FLUSH_INTERVAL_MS'],
+            max_queue=app.config['INGEST_MAX_QUEUE'],
+            max_retries=app.config['INGEST_MAX_RETRIES'],
+            retry_backoff_ms=app.config['INGEST_RETRY_BACKOFF_MS'],
+            retry_backoff_max_ms=app.config['INGEST_RETRY_BACKOFF_MAX_MS'],
+            failed_handler=defer_failed_batch,
+            idle_handler=ingest_journal.take_deferred,
+            quarantine_handler=quarantine_reading
+        )
+        ingest_pipeline.start()
+    
+    relay_dispatcher.start()
+    
+    # Flux SSE dans l'API seulement : les workers publient via la base, relue par le rechargement du registre
+    if app.config['INGEST_MODE'] != 'worker' and app.config['LIVE_PORT'] > 0:
+        live_broadcaster.start()
+    
+    # Une seule passe de rétention : dans l'API (modes 'inline' et 'workers'), pas dans les workers
+    if app.config['INGEST_MODE'] != 'worker' and app.config['RETENTION_INTERVAL_S'] > 0:
+        retention_job.start()
+    
+    if app.config['INGEST_MODE'] != 'inline':
+        # Plusieurs processus écrivent : recharger périodiquement le registre depuis la base
+        start_registry_refresh(app.config['REGISTRY_REFRESH_S'])
     init_mqtt_at_startup()  # ← AJOUTEZ CETTE LIGNE
 
 
 if __name__ == '__main__':
-    # Démarrer l'API Flask
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Démarrer l'API Flask. Sans rechargeur : journal, MQTT et port SSE sont démarrés à l'import, le
+    # processus fils du rechargeur les redémarrerait (port SSE déjà pris, second client MQTT)
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
 
 #if __name__ == '__main__':
 #    app.run(debug=True) [SENT]
\ No newline at end of file
@@ -0,0 +1,1065 @@
+import argparse
+import hashlib
+import heapq
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from db import MEMORY
+from migrations import migrate
+from repository import SqliteStore
+from timeseries import GRANULARITIES
+
+
+# -----------------------------------------------------------------------------------------------
+# Base partitionnée : N fichiers SQLite (un verrou d'écriture chacun), un utilisateur et tout ce
+# qui lui appartient (compteurs, factures, paiements, lectures) dans une seule partition.
+#   - partition d'un nouvel utilisateur : hachage stable de son email (jump consistent hash) ;
+#     passer de N à N+1 partitions ne déplace qu'environ 1/(N+1) des utilisateurs
+#   - annuaire global (petit fichier à part) : email, téléphone et partition des utilisateurs,
+#     numéros de compteur, séquences d'id des factures et paiements (ids uniques sur l'ensemble)
+#   - requêtes d'administration sans utilisateur : toutes les partitions en parallèle, résultats fusionnés
+#   - partition 0 = DATABASE_PATH : une base existante devient la première partition
+# Le rééquilibrage (déplacement des utilisateurs vers leur partition) se fait serveur arrêté :
+#   python shards.py rebalance --shards 4
+# -----------------------------------------------------------------------------------------------
+DIRECTORY_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        phone TEXT,
+        shard INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone);
+    CREATE TABLE IF NOT EXISTS meters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meter_number TEXT UNIQUE NOT NULL,
+        user_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_meters_user ON meters (user_id);
+    CREATE TABLE IF NOT EXISTS sequences (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+'''
+
+# Tables à id global, tirées de la séquence de l'annuaire
+SEQUENCES = ('invoices', 'payments')
+
+# Lignes d'un utilisateur, partition par partition ({meters} : schéma qui contient ses compteurs)
+# (table, condition sur les ids de la table temporaire moving, id conservé)
+USER_TABLES = [
+    ('users', "id IN (SELECT id FROM moving)", True),
+    ('meters', "user_id IN (SELECT id FROM moving)", True),
+    ('invoices', "user_id IN (SELECT id FROM moving)", True),
+    ('payments', "user_id IN (SELECT id FROM moving)", True),
+] + [
+    (table, "meter_id IN (SELECT id FROM {meters}.meters WHERE user_id IN (SELECT id FROM moving))", keep_id)
+    for table, keep_id in [('readings', True)] + [(f'consumption_{g}', True) for g in GRANULARITIES]
+    + [('late_readings', False)]     # ids propres à chaque partition
+]
+
+# État de la partition 0 recopié dans une partition neuve (rétention, segments archivés, journal)
+SHARED_TABLES = [
+    ('retention', ('name', 'value')),
+    ('reading_archives', ('month', 'path', 'meters', 'readings', 'wh', 'created_at')),
+    ('ingest_checkpoint', ('journal', 'seq')),
+]
+
+
+def jump_hash(key, buckets):
+    """Jump consistent hash (Lamping & Veach) : partition de `key` parmi `buckets`"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for(email, shards):
+    """Partition d'un utilisateur d'après son email"""
+    key = int.from_bytes(hashlib.blake2b(email.encode('utf-8'), digest_size=8).digest(), 'big')
+    return jump_hash(key, shards)
+
+
+def shard_path(path, index):
+    """gridpay.db, gridpay-1.db, gridpay-2.db, ..."""
+    if index == 0 or path == MEMORY:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{index}{ext}"
+
+
+def directory_path(path):
+    if path == MEMORY:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-directory{ext}"
+
+
+def _chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+# -----------------------------------------------------------------------------------------------
+# Annuaire global
+# -----------------------------------------------------------------------------------------------
+class ShardDirectory:
+    """Utilisateurs (email, téléphone, partition), compteurs (numéro, propriétaire) et séquences d'id
+
+    Les partitions des ids sont gardées en mémoire : elles ne changent que serveur arrêté (rebalance).
+    """
+
+    def __init__(self, database, reader=None):
+        self.store = SqliteStore(database, reader)
+        self._user_shards = {}
+        self._meter_shards = {}
+        self._emails = {}
+
+    def init(self):
+        conn = self.store.database.connect()
+        try:
+            conn.executescript(DIRECTORY_SCHEMA)
+        finally:
+            conn.close()
+
+    # ------------------------- Utilisateurs -------------------------
+    def user(self, email):
+        """(id, partition) de l'utilisateur, ou None"""
+        entry = self._emails.get(email)
+        if entry is None:
+            with self.store.read() as cursor:
+                cursor.execute("SELECT id, shard FROM users WHERE email = ?", (email,))
+                entry = cursor.fetchone()
+            if entry is not None:
+                self._emails[email] = entry
+                self._user_shards[entry[0]] = entry[1]
+        return entry
+
+    def shard_of_user(self, user_id):
+        shard = self._user_shards.get(user_id)
+        if shard is None:
+            with self.store.read() as cursor:
+                cursor.execute("SELECT shard FROM users WHERE id = ?", (user_id,))
+                row = cursor.fetchone()
+            if row is not None:
+                shard = self._user_shards[user_id] = row[0]
+        return shard
+
+    def users_for_emails(self, emails):
+        """{email: (id, partition)} des emails connus"""
+        entries = {}
+        with self.store.read() as cursor:
+            for chunk in _chunks(emails):
+                cursor.execute(f"SELECT email, id, shard FROM users WHERE email IN ({', '.join('?' * len(chunk))})",
+                               chunk)
+                entries.update((email, (user_id, shard)) for email, user_id, shard in cursor.fetchall())
+        return entries
+
+    def phone_exists(self, phone):
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id FROM users WHERE phone = ?", (phone,))
+            return cursor.fetchone() is not None
+
+    def add_user(self, email, phone, shard):
+        """Réserve l'email (UNIQUE) et retourne l'id du nouvel utilisateur"""
+        with self.store.transaction() as cursor:
+            cursor.execute("INSERT INTO users (email, phone, shard) VALUES (?, ?, ?)", (email, phone, shard))
+            return cursor.lastrowid
+
+    def add_users(self, rows):
+        """(email, phone, partition) : emails nouveaux réservés ; retourne {email: (id, partition)} de tous"""
+        with self.store.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO users (email, phone, shard) VALUES (?, ?, ?)", rows)
+        return self.users_for_emails({email for email, _, _ in rows})
+
+    def remove_user(self, user_id):
+        with self.store.transaction() as cursor:
+            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        self._user_shards.pop(user_id, None)
+        self._emails = {email: entry for email, entry in self._emails.items() if entry[0] != user_id}
+
+    def emails(self):
+        """(id, email) de tous les utilisateurs"""
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id, email FROM users")
+            return cursor.fetchall()
+
+    # ------------------------- Compteurs -------------------------
+    def meter(self, meter_number):
+        """(id, user_id) du compteur, ou None"""
+        with self.store.read() as cursor:
+            cursor.execute("SELECT id, user_id FROM meters WHERE meter_number = ?", (meter_number,))
+            return cursor.fetchone()
+
+    def shard_of_meter(self, meter_id):
+        shard = self._meter_shards.get(meter_id)
+        if shard is None:
+            with self.store.read() as cursor:
+                cursor.execute("""
+                    SELECT u.shard FROM meters m JOIN users u ON m.user_id = u.id WHERE m.id = ?
+                """, (meter_id,))
+                row = cursor.fetchone()
+            if row is not None:
+                shard = self._meter_shards[meter_id] = row[0]
+        return shard
+
+    def ids_for_numbers(self, meter_numbers):
+        """{meter_number: id} des compteurs connus"""
+        ids = {}
+        with self.store.read() as cursor:
+            for chunk in _chunks(meter_numbers):
+                cursor.execute(f"SELECT meter_number, id FROM meters WHERE meter_number IN ({', '.join('?' * len(chunk))})",
+                               chunk)
+                ids.update(cursor.fetchall())
+        return ids
+
+    def add_meter(self, meter_number, user_id):
+        with self.store.transaction() as cursor:
+            cursor.execute("INSERT INTO meters (meter_number, user_id) VALUES (?, ?)", (meter_number, user_id))
+            return cursor.lastrowid
+
+    def add_meters(self, rows):
+        """(meter_number, user_id) : numéros nouveaux réservés ; retourne {meter_number: (id, user_id)} de tous"""
+        with self.store.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO meters (meter_number, user_id) VALUES (?, ?)", rows)
+        entries = {}
+        with self.store.read() as cursor:
+            for chunk in _chunks({meter_number for meter_number, _ in rows}):
+                cursor.execute(f"""
+                    SELECT meter_number, id, user_id FROM meters
+                    WHERE meter_number IN ({', '.join('?' * len(chunk))})
+                """, chunk)
+                entries.update((number, (meter_id, user_id)) for number, meter_id, user_id in cursor.fetchall())
+        return entries
+
+    def remove_meter(self, meter_id):
+        with self.store.transaction() as cursor:
+            cursor.execute("DELETE FROM meters WHERE id = ?", (meter_id,))
+        self._meter_shards.pop(meter_id, None)
+
+    # ------------------------- Séquences -------------------------
+    def next_id(self, name):
+        with self.store.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO sequences (name, value) VALUES (?, 1)
+                ON CONFLICT (name) DO UPDATE SET value = value + 1
+                RETURNING value
+            """, (name,))
+            return cursor.fetchone()[0]
+
+    def stats(self):
+        return {
+            'cached_users': len(self._user_shards),
+            'cached_meters': len(self._meter_shards),
+        }
+
+
+# -----------------------------------------------------------------------------------------------
+# Dépôts partitionnés : mêmes méthodes que SqliteRepositories, chaque appel routé vers une partition
+# -----------------------------------------------------------------------------------------------
+class _Scope:
+    """Transaction englobante d'un thread : partitions rejointes au fil des appels"""
+
+    def __init__(self, stack, immediate):
+        self.stack = stack
+        self.immediate = immediate
+        self.entered = set()
+
+
+class ShardedRepositories:
+    """Dépôts répartis sur des SqliteRepositories (une par partition) et un ShardDirectory
+
+    transaction() : chaque partition touchée dans le bloc ouvre sa transaction, validée à la fin du
+    bloc ; atomique par partition (un arrêt brutal entre deux commits peut valider une partie du bloc :
+    le journal d'ingestion et le dédoublonnage rejouent l'autre). Les écritures passent comme avant
+    par un seul thread écrivain (write()), les partitions séparent les verrous entre processus.
+    """
+
+    def __init__(self, shards, directory, writer=None, located_max=100000):
+        self.shards = shards
+        self.directory = directory
+        self.writer = writer
+        self.pool = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard")
+        self._local = threading.local()
+        # Partition des factures et paiements déjà vus (id -> partition), et des compteurs supprimés
+        self._located = OrderedDict()
+        self._located_max = located_max
+        self._located_lock = threading.Lock()
+
+        # Métriques
+        self.fan_outs = 0
+        self.locate_misses = 0
+
+        self.users = ShardedUserRepository(self)
+        self.meters = ShardedMeterRepository(self)
+        self.invoices = ShardedInvoiceRepository(self)
+        self.payments = ShardedPaymentRepository(self)
+        self.readings = ShardedReadingRepository(self)
+        self.changes = ShardedChangeRepository(self)
+
+    # ------------------------- Démarrage -------------------------
+    def prepare(self):
+        """Migrations de chaque partition, annuaire (construit depuis les partitions s'il est vide)"""
+        for shard in self.shards:
+            conn = shard.store.database.connect()
+            try:
+                migrate(conn)
+            finally:
+                conn.close()
+        self.directory.init()
+        copy_shared_state(self.shards)
+        with self.directory.store.read() as cursor:
+            cursor.execute("SELECT COUNT(*), MAX(shard) FROM users")
+            users, last = cursor.fetchone()
+        if not users:
+            indexed = build_directory(self.shards, self.directory)
+            if indexed:
+                print(f"[SHARDS] Annuaire construit: {indexed} utilisateurs")
+        elif last >= len(self.shards):
+            raise RuntimeError(f"Utilisateurs sur la partition {last} : rééquilibrer vers {len(self.shards)} "
+                               f"partitions avant de démarrer (python shards.py rebalance)")
+
+    # ------------------------- Routage -------------------------
+    def shard(self, index):
+        """Dépôts de la partition ; dans une transaction englobante, la partition la rejoint"""
+        shard = self.shards[index]
+        scope = getattr(self._local, 'scope', None)
+        if scope is not None and index not in scope.entered:
+            scope.entered.add(index)
+            scope.stack.enter_context(shard.transaction(scope.immediate))
+        return shard
+
+    def fan_out(self, function, indexes=None):
+        """[function(dépôts, index)] sur toutes les partitions (ou `indexes`), en parallèle hors transaction"""
+        indexes = list(range(len(self.shards)) if indexes is None else indexes)
+        if len(indexes) <= 1 or getattr(self._local, 'scope', None) is not None:
+            return [function(self.shard(index), index) for index in indexes]
+        self.fan_outs += 1
+        return list(self.pool.map(lambda index: function(self.shards[index], index), indexes))
+
+    def for_each(self, function):
+        """[function(dépôts, index)] sur toutes les partitions, l'une après l'autre dans le thread appelant
+        (écritures : thread écrivain, transaction englobante)"""
+        return [function(self.shard(index), index) for index in range(len(self.shards))]
+
+    def group(self, rows, shard_of):
+        """{partition: [lignes]} ; lignes sans partition connue écartées"""
+        parts = {}
+        for row in rows:
+            index = shard_of(row)
+            if index is not None:
+                parts.setdefault(index, []).append(row)
+        return parts
+
+    def remember(self, kind, row_id, index):
+        with self._located_lock:
+            self._located[(kind, row_id)] = index
+            self._located.move_to_end((kind, row_id))
+            if len(self._located) > self._located_max:
+                self._located.popitem(last=False)
+
+    def locate(self, kind, row_id, get):
+        """Partition d'une ligne par id : déjà vue, sinon cherchée dans toutes les partitions avec get(dépôts)"""
+        with self._located_lock:
+            index = self._located.get((kind, row_id))
+        if index is not None or kind == 'meters':
+            return index
+        self.locate_misses += 1
+        self.fan_outs += 1
+        found = list(self.pool.map(lambda shard: get(shard) is not None, self.shards))
+        if True not in found:
+            return None
+        index = found.index(True)
+        self.remember(kind, row_id, index)
+        return index
+
+    def meter_shard(self, meter_id):
+        index = self.directory.shard_of_meter(meter_id)
+        return index if index is not None else self.locate('meters', meter_id, None)
+
+    # ------------------------- Transactions et écritures -------------------------
+    @contextmanager
+    def transaction(self, immediate=False):
+        if getattr(self._local, 'scope', None) is not None:
+            yield
+            return
+        with ExitStack() as stack:
+            self._local.scope = _Scope(stack, immediate)
+            try:
+                yield
+            finally:
+                self._local.scope = None
+
+    def write(self, operation, *args):
+        """Exécute operation(*args) dans le thread écrivain et retourne son résultat"""
+        if self.writer is None:
+            return operation(*args)
+        return self.writer.call(operation, *args)
+
+    def drop_indexes(self, table):
+        definitions = []
+        for shard in self.shards:
+            definitions += [sql for sql in shard.drop_indexes(table) if sql not in definitions]
+        return definitions
+
+    def create_indexes(self, definitions):
+        for shard in self.shards:
+            shard.create_indexes(definitions)
+
+    def stats(self):
+        return {
+            'shards': len(self.shards),
+            'fan_outs': self.fan_outs,
+            'located': len(self._located),
+            'locate_misses': self.locate_misses,
+            'directory': self.directory.stats(),
+            'databases': [shard.store.database.stats() for shard in self.shards],
+        }
+
+
+class ShardedUserRepository:
+    def __init__(self, repositories):
+        self.repositories = repositories
+        self.directory = repositories.directory
+
+    def get(self, user_id):
+        index = self.directory.shard_of_user(user_id)
+        return None if index is None else self.repositories.shard(index).users.get(user_id)
+
+    def get_by_email(self, email, with_password=False):
+        entry = self.directory.user(email)
+        return None if entry is None else self.repositories.shard(entry[1]).users.get_by_email(email, with_password)
+
+    def id_for_email(self, email):
+        entry = self.directory.user(email)
+        return entry[0] if entry else None
+
+    def phone_exists(self, phone):
+        return self.directory.phone_exists(phone)
+
+    def create(self, email, password, phone, name):
+        index = shard_for(email, len(self.repositories.shards))
+        user_id = self.directory.add_user(email, phone, index)
+        try:
+            return self.repositories.shard(index).users.create(email, password, phone, name, row_id=user_id)
+        except Exception:
+            self.directory.remove_user(user_id)
+            raise
+
+    def import_many(self, rows):
+        """Emails réservés dans l'annuaire puis utilisateurs insérés dans leur partition
+
+        Un email déjà réservé garde son id : relancer un import interrompu complète les partitions.
+        """
+        count = len(self.repositories.shards)
+        entries = self.directory.add_users([(email, phone, shard_for(email, count)) for email, _, phone, _ in rows])
+        parts = self.repositories.group(rows, lambda row: entries[row[0]][1] if row[0] in entries else None)
+        return sum(self.repositories.shard(index).users.import_many(part, [entries[row[0]][0] for row in part])
+                   for index, part in sorted(parts.items()))
+
+    def emails(self):
+        return self.directory.emails()
+
+
+class ShardedMeterRepository:
+    def __init__(self, repositories):
+        self.repositories = repositories
+        self.directory = repositories.directory
+
+    def _by_id(self, meter_id):
+        index = self.repositories.meter_shard(meter_id)
+        return None if index is None else self.repositories.shard(index).meters
+
+    def _by_number(self, meter_number):
+        entry = self.directory.meter(meter_number)
+        return None if entry is None else self._by_id(entry[0])
+
+    def get(self, meter_id, user_id=None):
+        meters = self._by_id(meter_id)
+        return meters.get(meter_id, user_id) if meters else None
+
+    def get_by_number(self, meter_number):
+        meters = self._by_number(meter_number)
+        return meters.get_by_number(meter_number) if meters else None
+
+    def owned_by_email(self, meter_id, email):
+        meters = self._by_id(meter_id)
+        return meters.owned_by_email(meter_id, email) if meters else False
+
+    def list_for_user(self, user_id, filters=None, after=None, limit=None):
+        index = self.directory.shard_of_user(user_id)
+        if index is None:
+            return []
+        return self.repositories.shard(index).meters.list_for_user(user_id, filters, after, limit)
+
+    def count_for_user(self, user_id, filters=None, cap=10000):
+        index = self.directory.shard_of_user(user_id)
+        return 0 if index is None else self.repositories.shard(index).meters.count_for_user(user_id, filters, cap)
+
+    def get_many(self, user_id, meter_ids):
+        index = self.directory.shard_of_user(user_id)
+        return [] if index is None else self.repositories.shard(index).meters.get_many(user_id, meter_ids)
+
+    def numbers_for_email(self, email):
+        entry = self.directory.user(email)
+        return [] if entry is None else self.repositories.shard(entry[1]).meters.numbers_for_email(email)
+
+    def all_with_thresholds(self):
+        results = self.repositories.fan_out(lambda shard, index: shard.meters.all_with_thresholds())
+        return [row for rows in results for row in rows]
+
+    def create(self, user_id, meter_number, meter_name):
+        index = self.directory.shard_of_user(user_id)
+        meter_id = self.directory.add_meter(meter_number, user_id)
+        try:
+            return self.repositories.shard(index).meters.create(user_id, meter_number, meter_name, row_id=meter_id)
+        except Exception:
+            self.directory.remove_meter(meter_id)
+            raise
+
+    def update(self, meter_id, changes):
+        meters = self._by_id(meter_id)
+        return meters.update(meter_id, changes) if meters else None
+
+    def delete(self, meter_id):
+        index = self.repositories.meter_shard(meter_id)
+        if index is None:
+            return
+        self.repositories.shard(index).meters.delete(meter_id)
+        # Lectures et agrégats restent dans la partition jusqu'à leur archivage
+        self.repositories.remember('meters', meter_id, index)
+        self.directory.remove_meter(meter_id)
+
+    def add_cumulative(self, totals):
+        ids = self.directory.ids_for_numbers(totals)
+        parts = self.repositories.group(
+            [number for number in totals if number in ids], lambda number: self.repositories.meter_shard(ids[number]))
+        cumulatives = {}
+        for index, numbers in sorted(parts.items()):
+            cumulatives.update(
+                self.repositories.shard(index).meters.add_cumulative({number: totals[number] for number in numbers}))
+        return cumulatives
+
+    def reset_cumulative(self, meter_number):
+        meters = self._by_number(meter_number)
+        if meters:
+            meters.reset_cumulative(meter_number)
+
+    def import_many(self, rows):
+        """Numéros réservés dans l'annuaire, compteurs insérés dans la partition de leur propriétaire
+
+        Un numéro déjà réservé par un autre propriétaire : ligne ignorée.
+        """
+        owners = self.directory.users_for_emails({email for email, _, _, _ in rows})
+        rows = [row for row in rows if row[0] in owners]
+        entries = self.directory.add_meters([(row[1], owners[row[0]][0]) for row in rows])
+        rows = [row for row in rows if entries[row[1]][1] == owners[row[0]][0]]
+        parts = self.repositories.group(rows, lambda row: owners[row[0]][1])
+        return sum(self.repositories.shard(index).meters.import_many(part, [entries[row[1]][0] for row in part])
+                   for index, part in sorted(parts.items()))
+
+    def export_ids(self, filters, after=0):
+        shards = _export_shards(self.repositories, filters)
+        return heapq.merge(*(shard.meters.export_ids(filters, after) for shard in shards))
+
+    def ids_for_numbers(self, meter_numbers):
+        return self.directory.ids_for_numbers(meter_numbers)
+
+
+def _export_shards(repositories, filters):
+    """Partitions concernées par un export : celle de l'utilisateur ou du compteur filtré, sinon toutes"""
+    if filters.get('email') is not None:
+        entry = repositories.directory.user(filters['email'])
+        return [repositories.shards[entry[1]]] if entry else []
+    if filters.get('meter_number') is not None:
+        entry = repositories.directory.meter(filters['meter_number'])
+        index = repositories.meter_shard(entry[0]) if entry else None
+        return [repositories.shards[index]] if index is not None else []
+    return repositories.shards
+
+
+class ShardedInvoiceRepository:
+    def __init__(self, repositories):
+        self.repositories = repositories
+        self.directory = repositories.directory
+
+    def _by_id(self, invoice_id):
+        index = self.repositories.locate('invoices', invoice_id, lambda shard: shard.invoices.get(invoice_id))
+        return None if index is None else self.repositories.shard(index).invoices
+
+    def _by_meter(self, meter_id):
+        index = self.repositories.meter_shard(meter_id)
+        return None if index is None else self.repositories.shard(index).invoices
+
+    def get(self, invoice_id, email=None):
+        if email is None:
+            invoices = self._by_id(invoice_id)
+            return invoices.get(invoice_id) if invoices else None
+        entry = self.directory.user(email)
+        if entry is None:
+            return None
+        invoice = self.repositories.shard(entry[1]).invoices.get(invoice_id, email)
+        if invoice:
+            self.repositories.remember('invoices', invoice_id, entry[1])
+        return invoice
+
+    def list_for_user(self, user_id, filters=None, after=None, limit=None):
+        index = self.directory.shard_of_user(user_id)
+        if index is None:
+            return []
+        return self.repositories.shard(index).invoices.list_for_user(user_id, filters, after, limit)
+
+    def count_for_user(self, user_id, filters=None, cap=10000):
+        index = self.directory.shard_of_user(user_id)
+        return 0 if index is None else self.repositories.shard(index).invoices.count_for_user(user_id, filters, cap)
+
+    def get_many(self, user_id, invoice_ids):
+        index = self.directory.shard_of_user(user_id)
+        return [] if index is None else self.repositories.shard(index).invoices.get_many(user_id, invoice_ids)
+
+    def list_for_meter(self, meter_id, filters=None, after=None, limit=None):
+        invoices = self._by_meter(meter_id)
+        return invoices.list_for_meter(meter_id, filters, after, limit) if invoices else []
+
+    def count_for_meter(self, meter_id, filters=None, cap=10000):
+        invoices = self._by_meter(meter_id)
+        return invoices.count_for_meter(meter_id, filters, cap) if invoices else 0
+
+    def export(self, filters, after=0):
+        shards = _export_shards(self.repositories, filters)
+        return heapq.merge(*(shard.invoices.export(filters, after) for shard in shards),
+                           key=lambda invoice: invoice.id)
+
+    def exists_for_month(self, meter_id, month, exclude_id=None):
+        invoices = self._by_meter(meter_id)
+        return invoices.exists_for_month(meter_id, month, exclude_id) if invoices else False
+
+    def latest_paid_kwh(self, meter_id):
+        invoices = self._by_meter(meter_id)
+        return invoices.latest_paid_kwh(meter_id) if invoices else None
+
+    def create(self, meter_id, month, amount, status, kwh):
+        index = self.repositories.meter_shard(meter_id)
+        invoice_id = self.directory.next_id('invoices')
+        self.repositories.remember('invoices', invoice_id, index)
+        return self.repositories.shard(index).invoices.create(meter_id, month, amount, status, kwh, row_id=invoice_id)
+
+    def update(self, invoice_id, changes):
+        invoices = self._by_id(invoice_id)
+        return invoices.update(invoice_id, changes) if invoices else None
+
+    def mark_paid(self, invoice_id):
+        invoices = self._by_id(invoice_id)
+        if invoices:
+            invoices.mark_paid(invoice_id)
+
+    def delete(self, invoice_id):
+        invoices = self._by_id(invoice_id)
+        if invoices:
+            invoices.delete(invoice_id)
+
+
+class ShardedPaymentRepository:
+    def __init__(self, repositories):
+        self.repositories = repositories
+        self.directory = repositories.directory
+
+    def get(self, payment_id, email=None):
+        if email is None:
+            index = self.repositories.locate('payments', payment_id, lambda shard: shard.payments.get(payment_id))
+            return None if index is None else self.repositories.shard(index).payments.get(payment_id)
+        entry = self.directory.user(email)
+        return None if entry is None else self.repositories.shard(entry[1]).payments.get(payment_id, email)
+
+    def _by_invoice(self, invoice_id):
+        index = self.repositories.locate('invoices', invoice_id, lambda shard: shard.invoices.get(invoice_id))
+        return None if index is None else self.repositories.shard(index).payments
+
+    def list_for_user(self, email, filters=None, after=None, limit=None):
+        entry = self.directory.user(email)
+        if entry is None:
+            return []
+        return self.repositories.shard(entry[1]).payments.list_for_user(email, filters, after, limit)
+
+    def count_for_user(self, email, filters=None, cap=10000):
+        entry = self.directory.user(email)
+        return 0 if entry is None else self.repositories.shard(entry[1]).payments.count_for_user(email, filters, cap)
+
+    def get_many(self, user_id, payment_ids):
+        index = self.directory.shard_of_user(user_id)
+        return [] if index is None else self.repositories.shard(index).payments.get_many(user_id, payment_ids)
+
+    def list_for_invoice(self, invoice_id, filters=None, after=None, limit=None):
+        payments = self._by_invoice(invoice_id)
+        return payments.list_for_invoice(invoice_id, filters, after, limit) if payments else []
+
+    def count_for_invoice(self, invoice_id, filters=None, cap=10000):
+        payments = self._by_invoice(invoice_id)
+        return payments.count_for_invoice(invoice_id, filters, cap) if payments else 0
+
+    def export(self, filters, after=0):
+        shards = _export_shards(self.repositories, filters)
+        return heapq.merge(*(shard.payments.export(filters, after) for shard in shards),
+                           key=lambda payment: payment.id)
+
+    def transaction_exists(self, transaction_id):
+        return any(self.repositories.fan_out(lambda shard, index: shard.payments.transaction_exists(transaction_id)))
+
+    def create(self, invoice_id, amount, payment_method, transaction_id):
+        index = self.repositories.locate('invoices', invoice_id, lambda shard: shard.invoices.get(invoice_id))
+        payment_id = self.directory.next_id('payments')
+        self.repositories.remember('payments', payment_id, index)
+        return self.repositories.shard(index).payments.create(invoice_id, amount, payment_method, transaction_id,
+                                                              row_id=payment_id)
+
+
+class ShardedReadingRepository:
+    """Lectures routées par compteur ; l'état de rétention et le checkpoint sont tenus dans chaque partition
+
+    Les segments d'archive sont communs : chacun est enregistré dans toutes les partitions.
+    """
+
+    def __init__(self, repositories):
+        self.repositories = repositories
+
+    def _by_meter(self, meter_id):
+        index = self.repositories.meter_shard(meter_id)
+        return None if index is None else self.repositories.shard(index).readings
+
+    def _each(self, rows, operation):
+        parts = self.repositories.group(rows, lambda row: self.repositories.meter_shard(row[0]))
+        return [operation(self.repositories.shard(index).readings, part) for index, part in sorted(parts.items())]
+
+    def insert(self, rows):
+        self._each(rows, lambda readings, part: readings.insert(part))
+
+    def import_many(self, rows):
+        return sum(self._each(rows, lambda readings, part: readings.import_many(part)))
+
+    def store_late(self, rows):
+        self._each(rows, lambda readings, part: readings.store_late(part))
+
+    def recent_timestamps(self, meter_ids, since):
+        parts = self.repositories.group(meter_ids, self.repositories.meter_shard)
+        seen = {meter_id: [] for meter_id in meter_ids}
+        for result in self.repositories.fan_out(
+                lambda shard, index: shard.readings.recent_timestamps(parts[index], since), sorted(parts)):
+            seen.update(result)
+        return seen
+
+    def range(self, meter_id, start, end, limit=1000):
+        readings = self._by_meter(meter_id)
+        return readings.range(meter_id, start, end, limit) if readings else []
+
+    def series(self, meter_id, granularity, start, end, limit=1000):
+        readings = self._by_meter(meter_id)
+        return readings.series(meter_id, granularity, start, end, limit) if readings else []
+
+    def total(self, meter_id, start, end):
+        readings = self._by_meter(meter_id)
+        if readings is None:
+            return self.repositories.shards[0].readings.total(meter_id, start, end)
+        return readings.total(meter_id, start, end)
+
+    def export(self, meter_id, start, end):
+        index = self.repositories.meter_shard(meter_id)
+        return iter(()) if index is None else self.repositories.shards[index].readings.export(meter_id, start, end)
+
+    # ------------------------- Rétention -------------------------
+    def retention_state(self, name):
+        """La plus petite valeur des partitions (une passe interrompue entre deux commits est refaite)"""
+        return min(self.repositories.fan_out(lambda shard, index: shard.readings.retention_state(name)))
+
+    def set_retention_state(self, name, value):
+        self.repositories.for_each(lambda shard, index: shard.readings.set_retention_state(name, value))
+
+    def segment_names(self):
+        names = self.repositories.fan_out(lambda shard, index: shard.readings.segment_names())
+        return sorted({name for shard_names in names for name in shard_names})
+
+    def months_with_readings(self, start, end):
+        months = self.repositories.fan_out(lambda shard, index: shard.readings.months_with_readings(start, end))
+        return sorted({month for shard_months in months for month in shard_months})
+
+    def meters_in_month(self, month):
+        def meters(shard, index):
+            meter_ids = shard.readings.meters_in_month(month)
+            for meter_id in meter_ids:
+                # Compteurs supprimés : encore des lectures à archiver, plus dans l'annuaire
+                if self.repositories.directory.shard_of_meter(meter_id) is None:
+                    self.repositories.remember('meters', meter_id, index)
+            return meter_ids
+        return list(heapq.merge(*self.repositories.fan_out(meters)))
+
+    def raw_range(self, meter_id, start, end):
+        readings = self._by_meter(meter_id)
+        return readings.raw_range(meter_id, start, end) if readings else []
+
+    def minute_counts(self, meter_id, start, end):
+        readings = self._by_meter(meter_id)
+        return readings.minute_counts(meter_id, start, end) if readings else []
+
+    def register_segment(self, month, path, meters, readings, wh):
+        self.repositories.for_each(lambda shard, index: shard.readings.register_segment(month, path, meters, readings, wh))
+
+    def delete_raw(self, spans):
+        self._each(spans, lambda readings, part: readings.delete_raw(part))
+
+    def vacuum(self, pages=0):
+        free = [free_pages for free_pages in self.repositories.for_each(lambda shard, index: shard.readings.vacuum(pages))
+                if free_pages is not None]
+        return sum(free) if free else None
+
+    def checkpoint(self, journal):
+        return min(self.repositories.fan_out(lambda shard, index: shard.readings.checkpoint(journal)))
+
+    def advance_checkpoint(self, journal, seq):
+        self.repositories.for_each(lambda shard, index: shard.readings.advance_checkpoint(journal, seq))
+
+
+# -----------------------------------------------------------------------------------------------
+# Outils : état commun des partitions, construction de l'annuaire, rééquilibrage (serveur arrêté)
+# -----------------------------------------------------------------------------------------------
+class ShardedChangeRepository:
+    """Journal des modifications de la partition de l'utilisateur
+
+    Chaque partition a son origine et ses séquences : un utilisateur déplacé par rebalance change
+    d'origine, ses curseurs demandent un rechargement complet.
+    """
+
+    def __init__(self, repositories):
+        self.repositories = repositories
+        self.directory = repositories.directory
+
+    def _by_user(self, user_id):
+        index = self.directory.shard_of_user(user_id)
+        return None if index is None else self.repositories.shard(index).changes
+
+    def state(self, user_id):
+        changes = self._by_user(user_id)
+        return changes.state(user_id) if changes else (None, 0, 0)
+
+    def since(self, user_id, seq, limit):
+        changes = self._by_user(user_id)
+        return changes.since(user_id, seq, limit) if changes else []
+
+    def prune(self, before):
+        return sum(self.repositories.for_each(lambda shard, index: shard.changes.prune(before)))
+
+
+def copy_shared_state(shards):
+    """Recopie dans chaque partition l'état de la partition 0 qui lui manque (rétention, segments, journal)"""
+    with shards[0].store.read() as cursor:
+        state = {}
+        for table, columns in SHARED_TABLES:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            state[table] = cursor.fetchall()
+    for shard in shards[1:]:
+        with shard.store.transaction() as cursor:
+            for table, columns in SHARED_TABLES:
+                cursor.executemany(f"""
+                    INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+                """, state[table])
+
+
+def build_directory(shards, directory):
+    """Inscrit dans l'annuaire les utilisateurs et compteurs des partitions ; retourne les utilisateurs ajoutés"""
+    added = 0
+    sequences = {name: 0 for name in SEQUENCES}
+    for index, shard in enumerate(shards):
+        with shard.store.read() as cursor:
+            cursor.execute("SELECT id, email, phone FROM users")
+            users = cursor.fetchall()
+            cursor.execute("SELECT id, meter_number, user_id FROM meters")
+            meters = cursor.fetchall()
+            for name in SEQUENCES:
+                cursor.execute(f"SELECT MAX(id) FROM {name}")
+                sequences[name] = max(sequences[name], cursor.fetchone()[0] or 0)
+        with directory.store.transaction() as cursor:
+            cursor.executemany("INSERT OR IGNORE INTO users (id, email, phone, shard) VALUES (?, ?, ?, ?)",
+                               [user + (index,) for user in users])
+            added += cursor.rowcount
+            cursor.executemany("INSERT OR IGNORE INTO meters (id, meter_number, user_id) VALUES (?, ?, ?)", meters)
+    with directory.store.transaction() as cursor:
+        cursor.executemany("""
+            INSERT INTO sequences (name, value) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+        """, list(sequences.items()))
+    return added
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS moving (id INTEGER PRIMARY KEY)")
+    return conn
+
+
+def _set_moving(conn, user_ids):
+    conn.execute("DELETE FROM moving")
+    conn.executemany("INSERT INTO moving (id) VALUES (?)", [(user_id,) for user_id in user_ids])
+
+
+def _delete_users(conn, schema='main'):
+    """Supprime les lignes des utilisateurs de `moving` (lignes des compteurs d'abord)"""
+    for table, where, _ in reversed(USER_TABLES):
+        conn.execute(f"DELETE FROM {schema}.{table} WHERE {where.format(meters=schema)}")
+
+
+def copy_users(source_path, target_path, user_ids):
+    """Copie les lignes des utilisateurs dans la partition cible, en une transaction (relançable)"""
+    conn = _connect(target_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS source", (source_path,))
+        _set_moving(conn, user_ids)
+        conn.execute("BEGIN IMMEDIATE")
+        # Copie partielle d'une passe interrompue : remplacée
+        _delete_users(conn)
+        for table, where, keep_id in USER_TABLES:
+            columns = ', '.join(row[1] for row in conn.execute(f"PRAGMA source.table_info({table})")
+                                if keep_id or row[1] != 'id')
+            conn.execute(f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM source.{table} "
+                         f"WHERE {where.format(meters='source')}")
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def delete_users(path, user_ids):
+    conn = _connect(path)
+    try:
+        _set_moving(conn, user_ids)
+        conn.execute("BEGIN IMMEDIATE")
+        _delete_users(conn)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def purge_strays(path, index, directory_file):
+    """Supprime de la partition les utilisateurs que l'annuaire place ailleurs (déplacement interrompu)"""
+    conn = _connect(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS directory", (directory_file,))
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM moving")
+        conn.execute("""
+            INSERT INTO moving (id)
+            SELECT u.id FROM main.users u JOIN directory.users d ON d.id = u.id WHERE d.shard != ?
+        """, (index,))
+        strays = conn.execute("SELECT COUNT(*) FROM moving").fetchone()[0]
+        if strays:
+            _delete_users(conn)
+        conn.execute("COMMIT")
+        if strays:
+            conn.executescript("PRAGMA incremental_vacuum")
+        return strays
+    finally:
+        conn.close()
+
+
+def misplaced(directory_file, shards):
+    """{(partition actuelle, partition cible): [user_id, ...]} des utilisateurs à déplacer"""
+    conn = sqlite3.connect(directory_file)
+    try:
+        moves = {}
+        for user_id, email, index in conn.execute("SELECT id, email, shard FROM users ORDER BY id"):
+            target = shard_for(email, shards)
+            if target != index:
+                moves.setdefault((index, target), []).append(user_id)
+        return moves
+    finally:
+        conn.close()
+
+
+def rebalance(path, directory_file, shards, batch=1000):
+    """Déplace chaque utilisateur vers la partition de son hachage ; retourne le nombre déplacé
+
+    Par lot : copie dans la cible, annuaire mis à jour, puis suppression à la source. Un arrêt entre
+    deux étapes laisse au pire des lignes en double, jamais de perte : relancer la commande termine
+    le déplacement (purge_strays retire les copies restées à la source).
+    """
+    moved = 0
+    directory = sqlite3.connect(directory_file, isolation_level=None)
+    try:
+        for (source, target), user_ids in sorted(misplaced(directory_file, shards).items()):
+            source_path, target_path = shard_path(path, source), shard_path(path, target)
+            for i in range(0, len(user_ids), batch):
+                chunk = user_ids[i:i + batch]
+                copy_users(source_path, target_path, chunk)
+                directory.execute("BEGIN IMMEDIATE")
+                directory.executemany("UPDATE users SET shard = ? WHERE id = ?", [(target, user_id) for user_id in chunk])
+                directory.execute("COMMIT")
+                delete_users(source_path, chunk)
+                moved += len(chunk)
+            print(f"[SHARDS] {len(user_ids)} utilisateurs déplacés de la partition {source} vers {target}")
+        used = directory.execute("SELECT MAX(shard) FROM users").fetchone()[0]
+    finally:
+        directory.close()
+
+    index = 0
+    while os.path.exists(shard_path(path, index)):
+        strays = purge_strays(shard_path(path, index), index, directory_file)
+        if strays:
+            print(f"[SHARDS] Partition {index}: {strays} utilisateurs en double retirés")
+        if index >= shards:
+            print(f"[SHARDS] Partition {index} hors de la configuration ({shards} partitions) : "
+                  f"{shard_path(path, index)} peut être supprimée")
+        index += 1
+    if used is not None and used >= shards:
+        raise RuntimeError(f"Utilisateurs encore sur la partition {used}")
+    return moved
+
+
+if __name__ == '__main__':
+    # Base partitionnée hors du serveur (serveur arrêté pour rebalance)
+    #   python shards.py status --shards 4       utilisateurs par partition, utilisateurs à déplacer
+    #   python shards.py index                   inscrit dans l'annuaire les utilisateurs des partitions
+    #   python shards.py rebalance --shards 4    migre les partitions puis déplace les utilisateurs
+    from db import Database
+    from repository import SqliteRepositories
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=('status', 'index', 'rebalance'))
+    parser.add_argument('--db', default=os.environ.get('DATABASE_PATH', os.path.join(here, 'gridpay.db')))
+    parser.add_argument('--directory', default=os.environ.get('DATABASE_DIRECTORY_PATH'))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('DATABASE_SHARDS', 1)))
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+    directory_file = args.directory or directory_path(args.db)
+
+    # Partitions configurées et partitions encore occupées (réduction du nombre de partitions)
+    count = args.shards
+    while os.path.exists(shard_path(args.db, count)):
+        count += 1
+    databases = [Database(shard_path(args.db, index)) for index in range(count)]
+    directory_database = Database(directory_file)
+    sharded = ShardedRepositories([SqliteRepositories(database) for database in databases],
+                                  ShardDirectory(directory_database))
+    sharded.prepare()
+    if args.command == 'index':
+        print(f"[SHARDS] {build_directory(sharded.shards, sharded.directory)} utilisateurs ajoutés à l'annuaire")
+    for database in databases + [directory_database]:
+        database.close_all()
+    sharded.pool.shutdown()
+
+    if args.command == 'rebalance':
+        total = rebalance(args.db, directory_file, args.shards, args.batch)
+        print(f"[SHARDS] {total} utilisateurs déplacés")
+
+    conn = sqlite3.connect(directory_file)
+    placed = dict(conn.execute("SELECT shard, COUNT(*) FROM users GROUP BY shard").fetchall())
+    conn.close()
+    moves = misplaced(directory_file, args.shards)
+    for index in range(max([count] + [shard + 1 for shard in placed])):
+        print(f"[SHARDS] Partition {index} ({shard_path(args.db, index)}): {placed.get(index, 0)} utilisateurs")
+    print(f"[SHARDS] {sum(len(user_ids) for user_ids in moves.values())} utilisateurs à déplacer "
+          f"pour {args.shards} partitions")
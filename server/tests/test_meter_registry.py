@@ -0,0 +1,207 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import Database
+from meter_registry import MeterRegistry, DEFAULT_ENERGY_THRESHOLD
+from migrations import migrate
+from repository import SqliteRepositories, MemoryRepositories
+
+
+# -----------------------------------------------------------------------------------------------
+# Cache des seuils (MeterRegistry.threshold) : jamais de seuil périmé après le commit d'une facture
+# -----------------------------------------------------------------------------------------------
+OPERATIONS = 240
+READERS = 4
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def repositories(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryRepositories()
+        return
+    database = Database(str(tmp_path / 'gridpay.db'))
+    conn = database.connect()
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    yield SqliteRepositories(database)
+    database.close_all()
+
+
+@pytest.fixture
+def meter(repositories):
+    user = repositories.users.create('client@gridpay.test', 'secret', '0', 'Client')
+    return repositories.meters.create(user.id, 'CNT-1', 'Compteur')
+
+
+def expected_threshold(repositories, meter_id):
+    kwh = repositories.invoices.latest_paid_kwh(meter_id)
+    return float(kwh) if kwh is not None else DEFAULT_ENERGY_THRESHOLD
+
+
+def test_threshold_counters(repositories, meter):
+    registry = MeterRegistry(repositories)
+    registry.load(verbose=False)
+    registry.invalidate_threshold(meter.id)
+
+    assert registry.threshold('CNT-1') == DEFAULT_ENERGY_THRESHOLD
+    assert registry.threshold('CNT-1') == DEFAULT_ENERGY_THRESHOLD
+    assert (registry.threshold_misses, registry.threshold_hits) == (1, 1)
+
+    invoice = repositories.invoices.create(meter.id, '2026-01', 10.0, 'unpaid', 42)
+    repositories.invoices.mark_paid(invoice.id)
+    registry.invalidate_threshold(meter.id)
+    assert registry.threshold('CNT-1') == 42.0
+    assert registry.threshold('CNT-1') == 42.0
+    stats = registry.stats()
+    assert (stats['threshold_misses'], stats['threshold_hits'], stats['threshold_invalidations']) == (2, 2, 2)
+
+    # Compteur inconnu : seuil par défaut, hors des compteurs du cache
+    assert registry.threshold('CNT-X') == DEFAULT_ENERGY_THRESHOLD
+    assert (registry.threshold_misses, registry.threshold_hits) == (2, 2)
+
+
+def test_invalidation_during_fetch_is_not_cached(repositories, meter):
+    registry = MeterRegistry(repositories)
+    registry.load(verbose=False)
+    invoice = repositories.invoices.create(meter.id, '2026-01', 10.0, 'paid', 10)
+    registry.invalidate_threshold(meter.id)
+
+    fetch = registry._fetch_threshold
+    calls = []
+
+    def racing_fetch(meter_id):
+        value = fetch(meter_id)
+        if not calls:
+            # Paiement validé entre la lecture du seuil et sa mise en cache
+            repositories.invoices.update(invoice.id, {'kwh': 20})
+            registry.invalidate_threshold(meter_id)
+        calls.append(value)
+        return value
+
+    registry._fetch_threshold = racing_fetch
+    assert registry.threshold('CNT-1') == 20.0
+    assert calls == [10.0, 20.0]
+    assert registry.threshold('CNT-1') == 20.0
+    assert registry.threshold_misses == 1
+
+
+def test_no_stale_threshold_under_concurrent_billing(repositories, meter):
+    """Un appel commencé après l'invalidation d'une écriture ne rend jamais un seuil antérieur"""
+    registry = MeterRegistry(repositories)
+    registry.load(verbose=False)
+
+    values = [expected_threshold(repositories, meter.id)]   # values[g] : seuil après l'écriture g
+    published = [0]                                          # dernière écriture validée et invalidée
+    observations = []
+    done = threading.Event()
+    errors = []
+
+    def bill():
+        paid = []
+        unpaid = []
+        try:
+            for n in range(1, OPERATIONS + 1):
+                kwh = 1000 + n
+                kind = n % 4
+                if kind == 0 and unpaid:
+                    # Paiement d'une facture (route POST /payments)
+                    invoice = unpaid.pop()
+                    repositories.payments.create(invoice.id, invoice.amount, 'momo', None)
+                    repositories.invoices.mark_paid(invoice.id)
+                    paid.append(invoice)
+                elif kind == 1 and paid:
+                    # kwh d'une facture payée modifié
+                    repositories.invoices.update(paid[-1].id, {'kwh': kwh})
+                elif kind == 2 and len(paid) > 1:
+                    repositories.invoices.delete(paid.pop().id)
+                else:
+                    # Facture ajoutée, payée une fois sur deux
+                    invoice = repositories.invoices.create(meter.id, f"{2000 + n // 12}-{n % 12 + 1:02d}",
+                                                           10.0, 'paid' if n % 2 else 'unpaid', kwh)
+                    (paid if n % 2 else unpaid).append(invoice)
+                registry.invalidate_threshold(meter.id)
+                values.append(expected_threshold(repositories, meter.id))
+                published[0] = n
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def read():
+        try:
+            while not done.is_set():
+                before = published[0]
+                value = registry.threshold('CNT-1')
+                observations.append((before, value, published[0]))
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(READERS)]
+    for thread in readers:
+        thread.start()
+    bill()
+    for thread in readers:
+        thread.join()
+
+    assert not errors
+    assert len(values) == OPERATIONS + 1
+    # Valeurs admises : celle de l'écriture publiée au début de l'appel, ou d'une écriture suivante
+    # (validée pendant l'appel, éventuellement pas encore publiée)
+    stale = [(before, value) for before, value, after in observations if value not in values[before:after + 2]]
+    assert not stale
+    assert registry.threshold('CNT-1') == values[-1]
+    assert registry.threshold_invalidations == OPERATIONS
+    assert registry.threshold_misses >= 1 and registry.threshold_hits >= 1
+
+
+# -----------------------------------------------------------------------------------------------
+# Numéros inconnus (topics MQTT fantaisistes) : pas de lecture SQL par message
+# -----------------------------------------------------------------------------------------------
+def counting_fetches(repositories):
+    calls = []
+    get_by_number = repositories.meters.get_by_number
+
+    def fetch(meter_number):
+        calls.append(meter_number)
+        return get_by_number(meter_number)
+
+    repositories.meters.get_by_number = fetch
+    return calls
+
+
+def test_authoritative_registry_never_queries_unknown_numbers(repositories, meter):
+    registry = MeterRegistry(repositories, authoritative=True)
+    registry.load(verbose=False)
+    calls = counting_fetches(repositories)
+
+    assert all(registry.lookup(f'JUNK-{n}') is None for n in range(1000))
+    assert registry.lookup('CNT-1').id == meter.id
+    assert calls == []
+    assert registry.stats()['unknown_dropped'] == 1000
+
+
+def test_negative_cache_evicts_least_recently_seen(repositories, meter):
+    registry = MeterRegistry(repositories, negative_max=3)
+    registry.load(verbose=False)
+    calls = counting_fetches(repositories)
+
+    for number in ('A', 'B', 'C', 'A', 'D'):
+        assert registry.lookup(number) is None
+    assert calls == ['A', 'B', 'C', 'D']         # 'A' servi par le cache, 'B' écarté pour 'D'
+    assert registry.stats()['negative_cache'] == 3
+
+    for number in ('A', 'C', 'D', 'B'):
+        registry.lookup(number)
+    assert calls == ['A', 'B', 'C', 'D', 'B']
+
+    # Compteur créé par un autre processus : trouvé en base à la première lecture
+    repositories.meters.create(meter.user_id, 'CNT-2', 'Compteur 2')
+    assert registry.lookup('CNT-2').meter_number == 'CNT-2'
+    assert registry.lookup('CNT-2') is not None
+    assert calls[-1] == 'CNT-2' and calls.count('CNT-2') == 1
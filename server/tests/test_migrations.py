@@ -0,0 +1,43 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from migrations import HOT_QUERIES, MIGRATIONS, check_query_plans, current_version, explain, migrate
+
+
+# -----------------------------------------------------------------------------------------------
+# Plans des requêtes fréquentes (HOT_QUERIES) sur une base neuve : un index pour chacune
+# -----------------------------------------------------------------------------------------------
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    connection = sqlite3.connect(str(tmp_path_factory.mktemp('db') / 'gridpay.db'))
+    migrate(connection)
+    yield connection
+    connection.close()
+
+
+def test_fresh_database_is_fully_migrated(conn):
+    assert current_version(conn) == len(MIGRATIONS)
+
+
+def test_no_hot_query_scans_a_table(conn):
+    assert check_query_plans(conn) == []
+
+
+@pytest.mark.parametrize('name, sql', HOT_QUERIES, ids=[name for name, _ in HOT_QUERIES])
+def test_hot_query_uses_an_index(conn, name, sql):
+    plan = explain(conn, sql)
+    assert any(step.startswith('SEARCH') and ' USING ' in step for step in plan), plan
+
+
+def test_missing_index_is_reported(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'gridpay.db'))
+    try:
+        migrate(connection)
+        connection.execute("DROP INDEX idx_users_phone")
+        assert [name for name, _ in check_query_plans(connection)] == ["inscription (téléphone)"]
+    finally:
+        connection.close()
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Serveur complet sur une base temporaire : pas de flux SSE ni de passe de rétention
+directory = tempfile.mkdtemp()
+os.environ.setdefault('DATABASE_PATH', os.path.join(directory, 'test_threshold_routes.db'))
+os.environ.setdefault('INGEST_JOURNAL_PATH', os.path.join(directory, 'ingest.journal'))
+os.environ.setdefault('INGEST_QUARANTINE_PATH', os.path.join(directory, 'ingest.quarantine.jsonl'))
+os.environ.setdefault('ARCHIVE_DIR', os.path.join(directory, 'archive'))
+os.environ.setdefault('RETENTION_INTERVAL_S', '0')
+os.environ.setdefault('LIVE_PORT', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import server
+from meter_registry import DEFAULT_ENERGY_THRESHOLD
+
+
+# -----------------------------------------------------------------------------------------------
+# Seuil servi par /check_threshold après une écriture de facturation faite par les routes
+# -----------------------------------------------------------------------------------------------
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+@pytest.fixture
+def account(client, request):
+    """(en-têtes, numéro de compteur, id du compteur) d'un nouvel utilisateur"""
+    name = request.node.name
+    email = f"{name.replace('_', '-')}@gridpay.test"
+    client.post('/register', json={'email': email, 'password': '12345678', 'phone': name, 'name': 'Client'})
+    token = client.post('/login', json={'email': email, 'password': '12345678'}).json['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    meter = client.post('/meters', json={'meter_number': f'CNT-{name}'}, headers=headers).json['meter']
+    return headers, meter['meter_number'], meter['id']
+
+
+def threshold(client, headers, meter_number):
+    response = client.get(f'/api/meters/{meter_number}/check_threshold', headers=headers)
+    assert response.status_code == 200
+    return response.json['energy_threshold']
+
+
+def add_invoice(client, headers, meter_id, month, kwh, status):
+    response = client.post('/invoices', headers=headers, json={
+        'meter_id': meter_id, 'month': month, 'amount': 5000, 'kwh': kwh, 'status': status})
+    assert response.status_code == 201
+    return response.json['invoice']['id']
+
+
+def test_payment_updates_threshold(client, account):
+    headers, meter_number, meter_id = account
+    invoice_id = add_invoice(client, headers, meter_id, '2026-01', 42, 'unpaid')
+    assert threshold(client, headers, meter_number) == DEFAULT_ENERGY_THRESHOLD    # seuil en cache
+
+    response = client.post('/payments', headers=headers, json={
+        'invoice_id': invoice_id, 'amount': 5000, 'payment_method': 'momo'})
+    assert response.status_code == 201
+    assert threshold(client, headers, meter_number) == 42.0
+
+
+def test_invoice_update_and_delete_update_threshold(client, account):
+    headers, meter_number, meter_id = account
+    first = add_invoice(client, headers, meter_id, '2026-01', 30, 'paid')
+    assert threshold(client, headers, meter_number) == 30.0
+
+    response = client.put(f'/invoices/{first}', headers=headers, json={'kwh': 55})
+    assert response.status_code == 200
+    assert threshold(client, headers, meter_number) == 55.0
+
+    second = add_invoice(client, headers, meter_id, '2026-02', 70, 'paid')
+    assert threshold(client, headers, meter_number) == 70.0
+
+    assert client.delete(f'/invoices/{second}', headers=headers).status_code == 200
+    assert threshold(client, headers, meter_number) == 55.0
+
+    assert client.delete(f'/invoices/{first}', headers=headers).status_code == 200
+    assert threshold(client, headers, meter_number) == DEFAULT_ENERGY_THRESHOLD
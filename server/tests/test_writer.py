@@ -0,0 +1,39 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from writer import DatabaseWriter
+
+
+# -----------------------------------------------------------------------------------------------
+# Délai d'attente de DatabaseWriter.call : jamais de TimeoutError pour une écriture qui s'exécute
+# -----------------------------------------------------------------------------------------------
+@pytest.fixture
+def writer():
+    writer = DatabaseWriter(timeout_s=0.2)
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+def test_queued_write_is_cancelled_on_timeout(writer):
+    release = threading.Event()
+    done = []
+    writer.submit(release.wait)
+
+    with pytest.raises(TimeoutError):
+        writer.call(done.append, 'applied')
+    release.set()
+    writer.call(done.append, 'after')
+
+    assert done == ['after']
+    assert writer.stats()['cancelled'] == 1
+
+
+def test_running_write_is_awaited(writer):
+    assert writer.call(lambda: time.sleep(0.5) or 'committed') == 'committed'
+    assert writer.stats()['cancelled'] == 0
@@ -0,0 +1,166 @@
+import calendar
+import time
+from collections import defaultdict
+from datetime import datetime
+
+
+# -----------------------------------------------------------------------------------------------
+# Lectures brutes : (meter_id, ts) -> Wh, regroupées par compteur puis par temps
+# -----------------------------------------------------------------------------------------------
+READINGS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS readings (
+        meter_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,              -- secondes epoch
+        wh INTEGER NOT NULL,
+        PRIMARY KEY (meter_id, ts)
+    ) WITHOUT ROWID
+'''
+
+
+# -----------------------------------------------------------------------------------------------
+# Agrégats minute/heure/jour/mois (UTC), maintenus par l'ingestion dans la même transaction
+# -----------------------------------------------------------------------------------------------
+GRANULARITIES = ('minute', 'hour', 'day', 'month')   # de la plus fine à la plus grossière
+
+ROLLUP_TABLES = [f'''
+    CREATE TABLE IF NOT EXISTS consumption_{granularity} (
+        meter_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,          -- début de la période, secondes epoch UTC
+        wh INTEGER NOT NULL,
+        readings INTEGER NOT NULL,
+        PRIMARY KEY (meter_id, bucket)
+    ) WITHOUT ROWID
+''' for granularity in GRANULARITIES]
+
+_SIZES = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def bucket_start(ts, granularity):
+    """Début de la période contenant ts"""
+    if granularity == 'month':
+        t = time.gmtime(ts)
+        return calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+    return ts - ts % _SIZES[granularity]
+
+
+def bucket_ceil(ts, granularity):
+    """Premier début de période >= ts"""
+    start = bucket_start(ts, granularity)
+    if start == ts:
+        return ts
+    if granularity == 'month':
+        t = time.gmtime(start)
+        year, month = (t.tm_year + 1, 1) if t.tm_mon == 12 else (t.tm_year, t.tm_mon + 1)
+        return calendar.timegm((year, month, 1, 0, 0, 0))
+    return start + _SIZES[granularity]
+
+
+def read_timestamp(value):
+    """Timestamp (epoch ou ISO 8601) en secondes epoch entières ; ValueError s'il est absent ou illisible
+
+    Un ISO sans fuseau est en heure locale du serveur, comme l'horloge des capteurs (sensors/sensor.py) :
+    seul parseur des lectures, pour que l'ingestion MQTT et l'import en masse rangent une même lecture
+    dans le même agrégat et la même case de dédoublonnage.
+    """
+    if value is None or value == '':
+        raise ValueError("timestamp manquant")
+    try:
+        return int(value) if isinstance(value, (int, float)) else int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"timestamp invalide: {value!r}")
+
+
+def parse_timestamp(value):
+    """Convertit le timestamp du capteur (ISO ou epoch) en secondes epoch entières"""
+    try:
+        return read_timestamp(value)
+    except ValueError:
+        return int(time.time())
+
+
+def kwh_to_wh(kwh):
+    return int(round(kwh * 1000))
+
+
+def insert_readings(cursor, rows):
+    """Insère un lot de lectures (meter_id, ts, wh) ; deux lectures dans la même seconde s'additionnent"""
+    cursor.executemany("""
+        INSERT INTO readings (meter_id, ts, wh) VALUES (?, ?, ?)
+        ON CONFLICT (meter_id, ts) DO UPDATE SET wh = wh + excluded.wh
+    """, rows)
+
+
+def update_rollups(cursor, rows):
+    """Ajoute un lot de lectures (meter_id, ts, wh) aux agrégats ; l'ordre d'arrivée est indifférent"""
+    for granularity in GRANULARITIES:
+        buckets = defaultdict(lambda: [0, 0])
+        for meter_id, ts, wh in rows:
+            bucket = buckets[(meter_id, bucket_start(ts, granularity))]
+            bucket[0] += wh
+            bucket[1] += 1
+        cursor.executemany(f"""
+            INSERT INTO consumption_{granularity} (meter_id, bucket, wh, readings) VALUES (?, ?, ?, ?)
+            ON CONFLICT (meter_id, bucket) DO UPDATE
+            SET wh = wh + excluded.wh, readings = readings + excluded.readings
+        """, [(meter_id, bucket, wh, n) for (meter_id, bucket), (wh, n) in buckets.items()])
+
+
+def plan_range(start, end, granularities=GRANULARITIES):
+    """Découpe [start, end) en morceaux servis par la table la plus grossière possible"""
+    if start >= end:
+        return []
+    if not granularities:
+        return [('readings', start, end)]
+
+    granularity = granularities[-1]
+    first = bucket_ceil(start, granularity)
+    last = bucket_start(end, granularity)
+    if first >= last:
+        return plan_range(start, end, granularities[:-1])
+
+    return (plan_range(start, first, granularities[:-1])
+            + [(f'consumption_{granularity}', first, last)]
+            + plan_range(last, end, granularities[:-1]))
+
+
+def sum_range(cursor, meter_id, start, end):
+    """Consommation totale (Wh) d'un compteur sur [start, end)"""
+    total = 0
+    plan = plan_range(start, end)
+    for table, lo, hi in plan:
+        column = 'ts' if table == 'readings' else 'bucket'
+        cursor.execute(f"""
+            SELECT COALESCE(SUM(wh), 0)
+            FROM {table}
+            WHERE meter_id = ? AND {column} >= ? AND {column} < ?
+        """, (meter_id, lo, hi))
+        total += cursor.fetchone()[0]
+    return total, plan
+
+
+def get_series(cursor, meter_id, granularity, start, end, limit=1000):
+    """Agrégats d'un compteur à la granularité demandée, sur les périodes qui commencent dans [start, end)"""
+    cursor.execute(f"""
+        SELECT bucket, wh, readings
+        FROM consumption_{granularity}
+        WHERE meter_id = ? AND bucket >= ? AND bucket < ?
+        ORDER BY bucket
+        LIMIT ?
+    """, (meter_id, bucket_start(start, granularity), end, limit))
+    return cursor.fetchall()
+
+
+def get_readings(cursor, meter_id, start, end, limit=1000):
+    """Lectures d'un compteur sur [start, end), par ordre chronologique"""
+    cursor.execute("""
+        SELECT ts, wh
+        FROM readings
+        WHERE meter_id = ? AND ts >= ? AND ts < ?
+        ORDER BY ts
+        LIMIT ?
+    """, (meter_id, start, end, limit))
+    return cursor.fetchall()
@@ -0,0 +1,66 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# -----------------------------------------------------------------------------------------------
+# Versions des données servies aux clients (requêtes GET conditionnelles)
+#   Chaque écriture incrémente, après son commit, la version des vues qu'elle modifie :
+#     meters:<user_id>  liste et détails des compteurs d'un utilisateur
+#     billing:<user_id> factures et paiements d'un utilisateur
+#     meter:<meter_id>  consommation cumulée d'un compteur
+#   L'ETag d'une réponse est la version de sa vue, lue AVANT les données : une écriture concurrente
+#   donne au pire une réponse fraîche sous un ancien ETag, jamais l'inverse.
+#   Les versions vivent en mémoire : l'époque (instant de démarrage) invalide les ETags d'avant un
+#   redémarrage ou d'un reset().
+# -----------------------------------------------------------------------------------------------
+def meters_key(user_id):
+    return f"meters:{user_id}"
+
+
+def billing_key(user_id):
+    return f"billing:{user_id}"
+
+
+def meter_key(meter_id):
+    return f"meter:{meter_id}"
+
+
+class Version:
+    """Validateurs HTTP d'une vue : ETag faible (sans guillemets) et date de dernière modification"""
+    __slots__ = ('etag', 'last_modified')
+
+    def __init__(self, etag, last_modified):
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ChangeVersions:
+    """Table clé de vue -> (version, instant de la dernière modification)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._versions = {}
+        self.reset()
+
+    def reset(self):
+        """Nouvelle époque : tous les ETags émis jusqu'ici sont périmés (import en masse, rechargement)"""
+        with self.lock:
+            self._started = time.time()
+            self.epoch = format(int(self._started * 1000), 'x')
+            self._versions = {}
+
+    def bump(self, *keys):
+        """À appeler après le commit d'une écriture qui modifie les vues keys"""
+        now = time.time()
+        with self.lock:
+            for key in keys:
+                version, _ = self._versions.get(key, (0, now))
+                self._versions[key] = (version + 1, now)
+
+    def current(self, key):
+        version, modified = self._versions.get(key, (0, self._started))
+        return Version(f"{self.epoch}-{key}-{version}", datetime.fromtimestamp(int(modified), timezone.utc))
+
+    def stats(self):
+        return {'epoch': self.epoch, 'keys': len(self._versions)}
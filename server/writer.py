@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+# -----------------------------------------------------------------------------------------------
+# Écrivain SQLite unique : toutes les écritures du processus passent par un seul thread
+# -----------------------------------------------------------------------------------------------
+class DatabaseWriter:
+    """File d'écritures + thread dédié ; chaque écriture rend son résultat dans un Future
+
+    Un seul thread prend le verrou d'écriture de la base : les requêtes HTTP et l'ingestion
+    n'attendent plus le verrou (busy_timeout, relances) mais leur tour dans la file.
+    """
+
+    def __init__(self, max_queue=10000, timeout_s=30):
+        self.timeout_s = timeout_s
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        self._thread = None
+
+        # Métriques
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        self.inline = 0
+        self.cancelled = 0
+        self.max_depth = 0
+        self.wait_ms_max = 0.0
+        self.last_write_ms = 0.0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Démarre le thread écrivain"""
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Arrête l'écrivain après les écritures déjà en file"""
+        if self.running:
+            self.queue.put(None)
+            self._thread.join(timeout)
+
+    @property
+    def running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def in_writer(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, operation, *args):
+        """Met une écriture en file ; le Future porte son résultat ou son exception"""
+        future = Future()
+        self.queue.put((future, time.perf_counter(), operation, args), timeout=self.timeout_s)
+        with self._lock:
+            self.submitted += 1
+            depth = self.queue.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return future
+
+    def call(self, operation, *args):
+        """Exécute une écriture dans le thread écrivain et attend son résultat
+
+        Depuis le thread écrivain (écriture imbriquée) ou avant start(), l'écriture est faite sur place.
+        Après timeout_s en file, l'écriture est retirée de la file et TimeoutError levée : rien n'a été
+        écrit, l'appelant peut la retenter. Déjà commencée, elle est attendue jusqu'à son résultat (un
+        TimeoutError suivi d'un commit ferait compter deux fois une écriture retentée).
+        """
+        if self.in_writer() or not self.running:
+            with self._lock:
+                self.inline += 1
+            return operation(*args)
+        future = self.submit(operation, *args)
+        try:
+            return future.result(self.timeout_s)
+        except FutureTimeout:
+            if not future.cancel():
+                return future.result()
+            with self._lock:
+                self.cancelled += 1
+            raise TimeoutError(f"écriture toujours en file après {self.timeout_s}s, annulée")
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            future, queued_at, operation, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            try:
+                result = operation(*args)
+            except BaseException as e:
+                with self._lock:
+                    self.errors += 1
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finished = time.perf_counter()
+            with self._lock:
+                self.completed += 1
+                self.last_write_ms = round((finished - started) * 1000, 3)
+                self.wait_ms_max = max(self.wait_ms_max, round((started - queued_at) * 1000, 3))
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'inline': self.inline,
+            'cancelled': self.cancelled,
+            'errors': self.errors,
+            'wait_ms_max': self.wait_ms_max,
+            'last_write_ms': self.last_write_ms,
+        }